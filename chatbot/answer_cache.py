@@ -0,0 +1,116 @@
+"""
+Model answers to common short messages, kept so the next person who says the
+same thing at the same point of a chat is answered without another model call.
+
+An answer is keyed by the message with case, punctuation and spacing
+normalized, plus a hash of the exchange just before it, so "hi" opening a
+chat and "hi" after a hard conversation are different entries. How long an
+answer is kept depends on the message's emotion (``TTLS``); messages showing
+distress, or an emotion not listed, are never cached nor answered from the
+cache. Long messages are skipped, as they hardly ever repeat.
+
+``record()`` counts where each answer came from and how long the model took,
+for ``manage.py chatbot_stats``.
+"""
+import hashlib
+import json
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+from . import replies
+
+# Messages of the preceding exchange (the last question and answer) in the key.
+CONTEXT_MESSAGES = 2
+MAX_LENGTH = 120
+TTLS = {
+    "neutral": 24 * 60 * 60,
+    "happy": 24 * 60 * 60,
+    "anxious": 6 * 60 * 60,
+    "sad": 6 * 60 * 60,
+}
+# Where an answer came from: the model, this cache, a template chosen by
+# replies.routed_reply, or the local reply when the model failed or is not set up.
+SOURCES = ("model", "cache", "local", "fallback")
+
+_PUNCTUATION = re.compile(r"[^\w\s']+")
+_SPACE = re.compile(r"\s+")
+
+
+def _cache():
+    return caches["chatbot"]
+
+
+def normalize(text):
+    text = _PUNCTUATION.sub(" ", text.lower().replace("’", "'"))
+    return _SPACE.sub(" ", text).strip()
+
+
+def _ttl(analysis):
+    return None if analysis.distress else TTLS.get(analysis.emotion)
+
+
+def key(text, history, analysis):
+    """The cache key of the answer to ``text`` after ``history``, or None if it is not to be cached."""
+    if not settings.CHATBOT_CACHE_ANSWERS or _ttl(analysis) is None:
+        return None
+    normalized = normalize(text)
+    if not normalized or len(normalized) > MAX_LENGTH:
+        return None
+    # A new model or prompt starts afresh.
+    context = json.dumps(
+        [settings.CHATBOT_MODEL, replies.SYSTEM_PROMPT, history[-CONTEXT_MESSAGES:], normalized],
+        sort_keys=True,
+    )
+    return "answer:" + hashlib.sha256(context.encode()).hexdigest()
+
+
+def get(key):
+    return _cache().get(key) if key else None
+
+
+def put(key, answer, analysis):
+    if key and answer:
+        _cache().set(key, answer, _ttl(analysis))
+
+
+def record(source, seconds=0.0):
+    """Count an answer from ``source``; for the model, also how long it took."""
+    cache = _cache()
+    counters = [(f"stats:{source}", 1)]
+    if source == "model":
+        counters.append(("stats:model_ms", round(seconds * 1000)))
+    for name, amount in counters:
+        cache.add(name, 0, None)
+        cache.incr(name, amount)
+
+
+aget = sync_to_async(get)
+aput = sync_to_async(put)
+arecord = sync_to_async(record)
+
+
+def stats():
+    """
+    Answers by source since the last ``reset()``, the share served by the
+    cache out of those that would otherwise have asked the model, and the
+    model time that cache hits and template answers saved, estimated from
+    the mean time of the model's answers.
+    """
+    values = _cache().get_many([f"stats:{source}" for source in SOURCES] + ["stats:model_ms"])
+    counts = {source: values.get(f"stats:{source}", 0) for source in SOURCES}
+    model_seconds = values.get("stats:model_ms", 0) / 1000 / counts["model"] if counts["model"] else 0.0
+    lookups = counts["cache"] + counts["model"]
+    return {
+        **counts,
+        "answers": sum(counts.values()),
+        "cache_hit_rate": counts["cache"] / lookups if lookups else 0.0,
+        "mean_model_seconds": model_seconds,
+        "saved_seconds": (counts["cache"] + counts["local"]) * model_seconds,
+    }
+
+
+def reset():
+    _cache().delete_many([f"stats:{source}" for source in SOURCES] + ["stats:model_ms"])
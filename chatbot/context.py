@@ -0,0 +1,171 @@
+"""
+The model's prompt for a chat message, kept within a token budget.
+
+A prompt is the system prompt, the conversation's rolling summary if it has
+one, the latest messages that fit in ``PROMPT_TOKENS`` and the message
+itself, cut to ``MESSAGE_TOKENS``. Tokens are estimated locally (a token per
+word or symbol, more for long words), which is close enough to budget with
+and costs nothing.
+
+Older turns aren't dropped: when a conversation is saved, ``fold`` moves its
+oldest exchanges into the summary once the messages kept verbatim pass
+``replies.CONTEXT_MESSAGES`` or ``HISTORY_TOKENS``. The most telling
+sentences of the user's folded messages are appended to it, oldest sentences
+going first when it grows past ``SUMMARY_TOKENS``. With
+``CHATBOT_SUMMARIZER = "model"``, ``afold`` (used by the async chat view)
+has the model rewrite the summary instead, through the streaming client so
+no thread waits on it, and falls back to the local summary if it can't.
+"""
+import logging
+import os
+import re
+
+from django.conf import settings
+
+from . import provider, replies, streaming
+from .retrieval import STOP_WORDS
+
+logger = logging.getLogger(__name__)
+
+PROMPT_TOKENS = 900
+MESSAGE_TOKENS = 300
+HISTORY_TOKENS = 400
+SUMMARY_TOKENS = 120
+# Role and separators the API adds to every message.
+MESSAGE_OVERHEAD = 4
+SUMMARY_PROMPT = (
+    "Summarize this conversation between a user and a supportive chatbot for the chatbot's own memory. "
+    "Keep what the user shared about themselves, their feelings and what they asked for. "
+    "Write at most 80 words in the third person, with no preamble."
+)
+
+_PIECE = re.compile(r"\w+|[^\w\s]")
+_SENTENCE = re.compile(r"[^.!?\n]+[.!?]*")
+
+
+def tokens(text):
+    """Estimated tokens of ``text``."""
+    return sum(1 + len(piece) // 8 for piece in _PIECE.findall(text))
+
+
+def message_tokens(message):
+    return tokens(message["content"]) + MESSAGE_OVERHEAD
+
+
+def truncate(text, limit):
+    """``text`` cut after about ``limit`` tokens."""
+    used = 0
+    for match in _PIECE.finditer(text):
+        used += 1 + len(match.group()) // 8
+        if used > limit:
+            return text[:match.start()].rstrip() + " …"
+    return text
+
+
+def prompt(conversation, text):
+    """The chat-completions ``messages`` for ``text`` in ``conversation`` (or a new chat), within budget."""
+    history = conversation["messages"] if conversation else []
+    summary = conversation.get("summary", "") if conversation else ""
+    messages = replies.prompt_messages([], truncate(text, MESSAGE_TOKENS), summary)
+    used = sum(message_tokens(message) for message in messages)
+    # Newest first, whole exchanges only, so the model never sees half a turn.
+    kept = []
+    for start in range(len(history) - 2, -1, -2):
+        exchange = history[start:start + 2]
+        cost = sum(message_tokens(message) for message in exchange)
+        if len(kept) + 2 > replies.CONTEXT_MESSAGES or used + cost > PROMPT_TOKENS:
+            break
+        kept[:0] = exchange
+        used += cost
+    messages[-1:-1] = kept
+    logger.info(
+        "Chat prompt: %d tokens (%d of %d messages, summary %d tokens)",
+        used, len(kept), len(history), tokens(summary),
+    )
+    provider.metrics.count("prompts")
+    provider.metrics.count("prompt_tokens", used)
+    return messages
+
+
+def _cut(messages):
+    """How many of the oldest ``messages`` to fold so the rest fit what is kept verbatim."""
+    cut = 0
+    while len(messages) - cut > replies.CONTEXT_MESSAGES or (
+        cut < len(messages) - 2 and sum(message_tokens(message) for message in messages[cut:]) > HISTORY_TOKENS
+    ):
+        cut += 2
+    return cut
+
+
+def fold(summary, messages):
+    """
+    ``(summary, messages, folded)``: the oldest exchanges of ``messages``
+    folded into ``summary`` until the rest fit what is kept verbatim.
+    """
+    cut = _cut(messages)
+    if not cut:
+        return summary, messages, 0
+    return summarize_locally(summary, messages[:cut]), messages[cut:], cut
+
+
+async def afold(summary, messages):
+    """``fold``, with the summary written by ``asummarize``."""
+    cut = _cut(messages)
+    if not cut:
+        return summary, messages, 0
+    return await asummarize(summary, messages[:cut]), messages[cut:], cut
+
+
+async def asummarize(summary, messages):
+    """``summary`` extended with ``messages``, by the model if it is the configured summarizer."""
+    api_key = os.getenv("OPENAI_API_KEY")
+    if settings.CHATBOT_SUMMARIZER == "model" and api_key:
+        transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+        request = [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"Summary so far: {summary or '(none)'}\n\nNew messages:\n{transcript}"},
+        ]
+        try:
+            rewritten = "".join([delta async for delta in streaming.stream_completion(request, api_key)])
+        except provider.ProviderError as error:
+            logger.warning("Chat summary request failed, summarizing locally: %s", error)
+        else:
+            if rewritten.strip():
+                return truncate(rewritten.strip(), SUMMARY_TOKENS)
+    return summarize_locally(summary, messages)
+
+
+def summarize_locally(summary, messages):
+    """
+    ``summary`` plus the user's sentences in ``messages`` that say the most
+    (at least two distinct content words, most first), in the order they were
+    said.
+    """
+    pieces = [piece.strip() for piece in _SENTENCE.findall(summary)]
+    seen = {piece.lower() for piece in pieces}
+    sentences = []
+    for message in messages:
+        if message["role"] != "user":
+            continue
+        for sentence in _SENTENCE.findall(message["content"]):
+            sentence = sentence.strip()
+            if sentence and sentence[-1] not in ".!?":
+                sentence += "."
+            if sentence.lower() not in seen:
+                seen.add(sentence.lower())
+                sentences.append(sentence)
+
+    def weight(sentence):
+        return len({word for word in re.findall(r"[a-z']+", sentence.lower()) if word not in STOP_WORDS})
+
+    budget = SUMMARY_TOKENS // 2
+    chosen = set()
+    for number in sorted(range(len(sentences)), key=lambda number: -weight(sentences[number])):
+        cost = tokens(sentences[number])
+        if weight(sentences[number]) >= 2 and cost <= budget:
+            chosen.add(number)
+            budget -= cost
+    pieces += [sentence for number, sentence in enumerate(sentences) if number in chosen]
+    while pieces and sum(tokens(piece) for piece in pieces) > SUMMARY_TOKENS:
+        pieces.pop(0)
+    return " ".join(pieces)
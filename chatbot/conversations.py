@@ -0,0 +1,178 @@
+"""
+Chatbot conversations, kept in their own tables instead of the session.
+
+Messages are only ever inserted: each exchange is one insert of the question
+and its answer, and the conversation row is touched at most every
+``TOUCH_INTERVAL`` to keep it from expiring. What the model sees, the rolling
+summary and the messages since (see ``context.fold``), is also kept in the
+"chatbot" cache with the owner and last activity, so continuing a chat
+usually reads nothing from the database. The tables stay the record: a cache
+miss rebuilds the entry from the row and the messages after
+``summarized_through``.
+
+A conversation is a plain dict here: ``id`` (str), ``user`` (id or None),
+``active`` (timestamp of last recorded activity), ``summary`` and
+``messages`` (``{"role", "content"}`` dicts, oldest first).
+
+Conversations idle for longer than ``TTL`` are no longer found, and
+``purge()`` (run hourly by ``run_jobs``) deletes them.
+"""
+import uuid
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from . import context, replies
+from .models import ChatMessage, Conversation
+
+TTL = timedelta(days=30)
+TOUCH_INTERVAL = timedelta(minutes=5)
+# How long an idle conversation's recent messages stay cached.
+CACHE_TIMEOUT = 60 * 60
+HISTORY_LIMIT = 50
+PURGE_BATCH = 500
+ROLES = dict(ChatMessage.ROLE_CHOICES)
+
+
+def _cache():
+    return caches["chatbot"]
+
+
+def _key(conversation_id):
+    return f"conversation:{conversation_id}"
+
+
+def _owner(user):
+    return user.pk if user is not None and user.is_authenticated else None
+
+
+def find(user, conversation_id, now=None):
+    """Conversation ``conversation_id`` if ``user`` may continue it and it hasn't expired, else None."""
+    try:
+        conversation_id = str(uuid.UUID(str(conversation_id)))
+    except ValueError:
+        return None
+    conversation = _cache().get(_key(conversation_id))
+    if conversation is None:
+        row = Conversation.objects.filter(pk=conversation_id).values(
+            "user_id", "last_active_at", "summary", "summarized_through",
+        ).first()
+        if row is None:
+            return None
+        recent = ChatMessage.objects.filter(conversation_id=conversation_id).order_by("-id")
+        if row["summarized_through"] is not None:
+            recent = recent.filter(id__gt=row["summarized_through"])
+        conversation = {
+            "id": conversation_id,
+            "user": row["user_id"],
+            "active": row["last_active_at"].timestamp(),
+            "summary": row["summary"],
+            "messages": [
+                {"role": ROLES[role], "content": content}
+                for role, content in reversed(recent.values_list("role", "content")[:replies.CONTEXT_MESSAGES])
+            ],
+        }
+        _cache().set(_key(conversation_id), conversation, CACHE_TIMEOUT)
+    now = now or timezone.now()
+    if conversation["user"] != _owner(user) or conversation["active"] < (now - TTL).timestamp():
+        return None
+    return conversation
+
+
+def _record(conversation, user, text, answer, now=None):
+    """Save an exchange; returns the conversation and its recent messages with the exchange."""
+    now = now or timezone.now()
+    with transaction.atomic():
+        if conversation is None:
+            row = Conversation.objects.create(
+                user_id=_owner(user), title=" ".join(text.split())[:80], created_at=now, last_active_at=now,
+            )
+            conversation = {
+                "id": str(row.pk), "user": row.user_id, "active": now.timestamp(), "summary": "", "messages": [],
+            }
+        elif now.timestamp() - conversation["active"] > TOUCH_INTERVAL.total_seconds():
+            Conversation.objects.filter(pk=conversation["id"]).update(last_active_at=now)
+            conversation["active"] = now.timestamp()
+        ChatMessage.objects.bulk_create([
+            ChatMessage(conversation_id=conversation["id"], role=ChatMessage.USER, content=text, created_at=now),
+            ChatMessage(conversation_id=conversation["id"], role=ChatMessage.ASSISTANT, content=answer, created_at=now),
+        ])
+    return conversation, conversation["messages"] + [
+        {"role": "user", "content": text},
+        {"role": "assistant", "content": answer},
+    ]
+
+
+def _store(conversation, summary, messages, folded):
+    """Keep the result of ``context.fold`` for ``conversation`` and cache it."""
+    conversation["messages"] = messages
+    if folded:
+        # The newest folded message; the ones kept are all after it.
+        through = ChatMessage.objects.filter(conversation_id=conversation["id"]).order_by("-id").values_list(
+            "id", flat=True,
+        )[len(messages)]
+        Conversation.objects.filter(pk=conversation["id"]).update(summary=summary, summarized_through=through)
+        conversation["summary"] = summary
+    # Two tabs answering at once may each drop the other's exchange from the
+    # cached context; the tables keep both.
+    _cache().set(_key(conversation["id"]), conversation, CACHE_TIMEOUT)
+    return conversation
+
+
+def append(conversation, user, text, answer, now=None):
+    """
+    Record an exchange, in a new conversation when ``conversation`` is None.
+    Returns the conversation with the exchange in its recent messages, older
+    ones folded into its summary.
+    """
+    conversation, messages = _record(conversation, user, text, answer, now)
+    return _store(conversation, *context.fold(conversation.get("summary", ""), messages))
+
+
+async def aappend(conversation, user, text, answer, now=None):
+    """``append`` for async views, folding with ``context.afold`` on the event loop."""
+    conversation, messages = await sync_to_async(_record)(conversation, user, text, answer, now)
+    folded = await context.afold(conversation.get("summary", ""), messages)
+    return await sync_to_async(_store)(conversation, *folded)
+
+
+afind = sync_to_async(find)
+
+
+def history(conversation, before=None, limit=HISTORY_LIMIT):
+    """
+    Up to ``limit`` messages of ``conversation``, oldest first, before message
+    id ``before`` if given, and whether there are earlier ones.
+    """
+    messages = ChatMessage.objects.filter(conversation_id=conversation["id"]).order_by("-id")
+    if before is not None:
+        messages = messages.filter(id__lt=before)
+    page = list(messages.values("id", "role", "content", "created_at")[:limit + 1])
+    more = len(page) > limit
+    return [
+        {"id": row["id"], "role": ROLES[row["role"]], "content": row["content"], "created_at": row["created_at"].isoformat()}
+        for row in reversed(page[:limit])
+    ], more
+
+
+def recent(user, limit=20, now=None):
+    """``user``'s conversations that haven't expired, most recently active first."""
+    now = now or timezone.now()
+    return list(Conversation.objects.filter(user=user, last_active_at__gte=now - TTL)[:limit])
+
+
+def purge(now=None):
+    """Delete conversations idle for longer than ``TTL``, with their messages. Returns how many."""
+    cutoff = (now or timezone.now()) - TTL
+    purged = 0
+    while True:
+        ids = list(Conversation.objects.filter(last_active_at__lt=cutoff).values_list("pk", flat=True)[:PURGE_BATCH])
+        if not ids:
+            return purged
+        ChatMessage.objects.filter(conversation_id__in=ids).delete()
+        Conversation.objects.filter(pk__in=ids).delete()
+        _cache().delete_many([_key(pk) for pk in ids])
+        purged += len(ids)
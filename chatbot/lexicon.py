@@ -0,0 +1,180 @@
+"""
+Keyword classification of chat messages: emotion, distress and intent.
+
+Every phrase of every category is compiled into one regular expression, so
+a message is scanned once however many lexicons there are. Phrases match
+whole words ("low" no longer fires inside "allow"); a trailing
+``*`` matches any word starting with the stem ("panic*" covers "panicking"),
+a ``?`` makes the character before it optional ("can'?t" covers "cant"),
+and a space matches any run of whitespace. Each hit adds the phrase's weight
+to its category, and a category counts once its score reaches the group's
+threshold. ``coverage`` is the share of the message's words that were part
+of some phrase: "hi there!" is almost all greeting, a long story that
+mentions a job is not mostly about careers.
+
+The lexicons live in ``data/lexicon.json`` (or the file named by the
+``CHATBOT_LEXICON`` setting)::
+
+    {"thresholds": {"emotion": 1.0, ...},
+     "emotion": {"anxious": {"panic*": 2.0, ...}, ...},
+     "distress": {"distress": {...}},
+     "intent": {"career": {...}, ...}}
+"""
+import functools
+import json
+import re
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+
+DEFAULT_PATH = Path(__file__).resolve().parent / "data" / "lexicon.json"
+GROUPS = ("emotion", "distress", "intent")
+
+
+class Analysis:
+    """
+    Scores of one message (``scores[group, category]``) and what they add up
+    to: the strongest ``emotion`` (or "neutral"), whether ``distress``
+    showed, ``intents`` strongest first, and the ``coverage`` of the message
+    by matched phrases (0 to 1).
+    """
+
+    def __init__(self, scores, thresholds, text="", covered=0):
+        self.scores = scores
+        self._text = text
+        self._covered = covered
+        ranked = {}
+        # Ties keep the order in which the categories first appeared.
+        for (group, category), score in sorted(scores.items(), key=lambda item: -item[1]):
+            if score >= thresholds.get(group, 1.0):
+                ranked.setdefault(group, []).append(category)
+        self.emotion = ranked["emotion"][0] if "emotion" in ranked else "neutral"
+        self.distress = "distress" in ranked
+        self.intents = ranked.get("intent", [])
+
+    @property
+    def coverage(self):
+        # Counted on demand: splitting a long message costs more than matching it.
+        words = len(self._text.split())
+        return self._covered / words if words else 0.0
+
+
+def normalize(text):
+    return text.lower().replace("’", "'")
+
+
+def _pieces(phrase):
+    """A phrase as regex pieces, one per character, so phrases share prefixes."""
+    pieces = []
+    for i, word in enumerate(normalize(phrase).split()):
+        if i:
+            pieces.append(r"\s+")
+        start = len(pieces)
+        for char in word.rstrip("*"):
+            if char == "?" and len(pieces) > start:
+                pieces[-1] += "?"
+            else:
+                pieces.append(re.escape(char))
+        if word.endswith("*"):
+            pieces.append(r"\w*")
+    return tuple(pieces)
+
+
+def _words(node):
+    """How many more words the longest phrase below a trie node has."""
+    return max(
+        (_words(child) + (piece == r"\s+") for piece, child in node.items() if piece is not None),
+        default=0,
+    )
+
+
+class Matcher:
+    """
+    All phrases compiled into one regular expression. The phrases are first
+    merged into a character trie, so the expression branches on shared
+    prefixes instead of trying every phrase at every word. Each phrase ends
+    in an empty group, and the group that matched says which phrase it was.
+    Phrases with more words are tried first, so "hurt* myself" wins over
+    "hurting" and "panic attack*" over "panic*".
+
+    ``patterns`` are raw regular expressions (without capturing groups) laid
+    out like ``lexicons``, ``{group: {category: {regex: weight}}}``, for what
+    phrases can't spell, such as phone numbers. They are tried after the
+    phrases, as further branches of the same expression, and like phrases
+    only where a word starts.
+    """
+
+    def __init__(self, lexicons, thresholds=None, patterns=None):
+        self.thresholds = dict(thresholds or {})
+        trie = {}
+        for group, categories in lexicons.items():
+            for category, entries in categories.items():
+                for phrase, weight in entries.items():
+                    node = trie
+                    for piece in _pieces(phrase):
+                        node = node.setdefault(piece, {})
+                    # The same phrase in several categories scores all of them.
+                    node.setdefault(None, []).append((group, category, float(weight)))
+        # (group, category, weight) lists, in the order of their groups in the regex.
+        self.targets = []
+        branches = [rf"{self._compile(trie)}(?!\w)"] if trie else []
+        for group, categories in (patterns or {}).items():
+            for category, entries in categories.items():
+                for pattern, weight in entries.items():
+                    self.targets.append([(group, category, float(weight))])
+                    branches.append(f"(?:{pattern})()")
+        # Nothing is tried inside a word, which is most positions of a text.
+        self.regex = re.compile(rf"\b(?:{'|'.join(branches)})" if branches else "(?!)")
+
+    def _compile(self, node):
+        # Branches leading on to more words go first: the regex takes the first
+        # alternative that matches, not the longest.
+        children = sorted(
+            ((piece, child) for piece, child in node.items() if piece is not None),
+            key=lambda item: -_words(item[1]) - (item[0] == r"\s+"),
+        )
+        branches = [piece + self._compile(child) for piece, child in children]
+        if None in node:
+            self.targets.append(node[None])
+            branches.append("()")
+        return branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+
+    @property
+    def phrases(self):
+        return len(self.targets)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as handle:
+            data = json.load(handle)
+        return cls({group: data.get(group, {}) for group in GROUPS}, data.get("thresholds"))
+
+    def matches(self, text):
+        """``(match, [(group, category, weight), ...])`` for each hit in ``text``, normalized."""
+        return self._matches(normalize(text or ""))
+
+    def _matches(self, text):
+        targets = self.targets
+        for match in self.regex.finditer(text):
+            yield match, targets[match.lastindex - 1]
+
+    def analyze(self, text):
+        scores = defaultdict(float)
+        text = normalize(text or "")
+        covered = 0
+        for match, targets in self._matches(text):
+            for group, category, weight in targets:
+                scores[group, category] += weight
+            covered += len(match.group().split())
+        return Analysis(scores, self.thresholds, text, covered)
+
+
+@functools.lru_cache(maxsize=None)
+def matcher():
+    """The matcher for the configured lexicon file, compiled on first use."""
+    return Matcher.load(getattr(settings, "CHATBOT_LEXICON", DEFAULT_PATH))
+
+
+def analyze(text):
+    return matcher().analyze(text)
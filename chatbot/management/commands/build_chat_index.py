@@ -0,0 +1,59 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from chatbot import lexicon, retrieval
+
+SAMPLES = [
+    "I feel so anxious about tomorrow",
+    "i cant sleep at night",
+    "my bf dumped me",
+    "how to negociate salary",
+    "my boss keeps yelling at me",
+    "I want to learn meditation",
+    "tips for my cv",
+    "I have no friends here since I moved",
+    "someone keeps sending me creepy messages online",
+    "my cat is cute",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the chatbot's offline response index from its curated corpus "
+        "and write it where each process memory-maps it, then time lookups."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lookups', type=int, default=2000, help="Timed lookups; 0 skips timing.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        raw = retrieval.corpus_path().read_bytes()
+        built = retrieval.Index.build(raw)
+        path = retrieval.index_path()
+        built.save(path)
+        self.stdout.write(
+            f"Indexed {len(built.entries)} responses ({len(built.row_weight)} rows, {len(built.rows)} values) "
+            f"into {path} in {(time.perf_counter() - started) * 1000:.0f}ms"
+        )
+        if not options['lookups']:
+            return
+
+        retrieval.index.cache_clear()
+        index = retrieval.index()
+        recent = [built.entries[0]["response"]]
+        analyses = [lexicon.analyze(text) for text in SAMPLES]
+        timings = []
+        for i in range(options['lookups']):
+            text, analysis = SAMPLES[i % len(SAMPLES)], analyses[i % len(SAMPLES)]
+            started = time.perf_counter()
+            index.respond(text, recent, (analysis.emotion, *analysis.intents))
+            timings.append(time.perf_counter() - started)
+        ms = 1000
+        self.stdout.write(
+            f"Lookup with one recent answer: mean={statistics.mean(timings) * ms:.3f}ms "
+            f"p50={statistics.median(timings) * ms:.3f}ms "
+            f"p99={sorted(timings)[int(len(timings) * 0.99)] * ms:.3f}ms"
+        )
@@ -0,0 +1,369 @@
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlparse
+
+import aiohttp
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils.crypto import get_random_string
+
+from chatbot import stub_llm
+
+# What the simulated users say, one script per user, turn after turn.
+SCRIPTS = (
+    (
+        "I had a really hard day at work today",
+        "My manager keeps criticising everything I do in front of others",
+        "I feel like I am not good enough and I can't sleep at night",
+        "What could I say to her without making it worse?",
+        "Thank you, I will try that tomorrow",
+    ),
+    (
+        "I feel anxious about my exams next week",
+        "Whenever I sit down to study my heart starts racing",
+        "My parents expect me to top the class again",
+        "How do I stop overthinking before the exam?",
+        "Can you remind me of the breathing exercise?",
+    ),
+    (
+        "My friend stopped talking to me and I don't know why",
+        "We were close for six years and now she ignores my messages",
+        "I keep wondering if I said something wrong",
+        "Should I message her again or give her space?",
+        "I think I just miss her a lot",
+    ),
+    (
+        "I moved to a new city and I feel very lonely",
+        "I don't know anyone here and weekends are the worst",
+        "I tried joining a club but I felt awkward",
+        "How do people make friends as adults?",
+        "Maybe I will try the book club again",
+    ),
+)
+ENDPOINTS = {"ask": "/chatbot/api/ask/", "stream": "/chatbot/api/stream/"}
+DEPLOYMENTS = ("wsgi", "asgi")
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def latency_summary(seconds):
+    if not seconds:
+        return None
+    ms = 1000
+    return {
+        "p50": round(percentile(seconds, 50) * ms, 1),
+        "p95": round(percentile(seconds, 95) * ms, 1),
+        "p99": round(percentile(seconds, 99) * ms, 1),
+        "mean": round(statistics.mean(seconds) * ms, 1),
+        "max": round(max(seconds) * ms, 1),
+    }
+
+
+class Server:
+    """One deployment of the project (gunicorn for WSGI, daphne for ASGI) in a child process."""
+
+    def __init__(self, deployment, env, log_path, options):
+        self.deployment = deployment
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        if deployment == "wsgi":
+            self.command = [
+                sys.executable, "-m", "gunicorn", "sisterhood_stories.wsgi:application",
+                "--bind", f"127.0.0.1:{self.port}", "--workers", str(options['workers']),
+                "--worker-class", "gthread", "--threads", str(options['threads']), "--timeout", "120",
+            ]
+        else:
+            self.command = [
+                sys.executable, "-m", "daphne", "-b", "127.0.0.1", "-p", str(self.port),
+                "sisterhood_stories.asgi:application",
+            ]
+        self.env = env
+        self.log_path = log_path
+        self.process = None
+
+    async def __aenter__(self):
+        self.log = open(self.log_path, "wb")
+        self.process = subprocess.Popen(
+            self.command, cwd=settings.BASE_DIR, env=self.env, stdout=self.log, stderr=subprocess.STDOUT,
+        )
+        deadline = time.monotonic() + 60
+        async with aiohttp.ClientSession() as session:
+            while True:
+                if self.process.poll() is not None:
+                    raise CommandError(f"{self.deployment} server exited:\n{self.tail()}")
+                try:
+                    async with session.get(f"{self.url}/chatbot/") as response:
+                        if response.status < 500:
+                            return self
+                except aiohttp.ClientConnectionError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise CommandError(f"{self.deployment} server did not start:\n{self.tail()}")
+                await asyncio.sleep(0.2)
+
+    async def __aexit__(self, *exc_info):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.log.close()
+
+    def tail(self, lines=30):
+        return "\n".join(Path(self.log_path).read_text(errors="replace").splitlines()[-lines:])
+
+
+class User:
+    """A simulated user holding one multi-turn conversation, with their own cookies."""
+
+    def __init__(self, index, options):
+        self.script = SCRIPTS[index % len(SCRIPTS)]
+        self.csrf = get_random_string(32)
+        self.conversation = ""
+        self.random = random.Random(index)
+        self.options = options
+
+    async def run(self, base_url, samples):
+        options = self.options
+        timeout = aiohttp.ClientTimeout(total=options['timeout'])
+        jar = aiohttp.CookieJar(unsafe=True)
+        jar.update_cookies({"csrftoken": self.csrf})
+        async with aiohttp.ClientSession(cookie_jar=jar, timeout=timeout) as session:
+            for turn in range(options['turns']):
+                if options['think']:
+                    await asyncio.sleep(self.random.expovariate(1 / options['think']))
+                text = self.script[turn % len(self.script)]
+                samples.append(await self.ask(session, base_url, text))
+
+    async def ask(self, session, base_url, text):
+        endpoint = self.options['endpoint']
+        sample = {"status": None, "seconds": None, "first": None}
+        started = time.perf_counter()
+        try:
+            async with session.post(
+                base_url + ENDPOINTS[endpoint],
+                data={"text": text, "conversation": self.conversation},
+                headers={"X-CSRFToken": self.csrf},
+            ) as response:
+                sample["status"] = response.status
+                if endpoint == "ask":
+                    body = await response.text()
+                    if response.status == 200:
+                        self.conversation = json.loads(body)["conversation"]
+                else:
+                    body = ""
+                    async for chunk in response.content.iter_any():
+                        body += chunk.decode()
+                        if sample["first"] is None and "event: delta" in body:
+                            sample["first"] = time.perf_counter() - started
+                    if "event: done" in body:
+                        done = body.split("event: done\ndata: ", 1)[1].split("\n", 1)[0]
+                        self.conversation = json.loads(done)["conversation"]
+                    elif response.status == 200:
+                        sample["status"] = "incomplete"
+        except asyncio.TimeoutError:
+            sample["status"] = "timeout"
+        except aiohttp.ClientError as error:
+            sample["status"] = type(error).__name__
+        sample["seconds"] = time.perf_counter() - started
+        return sample
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the chatbot endpoint as deployed under WSGI (gunicorn) and "
+        "ASGI (daphne): concurrent simulated users hold multi-turn "
+        "conversations against a local stub model, and latency percentiles, "
+        "throughput and error rate are reported and saved as JSON. Servers "
+        "run against a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50, help="Simultaneous users.")
+        parser.add_argument('--turns', type=int, default=5, help="Messages per user.")
+        parser.add_argument('--think', type=float, default=0.0, help="Mean seconds a user waits between turns.")
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), default="ask")
+        parser.add_argument('--deployment', action='append', choices=DEPLOYMENTS, help="Only these deployments.")
+        parser.add_argument('--workers', type=int, default=1, help="gunicorn worker processes.")
+        parser.add_argument('--threads', type=int, default=8, help="Threads per gunicorn worker.")
+        parser.add_argument('--latency', type=float, default=0.2, help="Stub seconds before the first token.")
+        parser.add_argument('--token-delay', type=float, default=0.005, help="Stub seconds per token.")
+        parser.add_argument('--tokens', type=int, default=60)
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Share of stub requests failing with a 500.")
+        parser.add_argument('--timeout', type=float, default=60.0, help="Seconds before a chat request counts as failed.")
+        parser.add_argument('--output', help="Where to save the results (default benchmarks/chat_load-<time>.json).")
+        parser.add_argument('--compare', help="Earlier results to compare against.")
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['turns'] < 1:
+            raise CommandError("--users and --turns must be positive")
+        baseline = None
+        if options['compare']:
+            with open(options['compare'], encoding="utf-8") as handle:
+                baseline = json.load(handle)
+        scratch = tempfile.mkdtemp()
+        if connection.vendor == 'sqlite':
+            # The servers are other processes, so the test database must be a file.
+            connection.settings_dict['TEST']['NAME'] = os.path.join(scratch, 'load.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = asyncio.run(self.run(options, scratch))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        output = Path(options['output'] or Path(settings.BASE_DIR) / "benchmarks" / (
+            f"chat_load-{datetime.now():%Y%m%d-%H%M%S}.json"
+        ))
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+        self.stdout.write(self.style.SUCCESS(f"Results saved to {output}"))
+        if baseline:
+            self.compare(baseline, results)
+
+    def server_env(self, stub_url):
+        env = dict(os.environ)
+        env.update({
+            "DJANGO_SETTINGS_MODULE": os.environ.get("DJANGO_SETTINGS_MODULE", "sisterhood_stories.settings"),
+            "DEBUG": "False",
+            "OPENAI_API_KEY": "stub",
+            "OPENAI_API_BASE": stub_url,
+            # Every user follows a script; measure the model path, not templates or the answer cache.
+            "CHATBOT_LOCAL_ROUTING": "False",
+            "CHATBOT_CACHE_ANSWERS": "False",
+            # All users come from one address.
+            "RATE_LIMIT_ENABLED": "False",
+        })
+        if connection.vendor == 'sqlite':
+            env["SQLITE_PATH"] = str(connection.settings_dict['NAME'])
+        elif os.environ.get("DATABASE_URL"):
+            url = urlparse(os.environ["DATABASE_URL"])
+            env["DATABASE_URL"] = url._replace(path=f"/{connection.settings_dict['NAME']}").geturl()
+        return env
+
+    async def run(self, options, scratch):
+        stub, stub_url, runner = await stub_llm.start(
+            latency=options['latency'], token_delay=options['token_delay'],
+            tokens=options['tokens'], error_rate=options['error_rate'],
+        )
+        env = self.server_env(stub_url)
+        results = {
+            "created": datetime.now().astimezone().isoformat(timespec="seconds"),
+            "revision": self.revision(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "cpus": os.cpu_count(),
+            "options": {
+                name: options[name] for name in (
+                    "users", "turns", "think", "endpoint", "workers", "threads",
+                    "latency", "token_delay", "tokens", "error_rate", "timeout",
+                )
+            },
+            "deployments": {},
+        }
+        try:
+            for deployment in options['deployment'] or DEPLOYMENTS:
+                log_path = os.path.join(scratch, f"{deployment}.log")
+                async with Server(deployment, env, log_path, options) as server:
+                    stub.stats["peak_active"] = stub.stats["active"]
+                    before = dict(stub.stats)
+                    samples = []
+                    users = [User(i, options) for i in range(options['users'])]
+                    started = time.perf_counter()
+                    await asyncio.gather(*(user.run(server.url, samples) for user in users))
+                    elapsed = time.perf_counter() - started
+                summary = self.summarize(server, samples, elapsed, before, stub.stats)
+                results["deployments"][deployment] = summary
+                self.report(deployment, summary)
+        finally:
+            await runner.cleanup()
+        return results
+
+    def summarize(self, server, samples, elapsed, before, after):
+        ok = [sample for sample in samples if sample["status"] == 200]
+        statuses = {}
+        for sample in samples:
+            statuses[str(sample["status"])] = statuses.get(str(sample["status"]), 0) + 1
+        firsts = [sample["first"] for sample in ok if sample["first"] is not None]
+        return {
+            "server": " ".join(server.command[1:]),
+            "requests": len(samples),
+            "errors": len(samples) - len(ok),
+            "error_rate": round((len(samples) - len(ok)) / len(samples), 4),
+            "statuses": statuses,
+            "elapsed_s": round(elapsed, 3),
+            "throughput_rps": round(len(ok) / elapsed, 2),
+            # Successful requests only; failures are counted above.
+            "latency_ms": latency_summary([sample["seconds"] for sample in ok]),
+            "first_token_ms": latency_summary(firsts),
+            # Chats the stub never answered were answered locally (model failure or breaker open).
+            "model_requests": after["requests"] - before["requests"],
+            "model_errors": after["errors"] - before["errors"],
+            "model_peak_concurrency": after["peak_active"],
+        }
+
+    def report(self, deployment, summary):
+        latency = summary["latency_ms"] or {"p50": 0, "p95": 0, "p99": 0}
+        line = (
+            f"{deployment}: {summary['requests']} requests in {summary['elapsed_s']:.2f}s, "
+            f"{summary['throughput_rps']:.1f}/s; p50 {latency['p50']:.0f}ms p95 {latency['p95']:.0f}ms "
+            f"p99 {latency['p99']:.0f}ms; errors {summary['error_rate']:.1%} {summary['statuses']}; "
+            f"{summary['model_requests']} model requests ({summary['model_errors']} failed)"
+        )
+        if summary["first_token_ms"]:
+            line += f"; first token p95 {summary['first_token_ms']['p95']:.0f}ms"
+        self.stdout.write(line)
+
+    def compare(self, baseline, results):
+        if baseline.get("options") != results["options"]:
+            self.stdout.write(self.style.WARNING("The baseline was run with different options."))
+        for deployment, summary in results["deployments"].items():
+            before = baseline.get("deployments", {}).get(deployment)
+            if not before or not before["latency_ms"] or not summary["latency_ms"]:
+                continue
+            changes = [
+                f"{name} {summary['latency_ms'][name]:.0f}ms ({self.change(before['latency_ms'][name], summary['latency_ms'][name])})"
+                for name in ("p50", "p95", "p99")
+            ]
+            changes.append(
+                f"throughput {summary['throughput_rps']:.1f}/s "
+                f"({self.change(before['throughput_rps'], summary['throughput_rps'])})"
+            )
+            changes.append(f"errors {summary['error_rate']:.1%} (was {before['error_rate']:.1%})")
+            self.stdout.write(f"{deployment} vs {baseline.get('revision') or baseline.get('created')}: " + ", ".join(changes))
+
+    @staticmethod
+    def change(before, after):
+        return f"{(after - before) / before:+.1%}" if before else "new"
+
+    @staticmethod
+    def revision():
+        try:
+            return subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from chatbot import answer_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Report where chatbot answers came from (model, answer cache, "
+        "templates, fallback), the cache hit rate and the model time saved. "
+        "Counts live in the chatbot cache, so with the local-memory cache "
+        "they only cover the process that runs this."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="Start counting afresh afterwards.")
+
+    def handle(self, *args, **options):
+        stats = answer_cache.stats()
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['answers']} answer(s): {stats['model']} from the model, {stats['cache']} from the cache, "
+            f"{stats['local']} from templates, {stats['fallback']} fallback. "
+            f"Cache hit rate {stats['cache_hit_rate']:.0%}; model answers took {stats['mean_model_seconds']:.2f}s "
+            f"on average, so about {stats['saved_seconds']:.0f}s of waiting was saved."
+        ))
+        if options['reset']:
+            answer_cache.reset()
@@ -0,0 +1,35 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from chatbot import stub_llm
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve a local stand-in for the chat-completions API with configurable "
+        "latency and failures. Point OPENAI_API_BASE at the printed URL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=0.2, help="Seconds before the first token.")
+        parser.add_argument('--token-delay', type=float, default=0.02, help="Seconds between tokens.")
+        parser.add_argument('--tokens', type=int, default=60)
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests answered with a 500.")
+
+    def handle(self, *args, **options):
+        asyncio.run(self.serve(options))
+
+    async def serve(self, options):
+        _, url, runner = await stub_llm.start(
+            options['host'], options['port'],
+            latency=options['latency'], token_delay=options['token_delay'],
+            tokens=options['tokens'], error_rate=options['error_rate'],
+        )
+        self.stdout.write(f"Stub LLM listening; set OPENAI_API_BASE={url}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
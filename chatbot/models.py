@@ -1,3 +1,61 @@
+import uuid
+
+from django.conf import settings
 from django.db import models
 
-# Create your models here.
+
+class Conversation(models.Model):
+    """
+    One chat with the chatbot. The id is random, so it can be handed to the
+    browser to resume the chat later; a signed-in user's conversations are
+    theirs alone, anonymous ones belong to whoever holds the id.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.CASCADE, related_name="chat_conversations",
+    )
+    title = models.CharField(max_length=80, blank=True)
+    created_at = models.DateTimeField()
+    # Refreshed at most every few minutes; expiry goes by it.
+    last_active_at = models.DateTimeField(db_index=True)
+    # Rolling summary of the messages up to and including ``summarized_through``,
+    # which the model sees instead of them.
+    summary = models.TextField(blank=True, default="")
+    summarized_through = models.BigIntegerField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-last_active_at"]
+        indexes = [
+            models.Index(fields=["user", "-last_active_at"], name="chatbot_conversation_recent"),
+        ]
+
+    def __str__(self):
+        return self.title or str(self.id)
+
+
+class ChatMessage(models.Model):
+    """One message of a conversation. Only ever inserted; the id orders them and pages history."""
+
+    USER = 1
+    ASSISTANT = 2
+    ROLE_CHOICES = (
+        (USER, "user"),
+        (ASSISTANT, "assistant"),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name="messages", db_index=False)
+    role = models.PositiveSmallIntegerField(choices=ROLE_CHOICES)
+    content = models.TextField()
+    created_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [
+            # Context and history read "the last N messages of this conversation".
+            models.Index(fields=["conversation", "id"], name="chatbot_message_recent"),
+        ]
+
+    def __str__(self):
+        return f"{self.get_role_display()}: {self.content[:40]}"
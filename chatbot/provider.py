@@ -0,0 +1,239 @@
+"""
+The chat model provider: one place that decides how the chatbot talks to
+the chat-completions API and when it stops trying.
+
+Requests go through one pooled HTTP session per process with strict connect
+and read timeouts. Failed connections, 429s and 5xxs are retried with
+exponential backoff and full jitter, so a burst of failures doesn't come
+back as a burst of retries; a read timeout is not, as a provider that slow
+would only make the chat wait that long again.
+
+A circuit breaker shared by ``complete()`` and the streaming endpoint opens
+after ``FAILURES`` failed calls in a row. While it is open calls fail at
+once with ``Unavailable`` and the chatbot answers locally; every
+``RESET_AFTER`` seconds one call is let through to see whether the provider
+is back.
+
+``metrics.snapshot()`` has the call counts, errors by kind, retries, calls
+refused by the breaker and latency percentiles of this process.
+"""
+import random
+import threading
+import time
+from collections import Counter, deque
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+CONNECT_TIMEOUT = 3
+# Longest wait for a whole (non-streamed) answer.
+READ_TIMEOUT = 20
+# Attempts after the first, and the backoff before each: a random wait up to
+# BACKOFF * 2 ** attempt seconds, never more than MAX_BACKOFF.
+RETRIES = 2
+BACKOFF = 0.25
+MAX_BACKOFF = 2.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+FAILURES = 5
+RESET_AFTER = 30
+POOL_SIZE = 32
+MAX_TOKENS = 300
+TEMPERATURE = 0.7
+
+
+class ProviderError(Exception):
+    """The model server failed, answered with an error or something unreadable."""
+
+    def __init__(self, message, kind="error", retry=False):
+        super().__init__(message)
+        self.kind = kind
+        self.retry = retry
+
+
+class Unavailable(ProviderError):
+    """The circuit breaker is open; the provider was not asked."""
+
+    def __init__(self):
+        super().__init__("provider circuit open", kind="circuit_open")
+
+
+class CircuitBreaker:
+    def __init__(self, failures=FAILURES, reset_after=RESET_AFTER):
+        self.failures = failures
+        self.reset_after = reset_after
+        self.failed = 0
+        self.open_until = 0.0
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.failed < self.failures:
+            return "closed"
+        return "open" if time.monotonic() < self.open_until else "half-open"
+
+    def allow(self):
+        """Whether a call may go ahead. Once open, one call per ``reset_after`` is let through as a probe."""
+        with self.lock:
+            if self.failed < self.failures:
+                return True
+            now = time.monotonic()
+            if now < self.open_until:
+                return False
+            self.open_until = now + self.reset_after
+            return True
+
+    def success(self):
+        with self.lock:
+            self.failed = 0
+
+    def failure(self):
+        with self.lock:
+            self.failed += 1
+            if self.failed == self.failures:
+                self.open_until = time.monotonic() + self.reset_after
+
+
+class Metrics:
+    """Counters and recent latencies of provider calls in this process."""
+
+    def __init__(self, keep=1000):
+        self.counts = Counter()
+        self.latencies = deque(maxlen=keep)
+        self.lock = threading.Lock()
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counts[name] += amount
+
+    def observe(self, seconds, kind=None):
+        """One finished call: ``kind`` is None for success, else the error kind."""
+        with self.lock:
+            self.counts["calls"] += 1
+            if kind is None:
+                self.counts["ok"] += 1
+                self.latencies.append(seconds)
+            else:
+                self.counts["errors"] += 1
+                self.counts[f"error:{kind}"] += 1
+
+    def snapshot(self):
+        with self.lock:
+            counts = dict(self.counts)
+            latencies = sorted(self.latencies)
+
+        def percentile(pct):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(pct / 100 * len(latencies)))], 4)
+
+        return {
+            "calls": counts.pop("calls", 0),
+            "ok": counts.pop("ok", 0),
+            "errors": counts.pop("errors", 0),
+            "errors_by_kind": {name[6:]: value for name, value in counts.items() if name.startswith("error:")},
+            "retries": counts.get("retries", 0),
+            "short_circuited": counts.get("short_circuited", 0),
+            "prompt_tokens_mean": round(counts["prompt_tokens"] / counts["prompts"]) if counts.get("prompts") else None,
+            "latency_seconds": {"p50": percentile(50), "p95": percentile(95), "p99": percentile(99)},
+            "circuit": breaker.state,
+        }
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+            self.latencies.clear()
+
+
+breaker = CircuitBreaker()
+metrics = Metrics()
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def session():
+    """The process's pooled HTTP session."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                http = requests.Session()
+                http.mount("https://", HTTPAdapter(pool_maxsize=POOL_SIZE))
+                http.mount("http://", HTTPAdapter(pool_maxsize=POOL_SIZE))
+                _session = http
+    return _session
+
+
+def url():
+    return settings.CHATBOT_LLM_URL.rstrip("/") + "/chat/completions"
+
+
+def payload(messages, stream=False):
+    return {
+        "model": settings.CHATBOT_MODEL,
+        "messages": messages,
+        "max_tokens": MAX_TOKENS,
+        "temperature": TEMPERATURE,
+        "stream": stream,
+    }
+
+
+def status_error(status, text):
+    """The ``ProviderError`` for an HTTP error answer."""
+    return ProviderError(f"{status}: {text[:200]}", kind=f"http_{status}", retry=status in RETRY_STATUSES)
+
+
+def backoff(attempt):
+    return random.uniform(0, min(MAX_BACKOFF, BACKOFF * 2 ** attempt))
+
+
+def counts_against(error):
+    # A 400 is about that one request (e.g. too long), not the provider's health.
+    return error.kind != "http_400"
+
+
+def complete(messages, api_key):
+    """The model's answer to ``messages``, retrying what is worth retrying. Raises ``ProviderError``."""
+    if not breaker.allow():
+        metrics.count("short_circuited")
+        raise Unavailable()
+    for attempt in range(RETRIES + 1):
+        if attempt:
+            metrics.count("retries")
+            time.sleep(backoff(attempt - 1))
+        started = time.monotonic()
+        try:
+            answer = _post(messages, api_key)
+        except ProviderError as error:
+            metrics.observe(time.monotonic() - started, error.kind)
+            if error.retry and attempt < RETRIES:
+                continue
+            if counts_against(error):
+                breaker.failure()
+            raise
+        metrics.observe(time.monotonic() - started)
+        breaker.success()
+        return answer
+
+
+def _post(messages, api_key):
+    try:
+        response = session().post(
+            url(),
+            json=payload(messages),
+            headers={"Authorization": f"Bearer {api_key}"},
+            timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+        )
+    except requests.ConnectTimeout as exc:
+        raise ProviderError(str(exc), kind="connect_timeout", retry=True) from exc
+    except requests.Timeout as exc:
+        raise ProviderError(str(exc), kind="timeout") from exc
+    except requests.ConnectionError as exc:
+        raise ProviderError(str(exc), kind="connection", retry=True) from exc
+    if response.status_code != 200:
+        raise status_error(response.status_code, response.text)
+    try:
+        return response.json()["choices"][0]["message"]["content"].strip()
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError) as exc:
+        raise ProviderError(f"unreadable answer: {response.text[:200]}", kind="unreadable") from exc
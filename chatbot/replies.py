@@ -0,0 +1,148 @@
+"""
+What the chatbot says, shared by the JSON and streaming endpoints: the
+system prompt and recent context sent to the model, and the local replies
+used when no model answers or none is needed.
+"""
+from . import retrieval
+
+SYSTEM_PROMPT = (
+    "You are Sisterly AI — a warm, compassionate companion for women. "
+    "Respond like a caring sister: empathetic, non-judgmental, supportive, and concise. "
+    "Offer gentle guidance (breathing, grounding, journaling, self-care). "
+    "Maintain short-term context from recent conversation turns. "
+    "If distress appears, add a kind safety reminder and suggest professional help. "
+    "Keep tone soft and encouraging. Use emojis sparingly (1-2 max). "
+    "Be helpful with any topic: career, relationships, health, wellness, or general support. "
+    "Keep responses under 200 words and conversational."
+)
+# Messages of recent context sent with each question (4 pairs); older ones are
+# folded into the conversation's summary (see ``context``).
+CONTEXT_MESSAGES = 8
+# A message is answered from the templates without asking the model when one
+# intent clearly owns it: the only intent found, scoring at least ROUTE_SCORE,
+# its phrases making up at least ROUTE_COVERAGE of the words, and no emotion
+# or distress to respond to.
+ROUTE_SCORE = 1.5
+ROUTE_COVERAGE = 0.5
+
+DISTRESS_REPLY = (
+    "Hey sister, I'm really concerned about you. You're not alone, and there are people who want to help. "
+    "If you're in immediate danger, please call your local emergency services or a crisis hotline. "
+    "You can also connect with a counselor here on our platform. Would you like me to help you find support?"
+)
+EMOTION_REPLIES = {
+    "anxious": (
+        "I feel your anxiety, and that's completely valid. Let's try some grounding together: "
+        "Take 4 deep breaths (inhale for 4, hold for 4, exhale for 6). "
+        "Notice 5 things you can see, 4 things you can touch, 3 things you can hear, 2 things you can smell, and 1 thing you can taste. "
+        "Would you like more calming techniques, or would it help to talk to a counselor?"
+    ),
+    "sad": (
+        "Hey sister, I hear you and your feelings are valid. It's okay to not be okay. "
+        "Sometimes a gentle walk, warm tea, journaling, or talking to someone can help. "
+        "What feels manageable right now? I'm here to support you."
+    ),
+    "happy": (
+        "That's wonderful! I'm so happy for you. Celebrating your wins, big or small, is important. "
+        "Would you like to capture this moment? Maybe write it down or share it with someone you trust?"
+    ),
+}
+INTENT_REPLIES = {
+    "career": (
+        "I'd love to help with your career journey! Whether it's resume tips, interview prep, or navigating workplace challenges, "
+        "I'm here. We can work on STAR method for behavioral questions, salary negotiation, or finding your next opportunity. "
+        "What specific area would you like to focus on?"
+    ),
+    "relationship": (
+        "Relationships can be complex, and I'm here to listen. Whether you're navigating dating, friendships, or family dynamics, "
+        "your feelings matter. Would you like to talk through what's on your mind? I can also help you find resources or connect with a counselor."
+    ),
+    "health": (
+        "Your health is important. While I can offer general wellness support and information, "
+        "for specific medical concerns, I'd recommend consulting with a healthcare professional. "
+        "I can help you find resources or talk through general wellness topics. What would be most helpful?"
+    ),
+    "report": (
+        "Thank you for reaching out. Your safety is the top priority. "
+        "If you're in immediate danger, please contact local authorities. "
+        "You can report concerns through our platform's reporting system, and we have counselors available to support you. "
+        "Would you like help accessing these resources?"
+    ),
+    "wellness": (
+        "Self-care is so important! I can share ideas for meditation, gentle movement, nutrition tips, or mindfulness practices. "
+        "What area of wellness interests you? Remember, self-care looks different for everyone—what feels good to you?"
+    ),
+    "support": (
+        "I'm here to support you, sister. Whether you need someone to listen, guidance on next steps, "
+        "or help connecting with resources, I've got you. What's on your mind? You can also explore our counseling services or community groups."
+    ),
+    "greeting": (
+        "Hi sister! 💜 I'm really glad you're here. How are you feeling today? "
+        "You can talk to me about anything: how your day is going, something on your mind, or something you'd like help with."
+    ),
+    "thanks": (
+        "You're so welcome, sister. 💜 I'm here whenever you want to talk again. "
+        "Take gentle care of yourself."
+    ),
+}
+DEFAULT_REPLY = (
+    "I'm here for you, sister. I'm listening and ready to help however I can. "
+    "Whether you need support, advice, resources, or just someone to talk to, I'm here. "
+    "What would be most helpful right now?"
+)
+SAFETY_NOTE = (
+    "\n\n💜 Remember: If you're in immediate danger, please seek local help or call a crisis hotline. "
+    "You can also connect with a counselor here: /counseling/"
+)
+
+
+def prompt_messages(history, text, summary=""):
+    """The chat-completions ``messages`` for ``text`` after ``history`` and the ``summary`` of what came before."""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        *([{"role": "system", "content": f"Earlier in this conversation: {summary}"}] if summary else []),
+        *history[-CONTEXT_MESSAGES:],
+        {"role": "user", "content": text},
+    ]
+
+
+def local_reply(analysis):
+    """A reply for an ``lexicon.Analysis`` without a model: distress first, then emotion, then intent."""
+    if analysis.distress:
+        return DISTRESS_REPLY
+    if analysis.emotion in EMOTION_REPLIES:
+        return EMOTION_REPLIES[analysis.emotion]
+    for intent in analysis.intents:
+        if intent in INTENT_REPLIES:
+            return INTENT_REPLIES[intent]
+    return DEFAULT_REPLY
+
+
+def offline_reply(analysis, text, history=()):
+    """
+    The answer when no model answers: the closest curated response, unless the
+    user is in distress or nothing in the corpus is close.
+    """
+    if not analysis.distress:
+        answer = retrieval.respond(text, history, analysis)
+        if answer:
+            return answer
+    return local_reply(analysis)
+
+
+def routed_reply(analysis):
+    """The template answer for a message one intent clearly owns, else None (ask the model)."""
+    if analysis.distress or analysis.emotion != "neutral" or len(analysis.intents) != 1:
+        return None
+    intent = analysis.intents[0]
+    if (intent not in INTENT_REPLIES or analysis.scores["intent", intent] < ROUTE_SCORE
+            or analysis.coverage < ROUTE_COVERAGE):
+        return None
+    return INTENT_REPLIES[intent]
+
+
+def safety_note(answer, analysis):
+    """The note to append to ``answer`` for a distressed user, unless it already covers it."""
+    if analysis.distress and "immediate danger" not in answer.lower():
+        return SAFETY_NOTE
+    return ""
@@ -0,0 +1,233 @@
+"""
+Offline answers for the chatbot: the closest response of a curated corpus
+(``data/responses.json``), found in well under a millisecond without the
+network.
+
+Text is turned into a hashed TF-IDF vector of its words, word pairs and
+character 4-grams (so "anxiety" still meets "anxious" and a typo only costs
+a few features), L2-normalized; stop words only count inside a pair with a
+content word. Every example prompt of an entry is a row of the index, and so
+is its response, weighted ``RESPONSE_WEIGHT``. An entry scores the best
+cosine similarity of its rows to the message, plus ``TAG_BOOST`` for each
+tag it shares with the lexicon's reading of the message, minus
+``DIVERSITY_PENALTY`` times the similarity of its response to the chatbot's
+last answers, so a long chat doesn't hear the same paragraph twice. Below
+``MIN_SIMILARITY`` nothing is close enough and the caller falls back to the
+keyword replies.
+
+The index is stored column by column (the rows and weights of each hashed
+feature), so a message only touches the columns of its own features.
+``manage.py build_chat_index`` writes it as ``.npy`` files that each process
+memory-maps; if they are missing or older than the corpus, it is built in
+memory on first use instead.
+
+The corpus is a JSON list of entries::
+
+    [{"id": "sleep", "tags": ["health"], "prompts": ["I can't sleep", ...],
+      "response": "Struggling with sleep is so draining. ..."}, ...]
+"""
+import functools
+import hashlib
+import json
+import logging
+import re
+import zlib
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DATA = Path(__file__).resolve().parent / "data"
+DEFAULT_CORPUS = DATA / "responses.json"
+DEFAULT_INDEX = DATA / "index"
+INDEX_VERSION = 1
+DIMENSIONS = 2 ** 18
+MAX_CHARS = 600
+RESPONSE_WEIGHT = 0.6
+TAG_BOOST = 0.05
+DIVERSITY_PENALTY = 0.5
+# Recent chatbot answers a response is compared with.
+RECENT_ANSWERS = 3
+MIN_SIMILARITY = 0.2
+ARRAYS = ("idf", "indptr", "rows", "values", "row_weight", "entry_start", "response_row")
+
+_TOKEN = re.compile(r"[a-z0-9']+")
+# Too common to say what a message is about; in a corpus this small their
+# idf is still high, so "I want to ..." would match every other "I want to".
+STOP_WORDS = frozenset("""
+    a about all am an and any are as at be been but by can could do does for from get go going had has
+    have he her him his how i i'd i'll i'm i've if in into is it it's just me more my myself no not now of
+    on or our out really she should so some still than that the their them then there they this to too up
+    us very want was we were what when where which who why will with would you you're your
+""".split())
+
+
+def _features(text):
+    words = _TOKEN.findall(text[:MAX_CHARS].lower().replace("’", "'"))
+    features = []
+    for i, word in enumerate(words):
+        if i and not (word in STOP_WORDS and words[i - 1] in STOP_WORDS):
+            features.append(f"b:{words[i - 1]} {word}")
+        if word in STOP_WORDS:
+            continue
+        features.append("w:" + word)
+        padded = f" {word} "
+        features.extend("c:" + padded[j:j + 4] for j in range(len(padded) - 3))
+    return features
+
+
+def _counts(text):
+    """Hashed feature counts of ``text``: (columns, counts)."""
+    counts = Counter(zlib.crc32(feature.encode()) & (DIMENSIONS - 1) for feature in _features(text))
+    columns = np.fromiter(counts.keys(), np.int64, len(counts))
+    return columns, np.fromiter(counts.values(), np.float32, len(counts))
+
+
+def _weigh(columns, counts, idf):
+    values = (1 + np.log(counts)) * idf[columns]
+    norm = float(np.sqrt(np.dot(values, values)))
+    return columns, (values / norm if norm else values)
+
+
+def corpus_path():
+    return Path(getattr(settings, "CHATBOT_RESPONSES", DEFAULT_CORPUS))
+
+
+def index_path():
+    return Path(getattr(settings, "CHATBOT_RETRIEVAL_INDEX", DEFAULT_INDEX))
+
+
+def _fingerprint(raw):
+    return hashlib.sha256(raw).hexdigest() + f":{INDEX_VERSION}:{DIMENSIONS}"
+
+
+class Index:
+    """The vectors of every prompt and response, and the entries they belong to."""
+
+    def __init__(self, entries, fingerprint, arrays):
+        self.entries = entries
+        self.fingerprint = fingerprint
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self.tags = {}
+        for number, entry in enumerate(entries):
+            for tag in entry.get("tags", []):
+                self.tags.setdefault(tag, []).append(number)
+        self.tags = {tag: np.array(numbers) for tag, numbers in self.tags.items()}
+
+    @classmethod
+    def build(cls, raw):
+        """Index the corpus JSON ``raw``."""
+        entries = json.loads(raw)
+        texts, row_weight, entry_start, response_row = [], [], [], []
+        for entry in entries:
+            entry_start.append(len(texts))
+            for prompt in entry["prompts"]:
+                texts.append(prompt)
+                row_weight.append(1.0)
+            response_row.append(len(texts))
+            texts.append(entry["response"])
+            row_weight.append(RESPONSE_WEIGHT)
+        counted = [_counts(text) for text in texts]
+        frequency = np.zeros(DIMENSIONS, np.float32)
+        for columns, _ in counted:
+            frequency[columns] += 1
+        idf = (np.log((1 + len(texts)) / (1 + frequency)) + 1).astype(np.float32)
+
+        columns, rows, values = [], [], []
+        for row, (features, counts) in enumerate(counted):
+            features, weights = _weigh(features, counts, idf)
+            columns.append(features)
+            rows.append(np.full(len(features), row, np.int32))
+            values.append(weights)
+        columns, rows, values = np.concatenate(columns), np.concatenate(rows), np.concatenate(values)
+        order = np.argsort(columns, kind="stable")
+        indptr = np.zeros(DIMENSIONS + 1, np.int32)
+        np.cumsum(np.bincount(columns, minlength=DIMENSIONS), out=indptr[1:])
+        return cls(entries, _fingerprint(raw), {
+            "idf": idf,
+            "indptr": indptr,
+            "rows": rows[order],
+            "values": values[order].astype(np.float32),
+            "row_weight": np.array(row_weight, np.float32),
+            "entry_start": np.array(entry_start, np.int32),
+            "response_row": np.array(response_row, np.int32),
+        })
+
+    def save(self, path):
+        path.mkdir(parents=True, exist_ok=True)
+        for name in ARRAYS:
+            np.save(path / f"{name}.npy", getattr(self, name))
+        # Written last: an index without it is never loaded.
+        (path / "index.json").write_text(json.dumps({"fingerprint": self.fingerprint, "entries": self.entries}))
+
+    @classmethod
+    def load(cls, path):
+        """The index saved at ``path``, memory-mapped, or None if there is none."""
+        try:
+            meta = json.loads((path / "index.json").read_text())
+            arrays = {name: np.load(path / f"{name}.npy", mmap_mode="r") for name in ARRAYS}
+        except (OSError, ValueError):
+            return None
+        return cls(meta["entries"], meta["fingerprint"], arrays)
+
+    def vector(self, text):
+        columns, counts = _counts(text)
+        return _weigh(columns, counts, self.idf) if len(columns) else None
+
+    def similarities(self, vector):
+        """Cosine similarity of ``vector`` to every row."""
+        columns, weights = vector
+        starts = self.indptr[columns]
+        lengths = self.indptr[columns + 1] - starts
+        total = int(lengths.sum())
+        if not total:
+            return np.zeros(len(self.row_weight))
+        # Positions of all stored values of the message's columns, in one go.
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+        return np.bincount(
+            self.rows[positions], weights=self.values[positions] * np.repeat(weights, lengths),
+            minlength=len(self.row_weight),
+        )
+
+    def respond(self, text, recent=(), tags=()):
+        """The best response to ``text`` given the chatbot's ``recent`` answers, or None if none is close."""
+        vector = self.vector(text)
+        if vector is None:
+            return None
+        similarity = np.maximum.reduceat(self.similarities(vector) * self.row_weight, self.entry_start)
+        close = similarity >= MIN_SIMILARITY
+        if not close.any():
+            return None
+        scores = similarity.copy()
+        for tag in tags:
+            if tag in self.tags:
+                scores[self.tags[tag]] += TAG_BOOST
+        for answer in recent:
+            answer_vector = self.vector(answer)
+            if answer_vector is not None:
+                scores -= DIVERSITY_PENALTY * self.similarities(answer_vector)[self.response_row]
+        # Only entries close to the message compete; penalties just reorder them.
+        best = int(np.argmax(np.where(close, scores, -np.inf)))
+        return self.entries[best]["response"]
+
+
+@functools.lru_cache(maxsize=None)
+def index():
+    """The index of the configured corpus: the saved one if it is up to date, else built now."""
+    raw = corpus_path().read_bytes()
+    saved = Index.load(index_path())
+    if saved is not None and saved.fingerprint == _fingerprint(raw):
+        return saved
+    logger.info("Chat response index missing or stale, building it in memory (run build_chat_index)")
+    return Index.build(raw)
+
+
+def respond(text, history=(), analysis=None):
+    """The closest curated response to ``text`` after ``history``, or None."""
+    recent = [message["content"] for message in history if message["role"] == "assistant"][-RECENT_ANSWERS:]
+    tags = (analysis.emotion, *analysis.intents) if analysis is not None else ()
+    return index().respond(text, recent, tags)
@@ -0,0 +1,167 @@
+"""
+Streaming chat completions for the async chatbot endpoint.
+
+The request to the model is made with aiohttp on the server's event loop, so
+a slow answer holds no thread. Each process shares one connection pool per
+event loop and runs at most ``CHATBOT_MAX_STREAMS`` model calls at once; a
+chat that can't get a turn within ``QUEUE_TIMEOUT`` is answered locally.
+Timeouts, retries, the circuit breaker and metrics are those of
+``chatbot.provider``; a stream is only retried before its first token.
+"""
+import asyncio
+import json
+import logging
+import time
+
+import aiohttp
+from django.conf import settings
+
+from . import provider
+from .provider import ProviderError
+
+logger = logging.getLogger(__name__)
+
+# Longest wait for the next piece of the answer.
+READ_TIMEOUT = 15
+QUEUE_TIMEOUT = 2
+
+
+class Busy(Exception):
+    """Every streaming slot of this process is in use."""
+
+
+class _LoopState:
+    def __init__(self):
+        self.session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=provider.CONNECT_TIMEOUT, sock_read=READ_TIMEOUT),
+            connector=aiohttp.TCPConnector(limit=settings.CHATBOT_MAX_STREAMS),
+        )
+        self.slots = asyncio.Semaphore(settings.CHATBOT_MAX_STREAMS)
+        self.active = 0
+
+
+_states = {}
+
+
+def _state():
+    loop = asyncio.get_running_loop()
+    state = _states.get(loop)
+    if state is None:
+        # Drop pools of loops that have finished, e.g. between test runs.
+        for old in [old for old in _states if old.is_closed()]:
+            del _states[old]
+        state = _states[loop] = _LoopState()
+    return state
+
+
+class slot:
+    """``async with slot():`` waits up to ``QUEUE_TIMEOUT`` for a streaming turn, else raises ``Busy``."""
+
+    async def __aenter__(self):
+        self.state = _state()
+        try:
+            await asyncio.wait_for(self.state.slots.acquire(), QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise Busy() from None
+        self.state.active += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.state.active -= 1
+        self.state.slots.release()
+
+
+async def close():
+    """Close this event loop's connection pool."""
+    state = _states.pop(asyncio.get_running_loop(), None)
+    if state is not None:
+        await state.session.close()
+
+
+def active():
+    """Model calls in progress on this event loop."""
+    state = _states.get(asyncio.get_running_loop())
+    return state.active if state else 0
+
+
+async def stream_completion(messages, api_key):
+    """
+    Yield the answer to ``messages`` piece by piece as the model writes it.
+    Raises ``ProviderError``; cancelling the consumer (the client went away)
+    closes the request.
+    """
+    if not provider.breaker.allow():
+        provider.metrics.count("short_circuited")
+        raise provider.Unavailable()
+    response, started = await _open(messages, api_key)
+    try:
+        async for line in response.content:
+            line = line.strip()
+            if not line.startswith(b"data:"):
+                continue
+            data = line[5:].strip()
+            if data == b"[DONE]":
+                break
+            try:
+                delta = json.loads(data)["choices"][0].get("delta", {})
+            except (ValueError, KeyError, IndexError) as exc:
+                raise ProviderError(f"unreadable chunk: {data[:200]!r}", kind="unreadable") from exc
+            if delta.get("content"):
+                yield delta["content"]
+    except asyncio.TimeoutError as exc:
+        error = ProviderError("stalled mid-answer", kind="timeout")
+        _failed(error, started)
+        raise error from exc
+    except aiohttp.ClientError as exc:
+        error = ProviderError(str(exc), kind="connection")
+        _failed(error, started)
+        raise error from exc
+    except ProviderError as error:
+        _failed(error, started)
+        raise
+    else:
+        provider.metrics.observe(time.monotonic() - started)
+        provider.breaker.success()
+    finally:
+        response.release()
+
+
+def _failed(error, started):
+    provider.metrics.observe(time.monotonic() - started, error.kind)
+    if provider.counts_against(error):
+        provider.breaker.failure()
+
+
+async def _open(messages, api_key):
+    """The response to the completion request once it starts streaming, and when its attempt began."""
+    for attempt in range(provider.RETRIES + 1):
+        if attempt:
+            provider.metrics.count("retries")
+            await asyncio.sleep(provider.backoff(attempt - 1))
+        started = time.monotonic()
+        try:
+            response = await _state().session.post(
+                provider.url(),
+                json=provider.payload(messages, stream=True),
+                headers={"Authorization": f"Bearer {api_key}"},
+            )
+        except aiohttp.ConnectionTimeoutError as exc:
+            error = ProviderError(str(exc), kind="connect_timeout", retry=True)
+        except asyncio.TimeoutError:
+            error = ProviderError("timed out waiting for the answer", kind="timeout")
+        except aiohttp.ClientError as exc:
+            error = ProviderError(str(exc), kind="connection", retry=True)
+        else:
+            if response.status == 200:
+                return response, started
+            error = provider.status_error(response.status, await response.text())
+            response.release()
+        if not error.retry or attempt == provider.RETRIES:
+            _failed(error, started)
+            raise error
+        provider.metrics.observe(time.monotonic() - started, error.kind)
+
+
+def event(name, data):
+    """One server-sent event."""
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
@@ -0,0 +1,100 @@
+"""
+A local stand-in for the chat-completions API, for benchmarks and offline
+development: ``manage.py stub_llm``, then point ``OPENAI_API_BASE`` at it.
+
+It answers ``POST /v1/chat/completions`` (streamed or not) with canned text
+after a configurable delay, writing one token every ``token_delay`` seconds,
+and fails a configurable share of requests with a 500. ``GET /stats`` returns
+counters, including streams the client abandoned part way.
+"""
+import asyncio
+import json
+import random
+import time
+
+from aiohttp import web
+
+WORDS = (
+    "I hear you, and what you are feeling makes sense. Let's take this one step at a time: "
+    "breathe slowly, notice what is around you, and be gentle with yourself. "
+    "Would you like to talk a little more about what happened today?"
+).split()
+
+
+class StubLLM:
+    def __init__(self, latency=0.2, token_delay=0.02, tokens=60, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.tokens = tokens
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.stats = {"requests": 0, "errors": 0, "completed": 0, "abandoned": 0, "active": 0, "peak_active": 0}
+
+    def app(self):
+        application = web.Application()
+        application.router.add_post("/v1/chat/completions", self.completions)
+        application.router.add_post("/chat/completions", self.completions)
+        application.router.add_get("/stats", self.get_stats)
+        return application
+
+    async def get_stats(self, request):
+        return web.json_response(self.stats)
+
+    def _chunk(self, content, finish=None):
+        return {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": "stub",
+            "choices": [{"index": 0, "delta": {"content": content} if content else {}, "finish_reason": finish}],
+        }
+
+    async def completions(self, request):
+        self.stats["requests"] += 1
+        body = await request.json()
+        if self.random.random() < self.error_rate:
+            self.stats["errors"] += 1
+            return web.json_response({"error": {"message": "stub failure", "type": "server_error"}}, status=500)
+        max_tokens = min(self.tokens, body.get("max_tokens") or self.tokens)
+        words = [WORDS[i % len(WORDS)] for i in range(max_tokens)]
+        self.stats["active"] += 1
+        self.stats["peak_active"] = max(self.stats["peak_active"], self.stats["active"])
+        try:
+            await asyncio.sleep(self.latency)
+            if not body.get("stream"):
+                await asyncio.sleep(self.token_delay * len(words))
+                self.stats["completed"] += 1
+                return web.json_response({
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": "stub",
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)},
+                })
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await response.prepare(request)
+            for i, word in enumerate(words):
+                content = word if i == 0 else " " + word
+                await response.write(f"data: {json.dumps(self._chunk(content))}\n\n".encode())
+                await asyncio.sleep(self.token_delay)
+            await response.write(f"data: {json.dumps(self._chunk(None, 'stop'))}\n\ndata: [DONE]\n\n".encode())
+            await response.write_eof()
+            self.stats["completed"] += 1
+            return response
+        except (ConnectionResetError, asyncio.CancelledError):
+            self.stats["abandoned"] += 1
+            raise
+        finally:
+            self.stats["active"] -= 1
+
+
+async def start(host="127.0.0.1", port=0, **options):
+    """Serve a ``StubLLM`` on the running loop. Returns ``(stub, base_url, runner)``; ``await runner.cleanup()`` stops it."""
+    stub = StubLLM(**options)
+    runner = web.AppRunner(stub.app(), handler_cancellation=True)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound = site._server.sockets[0].getsockname()[1]
+    return stub, f"http://{host}:{bound}/v1", runner
@@ -1,3 +1,738 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import requests
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from . import answer_cache, context, conversations, lexicon, provider, replies, retrieval, streaming, stub_llm
+from .management.commands import chat_load
+from .models import ChatMessage, Conversation
+
+# What the original keyword check in chat_api flagged as distress; every one
+# of them must still reach the distress threshold on its own.
+BASELINE_DISTRESS = ("hopeless", "give up", "end it", "suicide", "self harm", "hurt myself", "kill myself", "want to die")
+
+
+class LexiconTests(TestCase):
+    def test_baseline_distress_phrases(self):
+        for phrase in BASELINE_DISTRESS:
+            with self.subTest(phrase=phrase):
+                self.assertTrue(lexicon.analyze(f"Honestly I {phrase} today").distress)
+
+    def test_distress_variants(self):
+        for text in (
+            "I want to give up", "I feel worthless", "I can't go on", "i cant go on anymore",
+            "I can’t go on", "I am ending my life", "I keep hurting myself", "I'm suicidal",
+            "i dont want to live", "thinking about taking my own life", "I feel hopeless",
+        ):
+            with self.subTest(text=text):
+                self.assertTrue(lexicon.analyze(text).distress)
+
+    def test_no_distress(self):
+        for text in ("I had a lovely weekend", "send it to me", "I hurt my knee", "the weekend is over"):
+            with self.subTest(text=text):
+                self.assertFalse(lexicon.analyze(text).distress)
+
+    def test_whole_words_only(self):
+        self.assertEqual(lexicon.analyze("please allow me").emotion, "neutral")
+        self.assertEqual(lexicon.analyze("I feel low").emotion, "neutral")
+        self.assertEqual(lexicon.analyze("I am feeling low").emotion, "sad")
+
+    def test_stems_and_longer_phrases_first(self):
+        analysis = lexicon.analyze("I had a panic attack")
+        self.assertEqual(analysis.scores["emotion", "anxious"], 2.5)
+        self.assertEqual(lexicon.analyze("I keep panicking").emotion, "anxious")
+
+    def test_intents_and_coverage(self):
+        analysis = lexicon.analyze("hello!")
+        self.assertEqual(analysis.intents, ["greeting"])
+        self.assertEqual(analysis.coverage, 1.0)
+        self.assertLess(lexicon.analyze("my boss keeps asking about my job and my weekend plans").coverage, 0.5)
+
+    def test_optional_character(self):
+        matcher = lexicon.Matcher({"g": {"c": {"don'?t go": 1.0}}})
+        self.assertEqual(len(list(matcher.matches("dont go"))), 1)
+        self.assertEqual(len(list(matcher.matches("don't go"))), 1)
+        self.assertEqual(len(list(matcher.matches("don''t go"))), 0)
+
+    def test_patterns(self):
+        matcher = lexicon.Matcher({}, patterns={"g": {"number": {r"\d+": 1.0}}})
+        self.assertEqual([match.group() for match, _ in matcher.matches("a 12 b3 45")], ["12", "45"])
+
+
+@mock.patch.dict(os.environ, {"OPENAI_API_KEY": ""})
+@override_settings(RATE_LIMIT_ENABLED=False)
+class DistressReplyTests(TestCase):
+    def ask(self, text):
+        response = self.client.post("/chatbot/api/ask/", {"text": text})
+        self.assertEqual(response.status_code, 200)
+        return response.json()["answer"]
+
+    def test_distress_gets_crisis_reply(self):
+        for text in ("I want to give up", "I feel worthless", "I can't go on", "I keep thinking about ending my life"):
+            with self.subTest(text=text):
+                answer = self.ask(text)
+                self.assertIn("immediate danger", answer)
+                self.assertNotEqual(answer, replies.DEFAULT_REPLY)
+
+    def test_safety_note_added_once(self):
+        analysis = lexicon.analyze("I want to die")
+        self.assertEqual(replies.safety_note("Some model answer.", analysis), replies.SAFETY_NOTE)
+        self.assertEqual(replies.safety_note(replies.DISTRESS_REPLY, analysis), "")
+        self.assertEqual(replies.safety_note("Some model answer.", lexicon.analyze("hello")), "")
+
+
+def model_answer(*pieces, error=None):
+    """A stand-in for ``streaming.stream_completion`` writing ``pieces``, then raising ``error`` if given."""
+    async def stream_completion(messages, api_key):
+        for piece in pieces:
+            yield piece
+        if error:
+            raise error
+    return stream_completion
+
+
+@mock.patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"})
+@override_settings(RATE_LIMIT_ENABLED=False)
+class StreamTests(TestCase):
+    # Not routed to a template: too few of its words belong to an intent.
+    QUESTION = "my boss keeps asking about my job and my weekend plans"
+
+    def setUp(self):
+        caches["chatbot"].clear()
+
+    async def stream(self, text, **data):
+        response = await self.async_client.post("/chatbot/api/stream/", {"text": text, **data})
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(response["Cache-Control"], "no-cache")
+        body = "".join([chunk.decode() async for chunk in response.streaming_content])
+        # The stream's connection pool belongs to this test's event loop.
+        await streaming.close()
+        events = []
+        for block in body.split("\n\n")[:-1]:
+            name, data = block.split("\n")
+            events.append((name.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+        return events
+
+    def test_event_framing(self):
+        self.assertEqual(streaming.event("delta", {"text": "hi"}), 'event: delta\ndata: {"text": "hi"}\n\n')
+
+    async def test_model_answer_is_streamed_and_saved(self):
+        with mock.patch.object(streaming, "stream_completion", model_answer("That sounds ", "tiring.")):
+            events = await self.stream(self.QUESTION)
+        self.assertEqual([name for name, _ in events], ["meta", "delta", "delta", "done"])
+        self.assertEqual(events[0][1], {"emotion": "neutral"})
+        done = events[-1][1]
+        self.assertEqual(done["answer"], "That sounds tiring.")
+        conversation = await Conversation.objects.aget()
+        self.assertEqual(done["conversation"], str(conversation.pk))
+        self.assertEqual(await ChatMessage.objects.filter(conversation=conversation).acount(), 2)
+
+    async def test_repeated_question_is_answered_from_the_cache(self):
+        with mock.patch.object(streaming, "stream_completion", model_answer("That sounds tiring.")):
+            await self.stream(self.QUESTION)
+        with mock.patch.object(streaming, "stream_completion", side_effect=AssertionError("model asked")):
+            events = await self.stream(self.QUESTION)
+        self.assertEqual(events[1], ("delta", {"text": "That sounds tiring."}))
+
+    async def test_provider_failure_falls_back_to_a_local_answer(self):
+        failing = model_answer(error=provider.ProviderError("boom", kind="timeout"))
+        with mock.patch.object(streaming, "stream_completion", failing), self.assertLogs("chatbot.views", "WARNING"):
+            events = await self.stream(self.QUESTION)
+        done = events[-1][1]
+        self.assertTrue(done["answer"])
+        self.assertEqual(events[1], ("delta", {"text": done["answer"]}))
+
+    async def test_answer_cut_off_midway_is_replaced_not_saved(self):
+        failing = model_answer("Have you tried ", error=provider.ProviderError("boom", kind="timeout"))
+        with mock.patch.object(streaming, "stream_completion", failing), self.assertLogs("chatbot.views", "WARNING"):
+            events = await self.stream(self.QUESTION)
+        self.assertEqual([name for name, _ in events], ["meta", "delta", "reset", "delta", "done"])
+        done = events[-1][1]
+        self.assertEqual(events[3], ("delta", {"text": done["answer"]}))
+        self.assertNotIn("Have you tried", done["answer"])
+        saved = await ChatMessage.objects.filter(role=ChatMessage.ASSISTANT).aget()
+        self.assertEqual(saved.content, done["answer"])
+
+    async def test_distress_gets_the_safety_note(self):
+        with mock.patch.object(streaming, "stream_completion", model_answer("I am so sorry.")):
+            events = await self.stream("I want to die")
+        self.assertEqual(events[-2], ("delta", {"text": replies.SAFETY_NOTE}))
+        self.assertEqual(events[-1][1]["answer"], "I am so sorry." + replies.SAFETY_NOTE)
+
+    async def test_conversation_continues(self):
+        with mock.patch.object(streaming, "stream_completion", model_answer("First.")):
+            first = await self.stream("tell me something about my week at work please")
+        with mock.patch.object(streaming, "stream_completion", model_answer("Second.")):
+            second = await self.stream(self.QUESTION, conversation=first[-1][1]["conversation"])
+        self.assertEqual(first[-1][1]["conversation"], second[-1][1]["conversation"])
+        self.assertEqual(await ChatMessage.objects.acount(), 4)
+
+    async def test_empty_message(self):
+        response = await self.async_client.post("/chatbot/api/stream/", {"text": "  "})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(CHATBOT_MAX_STREAMS=1)
+    async def test_saturated_streams_are_busy(self):
+        await streaming.close()
+        with mock.patch.object(streaming, "QUEUE_TIMEOUT", 0.01):
+            async with streaming.slot():
+                self.assertEqual(streaming.active(), 1)
+                with self.assertRaises(streaming.Busy):
+                    async with streaming.slot():
+                        pass
+        self.assertEqual(streaming.active(), 0)
+        await streaming.close()
+
+
+@override_settings(CHATBOT_CACHE_ANSWERS=True)
+class AnswerCacheTests(TestCase):
+    def setUp(self):
+        caches["chatbot"].clear()
+
+    def test_key_ignores_case_punctuation_and_spacing(self):
+        analysis = lexicon.analyze("how do I sleep better")
+        self.assertEqual(
+            answer_cache.key("How do I  sleep better?", [], analysis),
+            answer_cache.key("how do i sleep better", [], analysis),
+        )
+        self.assertEqual(answer_cache.normalize("I can’t   SLEEP!!"), "i can't sleep")
+
+    def test_key_depends_on_the_last_exchange(self):
+        analysis = lexicon.analyze("hi")
+        earlier = [{"role": "user", "content": "old"}, {"role": "assistant", "content": "news"}]
+        self.assertNotEqual(answer_cache.key("hi", [], analysis), answer_cache.key("hi", earlier, analysis))
+        self.assertEqual(
+            answer_cache.key("hi", [{"role": "user", "content": "older"}, *earlier], analysis),
+            answer_cache.key("hi", earlier, analysis),
+        )
+
+    def test_not_cached(self):
+        self.assertIsNone(answer_cache.key("I want to die", [], lexicon.analyze("I want to die")))
+        long_text = "tell me about my day " * 10
+        self.assertIsNone(answer_cache.key(long_text, [], lexicon.analyze(long_text)))
+        self.assertIsNone(answer_cache.key("?!", [], lexicon.analyze("?!")))
+        with override_settings(CHATBOT_CACHE_ANSWERS=False):
+            self.assertIsNone(answer_cache.key("hi", [], lexicon.analyze("hi")))
+
+    def test_put_get_and_stats(self):
+        analysis = lexicon.analyze("hi")
+        key = answer_cache.key("hi", [], analysis)
+        answer_cache.put(key, "Hello!", analysis)
+        answer_cache.put(None, "ignored", analysis)
+        self.assertEqual(answer_cache.get(key), "Hello!")
+        self.assertIsNone(answer_cache.get(None))
+        answer_cache.record("model", 0.5)
+        answer_cache.record("model", 1.5)
+        answer_cache.record("cache")
+        answer_cache.record("local")
+        stats = answer_cache.stats()
+        self.assertEqual((stats["answers"], stats["model"], stats["mean_model_seconds"]), (4, 2, 1.0))
+        self.assertAlmostEqual(stats["cache_hit_rate"], 1 / 3)
+        self.assertEqual(stats["saved_seconds"], 2.0)
+        answer_cache.reset()
+        self.assertEqual(answer_cache.stats()["answers"], 0)
+
+
+class RoutingTests(TestCase):
+    def test_clear_single_intent_is_routed(self):
+        self.assertEqual(replies.routed_reply(lexicon.analyze("hello!")), replies.INTENT_REPLIES["greeting"])
+        self.assertEqual(replies.routed_reply(lexicon.analyze("thank you")), replies.INTENT_REPLIES["thanks"])
+
+    def test_everything_else_asks_the_model(self):
+        for text in ("hello, I feel hopeless", "hi, I am so anxious", StreamTests.QUESTION, "what's up with the weather"):
+            with self.subTest(text=text):
+                self.assertIsNone(replies.routed_reply(lexicon.analyze(text)))
+
+
+@mock.patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"})
+@override_settings(RATE_LIMIT_ENABLED=False, CHATBOT_LOCAL_ROUTING=True, CHATBOT_CACHE_ANSWERS=True)
+class AnswerSourceTests(TestCase):
+    def setUp(self):
+        caches["chatbot"].clear()
+
+    def ask(self, text):
+        response = self.client.post("/chatbot/api/ask/", {"text": text})
+        self.assertEqual(response.status_code, 200)
+        return response.json()["answer"]
+
+    def test_greeting_is_answered_without_the_model(self):
+        with mock.patch.object(provider, "complete", side_effect=AssertionError("model asked")):
+            self.assertEqual(self.ask("hello!"), replies.INTENT_REPLIES["greeting"])
+        self.assertEqual(answer_cache.stats()["local"], 1)
+
+    @override_settings(CHATBOT_LOCAL_ROUTING=False)
+    def test_routing_can_be_switched_off(self):
+        with mock.patch.object(provider, "complete", return_value="Hi there!") as complete:
+            self.assertEqual(self.ask("hello!"), "Hi there!")
+        complete.assert_called_once()
+
+    def test_repeated_question_is_answered_from_the_cache(self):
+        with mock.patch.object(provider, "complete", return_value="That sounds tiring.") as complete:
+            self.assertEqual(self.ask(StreamTests.QUESTION), "That sounds tiring.")
+            self.assertEqual(self.ask(StreamTests.QUESTION.upper() + "!"), "That sounds tiring.")
+        complete.assert_called_once()
+        stats = answer_cache.stats()
+        self.assertEqual((stats["model"], stats["cache"]), (1, 1))
+
+    def test_distress_is_never_cached(self):
+        with mock.patch.object(provider, "complete", return_value="I am here for you.") as complete:
+            self.ask("I want to die")
+            self.ask("I want to die")
+        self.assertEqual(complete.call_count, 2)
+
+
+class ProviderTests(TestCase):
+    def setUp(self):
+        for name, value in (("breaker", provider.CircuitBreaker(failures=2)), ("metrics", provider.Metrics())):
+            patcher = mock.patch.object(provider, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(provider.time, "sleep")
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def response(self, status=200, body=None, text=""):
+        response = mock.Mock(status_code=status, text=text or json.dumps(body))
+        response.json.side_effect = lambda: json.loads(response.text)
+        return response
+
+    def post(self, *responses):
+        return mock.patch.object(provider.session(), "post", side_effect=responses)
+
+    def test_answer(self):
+        with self.post(self.response(body={"choices": [{"message": {"content": " Hi! "}}]})):
+            self.assertEqual(provider.complete([], "key"), "Hi!")
+        snapshot = provider.metrics.snapshot()
+        self.assertEqual((snapshot["calls"], snapshot["ok"], snapshot["circuit"]), (1, 1, "closed"))
+
+    def test_retries_server_errors_and_failed_connections(self):
+        answer = self.response(body={"choices": [{"message": {"content": "Hi"}}]})
+        with self.post(self.response(503, text="busy"), requests.ConnectionError("reset"), answer) as post:
+            self.assertEqual(provider.complete([], "key"), "Hi")
+        self.assertEqual(post.call_count, 3)
+        self.assertEqual(self.sleep.call_count, 2)
+        snapshot = provider.metrics.snapshot()
+        self.assertEqual(snapshot["retries"], 2)
+        self.assertEqual(snapshot["errors_by_kind"], {"http_503": 1, "connection": 1})
+
+    def test_read_timeouts_are_not_retried(self):
+        with self.post(requests.ReadTimeout("slow")) as post, self.assertRaises(provider.ProviderError) as caught:
+            provider.complete([], "key")
+        self.assertEqual((caught.exception.kind, post.call_count), ("timeout", 1))
+
+    def test_unreadable_answer(self):
+        for response in (self.response(text="<html>"), self.response(body={"choices": []})):
+            with self.subTest(text=response.text), self.post(response), self.assertRaises(provider.ProviderError) as caught:
+                provider.complete([], "key")
+            self.assertEqual(caught.exception.kind, "unreadable")
+
+    def test_breaker_opens_after_failures_in_a_row(self):
+        with self.post(*[requests.ReadTimeout("slow")] * 2):
+            for _ in range(2):
+                with self.assertRaises(provider.ProviderError):
+                    provider.complete([], "key")
+        self.assertEqual(provider.breaker.state, "open")
+        with self.post() as post, self.assertRaises(provider.Unavailable):
+            provider.complete([], "key")
+        post.assert_not_called()
+        self.assertEqual(provider.metrics.snapshot()["short_circuited"], 1)
+
+    async def test_streams_share_the_breaker(self):
+        provider.breaker.failure()
+        provider.breaker.failure()
+        with self.assertRaises(provider.Unavailable):
+            async for _ in streaming.stream_completion([], "key"):
+                pass
+        self.assertEqual(provider.metrics.snapshot()["short_circuited"], 1)
+
+    def test_bad_requests_do_not_trip_the_breaker(self):
+        with self.post(*[self.response(400, text="too long")] * 3):
+            for _ in range(3):
+                with self.assertRaises(provider.ProviderError):
+                    provider.complete([], "key")
+        self.assertEqual(provider.breaker.state, "closed")
+
+    def test_half_open_breaker_lets_one_probe_through(self):
+        breaker = provider.breaker
+        breaker.failure()
+        breaker.failure()
+        self.assertFalse(breaker.allow())
+        breaker.open_until = 0.0
+        self.assertEqual(breaker.state, "half-open")
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.success()
+        self.assertEqual(breaker.state, "closed")
+        self.assertTrue(breaker.allow())
+
+    def test_backoff_is_capped(self):
+        with mock.patch.object(provider.random, "uniform", side_effect=lambda low, high: high):
+            self.assertEqual([provider.backoff(attempt) for attempt in (0, 1, 5)], [0.25, 0.5, provider.MAX_BACKOFF])
+
+    def test_percentiles(self):
+        for seconds in range(1, 101):
+            provider.metrics.observe(seconds / 100)
+        provider.metrics.observe(5, "timeout")
+        snapshot = provider.metrics.snapshot()
+        self.assertEqual(snapshot["latency_seconds"], {"p50": 0.51, "p95": 0.96, "p99": 1.0})
+        self.assertEqual((snapshot["calls"], snapshot["errors"]), (101, 1))
+
+    @mock.patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"})
+    @override_settings(RATE_LIMIT_ENABLED=False, CHATBOT_LOCAL_ROUTING=False, CHATBOT_CACHE_ANSWERS=False)
+    def test_chat_answers_locally_while_the_provider_is_down(self):
+        provider.breaker.failure()
+        provider.breaker.failure()
+        with self.post() as post:
+            response = self.client.post("/chatbot/api/ask/", {"text": "hello!"})
+        post.assert_not_called()
+        self.assertEqual(response.json()["answer"], replies.offline_reply(lexicon.analyze("hello!"), "hello!"))
+
+    def test_metrics_are_for_staff(self):
+        self.assertEqual(self.client.get("/chatbot/api/metrics/").status_code, 302)
+        self.client.force_login(User.objects.create_user("staff", is_staff=True))
+        metrics = self.client.get("/chatbot/api/metrics/").json()
+        self.assertEqual(metrics["provider"]["circuit"], "closed")
+        self.assertIn("cache_hit_rate", metrics["answers"])
+
+
+class ConversationTests(TestCase):
+    def setUp(self):
+        caches["chatbot"].clear()
+        self.user = User.objects.create_user("asha")
+        self.now = timezone.now()
+
+    def start(self, user=None, exchanges=1, now=None):
+        conversation = None
+        for number in range(exchanges):
+            conversation = conversations.append(conversation, user, f"question {number}", f"answer {number}", now=now)
+        return conversation
+
+    def test_append_and_find(self):
+        conversation = self.start(self.user)
+        row = Conversation.objects.get()
+        self.assertEqual((str(row.pk), row.user, row.title), (conversation["id"], self.user, "question 0"))
+        found = conversations.find(self.user, conversation["id"])
+        self.assertEqual(found["messages"], [
+            {"role": "user", "content": "question 0"},
+            {"role": "assistant", "content": "answer 0"},
+        ])
+
+    def test_only_the_owner_continues(self):
+        mine, anonymous = self.start(self.user), self.start()
+        stranger = User.objects.create_user("stranger")
+        self.assertIsNone(conversations.find(stranger, mine["id"]))
+        self.assertIsNone(conversations.find(AnonymousUser(), mine["id"]))
+        self.assertIsNone(conversations.find(self.user, anonymous["id"]))
+        self.assertIsNotNone(conversations.find(AnonymousUser(), anonymous["id"]))
+        for bad in ("not-a-uuid", None, "00000000-0000-0000-0000-000000000000"):
+            self.assertIsNone(conversations.find(self.user, bad))
+
+    def test_idle_conversations_expire(self):
+        conversation = self.start(self.user)
+        later = self.now + conversations.TTL + timedelta(minutes=1)
+        self.assertIsNone(conversations.find(self.user, conversation["id"], now=later))
+        self.assertEqual(conversations.recent(self.user, now=later), [])
+
+    def test_cached_until_it_is_rebuilt_from_the_tables(self):
+        conversation = self.start(self.user, exchanges=2)
+        with self.assertNumQueries(0):
+            conversations.find(self.user, conversation["id"])
+        caches["chatbot"].clear()
+        with self.assertNumQueries(2):
+            rebuilt = conversations.find(self.user, conversation["id"])
+        self.assertEqual(rebuilt["messages"], conversation["messages"])
+
+    def test_activity_is_recorded_at_most_every_few_minutes(self):
+        conversation = self.start(self.user, now=self.now)
+        conversations.append(conversation, self.user, "again", "yes", now=self.now + timedelta(minutes=1))
+        self.assertEqual(Conversation.objects.get().last_active_at, self.now)
+        later = self.now + conversations.TOUCH_INTERVAL + timedelta(minutes=1)
+        conversations.append(conversation, self.user, "later", "still here", now=later)
+        self.assertEqual(Conversation.objects.get().last_active_at, later)
+
+    def test_history_pages_back(self):
+        conversation = self.start(self.user, exchanges=3)
+        messages, more = conversations.history(conversation, limit=4)
+        self.assertTrue(more)
+        self.assertEqual([message["content"] for message in messages], ["question 1", "answer 1", "question 2", "answer 2"])
+        messages, more = conversations.history(conversation, before=messages[0]["id"], limit=4)
+        self.assertFalse(more)
+        self.assertEqual([message["content"] for message in messages], ["question 0", "answer 0"])
+
+    def test_purge(self):
+        old = self.start(self.user, now=self.now - conversations.TTL - timedelta(days=1))
+        fresh = self.start(self.user)
+        self.assertEqual(conversations.purge(), 1)
+        self.assertEqual([str(pk) for pk in Conversation.objects.values_list("pk", flat=True)], [fresh["id"]])
+        self.assertFalse(ChatMessage.objects.filter(conversation_id=old["id"]).exists())
+        self.assertIsNone(caches["chatbot"].get(f"conversation:{old['id']}"))
+
+
+@mock.patch.dict(os.environ, {"OPENAI_API_KEY": ""})
+@override_settings(RATE_LIMIT_ENABLED=False)
+class ConversationViewTests(TestCase):
+    def setUp(self):
+        caches["chatbot"].clear()
+        self.user = User.objects.create_user("asha")
+
+    def ask(self, text, conversation=None):
+        data = {"text": text, **({"conversation": conversation} if conversation else {})}
+        return self.client.post("/chatbot/api/ask/", data).json()["conversation"]
+
+    def test_ask_continues_a_conversation(self):
+        self.client.force_login(self.user)
+        first = self.ask("hello!")
+        self.assertEqual(self.ask("thank you", first), first)
+        self.assertEqual(ChatMessage.objects.filter(conversation_id=first).count(), 4)
+        listed = self.client.get("/chatbot/api/conversations/").json()["conversations"]
+        self.assertEqual([(item["id"], item["title"]) for item in listed], [(first, "hello!")])
+
+    def test_someone_elses_conversation_starts_a_new_one(self):
+        self.client.force_login(self.user)
+        mine = self.ask("hello!")
+        self.client.logout()
+        self.assertNotEqual(self.ask("hello!", mine), mine)
+        self.assertEqual(self.client.get("/chatbot/api/conversations/").json(), {"conversations": []})
+        self.assertEqual(self.client.get(f"/chatbot/api/conversations/{mine}/").status_code, 404)
+
+    def test_history(self):
+        conversation = self.ask("hello!")
+        url = f"/chatbot/api/conversations/{conversation}/"
+        history = self.client.get(url).json()
+        self.assertEqual([message["role"] for message in history["messages"]], ["user", "assistant"])
+        self.assertFalse(history["more"])
+        older = self.client.get(url, {"before": history["messages"][0]["id"]}).json()
+        self.assertEqual(older["messages"], [])
+        self.assertEqual(self.client.get(url, {"before": "x"}).status_code, 400)
+
+
+CORPUS = [
+    {"id": "sleep", "tags": ["health"], "prompts": ["I can't sleep", "insomnia keeps me awake"],
+     "response": "Struggling with sleep is so draining."},
+    {"id": "sleep-routine", "tags": ["wellness"], "prompts": ["how do I fall asleep faster", "I can't sleep!"],
+     "response": "A calm bedtime routine can help."},
+    {"id": "interview", "tags": ["career"], "prompts": ["I have a job interview tomorrow"],
+     "response": "Let's get you ready for that interview."},
+]
+
+
+class RetrievalTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.corpus = Path(directory.name) / "responses.json"
+        self.corpus.write_text(json.dumps(CORPUS))
+        self.index_path = Path(directory.name) / "index"
+        settings = override_settings(CHATBOT_RESPONSES=self.corpus, CHATBOT_RETRIEVAL_INDEX=self.index_path)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        retrieval.index.cache_clear()
+        self.addCleanup(retrieval.index.cache_clear)
+
+    def test_closest_response(self):
+        self.assertEqual(retrieval.respond("my insomnia is back"), CORPUS[0]["response"])
+        self.assertEqual(retrieval.respond("job interviews scare me"), CORPUS[2]["response"])
+
+    def test_nothing_close(self):
+        for text in ("my cat is cute", "", "?!"):
+            with self.subTest(text=text):
+                self.assertIsNone(retrieval.respond(text))
+
+    def test_recent_answers_are_not_repeated(self):
+        recent = [{"role": "assistant", "content": CORPUS[0]["response"]}]
+        self.assertEqual(retrieval.respond("I can't sleep", recent), CORPUS[1]["response"])
+
+    def test_matching_tags_break_ties(self):
+        # Both sleep entries have the prompt "I can't sleep".
+        index = retrieval.index()
+        self.assertEqual(index.respond("I can't sleep", tags=("wellness",)), CORPUS[1]["response"])
+        self.assertEqual(index.respond("I can't sleep", tags=("health",)), CORPUS[0]["response"])
+
+    def test_saved_index_is_used_while_it_matches_the_corpus(self):
+        call_command("build_chat_index", lookups=0, stdout=StringIO())
+        with mock.patch.object(retrieval.Index, "build", side_effect=AssertionError("rebuilt")):
+            saved = retrieval.index()
+        self.assertIsInstance(saved.rows, np.memmap)
+        self.assertEqual(saved.respond("my insomnia is back"), CORPUS[0]["response"])
+
+        self.corpus.write_text(json.dumps(CORPUS[2:]))
+        retrieval.index.cache_clear()
+        self.assertEqual([entry["id"] for entry in retrieval.index().entries], ["interview"])
+
+    def test_missing_index(self):
+        self.assertIsNone(retrieval.Index.load(self.index_path))
+
+    def test_offline_reply(self):
+        self.assertEqual(replies.offline_reply(lexicon.analyze("I can't sleep"), "I can't sleep"), CORPUS[0]["response"])
+        self.assertEqual(replies.offline_reply(lexicon.analyze("my cat is cute"), "my cat is cute"), replies.DEFAULT_REPLY)
+        # Someone in distress always gets the crisis reply.
+        distress = "I can't sleep and I want to die"
+        self.assertEqual(replies.offline_reply(lexicon.analyze(distress), distress), replies.DISTRESS_REPLY)
+
+
+def exchange(question, answer="I hear you."):
+    return [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+
+
+class ContextTests(TestCase):
+    def test_token_estimate(self):
+        self.assertEqual(context.tokens("I can't sleep."), 6)
+        self.assertEqual(context.tokens("extraordinarily"), 2)
+        self.assertEqual(context.truncate("one two three four", 2), "one two …")
+        self.assertEqual(context.truncate("one two", 2), "one two")
+
+    def test_prompt_keeps_the_newest_whole_exchanges_within_budget(self):
+        history = exchange("old " * 800) + exchange("recent question")
+        conversation = {"summary": "She is starting a new job.", "messages": history}
+        messages = context.prompt(conversation, "word " * 1000)
+        self.assertEqual([message["role"] for message in messages], ["system", "system", "user", "assistant", "user"])
+        self.assertEqual(messages[1]["content"], "Earlier in this conversation: She is starting a new job.")
+        self.assertEqual(messages[2]["content"], "recent question")
+        self.assertLessEqual(context.tokens(messages[-1]["content"]), context.MESSAGE_TOKENS + 1)
+        self.assertEqual(context.prompt(None, "hi")[1:], [{"role": "user", "content": "hi"}])
+
+    def test_fold_keeps_recent_messages_verbatim(self):
+        messages = []
+        for number in range(replies.CONTEXT_MESSAGES // 2 + 1):
+            messages += exchange(f"Question number {number} about my sister.")
+        summary, kept, folded = context.fold("", messages)
+        self.assertEqual(folded, 2)
+        self.assertEqual(kept, messages[2:])
+        self.assertEqual(summary, "Question number 0 about my sister.")
+        self.assertEqual(context.fold(summary, kept[2:]), (summary, kept[2:], 0))
+
+    def test_fold_long_messages_by_tokens(self):
+        messages = exchange("My exams went badly. " * 90) + exchange("And now?")
+        _, kept, folded = context.fold("", messages)
+        self.assertEqual((folded, kept), (2, messages[2:]))
+        # The latest exchange is always kept, however long.
+        self.assertEqual(context.fold("", messages[:2])[2], 0)
+
+    def test_local_summary_keeps_telling_sentences(self):
+        messages = exchange("ok. My mother is in hospital. My mother is in hospital.") + exchange("I lost my job today")
+        summary = context.summarize_locally("I moved to Pune.", messages)
+        self.assertEqual(summary, "I moved to Pune. My mother is in hospital. I lost my job today.")
+        long_summary = " ".join(f"Sentence number {number} here." for number in range(40))
+        self.assertLessEqual(context.tokens(context.summarize_locally(long_summary, messages)), context.SUMMARY_TOKENS)
+        self.assertTrue(context.summarize_locally(long_summary, messages).endswith("I lost my job today."))
+
+    @mock.patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"})
+    @override_settings(CHATBOT_SUMMARIZER="model")
+    async def test_model_summary(self):
+        messages = exchange("I lost my job today")
+        with mock.patch.object(streaming, "stream_completion", model_answer(" She lost ", "her job. ")):
+            self.assertEqual(await context.asummarize("", messages), "She lost her job.")
+        failing = model_answer(error=provider.ProviderError("down"))
+        with mock.patch.object(streaming, "stream_completion", failing), self.assertLogs("chatbot.context", "WARNING"):
+            self.assertEqual(await context.asummarize("", messages), "I lost my job today.")
+        # The synchronous fold never waits on the model.
+        with mock.patch.object(streaming, "stream_completion", side_effect=AssertionError("model asked")), \
+                mock.patch.object(provider, "complete", side_effect=AssertionError("model asked")):
+            self.assertEqual(context.fold("", messages * 8)[0], "I lost my job today.")
+
+    @mock.patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"})
+    @override_settings(CHATBOT_SUMMARIZER="model")
+    async def test_async_append_folds_with_the_model(self):
+        await caches["chatbot"].aclear()
+        conversation = None
+        with mock.patch.object(streaming, "stream_completion", model_answer("She asked about her sister.")):
+            for number in range(replies.CONTEXT_MESSAGES // 2 + 1):
+                conversation = await conversations.aappend(conversation, None, f"Question {number}.", "Yes.")
+        row = await Conversation.objects.aget()
+        self.assertEqual((row.summary, conversation["summary"]), ("She asked about her sister.",) * 2)
+        self.assertEqual(len(conversation["messages"]), replies.CONTEXT_MESSAGES)
+
+    def test_folded_messages_are_summarized_in_the_conversation(self):
+        caches["chatbot"].clear()
+        conversation = None
+        for number in range(replies.CONTEXT_MESSAGES // 2 + 1):
+            conversation = conversations.append(conversation, None, f"Question number {number} about my sister.", "Yes.")
+        row = Conversation.objects.get()
+        self.assertEqual(row.summary, "Question number 0 about my sister.")
+        self.assertEqual(row.summarized_through, ChatMessage.objects.order_by("id")[1].pk)
+        caches["chatbot"].clear()
+        rebuilt = conversations.find(AnonymousUser(), conversation["id"])
+        self.assertEqual((rebuilt["summary"], rebuilt["messages"]), (conversation["summary"], conversation["messages"]))
+        self.assertEqual(len(rebuilt["messages"]), replies.CONTEXT_MESSAGES)
+
+
+@mock.patch.dict(os.environ, {"OPENAI_API_KEY": ""})
+@override_settings(RATE_LIMIT_ENABLED=True, RATE_LIMITS={"chat": {"user": "5/m", "ip": "1/m"}})
+class ChatRateLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_chat_is_rate_limited(self):
+        self.assertEqual(self.client.post("/chatbot/api/ask/", {"text": "hello!"}).status_code, 200)
+        response = self.client.post("/chatbot/api/ask/", {"text": "hello!"})
+        self.assertEqual((response.status_code, response["Retry-After"]), (429, "60"))
+        self.assertEqual(self.client.post("/chatbot/api/stream/", {"text": "hello!"}).status_code, 429)
+        self.assertEqual(ChatMessage.objects.count(), 2)
+
+
+class StubLLMTests(TestCase):
+    def setUp(self):
+        for name, value in (("breaker", provider.CircuitBreaker()), ("metrics", provider.Metrics()), ("RETRIES", 0)):
+            patcher = mock.patch.object(provider, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def ask(self, **options):
+        stub, url, runner = await stub_llm.start(latency=0, token_delay=0, **options)
+        try:
+            with override_settings(CHATBOT_LLM_URL=url):
+                pieces = [piece async for piece in streaming.stream_completion([], "key")]
+            return stub, pieces
+        finally:
+            await streaming.close()
+            await runner.cleanup()
+
+    async def test_streamed_answer(self):
+        stub, pieces = await self.ask(tokens=5)
+        self.assertEqual("".join(pieces), " ".join(stub_llm.WORDS[:5]))
+        self.assertEqual((stub.stats["requests"], stub.stats["completed"], stub.stats["active"]), (1, 1, 0))
+        self.assertEqual(provider.metrics.snapshot()["ok"], 1)
+
+    async def test_failures(self):
+        with self.assertRaises(provider.ProviderError) as caught:
+            await self.ask(error_rate=1.0)
+        self.assertEqual(caught.exception.kind, "http_500")
+        self.assertEqual(provider.metrics.snapshot()["errors_by_kind"], {"http_500": 1})
+
+
+class ChatLoadTests(TestCase):
+    def test_latency_summary(self):
+        seconds = [number / 1000 for number in range(1, 101)]
+        self.assertEqual(chat_load.latency_summary(seconds), {"p50": 51.0, "p95": 95.0, "p99": 99.0, "mean": 50.5, "max": 100.0})
+        self.assertIsNone(chat_load.latency_summary([]))
+
+    def test_summary(self):
+        server = mock.Mock(command=["python", "-m", "daphne"])
+        samples = [
+            {"status": 200, "seconds": 0.1, "first": 0.05},
+            {"status": 200, "seconds": 0.3, "first": None},
+            {"status": "timeout", "seconds": 60.0, "first": None},
+        ]
+        before = {"requests": 1, "errors": 0, "peak_active": 0}
+        after = {"requests": 4, "errors": 1, "peak_active": 2}
+        summary = chat_load.Command().summarize(server, samples, 2.0, before, after)
+        self.assertEqual((summary["requests"], summary["errors"], summary["statuses"]), (3, 1, {"200": 2, "timeout": 1}))
+        self.assertEqual((summary["throughput_rps"], summary["latency_ms"]["max"]), (1.0, 300.0))
+        self.assertEqual(summary["first_token_ms"]["p50"], 50.0)
+        self.assertEqual((summary["model_requests"], summary["model_errors"]), (3, 1))
+        self.assertEqual((chat_load.Command.change(100, 90), chat_load.Command.change(0, 5)), ("-10.0%", "new"))
+
+    def test_rejects_an_empty_load(self):
+        with self.assertRaises(CommandError):
+            call_command("chat_load", users=0, stdout=StringIO())
@@ -6,4 +6,8 @@ app_name = 'chatbot'
 urlpatterns = [
     path('', views.ChatbotView.as_view(), name='chat'),
     path('api/ask/', views.chat_api, name='chat_api'),
+    path('api/stream/', views.chat_stream, name='chat_stream'),
+    path('api/metrics/', views.chat_metrics, name='chat_metrics'),
+    path('api/conversations/', views.conversation_list, name='conversation_list'),
+    path('api/conversations/<uuid:conversation_id>/', views.conversation_history, name='conversation_history'),
 ]
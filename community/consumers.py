@@ -0,0 +1,93 @@
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from .models import Group, GroupMember, Discussion
+from .realtime import group_channel, discussion_channel
+
+
+class CommunityConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Pushes new comments, like/comment counts and new discussions to viewers of
+    a group page (``group_id`` route kwarg) or a discussion page (``discussion_id``).
+
+    Access and membership are resolved once at connect time and cached on the
+    consumer, so fan-out never touches the database. A user who joins or
+    leaves while connected sees the change after reconnecting.
+    """
+
+    channel_group = None
+    is_member = False
+
+    async def connect(self):
+        kwargs = self.scope['url_route']['kwargs']
+        user = self.scope.get('user')
+
+        if 'discussion_id' in kwargs:
+            group_id = await self.get_discussion_group_id(kwargs['discussion_id'])
+            channel_group = discussion_channel(kwargs['discussion_id'])
+        else:
+            group_id = kwargs['group_id']
+            channel_group = group_channel(group_id)
+
+        access = await self.get_access(group_id, user) if group_id else None
+        if access is None:
+            await self.close()
+            return
+        can_view, self.is_member = access
+        if not can_view:
+            await self.close()
+            return
+
+        self.channel_group = channel_group
+        await self.channel_layer.group_add(self.channel_group, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if self.channel_group:
+            await self.channel_layer.group_discard(self.channel_group, self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        # Updates are push-only; clients may ping to keep proxies from idling out.
+        if content.get('type') == 'ping':
+            await self.send_json({'type': 'pong'})
+
+    @database_sync_to_async
+    def get_discussion_group_id(self, discussion_id):
+        return Discussion.objects.filter(pk=discussion_id).values_list('group_id', flat=True).first()
+
+    @database_sync_to_async
+    def get_access(self, group_id, user):
+        group = Group.objects.filter(pk=group_id, is_active=True).values('visibility').first()
+        if group is None:
+            return None
+        is_member = bool(
+            user and user.is_authenticated
+            and GroupMember.objects.filter(group_id=group_id, user=user).exists()
+        )
+        return group['visibility'] == 'public' or is_member, is_member
+
+    # Channel layer event handlers
+
+    async def comment_created(self, event):
+        await self.send_json({
+            'type': 'comment.created',
+            'discussion_id': event['discussion_id'],
+            'comment_id': event['comment_id'],
+            'parent_id': event['parent_id'],
+            'comment_count': event['comment_count'],
+            'html': event['html'],
+        })
+
+    async def discussion_stats(self, event):
+        payload = {'type': 'discussion.stats', 'discussion_id': event['discussion_id']}
+        for key in ('comment_count', 'like_count'):
+            if key in event:
+                payload[key] = event[key]
+        await self.send_json(payload)
+
+    async def discussion_created(self, event):
+        await self.send_json({
+            'type': 'discussion.created',
+            'discussion_id': event['discussion_id'],
+            'html': event['member_html'] if self.is_member else event['html'],
+        })
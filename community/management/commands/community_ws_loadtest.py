@@ -0,0 +1,102 @@
+import asyncio
+import statistics
+import time
+
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from community.models import Group, GroupMember, Discussion
+from community.realtime import discussion_channel
+from community.routing import websocket_urlpatterns
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "Open N websocket consumers on one discussion and measure how long the "
+        "channel layer takes to fan a new comment out to all of them. Runs "
+        "in-process against a throwaway test database, through Channels' test "
+        "communicator: it measures the consumers and channel layer only, not "
+        "real sockets, a server or several processes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sockets', type=int, default=5000)
+        parser.add_argument('--messages', type=int, default=20)
+        parser.add_argument('--connect-batch', type=int, default=250)
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            user = User.objects.create_user('loadtest_member', password='loadtest')
+            group = Group.objects.create(name='Load test', description='-', creator=user)
+            GroupMember.objects.create(group=group, user=user, role='admin')
+            discussion = Discussion.objects.create(group=group, author=user, content='-')
+            asyncio.run(self.run(discussion, user, options))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    async def run(self, discussion, user, options):
+        application = URLRouter(websocket_urlpatterns)
+        path = f'/ws/community/discussion/{discussion.pk}/'
+        sockets = options['sockets']
+
+        communicators = []
+        started = time.perf_counter()
+        for offset in range(0, sockets, options['connect_batch']):
+            batch = []
+            for _ in range(min(options['connect_batch'], sockets - offset)):
+                communicator = WebsocketCommunicator(application, path)
+                communicator.scope['user'] = user
+                batch.append(communicator)
+            results = await asyncio.gather(*(c.connect(timeout=60) for c in batch))
+            if not all(connected for connected, _ in results):
+                raise RuntimeError('A consumer refused the connection')
+            communicators.extend(batch)
+        connect_time = time.perf_counter() - started
+        self.stdout.write(f"Connected {sockets} sockets in {connect_time:.2f}s")
+
+        layer = get_channel_layer()
+        html = '<div class="comment-card">' + 'x' * 400 + '</div>'
+        per_socket = []
+        fanout = []
+        for i in range(options['messages']):
+            sent_at = time.perf_counter()
+
+            async def receive(communicator):
+                await communicator.receive_json_from(timeout=30)
+                return time.perf_counter() - sent_at
+
+            receivers = [asyncio.ensure_future(receive(c)) for c in communicators]
+            await layer.group_send(discussion_channel(discussion.pk), {
+                'type': 'comment.created',
+                'discussion_id': discussion.pk,
+                'comment_id': i,
+                'parent_id': None,
+                'comment_count': i + 1,
+                'html': html,
+            })
+            latencies = await asyncio.gather(*receivers)
+            fanout.append(max(latencies))
+            per_socket.extend(latencies)
+
+        await asyncio.gather(*(c.disconnect() for c in communicators))
+
+        ms = 1000
+        self.stdout.write(self.style.SUCCESS(
+            f"Fan-out to {sockets} sockets over {options['messages']} messages: "
+            f"p50={percentile(per_socket, 50) * ms:.1f}ms "
+            f"p95={percentile(per_socket, 95) * ms:.1f}ms "
+            f"p99={percentile(per_socket, 99) * ms:.1f}ms "
+            f"last-socket mean={statistics.mean(fanout) * ms:.1f}ms "
+            f"max={max(fanout) * ms:.1f}ms"
+        ))
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.7 on 2026-10-19 13:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiscussionReadMarker',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GroupReadMarker',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['discussion', 'created_at'], name='community_c_discuss_7f783e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='discussion',
+            index=models.Index(fields=['group', 'created_at'], name='community_d_group_i_22af2e_idx'),
+        ),
+        migrations.AddField(
+            model_name='discussionreadmarker',
+            name='discussion',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_markers', to='community.discussion'),
+        ),
+        migrations.AddField(
+            model_name='discussionreadmarker',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='discussion_read_markers', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='groupreadmarker',
+            name='group',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_markers', to='community.group'),
+        ),
+        migrations.AddField(
+            model_name='groupreadmarker',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='group_read_markers', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='discussionreadmarker',
+            unique_together={('user', 'discussion')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='groupreadmarker',
+            unique_together={('user', 'group')},
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.7 on 2026-10-19 13:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def encode_segment(position):
+    digits = []
+    while position:
+        position, remainder = divmod(position, 36)
+        digits.append('0123456789abcdefghijklmnopqrstuvwxyz'[remainder])
+    return ''.join(reversed(digits)).rjust(6, '0')
+
+
+def backfill_paths(apps, schema_editor):
+    """Existing comments are flat: number them as top-level threads in posting order."""
+    Comment = apps.get_model('community', 'Comment')
+    Discussion = apps.get_model('community', 'Discussion')
+    counts = {}
+    batch = []
+    comments = Comment.objects.order_by('discussion_id', 'created_at', 'id').only('id', 'discussion_id')
+    for comment in comments.iterator(chunk_size=2000):
+        position = counts.get(comment.discussion_id, 0) + 1
+        counts[comment.discussion_id] = position
+        comment.position = position
+        comment.path = encode_segment(position)
+        batch.append(comment)
+        if len(batch) >= 2000:
+            Comment.objects.bulk_update(batch, ['position', 'path'])
+            batch = []
+    if batch:
+        Comment.objects.bulk_update(batch, ['position', 'path'])
+    for discussion_id, count in counts.items():
+        Discussion.objects.filter(pk=discussion_id).update(thread_count=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0002_read_markers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='replies', to='community.comment'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(default='', editable=False, max_length=252),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='position',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='discussion',
+            name='thread_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Top-level comments ever posted'),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='comment',
+            unique_together={('discussion', 'path')},
+        ),
+    ]
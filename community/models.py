@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
+from sisterhood_stories.comment_threads import ThreadedComment
 
 
 class Group(models.Model):
@@ -62,11 +63,15 @@ class Discussion(models.Model):
     title = models.CharField(max_length=200, blank=True)
     content = models.TextField()
     is_pinned = models.BooleanField(default=False)
+    thread_count = models.PositiveIntegerField(default=0, editable=False, help_text="Top-level comments ever posted")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-is_pinned', '-created_at']
+        indexes = [
+            models.Index(fields=['group', 'created_at']),
+        ]
     
     def __str__(self):
         return f"{self.title or 'Discussion'} in {self.group.name}"
@@ -95,7 +100,9 @@ class DiscussionLike(models.Model):
         return f"{self.user.username} likes {self.discussion}"
 
 
-class Comment(models.Model):
+class Comment(ThreadedComment):
+    thread_container_field = 'discussion'
+
     discussion = models.ForeignKey(Discussion, on_delete=models.CASCADE, related_name='comments')
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='comments')
     content = models.TextField()
@@ -104,6 +111,36 @@ class Comment(models.Model):
     
     class Meta:
         ordering = ['created_at']
+        unique_together = ('discussion', 'path')
+        indexes = [
+            models.Index(fields=['discussion', 'created_at']),
+        ]
     
     def __str__(self):
         return f"Comment by {self.author.username} on {self.discussion}"
+
+
+class GroupReadMarker(models.Model):
+    """Per-(user, group) watermark: discussions created after it are unread."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='group_read_markers')
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='read_markers')
+    last_read_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'group')
+
+    def __str__(self):
+        return f"{self.user.username} read {self.group.name} up to {self.last_read_at}"
+
+
+class DiscussionReadMarker(models.Model):
+    """Per-(user, discussion) watermark: comments created after it are unread."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='discussion_read_markers')
+    discussion = models.ForeignKey(Discussion, on_delete=models.CASCADE, related_name='read_markers')
+    last_read_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'discussion')
+
+    def __str__(self):
+        return f"{self.user.username} read {self.discussion} up to {self.last_read_at}"
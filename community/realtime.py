@@ -0,0 +1,71 @@
+"""
+Live update broadcasting for community pages.
+
+Views call the ``broadcast_*`` helpers after a write; the payload is rendered
+once here and fanned out through the channel layer to every socket connected
+to the group or discussion (see ``consumers.CommunityConsumer``).
+"""
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.template.loader import render_to_string
+
+
+def group_channel(group_id):
+    return f"community.group.{group_id}"
+
+
+def discussion_channel(discussion_id):
+    return f"community.discussion.{discussion_id}"
+
+
+def _send(channel_group, message):
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    async_to_sync(layer.group_send)(channel_group, message)
+
+
+def _send_on_commit(channel_group, message):
+    # Only publish once the row is visible to readers reloading the page.
+    transaction.on_commit(lambda: _send(channel_group, message))
+
+
+def broadcast_comment(comment, comment_count):
+    discussion = comment.discussion
+    html = render_to_string('community/partials/comment.html', {'comment': comment})
+    _send_on_commit(discussion_channel(discussion.pk), {
+        'type': 'comment.created',
+        'discussion_id': discussion.pk,
+        'comment_id': comment.pk,
+        'parent_id': comment.parent_id,
+        'comment_count': comment_count,
+        'html': html,
+    })
+    _send_on_commit(group_channel(discussion.group_id), {
+        'type': 'discussion.stats',
+        'discussion_id': discussion.pk,
+        'comment_count': comment_count,
+    })
+
+
+def broadcast_like_count(discussion, like_count):
+    message = {
+        'type': 'discussion.stats',
+        'discussion_id': discussion.pk,
+        'like_count': like_count,
+    }
+    _send_on_commit(discussion_channel(discussion.pk), message)
+    _send_on_commit(group_channel(discussion.group_id), message)
+
+
+def broadcast_discussion(discussion):
+    # Members get the card with a working like button; everyone else gets the
+    # read-only variant. Rendering both here keeps fan-out free of templating.
+    context = {'discussion': discussion}
+    _send_on_commit(group_channel(discussion.group_id), {
+        'type': 'discussion.created',
+        'discussion_id': discussion.pk,
+        'html': render_to_string('community/partials/discussion_card.html', {**context, 'is_member': False}),
+        'member_html': render_to_string('community/partials/discussion_card.html', {**context, 'is_member': True}),
+    })
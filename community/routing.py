@@ -0,0 +1,7 @@
+from django.urls import path
+from . import consumers
+
+websocket_urlpatterns = [
+    path('ws/community/group/<int:group_id>/', consumers.CommunityConsumer.as_asgi()),
+    path('ws/community/discussion/<int:discussion_id>/', consumers.CommunityConsumer.as_asgi()),
+]
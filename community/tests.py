@@ -1,3 +1,253 @@
-from django.test import TestCase
+import json
+from datetime import timedelta
 
-# Create your tests here.
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from . import realtime, unread
+from sisterhood_stories.comment_threads import MAX_DEPTH, nest, thread_page
+
+from .routing import websocket_urlpatterns
+from .models import Comment, Discussion, DiscussionReadMarker, Group, GroupMember, GroupReadMarker
+
+
+def make_user(username):
+    # No password: hashing one costs more than the rest of a test, and tests log in with force_login.
+    return User.objects.create_user(username, f"{username}@example.com")
+
+
+def make_group(creator, name="Circle", **fields):
+    group = Group.objects.create(name=name, description=f"About {name}", creator=creator, **fields)
+    GroupMember.objects.create(group=group, user=creator, role="admin")
+    return group
+
+
+class ThreadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = make_user("author")
+        self.group = make_group(self.author)
+        self.discussion = Discussion.objects.create(group=self.group, author=self.author, content="Hello")
+
+    def comment(self, content, parent=None, discussion=None):
+        return Comment.objects.create(
+            discussion=discussion or self.discussion, author=self.author, content=content, parent=parent,
+        )
+
+    def test_paths_follow_the_tree(self):
+        first, second = self.comment("first"), self.comment("second")
+        reply = self.comment("reply", parent=first)
+        nested = self.comment("nested", parent=reply)
+        self.assertEqual((first.path, second.path), ("000001", "000002"))
+        self.assertEqual((reply.path, reply.depth), ("000001000001", 1))
+        self.assertEqual((nested.path, nested.depth), ("000001000001000001", 2))
+        self.discussion.refresh_from_db()
+        self.assertEqual(self.discussion.thread_count, 2)
+        ordered = Comment.objects.filter(discussion=self.discussion).order_by("path")
+        self.assertEqual(list(ordered), [first, reply, nested, second])
+
+    def test_thread_page_previews_replies(self):
+        first, second, third = self.comment("first"), self.comment("second"), self.comment("third")
+        replies = [self.comment(f"reply {i}", parent=first) for i in range(4)]
+        self.comment("nested", parent=replies[0])
+        page = thread_page(self.discussion.comments.all(), count=2, replies=3)
+        self.assertEqual(list(page), [first, *replies[:3], second])
+        roots = nest(page)
+        self.assertEqual(roots, [first, second])
+        self.assertEqual(roots[0].loaded_replies, replies[:3])
+        self.assertEqual(list(thread_page(self.discussion.comments.all(), parent=first, start=4)), [replies[3]])
+        self.assertEqual(list(thread_page(self.discussion.comments.all(), start=3)), [third])
+
+    def test_depth_is_capped(self):
+        parent = None
+        for level in range(MAX_DEPTH + 2):
+            parent = self.comment(f"level {level}", parent=parent)
+        self.assertEqual(parent.depth, MAX_DEPTH - 1)
+
+    def test_thread_view_pages(self):
+        first = self.comment("first")
+        self.comment("reply", parent=first)
+        self.comment("second")
+        response = self.client.get(f"/community/discussion/{self.discussion.pk}/comments/", {"start": 2})
+        self.assertContains(response, "second")
+        self.assertNotContains(response, "first")
+        self.assertIsNone(response.json()["next_start"])
+        response = self.client.get(f"/community/discussion/{self.discussion.pk}/comments/", {"parent": first.pk})
+        self.assertIn("reply", response.json()["html"])
+        for params in ({"start": "x"}, {"parent": "x"}):
+            with self.subTest(params=params):
+                response = self.client.get(f"/community/discussion/{self.discussion.pk}/comments/", params)
+                self.assertEqual(response.status_code, 400)
+
+    def test_private_threads_are_for_members(self):
+        private = make_group(self.author, "Private", visibility="private")
+        hidden = Discussion.objects.create(group=private, author=self.author, content="Members only")
+        for url in (f"/community/discussion/{hidden.pk}/comments/", f"/community/discussion/{hidden.pk}/"):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+                self.client.force_login(make_user(f"stranger{len(url)}"))
+                self.assertEqual(self.client.get(url).status_code, 404)
+                self.client.force_login(self.author)
+                self.assertEqual(self.client.get(url).status_code, 200)
+                self.client.logout()
+
+    def test_reply_must_be_in_the_same_discussion(self):
+        elsewhere = Discussion.objects.create(group=self.group, author=self.author, content="Elsewhere")
+        foreign = self.comment("foreign", discussion=elsewhere)
+        self.client.force_login(self.author)
+        url = f"/community/discussion/{self.discussion.pk}/comment/"
+        self.assertEqual(self.client.post(url, {"content": "hi", "parent": foreign.pk}).status_code, 404)
+        self.assertEqual(self.client.post(url, {"content": "hi", "parent": "x"}).status_code, 400)
+        parent = self.comment("parent")
+        self.client.post(url, {"content": "hi", "parent": parent.pk})
+        self.assertEqual(Comment.objects.get(content="hi").parent, parent)
+
+
+class UnreadTests(TestCase):
+    def setUp(self):
+        self.owner = make_user("owner")
+        self.reader = make_user("reader")
+        self.group = make_group(self.owner)
+        GroupMember.objects.create(group=self.group, user=self.reader)
+        GroupMember.objects.filter(user=self.reader).update(joined_at=timezone.now() - timedelta(hours=1))
+        self.discussion = Discussion.objects.create(group=self.group, author=self.owner, content="Hello")
+        self.private = make_group(self.owner, "Private", visibility="private")
+        self.hidden = Discussion.objects.create(group=self.private, author=self.owner, content="Members only")
+
+    def test_counts_for_members_only(self):
+        self.assertEqual(unread.unread_discussion_counts(self.reader), {self.group.pk: 1})
+        # Nobody counts their own posts.
+        self.assertEqual(unread.unread_discussion_counts(self.owner), {})
+        Comment.objects.create(discussion=self.discussion, author=self.owner, content="First")
+        Comment.objects.create(discussion=self.hidden, author=self.owner, content="Secret")
+        counts = unread.unread_comment_counts(self.reader, [self.discussion.pk, self.hidden.pk])
+        self.assertEqual(counts, {self.discussion.pk: 1})
+
+    def test_mark_read_clears_counts_and_never_moves_back(self):
+        now = timezone.now()
+        unread.mark_read(self.reader, groups={self.group.pk: now})
+        self.assertEqual(unread.unread_discussion_counts(self.reader), {})
+        unread.mark_read(self.reader, groups={self.group.pk: now - timedelta(days=1)})
+        self.assertEqual(GroupReadMarker.objects.get(user=self.reader).last_read_at, now)
+
+    def test_mark_read_clamps_to_now(self):
+        unread.mark_read(self.reader, discussions={self.discussion.pk: timezone.now() + timedelta(days=365)})
+        self.assertLessEqual(DiscussionReadMarker.objects.get().last_read_at, timezone.now())
+
+    def test_mark_read_ignores_groups_the_user_is_not_in(self):
+        now = timezone.now()
+        unread.mark_read(
+            self.reader,
+            groups={self.private.pk: now, 0: now},
+            discussions={self.hidden.pk: now, 0: now},
+        )
+        self.assertFalse(GroupReadMarker.objects.exists())
+        self.assertFalse(DiscussionReadMarker.objects.exists())
+
+    def test_view(self):
+        self.client.force_login(self.reader)
+        markers = {"groups": {str(self.group.pk): timezone.now().isoformat()},
+                   "discussions": {str(self.hidden.pk): timezone.now().isoformat()}}
+        response = self.client.post("/community/read/", json.dumps(markers), content_type="application/json")
+        self.assertEqual(response.json(), {"ok": True})
+        self.assertEqual(list(GroupReadMarker.objects.values_list("group", flat=True)), [self.group.pk])
+        self.assertFalse(DiscussionReadMarker.objects.exists())
+
+    def test_view_rejects_bad_markers(self):
+        self.client.force_login(self.reader)
+        too_many = {"groups": {str(pk): timezone.now().isoformat() for pk in range(unread.MAX_MARKERS_PER_REQUEST + 1)}}
+        for body in ("not json", json.dumps({"groups": {"1": "yesterday"}}), json.dumps(too_many)):
+            with self.subTest(body=body[:30]):
+                response = self.client.post("/community/read/", body, content_type="application/json")
+                self.assertEqual(response.status_code, 400)
+
+
+class RealtimeTests(TransactionTestCase):
+    # Consumers reach the database from other threads, so the data has to be committed.
+
+    def setUp(self):
+        self.owner = make_user("owner")
+        self.group = make_group(self.owner)
+        self.discussion = Discussion.objects.create(group=self.group, author=self.owner, content="Hello")
+        self.private = make_group(self.owner, "Private", visibility="private")
+        self.stranger = make_user("stranger")
+
+    async def connect(self, path, user=None):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+        communicator.scope["user"] = user or AnonymousUser()
+        connected, _ = await communicator.connect()
+        return communicator, connected
+
+    async def test_new_discussions_reach_group_viewers(self):
+        visitor, connected = await self.connect(f"/ws/community/group/{self.group.pk}/")
+        member, _ = await self.connect(f"/ws/community/group/{self.group.pk}/", self.owner)
+        self.assertTrue(connected)
+        await database_sync_to_async(realtime.broadcast_discussion)(self.discussion)
+        seen, member_seen = await visitor.receive_json_from(), await member.receive_json_from()
+        self.assertEqual((seen["type"], seen["discussion_id"]), ("discussion.created", self.discussion.pk))
+        # Only members get a working like button.
+        self.assertNotEqual(seen["html"], member_seen["html"])
+        await visitor.disconnect()
+        await member.disconnect()
+
+    async def test_comments_reach_discussion_viewers(self):
+        viewer, _ = await self.connect(f"/ws/community/discussion/{self.discussion.pk}/")
+        comment = await database_sync_to_async(Comment.objects.create)(
+            discussion=self.discussion, author=self.owner, content="First!",
+        )
+        await database_sync_to_async(realtime.broadcast_comment)(comment, 1)
+        event = await viewer.receive_json_from()
+        self.assertEqual((event["type"], event["comment_id"], event["comment_count"]), ("comment.created", comment.pk, 1))
+        self.assertIn("First!", event["html"])
+        await viewer.send_json_to({"type": "ping"})
+        self.assertEqual(await viewer.receive_json_from(), {"type": "pong"})
+        await viewer.disconnect()
+
+    async def test_private_groups_are_for_members(self):
+        _, connected = await self.connect(f"/ws/community/group/{self.private.pk}/")
+        self.assertFalse(connected)
+        _, connected = await self.connect(f"/ws/community/group/{self.private.pk}/", self.stranger)
+        self.assertFalse(connected)
+        member, connected = await self.connect(f"/ws/community/group/{self.private.pk}/", self.owner)
+        self.assertTrue(connected)
+        await member.disconnect()
+        _, connected = await self.connect("/ws/community/discussion/0/")
+        self.assertFalse(connected)
+
+
+class ThreadBackfillTests(TransactionTestCase):
+    before = [("community", "0002_read_markers")]
+    after = [("community", "0003_threaded_comments")]
+
+    def tearDown(self):
+        MigrationExecutor(connection).migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_existing_comments_become_threads_in_posting_order(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        author = apps.get_model("auth", "User").objects.create(username="author")
+        group = apps.get_model("community", "Group").objects.create(name="Circle", description="", creator=author)
+        Discussion = apps.get_model("community", "Discussion")
+        discussions = [Discussion.objects.create(group=group, author=author, content=str(i)) for i in range(2)]
+        Comment = apps.get_model("community", "Comment")
+        for discussion, text in ((discussions[0], "a"), (discussions[1], "b"), (discussions[0], "c")):
+            Comment.objects.create(discussion=discussion, author=author, content=text)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        apps = executor.loader.project_state(self.after).apps
+        Comment = apps.get_model("community", "Comment")
+        self.assertEqual(
+            list(Comment.objects.order_by("content").values_list("content", "path", "position")),
+            [("a", "000001", 1), ("b", "000001", 1), ("c", "000002", 2)],
+        )
+        thread_counts = apps.get_model("community", "Discussion").objects.order_by("pk").values_list("thread_count", flat=True)
+        self.assertEqual(list(thread_counts), [2, 1])
@@ -0,0 +1,99 @@
+"""
+Read state for community groups and discussions.
+
+Each user keeps one watermark row per group and per discussion. Anything
+created after the watermark (or after the user joined, if there is no
+watermark yet) counts as unread, so counts come from a single grouped query
+over indexed (parent, created_at) columns instead of per-item read rows.
+"""
+from django.db.models import Count, F, FilteredRelation, Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Group, Discussion, Comment, GroupReadMarker, DiscussionReadMarker
+
+# Upper bound on markers accepted per request; the client batches anyway.
+MAX_MARKERS_PER_REQUEST = 100
+
+
+def unread_discussion_counts(user):
+    """Return ``{group_id: unread discussion count}`` for every group the user belongs to."""
+    if not user.is_authenticated:
+        return {}
+    rows = Discussion.objects.annotate(
+        membership=FilteredRelation('group__members', condition=Q(group__members__user=user)),
+        marker=FilteredRelation('group__read_markers', condition=Q(group__read_markers__user=user)),
+        # Annotating (rather than filtering on) the coalesce keeps the marker a LEFT JOIN.
+        read_since=Coalesce(F('marker__last_read_at'), F('membership__joined_at')),
+    ).filter(
+        membership__isnull=False,
+        created_at__gt=F('read_since'),
+    ).exclude(author=user).values('group_id').annotate(unread=Count('id')).order_by()
+    return {row['group_id']: row['unread'] for row in rows}
+
+
+def unread_comment_counts(user, discussion_ids):
+    """Return ``{discussion_id: unread comment count}`` for the given discussions."""
+    if not user.is_authenticated or not discussion_ids:
+        return {}
+    rows = Comment.objects.filter(discussion_id__in=discussion_ids).annotate(
+        membership=FilteredRelation(
+            'discussion__group__members', condition=Q(discussion__group__members__user=user)
+        ),
+        marker=FilteredRelation('discussion__read_markers', condition=Q(discussion__read_markers__user=user)),
+        read_since=Coalesce(F('marker__last_read_at'), F('membership__joined_at')),
+    ).filter(
+        membership__isnull=False,
+        created_at__gt=F('read_since'),
+    ).exclude(author=user).values('discussion_id').annotate(unread=Count('id')).order_by()
+    return {row['discussion_id']: row['unread'] for row in rows}
+
+
+def _advance(model, parent_field, user, watermarks):
+    """
+    Move ``user``'s markers forward to the given ``{parent_id: datetime}``
+    watermarks. Markers never move backwards, so late or duplicated requests
+    are harmless.
+    """
+    if not watermarks:
+        return
+    existing = dict(
+        model.objects.filter(user=user, **{f'{parent_field}__in': watermarks})
+        .values_list(parent_field, 'last_read_at')
+    )
+    new_markers = []
+    for parent_id, read_at in watermarks.items():
+        if parent_id not in existing:
+            new_markers.append(model(user=user, last_read_at=read_at, **{parent_field: parent_id}))
+        elif existing[parent_id] < read_at:
+            # Conditional update keeps the marker monotonic under concurrent requests.
+            model.objects.filter(
+                user=user, last_read_at__lt=read_at, **{parent_field: parent_id}
+            ).update(last_read_at=read_at)
+    if new_markers:
+        model.objects.bulk_create(new_markers, ignore_conflicts=True)
+
+
+def mark_read(user, groups=None, discussions=None):
+    """
+    Advance read markers. ``groups`` and ``discussions`` map ids to the
+    timestamp of the newest item the user has seen; timestamps are clamped to
+    now, and ids outside the user's groups (or unknown ones) are dropped.
+    """
+    now = timezone.now()
+    groups = {pk: min(ts, now) for pk, ts in (groups or {}).items()}
+    discussions = {pk: min(ts, now) for pk, ts in (discussions or {}).items()}
+
+    if groups:
+        valid = set(
+            Group.objects.filter(pk__in=groups, members__user=user).values_list('pk', flat=True)
+        )
+        _advance(GroupReadMarker, 'group_id', user, {pk: ts for pk, ts in groups.items() if pk in valid})
+    if discussions:
+        valid = set(
+            Discussion.objects.filter(pk__in=discussions, group__members__user=user).values_list('pk', flat=True)
+        )
+        _advance(
+            DiscussionReadMarker, 'discussion_id', user,
+            {pk: ts for pk, ts in discussions.items() if pk in valid},
+        )
@@ -13,4 +13,6 @@ urlpatterns = [
     path('discussion/<int:pk>/', views.DiscussionDetailView.as_view(), name='discussion_detail'),
     path('discussion/<int:pk>/like/', views.ToggleDiscussionLikeView.as_view(), name='toggle_like'),
     path('discussion/<int:discussion_id>/comment/', views.CreateCommentView.as_view(), name='create_comment'),
+    path('discussion/<int:pk>/comments/', views.CommentThreadView.as_view(), name='comment_thread'),
+    path('read/', views.MarkReadView.as_view(), name='mark_read'),
 ]
@@ -1,14 +1,35 @@
+import json
 from django.views.generic import ListView, CreateView, DetailView, View
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.shortcuts import get_object_or_404, redirect
 from django.contrib import messages
 from django.db.models import Q, Count
-from django.http import JsonResponse
+from django.http import HttpResponseBadRequest, JsonResponse
+from django.template.loader import render_to_string
 from django.views.decorators.http import require_POST
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from .models import Group, GroupMember, Discussion, DiscussionLike, Comment
 from .forms import GroupForm, DiscussionForm, CommentForm
+from . import realtime, unread
+from sisterhood_stories.comment_threads import thread_page, nest
+from sisterhood_stories.ratelimit import ratelimit
+
+# Top-level comments per page, and how many replies of each are shown inline
+# before the reader expands the thread.
+THREADS_PER_PAGE = 20
+REPLIES_PER_PAGE = 10
+REPLY_PREVIEW = 3
+
+
+def visible_discussions(user):
+    """Discussions ``user`` may read: those of public groups and of private groups they belong to."""
+    visible = Q(group__visibility='public')
+    if user.is_authenticated:
+        visible |= Q(group__in=GroupMember.objects.filter(user=user).values('group_id'))
+    return Discussion.objects.filter(visible, group__is_active=True)
 
 
 class CommunityListView(ListView):
@@ -30,11 +51,13 @@ class CommunityListView(ListView):
                 member_count=Count('members')
             ).select_related('creator')
         
-        # Add membership status for each group
+        # Add membership status and unread badges for each group
+        self.unread_counts = unread.unread_discussion_counts(self.request.user)
         if self.request.user.is_authenticated:
             user_group_ids = set(GroupMember.objects.filter(user=self.request.user).values_list('group_id', flat=True))
             for group in queryset:
                 group.user_is_member = group.id in user_group_ids
+                group.unread_count = self.unread_counts.get(group.id, 0)
         else:
             for group in queryset:
                 group.user_is_member = False
@@ -47,9 +70,11 @@ class CommunityListView(ListView):
         # My groups
         if self.request.user.is_authenticated:
             my_group_ids = GroupMember.objects.filter(user=self.request.user).values_list('group_id', flat=True)
-            context['my_groups'] = Group.objects.filter(id__in=my_group_ids, is_active=True).annotate(
+            context['my_groups'] = list(Group.objects.filter(id__in=my_group_ids, is_active=True).annotate(
                 member_count=Count('members')
-            )
+            ))
+            for group in context['my_groups']:
+                group.unread_count = self.unread_counts.get(group.id, 0)
             
             # Suggested groups (groups user is not a member of)
             context['suggested_groups'] = Group.objects.filter(
@@ -115,10 +140,12 @@ class GroupDetailView(DetailView):
             'author'
         ).prefetch_related('likes', 'comments').order_by('-is_pinned', '-created_at')
         
-        # Add liked status for each discussion if user is authenticated
+        # Add liked status and unread comment counts for each discussion if user is authenticated
         if self.request.user.is_authenticated:
+            unread_counts = unread.unread_comment_counts(self.request.user, [d.pk for d in discussions])
             for discussion in discussions:
                 discussion.user_liked = discussion.is_liked_by(self.request.user)
+                discussion.unread_count = unread_counts.get(discussion.pk, 0)
         
         context['discussions'] = discussions
         
@@ -188,6 +215,7 @@ class CreateDiscussionView(LoginRequiredMixin, CreateView):
         discussion.group = group
         discussion.author = self.request.user
         discussion.save()
+        realtime.broadcast_discussion(discussion)
         
         messages.success(self.request, 'Discussion created successfully!')
         return redirect('community:group_detail', pk=group.pk)
@@ -197,6 +225,9 @@ class DiscussionDetailView(DetailView):
     model = Discussion
     template_name = "community/discussion_detail.html"
     context_object_name = "discussion"
+
+    def get_queryset(self):
+        return visible_discussions(self.request.user)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -207,8 +238,15 @@ class DiscussionDetailView(DetailView):
             context['is_member'] = discussion.group.is_member(self.request.user)
             context['is_liked'] = discussion.is_liked_by(self.request.user)
         
-        # Get comments
-        context['comments'] = discussion.comments.select_related('author').order_by('created_at')
+        # Get the first page of threads, each with a preview of its replies
+        comments = thread_page(
+            discussion.comments.select_related('author__profile'),
+            count=THREADS_PER_PAGE,
+            replies=REPLY_PREVIEW,
+        )
+        context['comments'] = nest(comments)
+        if discussion.thread_count > THREADS_PER_PAGE:
+            context['next_thread'] = THREADS_PER_PAGE + 1
         
         # Comment form
         if context['is_member']:
@@ -237,13 +275,16 @@ class ToggleDiscussionLikeView(LoginRequiredMixin, View):
         
         # Refresh discussion to get updated like count
         discussion.refresh_from_db()
+        like_count = discussion.like_count()
+        realtime.broadcast_like_count(discussion, like_count)
         
         return JsonResponse({
             'liked': liked,
-            'like_count': discussion.like_count()
+            'like_count': like_count
         })
 
 
+@method_decorator(ratelimit('comment'), name='dispatch')
 class CreateCommentView(LoginRequiredMixin, CreateView):
     model = Comment
     form_class = CommentForm
@@ -258,7 +299,88 @@ class CreateCommentView(LoginRequiredMixin, CreateView):
         comment = form.save(commit=False)
         comment.discussion = discussion
         comment.author = self.request.user
+        parent_id = self.request.POST.get('parent')
+        if parent_id:
+            if not parent_id.isdecimal():
+                return HttpResponseBadRequest('Invalid parent.')
+            comment.parent = get_object_or_404(Comment, pk=parent_id, discussion=discussion)
         comment.save()
+        realtime.broadcast_comment(comment, discussion.comment_count())
         
         messages.success(self.request, 'Comment added!')
         return redirect('community:discussion_detail', pk=discussion.pk)
+
+
+class CommentThreadView(View):
+    """
+    Lazily load part of a comment tree: the next page of top-level threads,
+    or (with ``?parent=<id>``) the next page of replies to one comment. Each
+    returned comment carries a preview of its own first replies.
+    """
+
+    def get(self, request, pk):
+        discussion = get_object_or_404(visible_discussions(request.user), pk=pk)
+        try:
+            start = max(int(request.GET.get('start', 1)), 1)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid start.'}, status=400)
+
+        parent = None
+        if request.GET.get('parent'):
+            if not request.GET['parent'].isdecimal():
+                return JsonResponse({'error': 'Invalid parent.'}, status=400)
+            parent = get_object_or_404(Comment, pk=request.GET['parent'], discussion=discussion)
+            count, total = REPLIES_PER_PAGE, parent.reply_count
+        else:
+            count, total = THREADS_PER_PAGE, discussion.thread_count
+
+        comments = thread_page(
+            discussion.comments.select_related('author__profile'),
+            parent=parent,
+            start=start,
+            count=count,
+            replies=REPLY_PREVIEW,
+        )
+        depth = parent.depth + 1 if parent else 0
+        html = ''.join(
+            render_to_string('community/partials/comment.html', {'comment': comment}, request=request)
+            for comment in nest(comments, depth=depth)
+        )
+        return JsonResponse({
+            'html': html,
+            'next_start': start + count if total >= start + count else None,
+        })
+
+
+class MarkReadView(LoginRequiredMixin, View):
+    """
+    Advance the user's read watermarks. The page batches what the user has
+    scrolled past and posts it here at most every few seconds, e.g.
+    ``{"groups": {"3": "<iso datetime>"}, "discussions": {"12": "<iso datetime>"}}``.
+    """
+
+    def post(self, request):
+        try:
+            payload = json.loads(request.body or b'{}')
+            groups = self._parse(payload.get('groups'))
+            discussions = self._parse(payload.get('discussions'))
+        except (ValueError, TypeError, AttributeError):
+            return JsonResponse({'error': 'Invalid read markers.'}, status=400)
+
+        if len(groups) + len(discussions) > unread.MAX_MARKERS_PER_REQUEST:
+            return JsonResponse({'error': 'Too many read markers.'}, status=400)
+
+        unread.mark_read(request.user, groups=groups, discussions=discussions)
+        return JsonResponse({'ok': True})
+
+    @staticmethod
+    def _parse(markers):
+        parsed = {}
+        for pk, value in (markers or {}).items():
+            read_at = parse_datetime(value)
+            if read_at is None:
+                raise ValueError(value)
+            if timezone.is_naive(read_at):
+                read_at = timezone.make_aware(read_at)
+            parsed[int(pk)] = read_at
+        return parsed
@@ -1,26 +1,84 @@
 from django.contrib import admin
-from .models import PsychiatristProfile, AvailabilitySlot, Booking, Feedback
+from . import availability, exports
+from .models import (
+    PsychiatristProfile, AvailabilityRule, AvailabilityException, AvailabilitySlot, Booking, Feedback,
+    Job, WaitlistEntry, SlotOffer, CalendarFeed, OnlineTime,
+)
 
 
 @admin.register(PsychiatristProfile)
 class PsychiatristProfileAdmin(admin.ModelAdmin):
-    list_display = ("full_name", "license_no", "specialization", "years_experience", "is_verified")
+    list_display = ("full_name", "license_no", "specialization", "years_experience", "rating", "rating_count", "is_verified")
     list_filter = ("is_verified", "specialization")
     search_fields = ("full_name", "license_no", "languages")
 
 
+@admin.register(AvailabilityRule)
+class AvailabilityRuleAdmin(admin.ModelAdmin):
+    list_display = ("psychiatrist", "weekdays", "start_time", "end_time", "slot_minutes", "valid_until", "is_active")
+    list_filter = ("is_active",)
+    search_fields = ("psychiatrist__full_name",)
+    readonly_fields = ("materialized_until",)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        availability.refresh_rule(obj)
+
+    def delete_model(self, request, obj):
+        availability.clear_rule_slots(obj)
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        for rule in queryset:
+            availability.clear_rule_slots(rule)
+        super().delete_queryset(request, queryset)
+
+
+@admin.register(AvailabilityException)
+class AvailabilityExceptionAdmin(admin.ModelAdmin):
+    list_display = ("psychiatrist", "starts_at", "ends_at", "reason")
+    search_fields = ("psychiatrist__full_name", "reason")
+
+    def save_model(self, request, obj, form, change):
+        previous = AvailabilityException.objects.filter(pk=obj.pk).first() if change else None
+        super().save_model(request, obj, form, change)
+        if previous:
+            availability.lift_exception(previous)
+        availability.apply_exception(obj)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        availability.lift_exception(obj)
+
+    def delete_queryset(self, request, queryset):
+        exceptions = list(queryset)
+        super().delete_queryset(request, queryset)
+        for exception in exceptions:
+            availability.lift_exception(exception)
+
+
 @admin.register(AvailabilitySlot)
 class AvailabilitySlotAdmin(admin.ModelAdmin):
-    list_display = ("psychiatrist", "start", "end", "is_booked")
+    list_display = ("psychiatrist", "start", "end", "is_booked", "held_by", "held_until")
     list_filter = ("is_booked",)
     search_fields = ("psychiatrist__full_name",)
 
 
+def export_action(kind, fmt):
+    def export(modeladmin, request, queryset):
+        return exports.response(queryset, kind, fmt)
+
+    export.__name__ = f"export_{fmt}"
+    export.short_description = f"Export selected as {fmt.upper()}"
+    return export
+
+
 @admin.register(Booking)
 class BookingAdmin(admin.ModelAdmin):
     list_display = ("user", "psychiatrist", "mode", "status", "created_at")
     list_filter = ("status", "mode")
     search_fields = ("user__username", "psychiatrist__full_name")
+    actions = [export_action("booking", "csv"), export_action("booking", "jsonl")]
 
 
 @admin.register(Feedback)
@@ -28,3 +86,40 @@ class FeedbackAdmin(admin.ModelAdmin):
     list_display = ("booking", "rating", "created_at")
     list_filter = ("rating", "created_at")
     search_fields = ("booking__psychiatrist__full_name", "comment")
+    actions = [export_action("feedback", "csv"), export_action("feedback", "jsonl")]
+
+
+@admin.register(WaitlistEntry)
+class WaitlistEntryAdmin(admin.ModelAdmin):
+    list_display = ("user", "psychiatrist", "window_start", "window_end", "status", "created_at")
+    list_filter = ("status",)
+    search_fields = ("user__username", "psychiatrist__full_name")
+
+
+@admin.register(SlotOffer)
+class SlotOfferAdmin(admin.ModelAdmin):
+    list_display = ("slot", "entry", "status", "expires_at", "created_at")
+    list_filter = ("status",)
+    search_fields = ("entry__user__username", "slot__psychiatrist__full_name")
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("task", "status", "run_at", "attempts", "locked_by", "finished_at")
+    list_filter = ("status", "task")
+    readonly_fields = ("last_error",)
+
+
+@admin.register(CalendarFeed)
+class CalendarFeedAdmin(admin.ModelAdmin):
+    list_display = ("user", "created_at")
+    search_fields = ("user__username",)
+    exclude = ("token",)
+
+
+@admin.register(OnlineTime)
+class OnlineTimeAdmin(admin.ModelAdmin):
+    list_display = ("psychiatrist", "date", "hours")
+    list_filter = ("date",)
+    search_fields = ("psychiatrist__full_name",)
+    date_hierarchy = "date"
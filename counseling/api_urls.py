@@ -1,9 +1,21 @@
 from rest_framework.routers import DefaultRouter
-from .api_views import PsychiatristProfileViewSet, AvailabilitySlotViewSet, BookingViewSet
+from .api_views import (
+    PsychiatristProfileViewSet,
+    AvailabilityRuleViewSet,
+    AvailabilityExceptionViewSet,
+    AvailabilitySlotViewSet,
+    BookingViewSet,
+    WaitlistEntryViewSet,
+    SlotOfferViewSet,
+)
 
 router = DefaultRouter()
 router.register(r"psychiatrists", PsychiatristProfileViewSet, basename="psychiatrists")
+router.register(r"availability-rules", AvailabilityRuleViewSet, basename="availability-rules")
+router.register(r"availability-exceptions", AvailabilityExceptionViewSet, basename="availability-exceptions")
 router.register(r"slots", AvailabilitySlotViewSet, basename="slots")
 router.register(r"bookings", BookingViewSet, basename="bookings")
+router.register(r"waitlist", WaitlistEntryViewSet, basename="waitlist")
+router.register(r"offers", SlotOfferViewSet, basename="offers")
 
 urlpatterns = router.urls
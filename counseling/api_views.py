@@ -1,16 +1,35 @@
 from rest_framework import viewsets, permissions, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from django.db import transaction
-from django.utils import timezone
-from .models import PsychiatristProfile, AvailabilitySlot, Booking
+from rest_framework.exceptions import APIException
+from sisterhood_stories.ratelimit import IPBucketThrottle, UserBucketThrottle
+from . import availability, booking, matching, slot_search, waitlist
+from .models import PsychiatristProfile, AvailabilityRule, AvailabilityException, AvailabilitySlot, Booking, WaitlistEntry, SlotOffer
 from .serializers import (
     PsychiatristProfileSerializer,
+    AvailabilityRuleSerializer,
+    AvailabilityExceptionSerializer,
     AvailabilitySlotSerializer,
     BookingSerializer,
+    WaitlistEntrySerializer,
+    SlotOfferSerializer,
 )
 
 
+class SlotTaken(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "Slot is not available for booking."
+    default_code = "slot_taken"
+
+    def __init__(self, alternatives=()):
+        super().__init__()
+        # Set after __init__, which would turn every value into an error string.
+        self.detail = {
+            "detail": self.default_detail,
+            "alternatives": AvailabilitySlotSerializer(alternatives, many=True).data,
+        }
+
+
 class IsOwnerOrReadOnly(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if request.method in permissions.SAFE_METHODS:
@@ -27,6 +46,14 @@ class PsychiatristProfileViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(user=self.request.user, is_female=True)
 
+    @action(detail=False, methods=["get"], permission_classes=[permissions.AllowAny])
+    def match(self, request):
+        try:
+            match_request = matching.parse_request(request.query_params)
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(matching.serialize(matching.match(match_request)))
+
 
 class AvailabilitySlotViewSet(viewsets.ModelViewSet):
     queryset = AvailabilitySlot.objects.select_related("psychiatrist").all()
@@ -40,11 +67,90 @@ class AvailabilitySlotViewSet(viewsets.ModelViewSet):
             qs = qs.filter(psychiatrist_id=psychiatrist_id)
         return qs
 
+    @action(detail=False, methods=["get"], permission_classes=[permissions.AllowAny])
+    def search(self, request):
+        try:
+            filters = slot_search.parse_filters(request.query_params)
+            limit = slot_search.parse_limit(request.query_params)
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        slots, days = slot_search.search(limit=limit, **filters)
+        return Response(slot_search.serialize(slots, days))
+
+    @action(detail=True, methods=["post", "delete"])
+    def hold(self, request, pk=None):
+        """POST holds the slot for the booking form; DELETE releases it."""
+        slot = self.get_object()
+        if request.method == "DELETE":
+            return Response({"released": booking.release_hold(request.user, slot.pk)})
+        try:
+            held_until = booking.hold_slot(request.user, slot.psychiatrist, slot.pk)
+        except booking.SlotUnavailable as exc:
+            raise SlotTaken(alternatives=exc.alternatives)
+        return Response({"slot_id": slot.pk, "held_until": held_until})
+
+
+class IsPsychiatrist(permissions.BasePermission):
+    message = "Only psychiatrists can manage availability."
+
+    def has_permission(self, request, view):
+        return hasattr(request.user, "psychiatrist_profile")
+
+
+class AvailabilityRuleViewSet(viewsets.ModelViewSet):
+    """A psychiatrist's recurring availability; every change re-expands the rule's future slots."""
+
+    serializer_class = AvailabilityRuleSerializer
+    permission_classes = [permissions.IsAuthenticated, IsPsychiatrist]
+
+    def get_queryset(self):
+        return AvailabilityRule.objects.filter(psychiatrist=self.request.user.psychiatrist_profile)
+
+    def perform_create(self, serializer):
+        rule = serializer.save(psychiatrist=self.request.user.psychiatrist_profile)
+        availability.refresh_rule(rule)
+
+    def perform_update(self, serializer):
+        availability.refresh_rule(serializer.save())
+
+    def perform_destroy(self, instance):
+        availability.clear_rule_slots(instance)
+        instance.delete()
+
+
+class AvailabilityExceptionViewSet(viewsets.ModelViewSet):
+    """A psychiatrist's time off. Slots inside it are withdrawn and given back when it is removed."""
+
+    serializer_class = AvailabilityExceptionSerializer
+    permission_classes = [permissions.IsAuthenticated, IsPsychiatrist]
+
+    def get_queryset(self):
+        return AvailabilityException.objects.filter(psychiatrist=self.request.user.psychiatrist_profile)
+
+    def perform_create(self, serializer):
+        availability.apply_exception(serializer.save(psychiatrist=self.request.user.psychiatrist_profile))
+
+    def perform_update(self, serializer):
+        previous = AvailabilityException(
+            psychiatrist=serializer.instance.psychiatrist,
+            starts_at=serializer.instance.starts_at,
+            ends_at=serializer.instance.ends_at,
+        )
+        exception = serializer.save()
+        availability.lift_exception(previous)
+        availability.apply_exception(exception)
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        availability.lift_exception(instance)
+
 
 class BookingViewSet(viewsets.ModelViewSet):
     queryset = Booking.objects.select_related("psychiatrist", "slot", "user").all()
     serializer_class = BookingSerializer
     permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [UserBucketThrottle, IPBucketThrottle]
+    throttle_scope = "booking"
 
     def get_queryset(self):
         qs = super().get_queryset()
@@ -53,22 +159,66 @@ class BookingViewSet(viewsets.ModelViewSet):
             qs = qs.filter(user=self.request.user)
         return qs
 
-    @transaction.atomic
     def perform_create(self, serializer):
-        slot = serializer.validated_data["slot"]
-        if slot.is_booked or slot.start <= timezone.now():
-            raise ValueError("Slot is not available for booking.")
-        slot.is_booked = True
-        slot.save(update_fields=["is_booked"])
-        serializer.save(user=self.request.user, status="confirmed")
+        data = serializer.validated_data
+        try:
+            serializer.instance = booking.book_slot(
+                self.request.user,
+                data["psychiatrist"],
+                data["slot"].pk,
+                status="confirmed",
+                **{k: v for k, v in data.items() if k not in ("psychiatrist", "slot", "status")},
+            )
+        except booking.SlotUnavailable as exc:
+            raise SlotTaken(alternatives=exc.alternatives)
 
     @action(detail=True, methods=["post"]) 
     def cancel(self, request, pk=None):
-        booking = self.get_object()
-        if booking.user != request.user and not request.user.is_staff:
+        instance = self.get_object()
+        if instance.user != request.user and not request.user.is_staff:
             return Response({"detail": "Not allowed"}, status=status.HTTP_403_FORBIDDEN)
-        booking.status = "cancelled"
-        booking.slot.is_booked = False
-        booking.slot.save(update_fields=["is_booked"])
-        booking.save(update_fields=["status"])
+        if not booking.cancel_booking(instance):
+            return Response({"detail": f"Booking is already {instance.status}."}, status=status.HTTP_409_CONFLICT)
         return Response({"status": "cancelled"})
+
+
+class WaitlistEntryViewSet(viewsets.ModelViewSet):
+    serializer_class = WaitlistEntrySerializer
+    permission_classes = [permissions.IsAuthenticated]
+    http_method_names = ["get", "post", "delete", "head", "options"]
+
+    def get_queryset(self):
+        return WaitlistEntry.objects.filter(user=self.request.user).select_related("psychiatrist")
+
+    def perform_create(self, serializer):
+        serializer.instance = waitlist.join(self.request.user, **serializer.validated_data)
+
+    def perform_destroy(self, instance):
+        waitlist.leave(instance)
+
+
+class SlotOfferViewSet(viewsets.ReadOnlyModelViewSet):
+    serializer_class = SlotOfferSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return SlotOffer.objects.filter(entry__user=self.request.user).select_related("slot", "entry", "entry__user", "entry__psychiatrist")
+
+    @action(detail=True, methods=["post"])
+    def accept(self, request, pk=None):
+        offer = self.get_object()
+        try:
+            new_booking = waitlist.accept(offer)
+        except waitlist.OfferUnavailable:
+            return Response({"detail": "This offer is no longer open."}, status=status.HTTP_409_CONFLICT)
+        except booking.SlotUnavailable as exc:
+            raise SlotTaken(alternatives=exc.alternatives)
+        return Response(BookingSerializer(new_booking).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=["post"])
+    def decline(self, request, pk=None):
+        try:
+            waitlist.decline(self.get_object())
+        except waitlist.OfferUnavailable:
+            return Response({"detail": "This offer is no longer open."}, status=status.HTTP_409_CONFLICT)
+        return Response({"status": "declined"})
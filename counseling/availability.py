@@ -0,0 +1,209 @@
+"""
+Expand recurring AvailabilityRules into AvailabilitySlot rows.
+
+Rules are materialized on a rolling horizon: each run continues from the
+rule's ``materialized_until`` date, so the regular run (every
+``MATERIALIZE_INTERVAL``, by ``run_jobs``) only inserts the days that have
+newly come into view, and a year of rules for every counselor is a few
+batched inserts rather than a ``get_or_create`` per slot.
+"""
+import zoneinfo
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import matching
+from .models import AvailabilityRule, AvailabilityException, AvailabilitySlot
+
+HORIZON_WEEKS = 8
+MATERIALIZE_INTERVAL = timedelta(hours=1)
+BATCH_SIZE = 5000
+
+
+def expand(rule, first_day, last_day, blocked=(), now=None):
+    """
+    Yield ``(start, end)`` for each slot of ``rule`` on the days
+    ``first_day .. last_day``, skipping slots that start in the past or
+    overlap one of the ``(starts_at, ends_at)`` periods in ``blocked``.
+    """
+    now = now or timezone.now()
+    zone = zoneinfo.ZoneInfo(rule.timezone)
+    weekdays = rule.day_numbers()
+    length = timedelta(minutes=rule.slot_minutes)
+    day = max(first_day, rule.valid_from)
+    if rule.valid_until:
+        last_day = min(last_day, rule.valid_until)
+    while day <= last_day:
+        if day.weekday() in weekdays:
+            start = datetime.combine(day, rule.start_time, tzinfo=zone)
+            close = datetime.combine(day, rule.end_time, tzinfo=zone)
+            todays_blocks = [(b_start, b_end) for b_start, b_end in blocked if b_start < close and start < b_end]
+            while start + length <= close:
+                end = start + length
+                if start > now and not any(b_start < end and start < b_end for b_start, b_end in todays_blocks):
+                    yield start, end
+                start = end
+        day += timedelta(days=1)
+
+
+def _utc_midnight(day):
+    return datetime.combine(day, datetime.min.time(), tzinfo=zoneinfo.ZoneInfo("UTC"))
+
+
+def _blocked_periods(start, end, psychiatrist_id=None):
+    """
+    Exceptions overlapping ``[start, end)`` as a function from psychiatrist id
+    to that psychiatrist's blocked periods (platform holidays included).
+    """
+    exceptions = AvailabilityException.objects.filter(starts_at__lt=end, ends_at__gt=start)
+    if psychiatrist_id:
+        exceptions = exceptions.filter(Q(psychiatrist__isnull=True) | Q(psychiatrist_id=psychiatrist_id))
+    everyone = []
+    personal = defaultdict(list)
+    for owner, starts_at, ends_at in exceptions.values_list("psychiatrist_id", "starts_at", "ends_at"):
+        (personal[owner] if owner else everyone).append((starts_at, ends_at))
+    return lambda pk: everyone + personal.get(pk, [])
+
+
+def _create(rows):
+    """
+    Insert ``(psychiatrist_id, rule_id, start, end)`` rows, skipping ones that
+    already exist, and return how many were inserted. Re-runs and overlapping
+    rules produce duplicates; the unique (psychiatrist, start, end)
+    constraint turns them into no-ops.
+    """
+    if not rows:
+        return 0
+    # bulk_create can't say which rows it skipped, so count the batch's range
+    # before and after; the unique index covers the lookup.
+    in_batch = AvailabilitySlot.objects.filter(
+        psychiatrist_id__in={row[0] for row in rows},
+        start__gte=min(row[2] for row in rows),
+        start__lte=max(row[2] for row in rows),
+    )
+    before = in_batch.count()
+    AvailabilitySlot.objects.bulk_create(
+        [
+            AvailabilitySlot(psychiatrist_id=psychiatrist_id, rule_id=rule_id, start=start, end=end)
+            for psychiatrist_id, rule_id, start, end in rows
+        ],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    # bulk_create sends no post_save, so tell the matcher directly.
+    transaction.on_commit(matching.invalidate)
+    return in_batch.count() - before
+
+
+def _fill(windows, blocked):
+    """Create slots for ``(rule, first_day, last_day)`` windows. Returns how many were new."""
+    now = timezone.now()
+    created = 0
+    pending = []
+    for rule, first_day, last_day in windows:
+        for start, end in expand(rule, first_day, last_day, blocked(rule.psychiatrist_id), now):
+            pending.append((rule.psychiatrist_id, rule.pk, start, end))
+        if len(pending) >= BATCH_SIZE:
+            created += _create(pending)
+            pending = []
+    return created + _create(pending)
+
+
+def materialize(rules=None, weeks=HORIZON_WEEKS, today=None):
+    """
+    Create slots for active ``rules`` (a queryset; all rules by default) up
+    to ``weeks`` ahead, continuing from where each rule was last expanded.
+    Returns the number of slots created; ones that already existed, from
+    another rule or an earlier run, are not counted.
+    """
+    today = today or timezone.localdate()
+    horizon = today + timedelta(weeks=weeks)
+    rules = list(
+        (AvailabilityRule.objects.all() if rules is None else rules)
+        .filter(is_active=True)
+        .filter(Q(valid_until__isnull=True) | Q(valid_until__gte=today))
+        .filter(Q(materialized_until__isnull=True) | Q(materialized_until__lt=horizon))
+    )
+    if not rules:
+        return 0
+
+    windows = [
+        (rule, max(today, rule.materialized_until + timedelta(days=1)) if rule.materialized_until else today, horizon)
+        for rule in rules
+    ]
+    psychiatrists = {rule.psychiatrist_id for rule in rules}
+    blocked = _blocked_periods(
+        timezone.now(),
+        _utc_midnight(horizon + timedelta(days=2)),
+        psychiatrist_id=psychiatrists.pop() if len(psychiatrists) == 1 else None,
+    )
+    with transaction.atomic():
+        created = _fill(windows, blocked)
+        pks = [rule.pk for rule in rules]
+        for offset in range(0, len(pks), 500):
+            AvailabilityRule.objects.filter(pk__in=pks[offset:offset + 500]).update(materialized_until=horizon)
+    return created
+
+
+def clear_rule_slots(rule):
+    """Delete the rule's future slots that nobody has booked. Returns how many were removed."""
+    # Slots with cancelled bookings are kept: Booking.slot protects them. So
+    # are slots held for a waitlist offer until the offer is answered.
+    now = timezone.now()
+    return AvailabilitySlot.objects.filter(
+        AvailabilitySlot.not_held(now), rule=rule, is_booked=False, start__gt=now, bookings__isnull=True
+    ).delete()[0]
+
+
+def refresh_rule(rule, weeks=HORIZON_WEEKS):
+    """Re-expand a rule after it was created or edited, replacing its unbooked future slots."""
+    with transaction.atomic():
+        clear_rule_slots(rule)
+        AvailabilityRule.objects.filter(pk=rule.pk).update(materialized_until=None)
+        materialize(AvailabilityRule.objects.filter(pk=rule.pk), weeks)
+    rule.refresh_from_db(fields=["materialized_until"])
+
+
+def apply_exception(exception):
+    """Remove unbooked future slots that fall inside a new or edited exception."""
+    now = timezone.now()
+    slots = AvailabilitySlot.objects.filter(
+        AvailabilitySlot.not_held(now),
+        is_booked=False,
+        start__gt=now,
+        start__lt=exception.ends_at,
+        end__gt=exception.starts_at,
+        bookings__isnull=True,
+    )
+    if exception.psychiatrist_id:
+        slots = slots.filter(psychiatrist_id=exception.psychiatrist_id)
+    return slots.delete()[0]
+
+
+def lift_exception(exception):
+    """
+    Give back the slots an exception was blocking, once it has been deleted
+    or moved. Only days that were already materialized are refilled.
+    """
+    rules = AvailabilityRule.objects.filter(is_active=True, materialized_until__isnull=False)
+    if exception.psychiatrist_id:
+        rules = rules.filter(psychiatrist_id=exception.psychiatrist_id)
+    # A day either side covers every rule timezone; expand() does the precise overlap check.
+    first_day = (exception.starts_at - timedelta(days=1)).date()
+    last_day = (exception.ends_at + timedelta(days=1)).date()
+    rules = list(rules.filter(materialized_until__gte=first_day))
+    if not rules:
+        return 0
+    blocked = _blocked_periods(
+        _utc_midnight(first_day - timedelta(days=1)),
+        _utc_midnight(last_day + timedelta(days=2)),
+        exception.psychiatrist_id,
+    )
+    with transaction.atomic():
+        return _fill(
+            [(rule, first_day, min(last_day, rule.materialized_until)) for rule in rules],
+            blocked,
+        )
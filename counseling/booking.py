@@ -0,0 +1,144 @@
+"""
+Booking service: claim a slot and create its booking atomically.
+
+The claim is a single conditional ``UPDATE ... SET is_booked = true WHERE
+is_booked = false``; the database serialises competing updates on the row, so
+exactly one request sees "1 row updated" and every other one gets a clean
+``SlotUnavailable`` instead of an IntegrityError further down.
+"""
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from . import jobs, matching, slot_search
+from .models import AvailabilitySlot, Booking
+
+ACTIVE_STATUSES = ("pending", "confirmed")
+HOLD_TTL = timedelta(minutes=5)
+
+
+class SlotUnavailable(Exception):
+    """The requested slot was taken (or never free). ``alternatives`` lists free slots to offer instead."""
+
+    def __init__(self, alternatives=()):
+        super().__init__("This time slot is no longer available.")
+        self.alternatives = list(alternatives)
+
+
+def alternative_slots(psychiatrist, near=None, limit=5):
+    """
+    Free slots to suggest when a booking fails: the same psychiatrist's next
+    openings first, topped up with the earliest slots of other psychiatrists.
+    """
+    start = max(near or timezone.now(), timezone.now())
+    slots = list(
+        slot_search.free_slots(start=start, psychiatrist=psychiatrist.pk)
+        .select_related("psychiatrist")[:limit]
+    )
+    if len(slots) < limit:
+        slots += list(
+            slot_search.free_slots(start=start)
+            .exclude(psychiatrist=psychiatrist)
+            .select_related("psychiatrist")[:limit - len(slots)]
+        )
+    return slots
+
+
+def hold_slot(user, psychiatrist, slot_id):
+    """
+    Reserve a free slot for ``user`` for ``HOLD_TTL`` while they fill in the
+    booking form, releasing any other slot they were holding with
+    ``psychiatrist``. Holding again extends the hold. Returns when it ends.
+
+    Raises ``SlotUnavailable`` if the slot is booked or held by someone else.
+    """
+    now = timezone.now()
+    held_until = now + HOLD_TTL
+    with transaction.atomic():
+        held = AvailabilitySlot.objects.filter(
+            AvailabilitySlot.not_held(now, user),
+            pk=slot_id,
+            psychiatrist=psychiatrist,
+            is_booked=False,
+            start__gt=now,
+        # Never shortens a longer hold the user already has, such as a waitlist offer.
+        ).update(held_by=user, held_until=Greatest(Coalesce(F("held_until"), Value(now)), Value(held_until)))
+        if held:
+            for other in _form_holds(user, psychiatrist).exclude(pk=slot_id).values_list("pk", flat=True):
+                release_hold(user, other)
+            return AvailabilitySlot.objects.filter(pk=slot_id).values_list("held_until", flat=True).get()
+    slot = AvailabilitySlot.objects.filter(pk=slot_id).only("start").first()
+    raise SlotUnavailable(alternative_slots(psychiatrist, near=slot.start if slot else None))
+
+
+def release_hold(user, slot_id):
+    """
+    Give back a slot held with ``hold_slot`` and offer it to the waitlist.
+    Returns False if ``user`` wasn't holding it.
+    """
+    if not _form_holds(user).filter(pk=slot_id).update(held_by=None, held_until=None):
+        return False
+    jobs.enqueue("counseling.waitlist.offer_slot", slot_id=slot_id)
+    return True
+
+
+def _form_holds(user, psychiatrist=None):
+    # Waitlist offers hold slots too, but those are released by answering the offer.
+    slots = AvailabilitySlot.objects.filter(held_by=user, is_booked=False).exclude(offers__status="open")
+    return slots.filter(psychiatrist=psychiatrist) if psychiatrist else slots
+
+
+def book_slot(user, psychiatrist, slot_id, status="pending", **fields):
+    """
+    Claim ``slot_id`` for ``user`` and create the booking in one transaction.
+    Extra ``fields`` (mode, notes, ...) are set on the new Booking. A hold
+    the user has on the slot is consumed by the same UPDATE.
+
+    Raises ``SlotUnavailable`` if the slot is booked, held for someone else,
+    in the past or does not belong to ``psychiatrist``.
+    """
+    try:
+        with transaction.atomic():
+            now = timezone.now()
+            claimed = AvailabilitySlot.objects.filter(
+                AvailabilitySlot.not_held(now, user),
+                pk=slot_id,
+                psychiatrist=psychiatrist,
+                is_booked=False,
+                start__gt=now,
+            ).update(is_booked=True, held_by=None, held_until=None)
+            if not claimed:
+                raise SlotUnavailable()
+            transaction.on_commit(matching.invalidate)
+            return Booking.objects.create(
+                user=user,
+                psychiatrist=psychiatrist,
+                slot_id=slot_id,
+                status=status,
+                **fields,
+            )
+    except (SlotUnavailable, IntegrityError):
+        slot = AvailabilitySlot.objects.filter(pk=slot_id).only("start").first()
+        raise SlotUnavailable(alternative_slots(psychiatrist, near=slot.start if slot else None))
+
+
+def cancel_booking(booking):
+    """
+    Cancel an active booking and release its slot. Returns False if the
+    booking was already cancelled or completed (e.g. by a concurrent request).
+    """
+    with transaction.atomic():
+        cancelled = Booking.objects.filter(
+            pk=booking.pk, status__in=ACTIVE_STATUSES
+        ).update(status="cancelled", updated_at=timezone.now())
+        if not cancelled:
+            return False
+        AvailabilitySlot.objects.filter(pk=booking.slot_id).update(is_booked=False)
+        # Waitlisted patients get first refusal; the job is only visible once this commits.
+        jobs.enqueue("counseling.waitlist.offer_slot", slot_id=booking.slot_id)
+        transaction.on_commit(matching.invalidate)
+    booking.status = "cancelled"
+    return True
@@ -0,0 +1,113 @@
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.utils import timezone
+
+from . import session_chat
+from .models import SessionMessage
+
+
+class SessionConsumer(AsyncJsonWebsocketConsumer):
+    """
+    The live chat of one counseling session (``booking_id`` route kwarg).
+
+    Only the booking's patient and psychiatrist may connect, only to a chat
+    booking and only while the session can be joined (``Booking.can_start``). On connect the client
+    gets the transcript after ``?after=<last message id>``, so a reconnect
+    picks up where it left off. Messages are saved in batches by
+    ``session_chat.writer()`` and reach both sides once saved; typing and
+    presence are relayed without touching the database.
+    """
+
+    channel_group = None
+    role = None
+
+    async def connect(self):
+        booking_id = self.scope['url_route']['kwargs']['booking_id']
+        access = await database_sync_to_async(session_chat.participant)(booking_id, self.scope.get('user'))
+        if access is None:
+            await self.close(code=4403)
+            return
+        booking, self.sender = access
+        if booking.mode != "chat":
+            await self.close(code=4406)
+            return
+        if not booking.can_start():
+            await self.close(code=4409)
+            return
+        self.booking_id = booking.pk
+        self.ends_at = booking.slot.end
+        self.role = session_chat.ROLES[self.sender]
+
+        # Join before reading the transcript: a message saved in between is
+        # then sent twice (clients skip ids they have) rather than lost.
+        self.channel_group = session_chat.session_channel(self.booking_id)
+        await self.channel_layer.group_add(self.channel_group, self.channel_name)
+        await self.accept()
+        try:
+            after = int(parse_qs(self.scope.get('query_string', b'').decode()).get('after', ['0'])[0])
+        except ValueError:
+            after = 0
+        messages = await database_sync_to_async(session_chat.history)(self.booking_id, after)
+        await self.send_json({'type': 'history', 'role': self.role, 'messages': messages})
+        await self.channel_layer.group_send(self.channel_group, {
+            'type': 'presence', 'role': self.role, 'online': True, 'reply_to': self.channel_name,
+        })
+
+    async def disconnect(self, code):
+        if self.channel_group:
+            await self.channel_layer.group_discard(self.channel_group, self.channel_name)
+            await self.channel_layer.group_send(self.channel_group, {
+                'type': 'presence', 'role': self.role, 'online': False,
+            })
+
+    async def receive_json(self, content, **kwargs):
+        kind = content.get('type')
+        if kind == 'message':
+            await self.receive_message(content)
+        elif kind == 'typing':
+            await self.channel_layer.group_send(self.channel_group, {
+                'type': 'typing', 'role': self.role, 'typing': bool(content.get('typing', True)),
+            })
+        elif kind == 'ping':
+            await self.send_json({'type': 'pong'})
+
+    async def receive_message(self, content):
+        client_id = content.get('client_id')
+        body = content.get('body')
+        body = body.strip() if isinstance(body, str) else ''
+        if not body or len(body) > session_chat.MAX_LENGTH:
+            await self.send_json({'type': 'error', 'client_id': client_id, 'error': 'invalid'})
+            return
+        now = timezone.now()
+        if now > self.ends_at:
+            await self.send_json({'type': 'error', 'client_id': client_id, 'error': 'ended'})
+            return
+        message = SessionMessage(booking_id=self.booking_id, sender=self.sender, body=body, created_at=now)
+        session_chat.writer().add(message, self.channel_name, client_id)
+
+    # Channel layer event handlers
+
+    async def chat_message(self, event):
+        payload = {'type': 'message', **event['message']}
+        if event['message']['sender'] == self.role:
+            payload['client_id'] = event['client_id']
+        await self.send_json(payload)
+
+    async def chat_failed(self, event):
+        await self.send_json({'type': 'error', 'client_id': event['client_id'], 'error': 'unsaved'})
+
+    async def typing(self, event):
+        if event['role'] != self.role:
+            await self.send_json({'type': 'typing', 'role': event['role'], 'typing': event['typing']})
+
+    async def presence(self, event):
+        if event['role'] == self.role:
+            return
+        await self.send_json({'type': 'presence', 'role': event['role'], 'online': event['online']})
+        if event.get('reply_to'):
+            # Tell the newcomer we are here too.
+            await self.channel_layer.send(event['reply_to'], {
+                'type': 'presence', 'role': self.role, 'online': True,
+            })
@@ -0,0 +1,149 @@
+"""
+Patient and psychiatrist dashboards.
+
+Each dashboard fetches a bounded window of bookings once and partitions it
+in Python, takes its counts from one conditional-aggregate query and pages
+through history with LIMIT/OFFSET slices, so the number of queries stays the
+same however long someone's booking history is.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import AvailabilitySlot, Booking
+
+ACTIVE_STATUSES = ("pending", "confirmed")
+UPCOMING_WINDOW = timedelta(days=60)
+WINDOW_LIMIT = 100
+RECENT_PAST = timedelta(days=30)
+SLOT_LIMIT = 50
+HISTORY_PAGE_SIZE = 10
+
+
+def _today_start(now):
+    return timezone.make_aware(datetime.combine(timezone.localtime(now).date(), time.min))
+
+
+def _counts(bookings, now):
+    today = _today_start(now)
+    upcoming = Q(status__in=ACTIVE_STATUSES, slot__start__gte=now)
+    return bookings.aggregate(
+        total=Count("id"),
+        upcoming=Count("id", filter=upcoming),
+        pending=Count("id", filter=upcoming & Q(status="pending")),
+        today=Count("id", filter=Q(
+            status__in=ACTIVE_STATUSES, slot__start__gte=today, slot__start__lt=today + timedelta(days=1),
+        )),
+        past=Count("id", filter=Q(status="completed") | Q(slot__start__lt=now)),
+        completed=Count("id", filter=Q(status="completed")),
+    )
+
+
+def page_number(params):
+    """The 1-based history page requested in query ``params``."""
+    try:
+        return max(int(params.get("page", 1)), 1)
+    except ValueError:
+        return 1
+
+
+def history_page(bookings, page, per_page=HISTORY_PAGE_SIZE, order_by="-slot__start"):
+    """
+    Return ``(items, has_next)`` for 1-based ``page`` of ``bookings``. One
+    extra row is fetched to tell whether another page exists, instead of
+    counting the whole history.
+    """
+    offset = (max(page, 1) - 1) * per_page
+    items = list(bookings.order_by(order_by, "-id")[offset:offset + per_page + 1])
+    return items[:per_page], len(items) > per_page
+
+
+def patient_dashboard(user, history=1, now=None):
+    now = now or timezone.now()
+    bookings = Booking.objects.filter(user=user)
+    window = list(
+        bookings.filter(slot__start__gte=now - RECENT_PAST, slot__start__lt=now + UPCOMING_WINDOW)
+        .select_related("psychiatrist", "slot")
+        .order_by("slot__start", "id")[:WINDOW_LIMIT]
+    )
+    upcoming = [b for b in window if b.status in ACTIVE_STATUSES and b.slot.start >= now]
+    summary = {
+        "counts": _counts(bookings, now),
+        "upcoming_bookings": upcoming,
+        "pending_bookings": [b for b in upcoming if b.status == "pending"],
+    }
+    # The first history page usually falls inside the window; only go back
+    # to the database for older pages or when the window has too few.
+    past = [b for b in reversed(window) if b.status == "completed" or b.slot.start < now]
+    if history <= 1 and len(past) >= min(HISTORY_PAGE_SIZE, summary["counts"]["past"]):
+        summary["past_bookings"] = past[:HISTORY_PAGE_SIZE]
+        summary["history_has_next"] = summary["counts"]["past"] > HISTORY_PAGE_SIZE
+    else:
+        summary["past_bookings"], summary["history_has_next"] = history_page(
+            bookings.filter(Q(status="completed") | Q(slot__start__lt=now)).select_related("psychiatrist", "slot"),
+            history,
+        )
+    summary["history_page"] = max(history, 1)
+    return summary
+
+
+def psychiatrist_dashboard(profile, history=1, now=None):
+    now = now or timezone.now()
+    today = _today_start(now)
+    bookings = Booking.objects.filter(psychiatrist=profile)
+    window = list(
+        bookings.filter(slot__start__gte=today, slot__start__lt=now + UPCOMING_WINDOW)
+        .select_related("user", "slot")
+        .order_by("slot__start")[:WINDOW_LIMIT]
+    )
+    active = [b for b in window if b.status in ACTIVE_STATUSES]
+    upcoming = [b for b in active if b.slot.start >= now]
+    summary = {
+        "counts": _counts(bookings, now),
+        "today_bookings": [b for b in active if b.slot.start < today + timedelta(days=1)],
+        "upcoming_bookings": upcoming,
+        "pending_bookings": [b for b in upcoming if b.status == "pending"],
+        "upcoming_slots": list(
+            AvailabilitySlot.objects.filter(psychiatrist=profile, start__gte=now, start__lt=now + UPCOMING_WINDOW)
+            .order_by("start")[:SLOT_LIMIT]
+        ),
+        "history_page": max(history, 1),
+    }
+    summary["recent_bookings"], summary["history_has_next"] = history_page(
+        bookings.select_related("user", "slot"), history, order_by="-created_at",
+    )
+    return summary
+
+
+def serialize(summary, counterpart):
+    """
+    JSON-friendly version of a dashboard summary for polling clients.
+    ``counterpart`` names the other party on each booking: ``"psychiatrist"``
+    for patients, ``"user"`` for psychiatrists.
+    """
+
+    def booking(b):
+        if counterpart == "psychiatrist":
+            who = b.psychiatrist.full_name
+        else:
+            who = b.pseudonym if b.allow_anonymous and b.pseudonym else b.user.username
+        return {
+            "id": b.id,
+            "status": b.status,
+            "mode": b.mode,
+            "start": b.slot.start.isoformat(),
+            "end": b.slot.end.isoformat(),
+            counterpart: who,
+        }
+
+    data = {"counts": summary["counts"]}
+    for key in ("today_bookings", "upcoming_bookings", "pending_bookings"):
+        if key in summary:
+            data[key] = [booking(b) for b in summary[key]]
+    if "upcoming_slots" in summary:
+        data["upcoming_slots"] = [
+            {"id": s.id, "start": s.start.isoformat(), "end": s.end.isoformat(), "is_booked": s.is_booked}
+            for s in summary["upcoming_slots"]
+        ]
+    return data
@@ -0,0 +1,236 @@
+"""
+Counselor directory: facet filters, ranked text search and facet counts.
+
+Specializations and languages are parsed out of a profile's free-text fields
+into shared Facet rows whenever it is saved, so filtering on them is an
+indexed join instead of ``icontains`` over every profile. Text search uses
+the database's own engine: an FTS5 table on SQLite, a GIN-indexed tsvector
+on PostgreSQL. Facet counts are cached and dropped whenever a profile changes.
+"""
+import re
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, Exists, FloatField, OuterRef, Q, Value
+from django.utils import timezone
+from django.utils.text import slugify
+
+from . import presence
+from .models import AvailabilitySlot, Facet, PsychiatristProfile
+
+FTS_TABLE = "counseling_psychiatrist_fts"
+FACETS_CACHE_KEY = "counseling:directory:facets"
+# Also bounds how stale "available this week" can get as slots are booked.
+FACETS_CACHE_TIMEOUT = 300
+RATING_BANDS = ("4.5", "4.0", "3.5", "3.0")
+MODES = ("chat", "voice", "video")
+
+SEPARATORS = {
+    Facet.SPECIALIZATION: re.compile(r"\s*(?:[,;/&|+]|\band\b)\s*", re.IGNORECASE),
+    Facet.LANGUAGE: re.compile(r"\s*[,;/|]\s*"),
+}
+
+
+def parse_terms(kind, text):
+    """Split a free-text field into ``{slug: display name}``."""
+    terms = {}
+    for part in SEPARATORS[kind].split(text or ""):
+        name = part.strip()[:80]
+        slug = slugify(name)[:80]
+        if slug and slug not in terms:
+            terms[slug] = name
+    return terms
+
+
+def search_vector():
+    # Must stay identical to the expression of the GIN index created in migration 0008.
+    from django.contrib.postgres.search import SearchVector
+
+    return (
+        SearchVector("full_name", weight="A", config="simple")
+        + SearchVector("specialization", weight="B", config="simple")
+        + SearchVector("bio", weight="C", config="simple")
+    )
+
+
+def index_profile(profile):
+    """Refresh a saved profile's facets and search entry, and drop cached counts."""
+    wanted = {
+        (kind, slug): name
+        for kind, text in ((Facet.SPECIALIZATION, profile.specialization), (Facet.LANGUAGE, profile.languages))
+        for slug, name in parse_terms(kind, text).items()
+    }
+    facet_ids = []
+    if wanted:
+        Facet.objects.bulk_create(
+            [Facet(kind=kind, slug=slug, name=name) for (kind, slug), name in wanted.items()],
+            ignore_conflicts=True,
+        )
+        lookup = Q()
+        for kind, slug in wanted:
+            lookup |= Q(kind=kind, slug=slug)
+        facet_ids = list(Facet.objects.filter(lookup).values_list("pk", flat=True))
+    profile.facets.set(facet_ids)
+
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [profile.pk])
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, full_name, specialization, bio) VALUES (%s, %s, %s, %s)",
+                [profile.pk, profile.full_name, profile.specialization, profile.bio],
+            )
+    invalidate_facet_counts()
+
+
+def unindex_profile(profile):
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [profile.pk])
+    invalidate_facet_counts()
+
+
+def rebuild_search_index():
+    """Repopulate the SQLite FTS table from scratch (PostgreSQL needs nothing: its index is on the table)."""
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, full_name, specialization, bio) "
+            f"SELECT id, full_name, specialization, bio FROM {PsychiatristProfile._meta.db_table}"
+        )
+
+
+def invalidate_facet_counts():
+    cache.delete(FACETS_CACHE_KEY)
+
+
+def listed():
+    """Profiles shown in the public directory."""
+    return PsychiatristProfile.objects.filter(is_female=True, is_verified=True)
+
+
+def available_this_week(now=None):
+    now = now or timezone.now()
+    return Exists(AvailabilitySlot.objects.filter(
+        psychiatrist=OuterRef("pk"), is_booked=False, start__gte=now, start__lt=now + timedelta(days=7),
+    ))
+
+
+def _match_expression(text):
+    # Quote every word so user input can't inject FTS5 syntax; each is a prefix match.
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", text))
+
+
+def text_search(queryset, text):
+    """Restrict ``queryset`` to profiles matching ``text``, annotated with ``search_rank`` (higher is better)."""
+    if connection.vendor == "postgresql":
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        query = SearchQuery(text, search_type="websearch", config="simple")
+        return queryset.annotate(document=search_vector()).filter(document=query).annotate(
+            search_rank=SearchRank(search_vector(), query),
+        )
+
+    if connection.vendor == "sqlite":
+        match = _match_expression(text)
+        if not match:
+            return queryset.none()
+        # A correlated MATCH per profile re-runs the full-text query for every
+        # row, so join the FTS table instead; ORM expressions can't express
+        # that, hence extra(). bm25() is lower-is-better; name matches weigh
+        # most, then specialization, then bio.
+        table = queryset.model._meta.db_table
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f"{FTS_TABLE}.rowid = {table}.id", f"{FTS_TABLE} MATCH %s"],
+            params=[match],
+            select={"search_rank": f"-bm25({FTS_TABLE}, 10.0, 5.0, 1.0)"},
+        )
+
+    return queryset.filter(
+        Q(full_name__icontains=text) | Q(specialization__icontains=text) | Q(bio__icontains=text)
+    ).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+def has_facet(kind, value, profile="pk"):
+    """
+    Filter for rows whose profile (the outer ``profile`` field) has a ``kind``
+    facet matching ``value`` by slug or part of its name.
+    """
+    through = PsychiatristProfile.facets.through
+    return Exists(through.objects.filter(
+        Q(facet__slug=slugify(value)) | Q(facet__name__icontains=value),
+        psychiatristprofile_id=OuterRef(profile),
+        facet__kind=kind,
+    ))
+
+
+def search(params):
+    """
+    Directory results for query ``params``: ``search`` (ranked text search),
+    ``specialization``, ``language`` (facet slug or part of a name),
+    ``mode``, ``rating`` (minimum) and ``available`` (``week``, or ``now``
+    for psychiatrists online and not in a session). Invalid values are
+    ignored, as the listing pages always have.
+    """
+    queryset = listed().select_related("user")
+    for kind in (Facet.SPECIALIZATION, Facet.LANGUAGE):
+        value = (params.get(kind) or "").strip()
+        if value:
+            queryset = queryset.filter(has_facet(kind, value))
+
+    mode = params.get("mode")
+    if mode in MODES:
+        queryset = queryset.filter(**{f"available_{mode}": True})
+    try:
+        if params.get("rating"):
+            queryset = queryset.filter(rating__gte=float(params["rating"]))
+    except ValueError:
+        pass
+    if params.get("available") == "week":
+        queryset = queryset.filter(available_this_week())
+    elif params.get("available") == "now":
+        queryset = queryset.filter(pk__in=presence.available_now(queryset.values_list("pk", flat=True)))
+
+    text = (params.get("search") or "").strip()
+    if text:
+        return text_search(queryset, text).order_by("-search_rank", "-rating", "-created_at")
+    return queryset.order_by("-rating", "-created_at")
+
+
+def facet_counts():
+    """
+    How many listed profiles fall under each filter value. Cached; profile
+    saves invalidate it, and a short timeout keeps availability fresh.
+    """
+    counts = cache.get(FACETS_CACHE_KEY)
+    if counts is None:
+        counts = _facet_counts()
+        cache.set(FACETS_CACHE_KEY, counts, FACETS_CACHE_TIMEOUT)
+    return counts
+
+
+def _facet_counts():
+    counts = {Facet.SPECIALIZATION: [], Facet.LANGUAGE: []}
+    facets = (
+        Facet.objects.filter(psychiatrists__is_verified=True, psychiatrists__is_female=True)
+        .annotate(count=Count("psychiatrists"))
+        .order_by("-count", "name")
+        .values_list("kind", "slug", "name", "count")
+    )
+    for kind, slug, name, count in facets:
+        counts[kind].append({"slug": slug, "name": name, "count": count})
+
+    totals = listed().aggregate(
+        total=Count("id"),
+        available_this_week=Count("id", filter=Q(available_this_week())),
+        **{f"mode_{mode}": Count("id", filter=Q(**{f"available_{mode}": True})) for mode in MODES},
+        **{f"rating_{i}": Count("id", filter=Q(rating__gte=band)) for i, band in enumerate(RATING_BANDS)},
+    )
+    counts["total"] = totals["total"]
+    counts["available_this_week"] = totals["available_this_week"]
+    counts["mode"] = {mode: totals[f"mode_{mode}"] for mode in MODES}
+    counts["rating"] = [{"band": band, "count": totals[f"rating_{i}"]} for i, band in enumerate(RATING_BANDS)]
+    return counts
@@ -17,7 +17,6 @@ class PsychiatristProfileForm(forms.ModelForm):
             'available_chat',
             'available_voice',
             'available_video',
-            'rating',
         ]
         widgets = {
             'bio': forms.Textarea(attrs={'rows': 3}),
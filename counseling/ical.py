@@ -0,0 +1,106 @@
+"""
+iCalendar subscription feeds of a user's counseling sessions.
+
+Calendar apps poll feeds every few minutes, so each poll first answers the
+conditional GET from one aggregate query (the ETag covers the newest booking
+change and the number of bookings in the feed) and only streams the
+calendar, a chunk of bookings at a time, when something has changed.
+"""
+import hashlib
+import secrets
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from .models import Booking, CalendarFeed
+
+PAST_WINDOW = timedelta(days=90)
+CHUNK_SIZE = 500
+STATUSES = {"pending": "TENTATIVE", "confirmed": "CONFIRMED", "completed": "CONFIRMED", "cancelled": "CANCELLED"}
+
+
+def feed_for(user):
+    feed, _ = CalendarFeed.objects.get_or_create(user=user, defaults={"token": secrets.token_urlsafe(32)})
+    return feed
+
+
+def reset(user):
+    """Give ``user`` a new feed URL; the old one stops working."""
+    feed = feed_for(user)
+    feed.token = secrets.token_urlsafe(32)
+    feed.save(update_fields=["token"])
+    return feed
+
+
+def bookings(user, now=None):
+    """Sessions in ``user``'s feed: as a patient and, for psychiatrists, with their patients."""
+    now = now or timezone.now()
+    return Booking.objects.filter(
+        Q(user=user) | Q(psychiatrist__user=user),
+        slot__start__gte=now - PAST_WINDOW,
+    )
+
+
+def etag(user):
+    # Cancelling keeps the row and bumps updated_at; the count catches deletions.
+    state = bookings(user).aggregate(changed=Max("updated_at"), count=Count("id"))
+    changed = state["changed"].isoformat() if state["changed"] else ""
+    return hashlib.sha1(f"{user.pk}:{changed}:{state['count']}".encode()).hexdigest()
+
+
+def _escape(text):
+    return (
+        text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+        .replace("\r\n", "\\n").replace("\n", "\\n")
+    )
+
+
+def _fold(line):
+    """Split a content line into 75-octet pieces as RFC 5545 requires."""
+    data = line.encode()
+    if len(data) <= 75:
+        return line + "\r\n"
+    parts = []
+    while data:
+        limit = 75 if not parts else 74
+        # Don't split a multi-byte character.
+        while limit < len(data) and (data[limit] & 0xC0) == 0x80:
+            limit -= 1
+        parts.append(data[:limit].decode())
+        data = data[limit:]
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def _stamp(value):
+    return value.astimezone(dt_timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def events(user, host):
+    """Yield the feed's text, one event at a time."""
+    yield _fold("BEGIN:VCALENDAR")
+    yield _fold("VERSION:2.0")
+    yield _fold("PRODID:-//Sisterhood Stories//Counseling//EN")
+    yield _fold("CALSCALE:GREGORIAN")
+    yield _fold("X-WR-CALNAME:Counseling sessions")
+    rows = bookings(user).order_by().values_list(
+        "id", "user_id", "status", "mode", "allow_anonymous", "pseudonym", "updated_at",
+        "user__username", "psychiatrist__full_name", "slot__start", "slot__end",
+    ).iterator(chunk_size=CHUNK_SIZE)
+    for pk, patient_id, status, mode, anonymous, pseudonym, updated_at, username, psychiatrist, start, end in rows:
+        if patient_id == user.pk:
+            summary = f"Counseling session with {psychiatrist}"
+        else:
+            summary = f"Session with {pseudonym if anonymous and pseudonym else username}"
+        yield "".join(_fold(line) for line in (
+            "BEGIN:VEVENT",
+            f"UID:booking-{pk}@{host}",
+            f"DTSTAMP:{_stamp(updated_at)}",
+            f"DTSTART:{_stamp(start)}",
+            f"DTEND:{_stamp(end)}",
+            f"SUMMARY:{_escape(summary)}",
+            f"DESCRIPTION:{_escape(mode.title())} session",
+            f"STATUS:{STATUSES.get(status, 'CONFIRMED')}",
+            "END:VEVENT",
+        ))
+    yield _fold("END:VCALENDAR")
@@ -0,0 +1,95 @@
+"""
+A small database-backed job queue.
+
+Jobs are rows in the same database as the data they act on, so enqueueing
+inside a transaction means the job exists exactly when the change that
+caused it was committed. Workers claim due jobs with a conditional UPDATE
+(the same pattern the booking service uses for slots) and hold them on a
+lease; a worker that dies mid-job simply lets the lease run out, and the job
+is picked up again.
+"""
+import os
+import socket
+import traceback
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+LEASE = timedelta(minutes=5)
+MAX_ATTEMPTS = 5
+RETRY_DELAY = timedelta(seconds=30)
+KEEP_FINISHED = timedelta(days=7)
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue(task, run_at=None, **kwargs):
+    """Queue a call of ``task`` (a dotted path) with JSON-serializable ``kwargs``."""
+    return Job.objects.create(task=task, kwargs=kwargs, run_at=run_at or timezone.now())
+
+
+def _due(now):
+    return Q(status="queued", run_at__lte=now) | Q(status="running", locked_until__lt=now)
+
+
+def claim(worker, limit=10, now=None):
+    """
+    Lease up to ``limit`` due jobs to ``worker``. Jobs whose lease expired are
+    due again. Each job is claimed with its own conditional UPDATE, so two
+    workers never get the same one.
+    """
+    now = now or timezone.now()
+    claimed = []
+    for pk in Job.objects.filter(_due(now)).values_list("pk", flat=True)[:limit]:
+        won = Job.objects.filter(_due(now), pk=pk).update(
+            status="running", locked_by=worker, locked_until=now + LEASE,
+        )
+        if won:
+            claimed.append(pk)
+    return list(Job.objects.filter(pk__in=claimed, locked_by=worker).order_by("run_at", "id"))
+
+
+def run(job):
+    """Run a claimed job; on failure it is retried with backoff, up to ``MAX_ATTEMPTS``."""
+    attempts = job.attempts + 1
+    try:
+        with transaction.atomic():
+            import_string(job.task)(**job.kwargs)
+            finished = Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+                status="done", attempts=attempts, finished_at=timezone.now(), locked_until=None,
+            )
+            if not finished:
+                # Our lease ran out and another worker took the job over; let it win.
+                transaction.set_rollback(True)
+        return True
+    except Exception:
+        failed = attempts >= MAX_ATTEMPTS
+        Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+            status="failed" if failed else "queued",
+            attempts=attempts,
+            run_at=timezone.now() + RETRY_DELAY * 2 ** (attempts - 1),
+            last_error=traceback.format_exc(),
+            locked_until=None,
+            finished_at=timezone.now() if failed else None,
+        )
+        return False
+
+
+def work(worker=None, limit=10):
+    """Claim and run one batch of due jobs. Returns how many were run."""
+    jobs = claim(worker or worker_name(), limit)
+    for job in jobs:
+        run(job)
+    return len(jobs)
+
+
+def prune(older_than=KEEP_FINISHED):
+    """Delete jobs that finished (or gave up) more than ``older_than`` ago."""
+    return Job.objects.filter(status__in=("done", "failed"), finished_at__lt=timezone.now() - older_than).delete()[0]
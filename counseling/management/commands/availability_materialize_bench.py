@@ -0,0 +1,66 @@
+import time
+from datetime import time as clock, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from counseling import availability
+from counseling.models import PsychiatristProfile, AvailabilityRule, AvailabilityException, AvailabilitySlot
+
+
+class Command(BaseCommand):
+    help = (
+        "Time materializing recurring rules for many counselors (a cold run, "
+        "then the incremental daily run). Runs against a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--counselors', type=int, default=1000)
+        parser.add_argument('--weeks', type=int, default=52)
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.seed(options['counselors'])
+            today = timezone.localdate()
+
+            started = time.perf_counter()
+            created = availability.materialize(weeks=options['weeks'], today=today)
+            cold = time.perf_counter() - started
+            self.stdout.write(
+                f"Cold run: {created} new slots for {options['counselors']} counselors over "
+                f"{options['weeks']} weeks in {cold:.2f}s ({created / cold:.0f} slots/sec)"
+            )
+
+            started = time.perf_counter()
+            created = availability.materialize(weeks=options['weeks'], today=today + timedelta(days=1))
+            self.stdout.write(
+                f"Next day's run: {created} new slots in {time.perf_counter() - started:.2f}s"
+            )
+            self.stdout.write(self.style.SUCCESS(f"{AvailabilitySlot.objects.count()} slots in total."))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def seed(self, counselors):
+        users = User.objects.bulk_create(User(username=f'bench_counselor_{i}') for i in range(counselors))
+        profiles = PsychiatristProfile.objects.bulk_create(
+            PsychiatristProfile(user=user, full_name=f'Dr Bench {i}', license_no=f'BENCH-{i}', is_verified=True)
+            for i, user in enumerate(users)
+        )
+        rules = []
+        for i, profile in enumerate(profiles):
+            # Two evening windows and a weekend morning, like a typical part-time schedule.
+            rules.append(AvailabilityRule(psychiatrist=profile, weekdays='mon,wed', start_time=clock(18),
+                                          end_time=clock(21), timezone='Asia/Kolkata'))
+            rules.append(AvailabilityRule(psychiatrist=profile, weekdays='sat', start_time=clock(9),
+                                          end_time=clock(12), slot_minutes=60))
+        AvailabilityRule.objects.bulk_create(rules)
+        now = timezone.now()
+        AvailabilityException.objects.bulk_create(
+            [AvailabilityException(starts_at=now + timedelta(days=d), ends_at=now + timedelta(days=d + 1),
+                                   reason='Holiday') for d in (30, 90, 180)]
+            + [AvailabilityException(psychiatrist=profile, starts_at=now + timedelta(days=60),
+                                     ends_at=now + timedelta(days=74), reason='Leave') for profile in profiles[::10]]
+        )
@@ -0,0 +1,139 @@
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from counseling.booking import SlotUnavailable, book_slot
+from counseling.models import PsychiatristProfile, AvailabilitySlot, Booking
+
+
+def claim_worker(worker, slot_ids, psychiatrist_ids, seed, start_at, results):
+    # Forked children must not share the parent's database socket.
+    connections.close_all()
+    patient = User.objects.get(username=f'bench_patient_{worker}')
+    psychiatrists = dict(PsychiatristProfile.objects.in_bulk(set(psychiatrist_ids)))
+    order = list(zip(slot_ids, psychiatrist_ids))
+    random.Random(seed).shuffle(order)
+
+    while time.time() < start_at:
+        time.sleep(0.001)
+    claimed = taken = 0
+    started = time.perf_counter()
+    for slot_id, psychiatrist_id in order:
+        try:
+            book_slot(patient, psychiatrists[psychiatrist_id], slot_id, mode='chat')
+            claimed += 1
+        except SlotUnavailable:
+            taken += 1
+    results.put((worker, claimed, taken, time.perf_counter() - started))
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        "Have several processes race to book the same slots through the booking "
+        "service, then check that no slot ended up with two bookings. Runs "
+        "against a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--slots', type=int, default=500)
+        parser.add_argument('--psychiatrists', type=int, default=10)
+
+    def handle(self, *args, **options):
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise CommandError("This benchmark needs the 'fork' start method.")
+
+        db_file = None
+        if connection.vendor == 'sqlite':
+            # The default in-memory test database is invisible to other processes.
+            fd, db_file = tempfile.mkstemp(suffix='.sqlite3')
+            os.close(fd)
+            connection.settings_dict['TEST']['NAME'] = db_file
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            slot_ids, psychiatrist_ids = self.seed(options)
+            self.race(slot_ids, psychiatrist_ids, options)
+            self.verify(len(slot_ids))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            if db_file and os.path.exists(db_file):
+                os.remove(db_file)
+
+    def seed(self, options):
+        psychiatrists = []
+        for i in range(options['psychiatrists']):
+            user = User.objects.create_user(f'bench_psychiatrist_{i}', password='bench')
+            psychiatrists.append(PsychiatristProfile.objects.create(
+                user=user, full_name=f'Dr Bench {i}', license_no=f'BENCH-{i}',
+                is_verified=True, is_female=True,
+            ))
+        for i in range(options['workers']):
+            User.objects.create_user(f'bench_patient_{i}', password='bench')
+
+        first = timezone.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=1)
+        AvailabilitySlot.objects.bulk_create(
+            AvailabilitySlot(
+                psychiatrist=psychiatrists[i % len(psychiatrists)],
+                start=first + timedelta(hours=i // len(psychiatrists)),
+                end=first + timedelta(hours=i // len(psychiatrists), minutes=50),
+            )
+            for i in range(options['slots'])
+        )
+        rows = list(AvailabilitySlot.objects.values_list('id', 'psychiatrist_id'))
+        return [r[0] for r in rows], [r[1] for r in rows]
+
+    def race(self, slot_ids, psychiatrist_ids, options):
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        connections.close_all()
+        start_at = time.time() + 1
+        processes = [
+            context.Process(
+                target=claim_worker,
+                args=(worker, slot_ids, psychiatrist_ids, worker, start_at, results),
+            )
+            for worker in range(options['workers'])
+        ]
+        for process in processes:
+            process.start()
+        rows = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        if any(process.exitcode for process in processes):
+            raise CommandError("A worker process failed.")
+
+        elapsed = max(row[3] for row in rows)
+        claimed = sum(row[1] for row in rows)
+        attempts = claimed + sum(row[2] for row in rows)
+        for worker, won, lost, seconds in sorted(rows):
+            self.stdout.write(f"worker {worker}: {won} claimed, {lost} taken in {seconds:.2f}s")
+        self.stdout.write(
+            f"{options['workers']} workers, {attempts} attempts on {len(slot_ids)} slots in {elapsed:.2f}s: "
+            f"{claimed / elapsed:.0f} claims/sec, {attempts / elapsed:.0f} attempts/sec"
+        )
+
+    def verify(self, slot_count):
+        active = Booking.objects.exclude(status='cancelled')
+        doubled = active.values('slot_id').annotate(n=Count('id')).filter(n__gt=1).count()
+        orphaned = AvailabilitySlot.objects.filter(is_booked=True).exclude(
+            Q(bookings__isnull=False) & ~Q(bookings__status='cancelled')
+        ).count()
+        booked = AvailabilitySlot.objects.filter(is_booked=True).count()
+        if doubled or orphaned or booked != active.count() or booked != slot_count:
+            raise CommandError(
+                f"Inconsistent bookings: {doubled} double-booked slots, {orphaned} booked "
+                f"slots without a booking, {booked} booked slots vs {active.count()} bookings."
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"OK: {booked} slots booked exactly once, 0 double bookings."
+        ))
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from counseling import availability
+from counseling.models import AvailabilityRule
+
+
+class Command(BaseCommand):
+    help = (
+        "Expand recurring availability rules into bookable slots up to the "
+        "rolling horizon. Safe to run repeatedly; run_jobs already runs it "
+        "regularly, so this is for backfills and rebuilds."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--weeks', type=int, default=availability.HORIZON_WEEKS)
+        parser.add_argument('--psychiatrist', type=int, help="Only expand this psychiatrist's rules.")
+        parser.add_argument('--rebuild', action='store_true',
+                            help="Start again from today, replacing unbooked future slots.")
+
+    def handle(self, *args, **options):
+        rules = AvailabilityRule.objects.all()
+        if options['psychiatrist']:
+            rules = rules.filter(psychiatrist_id=options['psychiatrist'])
+
+        started = time.perf_counter()
+        if options['rebuild']:
+            for rule in rules:
+                availability.clear_rule_slots(rule)
+            rules.update(materialized_until=None)
+        created = availability.materialize(rules, weeks=options['weeks'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {created} new slot(s) up to {options['weeks']} week(s) ahead "
+            f"in {time.perf_counter() - started:.2f}s."
+        ))
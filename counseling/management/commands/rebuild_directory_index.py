@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from counseling import directory
+from counseling.models import PsychiatristProfile
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-derive every psychiatrist's specialization/language facets and "
+        "rebuild the directory's full-text index, e.g. after bulk imports "
+        "that bypassed model saves."
+    )
+
+    def handle(self, *args, **options):
+        count = 0
+        for profile in PsychiatristProfile.objects.only('id', 'full_name', 'specialization', 'languages', 'bio').iterator(chunk_size=500):
+            directory.index_profile(profile)
+            count += 1
+        directory.rebuild_search_index()
+        directory.invalidate_facet_counts()
+        self.stdout.write(self.style.SUCCESS(f"Re-indexed {count} psychiatrist(s)."))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from counseling import ratings
+from counseling.models import PsychiatristProfile
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild every psychiatrist's rating totals, histogram and average "
+        "from their feedback, in batches, and report how many had drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        ids = list(PsychiatristProfile.objects.order_by('pk').values_list('pk', flat=True))
+        stale = 0
+        for offset in range(0, len(ids), options['batch_size']):
+            stale += ratings.reconcile(ids[offset:offset + options['batch_size']])
+        self.stdout.write(self.style.SUCCESS(
+            f"Reconciled {len(ids)} psychiatrist(s); {stale} had out-of-date ratings."
+        ))
@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from chatbot import conversations
+from counseling import availability, jobs, presence
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued background jobs (waitlist offers and their expiry), "
+        "extend availability rules into slots on the rolling horizon, compact "
+        "presence into online-time totals and purge expired chatbot "
+        "conversations. Runs until stopped; start as many workers as needed, "
+        "they never share a job."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Run the jobs that are due now, then exit.")
+        parser.add_argument('--batch', type=int, default=10, help="Jobs to claim at a time.")
+        parser.add_argument('--sleep', type=float, default=1.0, help="Seconds to wait when nothing is due.")
+
+    def handle(self, *args, **options):
+        worker = jobs.worker_name()
+        ran = 0
+        last_prune = 0
+        last_compact = 0
+        last_materialize = 0
+        while True:
+            if time.monotonic() - last_materialize > availability.MATERIALIZE_INTERVAL.total_seconds():
+                availability.materialize()
+                last_materialize = time.monotonic()
+            if time.monotonic() - last_compact > presence.COMPACT_INTERVAL.total_seconds():
+                presence.compact()
+                last_compact = time.monotonic()
+            count = jobs.work(worker, options['batch'])
+            ran += count
+            if count:
+                continue
+            if options['once']:
+                break
+            if time.monotonic() - last_prune > 3600:
+                jobs.prune()
+                conversations.purge()
+                last_prune = time.monotonic()
+            time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(f"Ran {ran} job(s)."))
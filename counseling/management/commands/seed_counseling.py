@@ -1,11 +1,11 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
-from django.utils import timezone
-from datetime import timedelta
-from counseling.models import PsychiatristProfile, AvailabilitySlot
+from datetime import time
+from counseling import availability
+from counseling.models import PsychiatristProfile, AvailabilityRule
 
 class Command(BaseCommand):
-    help = "Create a demo verified female psychiatrist and a few availability slots"
+    help = "Create a demo verified female psychiatrist with recurring weekday-evening availability"
 
     def handle(self, *args, **options):
         # Create or get demo counselor user
@@ -31,20 +31,16 @@ class Command(BaseCommand):
             }
         )
 
-        # Create three upcoming 30-min slots
-        now = timezone.now().replace(minute=0, second=0, microsecond=0)
-        created_slots = 0
-        for i in range(1, 4):
-            start = now + timedelta(hours=i)
-            end = start + timedelta(minutes=30)
-            slot, made = AvailabilitySlot.objects.get_or_create(
-                psychiatrist=profile,
-                start=start,
-                end=end,
-            )
-            if made:
-                created_slots += 1
+        # Weekday evenings in 30-min slots, expanded a few weeks ahead
+        rule, _ = AvailabilityRule.objects.get_or_create(
+            psychiatrist=profile,
+            weekdays="mon,tue,wed,thu,fri",
+            start_time=time(18, 0),
+            end_time=time(21, 0),
+            defaults={"slot_minutes": 30},
+        )
+        created_slots = availability.materialize(AvailabilityRule.objects.filter(pk=rule.pk), weeks=4)
 
         self.stdout.write(self.style.SUCCESS(
-            f"Seeded counselor '{profile.full_name}' with {created_slots} new slot(s). Username: demo_counselor / Password: demo1234"
+            f"Seeded counselor '{profile.full_name}' with {created_slots} slot(s) over the next 4 weeks. Username: demo_counselor / Password: demo1234"
         ))
@@ -0,0 +1,150 @@
+import asyncio
+import statistics
+import time
+from datetime import timedelta
+
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from counseling.models import AvailabilitySlot, Booking, PsychiatristProfile, SessionMessage
+from counseling.routing import websocket_urlpatterns
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "Open N live counseling sessions (a patient and a psychiatrist socket "
+        "each), exchange messages in all of them at once and measure delivery "
+        "latency, then check the transcripts and a resumed reconnect. Runs "
+        "in-process against a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=2000)
+        parser.add_argument('--messages', type=int, default=10, help="Messages per session, alternating sides.")
+        parser.add_argument('--connect-batch', type=int, default=250)
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            sessions = self.create_sessions(options['sessions'])
+            asyncio.run(self.run(sessions, options))
+            saved = SessionMessage.objects.count()
+            expected = options['sessions'] * options['messages']
+            if saved != expected:
+                raise RuntimeError(f"Expected {expected} saved messages, found {saved}")
+            self.stdout.write(f"Transcripts complete: {saved} messages saved")
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def create_sessions(self, count):
+        now = timezone.now()
+        patients = User.objects.bulk_create([User(username=f'loadtest_patient_{i}') for i in range(count)])
+        doctors = User.objects.bulk_create([User(username=f'loadtest_doctor_{i}') for i in range(count)])
+        profiles = PsychiatristProfile.objects.bulk_create([
+            PsychiatristProfile(user=user, full_name=f'Doctor {i}', license_no=f'LT-{i}', is_verified=True)
+            for i, user in enumerate(doctors)
+        ])
+        slots = AvailabilitySlot.objects.bulk_create([
+            AvailabilitySlot(psychiatrist=profile, start=now - timedelta(minutes=5), end=now + timedelta(hours=1), is_booked=True)
+            for profile in profiles
+        ])
+        bookings = Booking.objects.bulk_create([
+            Booking(user=patient, psychiatrist=profile, slot=slot, status='confirmed')
+            for patient, profile, slot in zip(patients, profiles, slots)
+        ])
+        return list(zip(bookings, patients, doctors))
+
+    async def connect(self, application, path, user):
+        communicator = WebsocketCommunicator(application, path)
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect(timeout=60)
+        if not connected:
+            raise RuntimeError('A consumer refused the connection')
+        await self.expect(communicator, 'history')
+        return communicator
+
+    async def expect(self, communicator, kind):
+        while True:
+            event = await communicator.receive_json_from(timeout=60)
+            if event['type'] == kind:
+                return event
+
+    async def run(self, sessions, options):
+        application = URLRouter(websocket_urlpatterns)
+        batch_size = options['connect_batch']
+
+        pairs = []
+        started = time.perf_counter()
+        for offset in range(0, len(sessions), batch_size):
+            batch = sessions[offset:offset + batch_size]
+            pairs.extend(await asyncio.gather(*(self.connect_pair(application, *session) for session in batch)))
+        connect_time = time.perf_counter() - started
+        self.stdout.write(f"Connected {len(pairs)} sessions ({len(pairs) * 2} sockets) in {connect_time:.2f}s")
+
+        latencies = []
+        started = time.perf_counter()
+        for i in range(options['messages']):
+            round_started = time.perf_counter()
+
+            async def exchange(patient, doctor):
+                sender, receiver = (patient, doctor) if i % 2 == 0 else (doctor, patient)
+                await sender.send_json_to({'type': 'typing'})
+                await sender.send_json_to({'type': 'message', 'body': f'message {i} ' + 'x' * 100, 'client_id': str(i)})
+                await self.expect(receiver, 'message')
+                latencies.append(time.perf_counter() - round_started)
+                await self.expect(sender, 'message')
+
+            await asyncio.gather(*(exchange(patient, doctor) for _, patient, doctor in pairs))
+        elapsed = time.perf_counter() - started
+        total = len(pairs) * options['messages']
+
+        ms = 1000
+        self.stdout.write(self.style.SUCCESS(
+            f"Delivered {total} messages in {elapsed:.2f}s ({total / elapsed:.0f}/s): "
+            f"p50={percentile(latencies, 50) * ms:.1f}ms "
+            f"p95={percentile(latencies, 95) * ms:.1f}ms "
+            f"p99={percentile(latencies, 99) * ms:.1f}ms "
+            f"mean={statistics.mean(latencies) * ms:.1f}ms"
+        ))
+
+        # Drop one patient, send while they are away, and check the resume.
+        booking, patient, doctor = pairs[0]
+        await patient.disconnect()
+        last_seen = await database_sync_to_async(
+            lambda: SessionMessage.objects.filter(booking=booking).order_by('-id').values_list('id', flat=True).first()
+        )()
+        await doctor.send_json_to({'type': 'message', 'body': 'while you were away', 'client_id': 'away'})
+        await self.expect(doctor, 'message')
+        communicator = WebsocketCommunicator(application, f'/ws/counseling/session/{booking.pk}/?after={last_seen}')
+        communicator.scope['user'] = booking.user
+        await communicator.connect(timeout=60)
+        history = await self.expect(communicator, 'history')
+        if [message['body'] for message in history['messages']] != ['while you were away']:
+            raise RuntimeError(f"Resume returned {history['messages']}")
+        self.stdout.write("Resume after reconnect returned exactly the missed message")
+        await communicator.disconnect()
+        await database_sync_to_async(
+            lambda: SessionMessage.objects.filter(booking=booking, body='while you were away').delete()
+        )()
+
+        sockets = [doctor] + [socket for _, patient, doctor in pairs[1:] for socket in (patient, doctor)]
+        await asyncio.gather(*(socket.disconnect() for socket in sockets))
+
+    async def connect_pair(self, application, booking, patient, doctor):
+        path = f'/ws/counseling/session/{booking.pk}/'
+        patient_socket = await self.connect(application, path, patient)
+        doctor_socket = await self.connect(application, path, doctor)
+        await self.expect(patient_socket, 'presence')
+        await self.expect(doctor_socket, 'presence')
+        return booking, patient_socket, doctor_socket
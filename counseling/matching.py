@@ -0,0 +1,299 @@
+"""
+Match patients with counselors.
+
+Every listed counselor is scored against a patient's request (concerns,
+language, session mode, time of day) with NumPy over a feature matrix that
+is built in four queries and kept in memory. Profile and slot changes bump
+a version in the cache, and processes sharing that cache rebuild lazily on
+their next request; ``MAX_AGE`` bounds how stale a process can get
+otherwise.
+"""
+import math
+import threading
+import time
+import zoneinfo
+from datetime import datetime, timedelta
+
+import numpy as np
+from django.core.cache import cache
+from django.db.models import Count, Func, IntegerField, Min
+from django.utils import timezone
+
+from .directory import MODES, listed, parse_terms
+from .models import AvailabilitySlot, Facet, PsychiatristProfile
+from .slot_search import DAY_PARTS
+
+VERSION_KEY = "counseling:matching:version"
+MAX_AGE = 120  # seconds
+HORIZON = timedelta(days=14)
+# Free slots are bucketed by half hour of the UTC day, so a patient's time of
+# day can be matched in any timezone whose offset is a multiple of 30 minutes.
+BUCKETS_PER_HOUR = 2
+BUCKETS = 24 * BUCKETS_PER_HOUR
+
+WEIGHTS = {
+    "concerns": 3.0,
+    "language": 2.0,
+    "time": 1.0,
+    "soonest": 1.0,
+    "rating": 1.5,
+    "experience": 0.5,
+}
+# Ratings are shrunk towards PRIOR_RATING as if every counselor had
+# PRIOR_WEIGHT extra reviews, so one 5-star review doesn't top the list.
+PRIOR_RATING = 3.5
+PRIOR_WEIGHT = 5
+SOONEST_SCALE_HOURS = 72
+TIME_SCALE_SLOTS = 3
+MAX_EXPERIENCE = 30
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+
+class HalfHourOfDay(Func):
+    """The UTC half hour of the day (0-47) a datetime column falls in."""
+    output_field = IntegerField()
+    template = (
+        f"(CAST(EXTRACT(HOUR FROM %(expressions)s AT TIME ZONE 'UTC') AS integer) * {BUCKETS_PER_HOUR}"
+        f" + CAST(EXTRACT(MINUTE FROM %(expressions)s AT TIME ZONE 'UTC') AS integer) / {60 // BUCKETS_PER_HOUR})"
+    )
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # Django's SQLite Extract calls back into Python for every row; the
+        # column is stored as UTC "YYYY-MM-DD HH:MM:SS", so slice it natively.
+        return self.as_sql(compiler, connection, template=(
+            f"(CAST(substr(%(expressions)s, 12, 2) AS INTEGER) * {BUCKETS_PER_HOUR}"
+            f" + CAST(substr(%(expressions)s, 15, 2) AS INTEGER) / {60 // BUCKETS_PER_HOUR})"
+        ), **extra_context)
+
+
+class Features:
+    """Column-oriented snapshot of every listed counselor, one row each."""
+
+    def __init__(self, version, now):
+        self.version = version
+        self.built_at = time.monotonic()
+
+        rows = list(listed().values_list(
+            "id", "rating_sum", "rating_count", "years_experience",
+            *(f"available_{mode}" for mode in MODES),
+        ).order_by("id"))
+        columns = list(zip(*rows)) or [()] * (4 + len(MODES))
+        self.ids = np.array(columns[0], dtype=np.int64)
+        self.rating_sum = np.array(columns[1], dtype=np.float32)
+        self.rating_count = np.array(columns[2], dtype=np.float32)
+        self.experience = np.array(columns[3], dtype=np.float32)
+        self.modes = np.array(columns[4:], dtype=bool).reshape(len(MODES), len(rows)).T
+        index = {pk: i for i, pk in enumerate(columns[0])}
+
+        self.facets = {}
+        self.facet_names = {}
+        self.matrices = {}
+        through = PsychiatristProfile.facets.through
+        memberships = through.objects.filter(psychiatristprofile__in=listed()).values_list(
+            "psychiatristprofile_id", "facet__kind", "facet__slug", "facet__name",
+        )
+        cells = {Facet.SPECIALIZATION: ([], []), Facet.LANGUAGE: ([], [])}
+        for profile_id, kind, slug, name in memberships:
+            slugs = self.facets.setdefault(kind, {})
+            column = slugs.setdefault(slug, len(slugs))
+            self.facet_names.setdefault(kind, {})[column] = name
+            cells[kind][0].append(index[profile_id])
+            cells[kind][1].append(column)
+        for kind, (profile_rows, facet_columns) in cells.items():
+            matrix = np.zeros((len(rows), len(self.facets.get(kind, ()))), dtype=np.float32)
+            matrix[profile_rows, facet_columns] = 1
+            self.matrices[kind] = matrix
+
+        self.free = np.zeros((len(rows), BUCKETS), dtype=np.float32)
+        self.soonest = np.full(len(rows), np.inf)
+        free = AvailabilitySlot.objects.filter(
+            AvailabilitySlot.not_held(now), psychiatrist__in=listed(), is_booked=False, start__gte=now, start__lt=now + HORIZON,
+        ).order_by()
+        buckets = free.annotate(bucket=HalfHourOfDay("start")).values_list("psychiatrist_id", "bucket").annotate(Count("id"))
+        for psychiatrist_id, bucket, count in buckets:
+            self.free[index[psychiatrist_id], int(bucket)] = count
+        for psychiatrist_id, first in free.values_list("psychiatrist_id").annotate(Min("start")):
+            self.soonest[index[psychiatrist_id]] = first.timestamp()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def columns(self, kind, term):
+        """Columns of ``kind`` facets whose slug contains, or is contained in, ``term``'s slug."""
+        wanted = next(iter(parse_terms(kind, term)), "")
+        return [
+            column for slug, column in self.facets.get(kind, {}).items()
+            if wanted and (wanted in slug or slug in wanted)
+        ]
+
+
+_features = None
+_lock = threading.Lock()
+
+
+def invalidate():
+    """Make every process rebuild its feature matrix on its next match."""
+    cache.set(VERSION_KEY, time.time_ns(), None)
+
+
+def features():
+    global _features
+    version = cache.get(VERSION_KEY)
+    current = _features
+    if current is None or current.version != version or time.monotonic() - current.built_at > MAX_AGE:
+        with _lock:
+            current = _features
+            if current is None or current.version != version or time.monotonic() - current.built_at > MAX_AGE:
+                current = _features = Features(version, timezone.now())
+    return current
+
+
+def parse_request(params):
+    """
+    Read a match request from query ``params``: ``concerns`` (comma
+    separated), ``language``, ``mode``, ``time`` (a ``DAY_PARTS`` key), ``tz``
+    and ``limit``. Raises ``ValueError`` for malformed values.
+    """
+    request = {
+        "concerns": list(parse_terms(Facet.SPECIALIZATION, params.get("concerns", "")).values()),
+        "language": (params.get("language") or "").strip(),
+        "mode": (params.get("mode") or "").strip().lower(),
+        "time": (params.get("time") or "").strip().lower(),
+        "limit": min(max(int(params.get("limit") or DEFAULT_LIMIT), 1), MAX_LIMIT),
+    }
+    if request["mode"] and request["mode"] not in MODES:
+        raise ValueError(f"Unknown mode {request['mode']!r}.")
+    if request["time"] and request["time"] not in DAY_PARTS:
+        raise ValueError(f"Unknown time of day {request['time']!r}.")
+    try:
+        request["tz"] = zoneinfo.ZoneInfo(params.get("tz") or timezone.get_current_timezone_name())
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone {params.get('tz')!r}.")
+    return request
+
+
+def _time_buckets(part, tz, now):
+    """UTC half-hour buckets that fall in day part ``part`` in ``tz``."""
+    hour_from, hour_to = DAY_PARTS[part]
+    offset = round(now.astimezone(tz).utcoffset().total_seconds() / 3600 * BUCKETS_PER_HOUR)
+    return [(bucket - offset) % BUCKETS for bucket in range(hour_from * BUCKETS_PER_HOUR, hour_to * BUCKETS_PER_HOUR)]
+
+
+def score(features, request, now):
+    """
+    Score every counselor for ``request``. Returns ``(eligible, total, parts)``:
+    a mask of counselors offering the requested mode, the weighted total per
+    counselor and the unweighted 0-1 component arrays it was summed from.
+    """
+    n = len(features)
+    eligible = np.ones(n, dtype=bool)
+    if request.get("mode"):
+        eligible &= features.modes[:, MODES.index(request["mode"])]
+
+    parts = {}
+    concerns = request.get("concerns") or []
+    if concerns:
+        # One column per concern, marking the specializations that cover it.
+        specializations = features.matrices[Facet.SPECIALIZATION]
+        wanted = np.zeros((specializations.shape[1], len(concerns)), dtype=np.float32)
+        for j, concern in enumerate(concerns):
+            wanted[features.columns(Facet.SPECIALIZATION, concern), j] = 1
+        parts["concerns"] = (specializations @ wanted > 0).mean(axis=1)
+    if request.get("language"):
+        columns = features.columns(Facet.LANGUAGE, request["language"])
+        parts["language"] = features.matrices[Facet.LANGUAGE][:, columns].any(axis=1).astype(np.float32)
+    if request.get("time"):
+        free = features.free[:, _time_buckets(request["time"], request["tz"], now)].sum(axis=1)
+        parts["time"] = 1 - np.exp(-free / TIME_SCALE_SLOTS)
+
+    hours = np.maximum(features.soonest - now.timestamp(), 0) / 3600
+    parts["soonest"] = np.exp(-hours / SOONEST_SCALE_HOURS)
+    shrunk = (features.rating_sum + PRIOR_RATING * PRIOR_WEIGHT) / (features.rating_count + PRIOR_WEIGHT)
+    parts["rating"] = (shrunk - 1) / 4
+    parts["experience"] = np.log1p(np.minimum(features.experience, MAX_EXPERIENCE)) / math.log1p(MAX_EXPERIENCE)
+
+    total = np.zeros(n, dtype=np.float64)
+    for key, values in parts.items():
+        total += WEIGHTS[key] * values
+    return eligible, total, parts
+
+
+def top(eligible, total, ids, limit):
+    """Row numbers of the ``limit`` best eligible scores, best first (ties go to the older profile)."""
+    candidates = np.flatnonzero(eligible)
+    if len(candidates) > limit:
+        candidates = candidates[np.argpartition(-total[candidates], limit - 1)[:limit]]
+    return candidates[np.lexsort((ids[candidates], -total[candidates]))]
+
+
+def _reasons(features, request, row, parts, now):
+    reasons = []
+    if "concerns" in parts and parts["concerns"][row]:
+        names = features.facet_names[Facet.SPECIALIZATION]
+        matched = {
+            names[column]
+            for concern in request["concerns"]
+            for column in features.columns(Facet.SPECIALIZATION, concern)
+            if features.matrices[Facet.SPECIALIZATION][row, column]
+        }
+        reasons.append(f"Specializes in {', '.join(sorted(matched))}")
+    if "language" in parts and parts["language"][row]:
+        reasons.append(f"Speaks {request['language'].title()}")
+    if "time" in parts and parts["time"][row]:
+        free = features.free[row, _time_buckets(request["time"], request["tz"], now)].sum()
+        reasons.append(f"{int(free)} free {request['time']} slot{'s' if free != 1 else ''} in the next two weeks")
+    if np.isfinite(features.soonest[row]):
+        soonest = datetime.fromtimestamp(features.soonest[row], tz=request["tz"])
+        reasons.append(f"Next free slot {soonest:%a %d %b, %H:%M}")
+    if features.rating_count[row]:
+        count = int(features.rating_count[row])
+        average = features.rating_sum[row] / count
+        reasons.append(f"Rated {average:.1f} from {count} review{'s' if count != 1 else ''}")
+    if features.experience[row]:
+        reasons.append(f"{int(features.experience[row])} years of experience")
+    return reasons
+
+
+def match(request, now=None):
+    """
+    The best counselors for a ``parse_request`` result. Returns a list of
+    ``{"psychiatrist", "score", "reasons", "breakdown"}`` dicts, best first.
+    """
+    now = now or timezone.now()
+    snapshot = features()
+    if not len(snapshot):
+        return []
+    eligible, total, parts = score(snapshot, request, now)
+    rows = top(eligible, total, snapshot.ids, request.get("limit", DEFAULT_LIMIT))
+    profiles = PsychiatristProfile.objects.in_bulk(snapshot.ids[rows].tolist())
+    return [
+        {
+            "psychiatrist": profiles[pk],
+            "score": round(float(total[row]), 3),
+            "reasons": _reasons(snapshot, request, row, parts, now),
+            "breakdown": {key: round(float(WEIGHTS[key] * values[row]), 3) for key, values in parts.items()},
+        }
+        for row, pk in zip(rows.tolist(), snapshot.ids[rows].tolist())
+        # A profile deleted since the snapshot was built is simply skipped.
+        if pk in profiles
+    ]
+
+
+def serialize(matches):
+    return {
+        "results": [
+            {
+                "psychiatrist": {
+                    "id": m["psychiatrist"].id,
+                    "full_name": m["psychiatrist"].full_name,
+                    "specialization": m["psychiatrist"].specialization,
+                    "languages": m["psychiatrist"].languages,
+                },
+                "score": m["score"],
+                "reasons": m["reasons"],
+                "breakdown": m["breakdown"],
+            }
+            for m in matches
+        ],
+    }
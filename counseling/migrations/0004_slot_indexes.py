@@ -0,0 +1,21 @@
+# Generated by Django 5.2.7 on 2026-10-19 13:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('counseling', '0003_feedback'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='availabilityslot',
+            index=models.Index(fields=['psychiatrist', 'is_booked', 'start'], name='counseling__psychia_ee6163_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='availabilityslot',
+            index=models.Index(condition=models.Q(('is_booked', False)), fields=['start'], name='counseling_slot_free_start'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.7 on 2026-10-19 13:33
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('counseling', '0005_booking_slot_constraint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AvailabilityRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weekdays', models.CharField(help_text='Comma-separated days, e.g. mon,wed', max_length=27)),
+                ('start_time', models.TimeField()),
+                ('end_time', models.TimeField()),
+                ('slot_minutes', models.PositiveSmallIntegerField(default=30)),
+                ('timezone', models.CharField(default='UTC', max_length=64)),
+                ('valid_from', models.DateField(default=django.utils.timezone.localdate)),
+                ('valid_until', models.DateField(blank=True, null=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('materialized_until', models.DateField(blank=True, editable=False, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('psychiatrist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='availability_rules', to='counseling.psychiatristprofile')),
+            ],
+            options={
+                'ordering': ['psychiatrist', 'start_time'],
+            },
+        ),
+        migrations.AddField(
+            model_name='availabilityslot',
+            name='rule',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='slots', to='counseling.availabilityrule'),
+        ),
+        migrations.CreateModel(
+            name='AvailabilityException',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('starts_at', models.DateTimeField()),
+                ('ends_at', models.DateTimeField()),
+                ('reason', models.CharField(blank=True, max_length=120)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('psychiatrist', models.ForeignKey(blank=True, help_text='Leave empty for a holiday that applies to everyone', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='availability_exceptions', to='counseling.psychiatristprofile')),
+            ],
+            options={
+                'ordering': ['starts_at'],
+                'indexes': [models.Index(fields=['ends_at'], name='counseling__ends_at_4fffda_idx')],
+            },
+        ),
+    ]
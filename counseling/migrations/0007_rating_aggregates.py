@@ -0,0 +1,77 @@
+# Generated by Django 5.2.7 on 2026-10-19 13:41
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_ratings(apps, schema_editor):
+    """Start the running totals from existing feedback; profiles without any lose their hand-entered rating."""
+    PsychiatristProfile = apps.get_model('counseling', 'PsychiatristProfile')
+    Feedback = apps.get_model('counseling', 'Feedback')
+    PsychiatristProfile.objects.update(rating=None)
+    rows = Feedback.objects.values('booking__psychiatrist_id').annotate(
+        rating_sum=Sum('rating'),
+        rating_count=Count('id'),
+        **{f'rating_{star}_count': Count('id', filter=Q(rating=star)) for star in range(1, 6)},
+    ).order_by()
+    for row in rows:
+        psychiatrist_id = row.pop('booking__psychiatrist_id')
+        row['rating'] = round(row['rating_sum'] / row['rating_count'], 2)
+        PsychiatristProfile.objects.filter(pk=psychiatrist_id).update(**row)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('counseling', '0006_availability_rules'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='psychiatristprofile',
+            name='rating_1_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='psychiatristprofile',
+            name='rating_2_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='psychiatristprofile',
+            name='rating_3_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='psychiatristprofile',
+            name='rating_4_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='psychiatristprofile',
+            name='rating_5_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='psychiatristprofile',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='psychiatristprofile',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='psychiatristprofile',
+            name='rating',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, help_text='Private average rating', max_digits=3, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='psychiatristprofile',
+            index=models.Index(condition=models.Q(('is_female', True), ('is_verified', True)), fields=['-rating', '-created_at'], name='counseling_psych_rating'),
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
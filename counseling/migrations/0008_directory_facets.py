@@ -0,0 +1,87 @@
+# Generated by Django 5.2.7 on 2026-10-19 13:44
+
+import re
+
+from django.db import migrations, models
+from django.utils.text import slugify
+
+FTS_TABLE = 'counseling_psychiatrist_fts'
+SEPARATORS = {
+    'specialization': re.compile(r'\s*(?:[,;/&|+]|\band\b)\s*', re.IGNORECASE),
+    'language': re.compile(r'\s*[,;/|]\s*'),
+}
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f'CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(full_name, specialization, bio)')
+        schema_editor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, full_name, specialization, bio) '
+            f'SELECT id, full_name, specialization, bio FROM counseling_psychiatristprofile'
+        )
+    elif vendor == 'postgresql':
+        from django.contrib.postgres.indexes import GinIndex
+        from django.contrib.postgres.search import SearchVector
+
+        PsychiatristProfile = apps.get_model('counseling', 'PsychiatristProfile')
+        schema_editor.add_index(PsychiatristProfile, GinIndex(
+            SearchVector('full_name', weight='A', config='simple')
+            + SearchVector('specialization', weight='B', config='simple')
+            + SearchVector('bio', weight='C', config='simple'),
+            name='counseling_psych_search',
+        ))
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+    elif vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS counseling_psych_search')
+
+
+def backfill_facets(apps, schema_editor):
+    PsychiatristProfile = apps.get_model('counseling', 'PsychiatristProfile')
+    Facet = apps.get_model('counseling', 'Facet')
+    facets = {}
+    for profile in PsychiatristProfile.objects.only('id', 'specialization', 'languages'):
+        for kind, text in (('specialization', profile.specialization), ('language', profile.languages)):
+            for part in SEPARATORS[kind].split(text or ''):
+                name = part.strip()[:80]
+                slug = slugify(name)[:80]
+                if not slug:
+                    continue
+                if (kind, slug) not in facets:
+                    facets[(kind, slug)] = Facet.objects.get_or_create(kind=kind, slug=slug, defaults={'name': name})[0]
+                profile.facets.add(facets[(kind, slug)])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('counseling', '0007_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Facet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('specialization', 'Specialization'), ('language', 'Language')], max_length=20)),
+                ('slug', models.SlugField(max_length=80)),
+                ('name', models.CharField(max_length=80)),
+            ],
+            options={
+                'ordering': ['kind', 'name'],
+                'unique_together': {('kind', 'slug')},
+            },
+        ),
+        migrations.AddField(
+            model_name='psychiatristprofile',
+            name='facets',
+            field=models.ManyToManyField(blank=True, editable=False, related_name='psychiatrists', to='counseling.facet'),
+        ),
+        migrations.RunPython(backfill_facets, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
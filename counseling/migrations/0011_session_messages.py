@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-19 14:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('counseling', '0010_calendar_feeds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SessionMessage',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('sender', models.PositiveSmallIntegerField(choices=[(1, 'Patient'), (2, 'Psychiatrist')])),
+                ('body', models.TextField()),
+                ('created_at', models.DateTimeField()),
+                ('booking', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='counseling.booking')),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['booking', 'id'], name='counseling_message_resume')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-19 14:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('counseling', '0011_session_messages'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OnlineTime',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('seconds', models.PositiveIntegerField(default=0)),
+                ('psychiatrist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='online_time', to='counseling.psychiatristprofile')),
+            ],
+            options={
+                'ordering': ['-date'],
+                'unique_together': {('psychiatrist', 'date')},
+            },
+        ),
+    ]
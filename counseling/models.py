@@ -1,5 +1,35 @@
-from django.db import models
+import zoneinfo
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.contrib.auth.models import User
+from django.utils.timezone import localdate, now as timezone_now
+
+
+class Facet(models.Model):
+    """A normalized directory filter value (a specialization or a language) shared by many profiles."""
+
+    SPECIALIZATION = "specialization"
+    LANGUAGE = "language"
+    KIND_CHOICES = (
+        (SPECIALIZATION, "Specialization"),
+        (LANGUAGE, "Language"),
+    )
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    slug = models.SlugField(max_length=80)
+    name = models.CharField(max_length=80)
+
+    class Meta:
+        ordering = ["kind", "name"]
+        unique_together = ("kind", "slug")
+
+    def __str__(self):
+        return f"{self.get_kind_display()}: {self.name}"
 
 
 class PsychiatristProfile(models.Model):
@@ -13,35 +43,155 @@ class PsychiatristProfile(models.Model):
     photo = models.ImageField(upload_to="psychiatrists/photos/", blank=True, null=True)
     is_verified = models.BooleanField(default=False)
     is_female = models.BooleanField(default=True)
-    rating = models.DecimalField(max_digits=3, decimal_places=2, blank=True, null=True, help_text="Private average rating (optional)")
+    # Derived from the running totals below by counseling.ratings; never set directly.
+    rating = models.DecimalField(max_digits=3, decimal_places=2, blank=True, null=True, editable=False, help_text="Private average rating")
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_1_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_2_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_3_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_4_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_5_count = models.PositiveIntegerField(default=0, editable=False)
     available_chat = models.BooleanField(default=True)
     available_voice = models.BooleanField(default=True)
     available_video = models.BooleanField(default=True)
+    # Parsed from specialization/languages on save by counseling.directory.
+    facets = models.ManyToManyField(Facet, related_name="psychiatrists", blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Serves the public listings: verified psychiatrists, best rated first.
+            models.Index(
+                fields=["-rating", "-created_at"],
+                condition=models.Q(is_verified=True, is_female=True),
+                name="counseling_psych_rating",
+            ),
+        ]
+
     def __str__(self):
         return f"{self.full_name} ({'Verified' if self.is_verified else 'Unverified'})"
 
+    @property
+    def rating_histogram(self):
+        """``{stars: count}`` for 1-5 stars."""
+        return {star: getattr(self, f"rating_{star}_count") for star in range(1, 6)}
+
     def clean(self):
         # enforce female-only psychiatrists policy
         if not self.is_female:
             raise ValueError("Only female psychiatrists are allowed on this platform.")
 
 
+class AvailabilityRule(models.Model):
+    """
+    A weekly recurring window such as "Mon/Wed 18:00-21:00 in 30-minute slots
+    until December", expanded into AvailabilitySlot rows by
+    ``counseling.availability``. Times are wall-clock times in ``timezone``.
+    """
+
+    WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")  # date.weekday() order
+
+    psychiatrist = models.ForeignKey(PsychiatristProfile, on_delete=models.CASCADE, related_name="availability_rules")
+    weekdays = models.CharField(max_length=27, help_text="Comma-separated days, e.g. mon,wed")
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+    slot_minutes = models.PositiveSmallIntegerField(default=30)
+    timezone = models.CharField(max_length=64, default=settings.TIME_ZONE)
+    valid_from = models.DateField(default=localdate)
+    valid_until = models.DateField(blank=True, null=True)
+    is_active = models.BooleanField(default=True)
+    # Slots exist up to and including this date; the materializer continues from here.
+    materialized_until = models.DateField(blank=True, null=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["psychiatrist", "start_time"]
+
+    def __str__(self):
+        return f"{self.psychiatrist.full_name}: {self.weekdays} {self.start_time:%H:%M}-{self.end_time:%H:%M}"
+
+    def day_numbers(self):
+        """The rule's days as ``date.weekday()`` numbers."""
+        return {self.WEEKDAYS.index(day) for day in self.weekdays.split(",") if day in self.WEEKDAYS}
+
+    def clean(self):
+        days = [day.strip().lower()[:3] for day in self.weekdays.split(",") if day.strip()]
+        unknown = [day for day in days if day not in self.WEEKDAYS]
+        if not days or unknown:
+            raise ValidationError({"weekdays": "Use comma-separated days such as mon,wed."})
+        self.weekdays = ",".join(day for day in self.WEEKDAYS if day in days)
+        if self.end_time <= self.start_time:
+            raise ValidationError("End time must be after start time.")
+        if not 10 <= self.slot_minutes <= 240:
+            raise ValidationError({"slot_minutes": "Slots must be between 10 and 240 minutes."})
+        if self.valid_until and self.valid_until < self.valid_from:
+            raise ValidationError({"valid_until": "End date must not be before the start date."})
+        try:
+            zoneinfo.ZoneInfo(self.timezone)
+        except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+            raise ValidationError({"timezone": "Unknown timezone."})
+
+
+class AvailabilityException(models.Model):
+    """Time off (or a platform-wide holiday when no psychiatrist is set) during which no slots are offered."""
+
+    psychiatrist = models.ForeignKey(
+        PsychiatristProfile,
+        on_delete=models.CASCADE,
+        related_name="availability_exceptions",
+        blank=True,
+        null=True,
+        help_text="Leave empty for a holiday that applies to everyone",
+    )
+    starts_at = models.DateTimeField()
+    ends_at = models.DateTimeField()
+    reason = models.CharField(max_length=120, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["starts_at"]
+        indexes = [models.Index(fields=["ends_at"])]
+
+    def __str__(self):
+        who = self.psychiatrist.full_name if self.psychiatrist else "Everyone"
+        return f"{who}: off {self.starts_at} - {self.ends_at}"
+
+    def clean(self):
+        if self.starts_at and self.ends_at and self.ends_at <= self.starts_at:
+            raise ValidationError("End must be after start.")
+
+
 class AvailabilitySlot(models.Model):
     psychiatrist = models.ForeignKey(PsychiatristProfile, on_delete=models.CASCADE, related_name="slots")
+    rule = models.ForeignKey(AvailabilityRule, on_delete=models.SET_NULL, related_name="slots", blank=True, null=True)
     start = models.DateTimeField()
     end = models.DateTimeField()
     is_booked = models.BooleanField(default=False)
+    # Reserved for one patient until held_until (e.g. a waitlist offer); nobody else can book it meanwhile.
+    held_by = models.ForeignKey(User, on_delete=models.SET_NULL, related_name="held_slots", blank=True, null=True)
+    held_until = models.DateTimeField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ["start"]
         unique_together = ("psychiatrist", "start", "end")
+        indexes = [
+            models.Index(fields=["psychiatrist", "is_booked", "start"]),
+            # Cross-psychiatrist "next free slot" searches only ever look at unbooked rows.
+            models.Index(fields=["start"], condition=models.Q(is_booked=False), name="counseling_slot_free_start"),
+        ]
 
     def __str__(self):
         return f"{self.psychiatrist.full_name}: {self.start} - {self.end} {'(booked)' if self.is_booked else ''}"
 
+    @staticmethod
+    def not_held(now, user=None):
+        """Q matching slots without a live hold (or held by ``user``)."""
+        free = models.Q(held_until__isnull=True) | models.Q(held_until__lte=now)
+        return free | models.Q(held_by=user) if user is not None else free
+
     def clean(self):
         if self.end <= self.start:
             raise ValueError("Slot end time must be after start time.")
@@ -59,38 +209,58 @@ class Booking(models.Model):
         ("completed", "Completed"),
         ("cancelled", "Cancelled"),
     )
+    # The session room opens this long before the slot starts.
+    EARLY_JOIN = timedelta(minutes=15)
 
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="counseling_bookings")
     psychiatrist = models.ForeignKey(PsychiatristProfile, on_delete=models.CASCADE, related_name="bookings")
-    slot = models.OneToOneField(AvailabilitySlot, on_delete=models.PROTECT, related_name="booking")
+    slot = models.ForeignKey(AvailabilitySlot, on_delete=models.PROTECT, related_name="bookings")
     mode = models.CharField(max_length=10, choices=MODE_CHOICES, default="chat")
     status = models.CharField(max_length=12, choices=STATUS_CHOICES, default="pending")
     allow_anonymous = models.BooleanField(default=False)
     pseudonym = models.CharField(max_length=80, blank=True)
     notes = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Bumped by save(); queryset updates of a booking must set it too (calendar feeds key their ETag on it).
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ["-created_at"]
+        constraints = [
+            # A slot can be rebooked after a cancellation, but never held by two live bookings.
+            models.UniqueConstraint(
+                fields=["slot"],
+                condition=~models.Q(status="cancelled"),
+                name="counseling_booking_one_active_per_slot",
+            ),
+        ]
 
     def __str__(self):
         who = self.pseudonym if self.allow_anonymous and self.pseudonym else self.user.username
         return f"Booking by {who} with {self.psychiatrist.full_name} @ {self.slot.start} [{self.mode}]"
 
+    def can_start(self, now=None):
+        """Whether the session can be joined: from ``EARLY_JOIN`` before the slot until it ends."""
+        now = now or timezone_now()
+        return (
+            self.status in ("pending", "confirmed")
+            and self.slot.start - self.EARLY_JOIN <= now <= self.slot.end
+        )
+
     def clean(self):
         # ensure psychiatrist is female and verified for safety
         if not (self.psychiatrist.is_female and self.psychiatrist.is_verified):
-            raise ValueError("Bookings are allowed only with verified female psychiatrists.")
-        # ensure slot belongs to psychiatrist
-        if self.slot.psychiatrist_id != self.psychiatrist_id:
-            raise ValueError("Selected slot does not belong to the chosen psychiatrist.")
+            raise ValidationError("Bookings are allowed only with verified female psychiatrists.")
+        # ensure slot belongs to psychiatrist (forms validate before a slot is picked)
+        if self.slot_id and self.slot.psychiatrist_id != self.psychiatrist_id:
+            raise ValidationError("Selected slot does not belong to the chosen psychiatrist.")
         # ensure mode is supported by psychiatrist
         if self.mode == "chat" and not self.psychiatrist.available_chat:
-            raise ValueError("Psychiatrist does not accept chat sessions.")
+            raise ValidationError("Psychiatrist does not accept chat sessions.")
         if self.mode == "voice" and not self.psychiatrist.available_voice:
-            raise ValueError("Psychiatrist does not accept voice sessions.")
+            raise ValidationError("Psychiatrist does not accept voice sessions.")
         if self.mode == "video" and not self.psychiatrist.available_video:
-            raise ValueError("Psychiatrist does not accept video sessions.")
+            raise ValidationError("Psychiatrist does not accept video sessions.")
 
 
 class Feedback(models.Model):
@@ -104,3 +274,201 @@ class Feedback(models.Model):
     
     def __str__(self):
         return f"Feedback for {self.booking.psychiatrist.full_name} - {self.rating}★"
+
+    def save(self, *args, **kwargs):
+        from . import ratings
+
+        with transaction.atomic():
+            previous = None
+            if self.pk:
+                previous = Feedback.objects.select_for_update().filter(pk=self.pk).values_list("rating", flat=True).first()
+            super().save(*args, **kwargs)
+            ratings.adjust(self.booking.psychiatrist_id, added=self.rating, removed=previous)
+
+
+class SessionMessage(models.Model):
+    """
+    One line of a session transcript. Kept small: the sender is stored as a
+    role, since a booking has exactly one patient and one psychiatrist. The
+    id doubles as the cursor clients resume from after reconnecting.
+    """
+
+    PATIENT = 1
+    PSYCHIATRIST = 2
+    SENDER_CHOICES = (
+        (PATIENT, "Patient"),
+        (PSYCHIATRIST, "Psychiatrist"),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name="messages", db_index=False)
+    sender = models.PositiveSmallIntegerField(choices=SENDER_CHOICES)
+    body = models.TextField()
+    created_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [
+            # Resuming reads "messages of this booking after id N".
+            models.Index(fields=["booking", "id"], name="counseling_message_resume"),
+        ]
+
+    def __str__(self):
+        return f"{self.get_sender_display()} in booking {self.booking_id}: {self.body[:40]}"
+
+
+class OnlineTime(models.Model):
+    """Time a psychiatrist was online on a (UTC) day, added up by ``counseling.presence.compact``."""
+
+    psychiatrist = models.ForeignKey(PsychiatristProfile, on_delete=models.CASCADE, related_name="online_time")
+    date = models.DateField()
+    seconds = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ["-date"]
+        unique_together = ("psychiatrist", "date")
+
+    def __str__(self):
+        return f"{self.psychiatrist.full_name} online {self.hours} h on {self.date}"
+
+    @property
+    def hours(self):
+        return round(self.seconds / 3600, 1)
+
+
+class CalendarFeed(models.Model):
+    """The secret token in a user's iCalendar subscription URL. Resetting it revokes the old URL."""
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="calendar_feed")
+    token = models.CharField(max_length=64, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Calendar feed for {self.user.username}"
+
+
+class Job(models.Model):
+    """
+    A unit of background work run by ``manage.py run_jobs``. ``task`` is the
+    dotted path of a function called with ``kwargs``; see ``counseling.jobs``.
+    """
+
+    STATUS_CHOICES = (
+        ("queued", "Queued"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    )
+
+    task = models.CharField(max_length=200)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="queued")
+    run_at = models.DateTimeField(default=timezone_now)
+    attempts = models.PositiveIntegerField(default=0)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ["run_at", "id"]
+        indexes = [
+            # Workers only ever scan due work; finished jobs stay out of the index.
+            models.Index(fields=["run_at"], condition=models.Q(status__in=["queued", "running"]), name="counseling_job_due"),
+        ]
+
+    def __str__(self):
+        return f"{self.task} [{self.status}]"
+
+
+class WaitlistEntry(models.Model):
+    """A patient waiting for any slot with a psychiatrist between window_start and window_end."""
+
+    STATUS_CHOICES = (
+        ("waiting", "Waiting"),
+        ("offered", "Offered"),
+        ("booked", "Booked"),
+        ("cancelled", "Cancelled"),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="waitlist_entries")
+    psychiatrist = models.ForeignKey(PsychiatristProfile, on_delete=models.CASCADE, related_name="waitlist_entries")
+    window_start = models.DateTimeField()
+    window_end = models.DateTimeField()
+    mode = models.CharField(max_length=10, choices=Booking.MODE_CHOICES, default="chat")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="waiting")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["created_at", "id"]
+        verbose_name_plural = "waitlist entries"
+        indexes = [
+            # First come, first served per psychiatrist.
+            models.Index(fields=["psychiatrist", "created_at"], condition=models.Q(status="waiting"), name="counseling_waitlist_queue"),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} waiting for {self.psychiatrist.full_name} ({self.window_start} - {self.window_end})"
+
+
+class SlotOffer(models.Model):
+    """A freed slot held for a waitlisted patient until ``expires_at``."""
+
+    STATUS_CHOICES = (
+        ("open", "Open"),
+        ("accepted", "Accepted"),
+        ("declined", "Declined"),
+        ("expired", "Expired"),
+    )
+
+    slot = models.ForeignKey(AvailabilitySlot, on_delete=models.CASCADE, related_name="offers")
+    entry = models.ForeignKey(WaitlistEntry, on_delete=models.CASCADE, related_name="offers")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="open")
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        constraints = [
+            # Backstop for the slot hold: a slot is never offered to two patients at once.
+            models.UniqueConstraint(fields=["slot"], condition=models.Q(status="open"), name="counseling_offer_one_open_per_slot"),
+        ]
+
+    def __str__(self):
+        return f"Offer of {self.slot} to {self.entry.user.username} [{self.status}]"
+
+
+@receiver(post_save, sender=PsychiatristProfile)
+def index_psychiatrist(sender, instance, raw=False, **kwargs):
+    from . import directory
+
+    if not raw:
+        directory.index_profile(instance)
+
+
+@receiver(post_delete, sender=PsychiatristProfile)
+def unindex_psychiatrist(sender, instance, **kwargs):
+    from . import directory
+
+    directory.unindex_profile(instance)
+
+
+@receiver(post_save, sender=PsychiatristProfile)
+@receiver(post_delete, sender=PsychiatristProfile)
+@receiver(post_save, sender=AvailabilitySlot)
+@receiver(post_delete, sender=AvailabilitySlot)
+def refresh_match_features(sender, **kwargs):
+    from . import matching
+
+    matching.invalidate()
+
+
+@receiver(post_delete, sender=Feedback)
+def remove_feedback_rating(sender, instance, **kwargs):
+    # A signal rather than delete() so queryset and cascade deletes are counted too.
+    from . import ratings
+
+    psychiatrist_id = Booking.objects.filter(pk=instance.booking_id).values_list("psychiatrist_id", flat=True).first()
+    if psychiatrist_id:
+        ratings.adjust(psychiatrist_id, removed=instance.rating)
@@ -0,0 +1,153 @@
+"""
+Who among the psychiatrists is online right now.
+
+An open dashboard sends a heartbeat every ``HEARTBEAT_INTERVAL``; each one is
+a cache write, never a database write, and a psychiatrist counts as online
+until ``ONLINE_TTL`` after their last one. The cache entry also remembers when
+the current online stretch began (and stretches that ended since the last
+compaction), so ``compact``, run periodically by ``run_jobs``, can add the
+time to the daily ``OnlineTime`` totals.
+
+The cache must be shared by web and worker processes for this to work
+across them; see ``CACHES`` in settings (with ``MULTI_PROCESS`` a system
+check refuses a per-process one).
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Booking, OnlineTime, PsychiatristProfile
+
+HEARTBEAT_INTERVAL = timedelta(seconds=30)
+ONLINE_TTL = timedelta(seconds=90)
+COMPACT_INTERVAL = timedelta(minutes=1)
+# How long presence records outlive their last heartbeat, uncompacted.
+KEEP = timedelta(days=1)
+# Ended stretches kept per psychiatrist between compactions.
+MAX_ENDED = 10
+ACTIVE_STATUSES = ("pending", "confirmed")
+
+LOCK_KEY = "counseling:presence:compacting"
+CHUNK_SIZE = 500
+
+
+def _key(psychiatrist_id):
+    return f"counseling:presence:{psychiatrist_id}"
+
+
+def _credited_key(psychiatrist_id):
+    # Written only by compact(), so heartbeats can't overwrite its progress.
+    return f"counseling:presence:credited:{psychiatrist_id}"
+
+
+def _is_online(state, now):
+    return bool(state and state["online"] and now - state["last"] <= ONLINE_TTL.total_seconds())
+
+
+def heartbeat(psychiatrist_id, now=None, online=True):
+    """Record that the psychiatrist is (or, with ``online=False``, has just stopped being) online."""
+    now = (now or timezone.now()).timestamp()
+    key, credited_key = _key(psychiatrist_id), _credited_key(psychiatrist_id)
+    found = cache.get_many([key, credited_key])
+    state, credited = found.get(key), found.get(credited_key, 0)
+    ended = [stretch for stretch in (state["ended"] if state else []) if stretch[1] > credited]
+    if _is_online(state, now):
+        since = state["since"]
+    else:
+        if state and state["last"] > credited:
+            ended.append((state["since"], state["last"]))
+        since = now
+    cache.set(key, {
+        "since": since, "last": now, "online": online, "ended": ended[-MAX_ENDED:],
+    }, KEEP.total_seconds())
+
+
+def leave(psychiatrist_id, now=None):
+    """The psychiatrist went offline (closed their dashboard)."""
+    state = cache.get(_key(psychiatrist_id))
+    if _is_online(state, (now or timezone.now()).timestamp()):
+        heartbeat(psychiatrist_id, now, online=False)
+
+
+def online(psychiatrist_ids, now=None):
+    """The set of ``psychiatrist_ids`` online now, from one bulk cache read."""
+    now = (now or timezone.now()).timestamp()
+    keys = {_key(pk): pk for pk in psychiatrist_ids}
+    return {keys[key] for key, state in cache.get_many(keys).items() if _is_online(state, now)}
+
+
+def available_now(psychiatrist_ids, now=None):
+    """Those of ``psychiatrist_ids`` who are online and not in a session."""
+    now = now or timezone.now()
+    ids = online(psychiatrist_ids, now)
+    if not ids:
+        return ids
+    busy = Booking.objects.filter(
+        psychiatrist_id__in=ids, status__in=ACTIVE_STATUSES, slot__start__lte=now, slot__end__gt=now,
+    ).values_list("psychiatrist_id", flat=True)
+    return ids - set(busy)
+
+
+def _days(start, end):
+    """Split the span ``start``-``end`` (timestamps) at UTC midnights: ``(date, seconds)`` pairs."""
+    while start < end:
+        moment = datetime.fromtimestamp(start, dt_timezone.utc)
+        midnight = datetime.combine(moment.date() + timedelta(days=1), datetime.min.time(), dt_timezone.utc)
+        stop = min(end, midnight.timestamp())
+        yield moment.date(), stop - start
+        start = stop
+
+
+def _record(totals):
+    for (psychiatrist_id, day), seconds in totals.items():
+        seconds = round(seconds)
+        if not seconds:
+            continue
+        rows = OnlineTime.objects.filter(psychiatrist_id=psychiatrist_id, date=day)
+        if rows.update(seconds=F("seconds") + seconds):
+            continue
+        try:
+            with transaction.atomic():
+                OnlineTime.objects.create(psychiatrist_id=psychiatrist_id, date=day, seconds=seconds)
+        except IntegrityError:
+            rows.update(seconds=F("seconds") + seconds)
+
+
+def compact():
+    """
+    Add online time since the last run to the ``OnlineTime`` totals. Safe
+    to call from several workers: only one compacts at a time. Returns the
+    number of psychiatrists credited, or None if another run was in progress.
+    """
+    if not cache.add(LOCK_KEY, True, COMPACT_INTERVAL.total_seconds() * 5):
+        return None
+    try:
+        credited_count = 0
+        ids = list(PsychiatristProfile.objects.values_list("pk", flat=True))
+        for offset in range(0, len(ids), CHUNK_SIZE):
+            chunk = ids[offset:offset + CHUNK_SIZE]
+            found = cache.get_many([_key(pk) for pk in chunk] + [_credited_key(pk) for pk in chunk])
+            totals = defaultdict(float)
+            progress = {}
+            for pk in chunk:
+                state = found.get(_key(pk))
+                if not state:
+                    continue
+                credited = found.get(_credited_key(pk), 0)
+                for since, last in state["ended"] + [(state["since"], state["last"])]:
+                    for day, seconds in _days(max(since, credited), last):
+                        totals[pk, day] += seconds
+                if state["last"] > credited:
+                    progress[_credited_key(pk)] = state["last"]
+            with transaction.atomic():
+                _record(totals)
+            # Only after the totals are saved, or a failure would lose them.
+            cache.set_many(progress, KEEP.total_seconds())
+            credited_count += len(progress)
+        return credited_count
+    finally:
+        cache.delete(LOCK_KEY)
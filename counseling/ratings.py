@@ -0,0 +1,113 @@
+"""
+Running rating aggregates on PsychiatristProfile.
+
+A feedback change adjusts ``rating_sum``, ``rating_count`` and the per-star
+histogram with one UPDATE of F() expressions, and re-derives ``rating`` in
+the same statement, instead of re-averaging every feedback row through a
+join. ``reconcile`` rebuilds the aggregates from scratch. Queryset updates
+send no ``post_save``, so both drop the match features and the directory's
+cached counts themselves once they commit.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Q, Sum, When
+from django.db.models.functions import Cast, Round
+from django.db.models.lookups import LessThanOrEqual
+
+from . import directory, matching
+from .models import PsychiatristProfile, Feedback
+
+STARS = range(1, 6)
+
+
+def star_field(star):
+    return f"rating_{star}_count"
+
+
+def average(rating_sum, rating_count):
+    """The rounded average for expressions ``rating_sum``/``rating_count``; NULL when there are no ratings."""
+    return Case(
+        When(LessThanOrEqual(rating_count, 0), then=None),
+        default=Round(Cast(rating_sum, FloatField()) / rating_count, 2),
+    )
+
+
+def _ratings_changed():
+    transaction.on_commit(matching.invalidate)
+    transaction.on_commit(directory.invalidate_facet_counts)
+
+
+def adjust(psychiatrist_id, added=None, removed=None):
+    """
+    Apply one feedback change to a psychiatrist's aggregates: ``added`` is a
+    new star rating, ``removed`` an old one (both for an edit).
+    """
+    if added == removed:
+        return
+    stars = Counter()
+    if added is not None:
+        stars[added] += 1
+    if removed is not None:
+        stars[removed] -= 1
+    delta_sum = (added or 0) - (removed or 0)
+    delta_count = sum(stars.values())
+
+    # Every F() refers to the row as it was before this UPDATE, so the
+    # average is computed from the new totals in the same statement.
+    new_sum = F("rating_sum") + delta_sum
+    new_count = F("rating_count") + delta_count
+    updates = {star_field(star): F(star_field(star)) + delta for star, delta in stars.items() if delta}
+    PsychiatristProfile.objects.filter(pk=psychiatrist_id).update(
+        rating_sum=new_sum,
+        rating_count=new_count,
+        rating=average(new_sum, new_count),
+        **updates,
+    )
+    _ratings_changed()
+
+
+def reconcile(psychiatrist_ids):
+    """
+    Recompute the aggregates of the given psychiatrists from their feedback
+    with one grouped query. Returns how many profiles were out of date.
+    """
+    fields = ["rating_sum", "rating_count", "rating", *(star_field(star) for star in STARS)]
+    with transaction.atomic():
+        # Lock first so feedback saved meanwhile lands on top of the rebuilt totals.
+        profiles = list(PsychiatristProfile.objects.select_for_update().filter(pk__in=psychiatrist_ids).only(*fields))
+        totals = {
+            row.pop("booking__psychiatrist_id"): row
+            for row in Feedback.objects.filter(booking__psychiatrist_id__in=psychiatrist_ids)
+            .values("booking__psychiatrist_id")
+            .annotate(
+                rating_sum=Sum("rating"),
+                rating_count=Count("id"),
+                **{star_field(star): Count("id", filter=Q(rating=star)) for star in STARS},
+            )
+            .order_by()
+        }
+        stale = []
+        for profile in profiles:
+            row = totals.get(profile.pk, {})
+            values = {
+                "rating_sum": row.get("rating_sum") or 0,
+                "rating_count": row.get("rating_count", 0),
+                **{star_field(star): row.get(star_field(star), 0) for star in STARS},
+            }
+            count = values["rating_count"]
+            values["rating"] = round(values["rating_sum"] / count, 2) if count else None
+            if any(_differs(getattr(profile, key), value) for key, value in values.items()):
+                for key, value in values.items():
+                    setattr(profile, key, value)
+                stale.append(profile)
+        PsychiatristProfile.objects.bulk_update(stale, fields)
+        if stale:
+            _ratings_changed()
+    return len(stale)
+
+
+def _differs(current, expected):
+    if current is None or expected is None:
+        return current is not expected
+    return round(float(current), 2) != round(float(expected), 2)
@@ -0,0 +1,6 @@
+from django.urls import path
+from . import consumers
+
+websocket_urlpatterns = [
+    path('ws/counseling/session/<int:booking_id>/', consumers.SessionConsumer.as_asgi()),
+]
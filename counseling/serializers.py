@@ -1,6 +1,8 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import PsychiatristProfile, AvailabilitySlot, Booking
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.utils import timezone
+from .models import PsychiatristProfile, AvailabilityRule, AvailabilityException, AvailabilitySlot, Booking, WaitlistEntry, SlotOffer
 
 
 class UserPublicSerializer(serializers.ModelSerializer):
@@ -43,6 +45,54 @@ class AvailabilitySlotSerializer(serializers.ModelSerializer):
         read_only_fields = ["id", "is_booked", "created_at"]
 
 
+class AvailabilityRuleSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AvailabilityRule
+        fields = [
+            "id",
+            "psychiatrist",
+            "weekdays",
+            "start_time",
+            "end_time",
+            "slot_minutes",
+            "timezone",
+            "valid_from",
+            "valid_until",
+            "is_active",
+            "materialized_until",
+            "created_at",
+        ]
+        read_only_fields = ["id", "psychiatrist", "materialized_until", "created_at"]
+
+    def validate(self, attrs):
+        rule = AvailabilityRule(**{**self._current_values(), **attrs})
+        try:
+            rule.clean()
+        except DjangoValidationError as exc:
+            raise serializers.ValidationError(exc.message_dict if hasattr(exc, "error_dict") else exc.messages)
+        attrs["weekdays"] = rule.weekdays
+        return attrs
+
+    def _current_values(self):
+        if self.instance is None:
+            return {}
+        return {field: getattr(self.instance, field) for field in self.Meta.fields if field not in self.Meta.read_only_fields}
+
+
+class AvailabilityExceptionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AvailabilityException
+        fields = ["id", "psychiatrist", "starts_at", "ends_at", "reason", "created_at"]
+        read_only_fields = ["id", "psychiatrist", "created_at"]
+
+    def validate(self, attrs):
+        starts_at = attrs.get("starts_at", getattr(self.instance, "starts_at", None))
+        ends_at = attrs.get("ends_at", getattr(self.instance, "ends_at", None))
+        if starts_at and ends_at and ends_at <= starts_at:
+            raise serializers.ValidationError("End must be after start.")
+        return attrs
+
+
 class BookingSerializer(serializers.ModelSerializer):
     user = UserPublicSerializer(read_only=True)
 
@@ -61,3 +111,30 @@ class BookingSerializer(serializers.ModelSerializer):
             "created_at",
         ]
         read_only_fields = ["id", "user", "status", "created_at"]
+
+
+class WaitlistEntrySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = WaitlistEntry
+        fields = ["id", "psychiatrist", "window_start", "window_end", "mode", "status", "created_at"]
+        read_only_fields = ["id", "status", "created_at"]
+
+    def validate(self, attrs):
+        if attrs["window_end"] <= attrs["window_start"]:
+            raise serializers.ValidationError("End must be after start.")
+        if attrs["window_end"] <= timezone.now():
+            raise serializers.ValidationError("The window has already passed.")
+        psychiatrist = attrs["psychiatrist"]
+        if not (psychiatrist.is_verified and psychiatrist.is_female):
+            raise serializers.ValidationError("Waitlists are only available for verified psychiatrists.")
+        return attrs
+
+
+class SlotOfferSerializer(serializers.ModelSerializer):
+    slot = AvailabilitySlotSerializer(read_only=True)
+    entry = WaitlistEntrySerializer(read_only=True)
+
+    class Meta:
+        model = SlotOffer
+        fields = ["id", "slot", "entry", "status", "expires_at", "created_at"]
+        read_only_fields = fields
@@ -0,0 +1,130 @@
+"""
+Live session chat between a booking's patient and psychiatrist.
+
+Messages are not written one INSERT at a time. Each process keeps a
+``TranscriptWriter`` that gathers messages from all of its sessions and
+saves them with one ``bulk_create`` every ``FLUSH_INTERVAL`` (or sooner once
+``MAX_BATCH`` are waiting). A message is broadcast only after its batch is
+saved, so everything a client has seen has a transcript id to resume from.
+Typing and presence signals go through the channel layer only.
+"""
+import asyncio
+import logging
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+
+from .models import Booking, SessionMessage
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 0.05
+MAX_BATCH = 500
+MAX_LENGTH = 4000
+# Messages sent to a client that connects (or resumes) at once.
+HISTORY_LIMIT = 500
+
+ROLES = {SessionMessage.PATIENT: "patient", SessionMessage.PSYCHIATRIST: "psychiatrist"}
+
+
+def session_channel(booking_id):
+    return f"counseling.session.{booking_id}"
+
+
+def participant(booking_id, user):
+    """
+    ``(booking, sender)`` if ``user`` is the booking's patient or
+    psychiatrist, else None.
+    """
+    if not (user and user.is_authenticated):
+        return None
+    booking = Booking.objects.select_related("slot", "psychiatrist").filter(pk=booking_id).first()
+    if booking is None:
+        return None
+    if booking.user_id == user.pk:
+        return booking, SessionMessage.PATIENT
+    if booking.psychiatrist.user_id == user.pk:
+        return booking, SessionMessage.PSYCHIATRIST
+    return None
+
+
+def history(booking_id, after=0, limit=HISTORY_LIMIT):
+    """The transcript after message ``after``, oldest first; the latest ``limit`` when starting from 0."""
+    messages = SessionMessage.objects.filter(booking_id=booking_id)
+    if after:
+        rows = messages.filter(id__gt=after).order_by("id")[:limit]
+    else:
+        rows = reversed(messages.order_by("-id")[:limit])
+    return [serialize(message) for message in rows]
+
+
+def serialize(message):
+    return {
+        "id": message.id,
+        "sender": ROLES[message.sender],
+        "body": message.body,
+        "created_at": message.created_at.isoformat(),
+    }
+
+
+class TranscriptWriter:
+    """Batches transcript writes for every session in this process, then broadcasts them."""
+
+    def __init__(self, interval=FLUSH_INTERVAL, max_batch=MAX_BATCH):
+        self.interval = interval
+        self.max_batch = max_batch
+        self.loop = asyncio.get_running_loop()
+        self.pending = []
+        self.ready = asyncio.Event()
+        self.task = self.loop.create_task(self.run())
+
+    def add(self, message, reply_channel, client_id=None):
+        """Queue ``message``; ``reply_channel`` is told if it can't be saved."""
+        self.pending.append((message, reply_channel, client_id))
+        self.ready.set()
+
+    async def run(self):
+        while True:
+            await self.ready.wait()
+            # Let a batch gather unless one is already full.
+            if len(self.pending) < self.max_batch:
+                await asyncio.sleep(self.interval)
+            self.ready.clear()
+            while self.pending:
+                batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+                try:
+                    await self.flush(batch)
+                except Exception:
+                    # Keep writing for every other session whatever went wrong here.
+                    logger.exception("Could not deliver %d session message(s)", len(batch))
+
+    async def flush(self, batch):
+        layer = get_channel_layer()
+        try:
+            await database_sync_to_async(SessionMessage.objects.bulk_create)([message for message, _, _ in batch])
+        except Exception:
+            logger.exception("Could not save %d session message(s)", len(batch))
+            for _, reply_channel, client_id in batch:
+                await layer.send(reply_channel, {"type": "chat.failed", "client_id": client_id})
+            return
+        for message, _, client_id in batch:
+            await layer.group_send(session_channel(message.booking_id), {
+                "type": "chat.message",
+                "message": serialize(message),
+                "client_id": client_id,
+            })
+
+
+_writers = {}
+
+
+def writer():
+    """This event loop's writer (daphne runs one loop per process)."""
+    loop = asyncio.get_running_loop()
+    current = _writers.get(loop)
+    if current is None:
+        # Drop writers of loops that have finished, e.g. between test runs.
+        for old in [old for old in _writers if old.is_closed()]:
+            del _writers[old]
+        current = _writers[loop] = TranscriptWriter()
+    return current
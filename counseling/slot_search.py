@@ -0,0 +1,175 @@
+"""
+"Who is free when?" search over AvailabilitySlot.
+
+Free future slots are served by a partial index on ``start`` (only unbooked
+rows), so the cost of a search depends on the size of the requested window,
+not on how many historical slots have piled up.
+"""
+from datetime import timedelta
+
+from django.db.models import Count, F, Q, Window
+from django.db.models.functions import RowNumber, TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import directory
+from .models import AvailabilitySlot, Facet
+
+DEFAULT_WINDOW = timedelta(days=14)
+MAX_WINDOW = timedelta(days=90)
+MAX_RESULTS = 100
+
+MODE_FIELDS = {
+    "chat": "psychiatrist__available_chat",
+    "voice": "psychiatrist__available_voice",
+    "video": "psychiatrist__available_video",
+}
+
+# Django's week_day lookup numbers days 1 (Sunday) .. 7 (Saturday).
+WEEKDAYS = {"sun": 1, "mon": 2, "tue": 3, "wed": 4, "thu": 5, "fri": 6, "sat": 7}
+
+# Named parts of the day, as [from, to) hours in the searcher's timezone.
+DAY_PARTS = {
+    "morning": (6, 12),
+    "afternoon": (12, 17),
+    "evening": (17, 22),
+}
+
+
+def free_slots(start=None, end=None, mode=None, language=None, specialization=None,
+               psychiatrist=None, weekdays=None, hours=None):
+    """
+    Return a queryset of free slots in ``[start, end)`` with verified
+    psychiatrists matching the filters, earliest first.
+
+    ``weekdays`` is an iterable of keys from ``WEEKDAYS``; ``hours`` is an
+    ``(from, to)`` pair of hours. Both are evaluated in the current timezone,
+    so activate the searcher's timezone before calling.
+    """
+    now = timezone.now()
+    start = max(start or now, now)
+    end = min(end or start + DEFAULT_WINDOW, start + MAX_WINDOW)
+
+    slots = AvailabilitySlot.objects.filter(
+        AvailabilitySlot.not_held(now),
+        is_booked=False,
+        start__gte=start,
+        start__lt=end,
+        psychiatrist__is_verified=True,
+        psychiatrist__is_female=True,
+    )
+    if psychiatrist:
+        slots = slots.filter(psychiatrist=psychiatrist)
+    if mode in MODE_FIELDS:
+        slots = slots.filter(**{MODE_FIELDS[mode]: True})
+    # The same facet matching as the directory, so both agree on who speaks what.
+    if language:
+        slots = slots.filter(directory.has_facet(Facet.LANGUAGE, language, profile="psychiatrist_id"))
+    if specialization:
+        slots = slots.filter(directory.has_facet(Facet.SPECIALIZATION, specialization, profile="psychiatrist_id"))
+    if weekdays:
+        slots = slots.filter(start__week_day__in=[WEEKDAYS[d] for d in weekdays])
+    if hours:
+        hour_from, hour_to = hours
+        slots = slots.filter(start__hour__gte=hour_from, start__hour__lt=hour_to)
+    return slots.order_by("start", "psychiatrist_id")
+
+
+def search(limit=MAX_RESULTS, **filters):
+    """
+    Run a slot search. Returns ``(slots, days)``: the earliest ``limit`` free
+    slots (with their psychiatrist loaded) and per-day counts of every
+    matching slot in the window for a calendar view.
+
+    Both come from one query: window functions number the matches overall and
+    within their day and count each day, and only the first ``limit`` rows plus
+    the first row of every day (which carries that day's count) are fetched.
+    """
+    limit = max(1, min(limit, MAX_RESULTS))
+    day = TruncDate("start", tzinfo=timezone.get_current_timezone())
+    order = [F("start").asc(), F("psychiatrist_id").asc()]
+    rows = (
+        free_slots(**filters)
+        .select_related("psychiatrist")
+        .annotate(
+            day=day,
+            position=Window(RowNumber(), order_by=order),
+            day_position=Window(RowNumber(), partition_by=[day], order_by=order),
+            day_count=Window(Count("id"), partition_by=[day]),
+        )
+        .filter(Q(position__lte=limit) | Q(day_position=1))
+    )
+    results, days = [], []
+    for slot in rows:
+        if slot.day_position == 1:
+            days.append({"day": slot.day, "count": slot.day_count})
+        if slot.position <= limit:
+            results.append(slot)
+    return results, days
+
+
+def parse_filters(params):
+    """
+    Build ``free_slots`` keyword arguments from request query parameters:
+    ``from``/``to`` (ISO datetimes), ``mode``, ``language``, ``specialization``,
+    ``psychiatrist``, ``days`` (e.g. ``thu,fri``) and ``time`` (a ``DAY_PARTS``
+    key or ``HH-HH``). Raises ``ValueError`` for malformed values.
+    """
+    filters = {}
+    for param, key in (("from", "start"), ("to", "end")):
+        if params.get(param):
+            value = parse_datetime(params[param])
+            if value is None:
+                raise ValueError(f"Invalid {param!r} datetime.")
+            if timezone.is_naive(value):
+                value = timezone.make_aware(value)
+            filters[key] = value
+
+    for key in ("mode", "language", "specialization"):
+        if params.get(key):
+            filters[key] = params[key].strip()
+    if params.get("psychiatrist"):
+        filters["psychiatrist"] = int(params["psychiatrist"])
+
+    if params.get("days"):
+        days = [d.strip().lower()[:3] for d in params["days"].split(",") if d.strip()]
+        unknown = [d for d in days if d not in WEEKDAYS]
+        if unknown:
+            raise ValueError(f"Unknown day(s): {', '.join(unknown)}.")
+        filters["weekdays"] = days
+
+    time_of_day = (params.get("time") or "").strip().lower()
+    if time_of_day in DAY_PARTS:
+        filters["hours"] = DAY_PARTS[time_of_day]
+    elif time_of_day:
+        hour_from, _, hour_to = time_of_day.partition("-")
+        filters["hours"] = (int(hour_from), int(hour_to))
+    return filters
+
+
+def parse_limit(params, default=20):
+    """The ``limit`` query parameter, at most ``MAX_RESULTS``. Raises ``ValueError`` below 1 or if malformed."""
+    limit = int(params.get("limit", default))
+    if limit < 1:
+        raise ValueError("'limit' must be at least 1.")
+    return min(limit, MAX_RESULTS)
+
+
+def serialize(slots, days):
+    return {
+        "slots": [
+            {
+                "id": slot.id,
+                "start": slot.start.isoformat(),
+                "end": slot.end.isoformat(),
+                "psychiatrist": {
+                    "id": slot.psychiatrist_id,
+                    "full_name": slot.psychiatrist.full_name,
+                    "specialization": slot.psychiatrist.specialization,
+                    "languages": slot.psychiatrist.languages,
+                },
+            }
+            for slot in slots
+        ],
+        "days": [{"date": row["day"].isoformat(), "count": row["count"]} for row in days],
+    }
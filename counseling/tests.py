@@ -1,3 +1,952 @@
-from django.test import TestCase
+import asyncio
+import json
+from collections import Counter
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from . import (
+    availability, booking, dashboard, directory, exports, ical, jobs, matching, presence, ratings, session_chat,
+    slot_search, waitlist,
+)
+from .api_views import AvailabilitySlotViewSet, BookingViewSet, PsychiatristProfileViewSet
+from .routing import websocket_urlpatterns
+from .models import (
+    AvailabilityException, AvailabilityRule, AvailabilitySlot, Booking, Facet, Feedback, Job, OnlineTime,
+    PsychiatristProfile, SessionMessage, SlotOffer, WaitlistEntry,
+)
+
+
+def make_user(username):
+    # No password: hashing one costs more than the rest of a test, and tests log in with force_login.
+    return User.objects.create_user(username, f"{username}@example.com")
+
+
+def make_psychiatrist(name, **fields):
+    fields.setdefault("is_verified", True)
+    return PsychiatristProfile.objects.create(
+        user=make_user(name.lower().replace(" ", "")), full_name=name, license_no=f"LIC-{name}", **fields,
+    )
+
+
+def make_slot(psychiatrist, start, minutes=30, **fields):
+    return AvailabilitySlot.objects.create(
+        psychiatrist=psychiatrist, start=start, end=start + timedelta(minutes=minutes), **fields,
+    )
+
+
+def make_booking(user, slot, **fields):
+    return Booking.objects.create(user=user, psychiatrist=slot.psychiatrist, slot=slot, **fields)
+
+
+class AvailabilityTests(TestCase):
+    def setUp(self):
+        self.psychiatrist = make_psychiatrist("Asha")
+        self.tomorrow = timezone.localdate() + timedelta(days=1)
+        self.rule = self.make_rule()
+
+    def make_rule(self, **fields):
+        fields = {"weekdays": ",".join(AvailabilityRule.WEEKDAYS), "start_time": time(9), "end_time": time(10),
+                  "timezone": "UTC", "valid_from": self.tomorrow, **fields}
+        return AvailabilityRule.objects.create(psychiatrist=self.psychiatrist, **fields)
+
+    def test_materialize_counts_created_slots(self):
+        self.assertEqual(availability.materialize(weeks=1), 14)
+        self.assertEqual(AvailabilitySlot.objects.filter(rule=self.rule).count(), 14)
+        # Already expanded up to the horizon: nothing to do.
+        self.assertEqual(availability.materialize(weeks=1), 0)
+
+    def test_duplicates_are_not_counted(self):
+        # Same times as the first rule plus one more hour a day; only that hour is new.
+        overlapping = self.make_rule(end_time=time(11))
+        self.assertEqual(availability.materialize(AvailabilityRule.objects.filter(pk=self.rule.pk), weeks=1), 14)
+        self.assertEqual(availability.materialize(AvailabilityRule.objects.filter(pk=overlapping.pk), weeks=1), 14)
+        self.assertEqual(AvailabilitySlot.objects.count(), 28)
+
+    def test_rolling_horizon_only_adds_new_days(self):
+        availability.materialize(weeks=1)
+        self.assertEqual(availability.materialize(weeks=1, today=timezone.localdate() + timedelta(days=2)), 4)
+
+    def test_exceptions_block_slots(self):
+        day = datetime.combine(self.tomorrow, time(9), tzinfo=dt_timezone.utc)
+        exception = AvailabilityException.objects.create(starts_at=day, ends_at=day + timedelta(hours=1))
+        self.assertEqual(availability.materialize(weeks=1), 12)
+        exception.delete()
+        self.assertEqual(availability.lift_exception(exception), 2)
+        self.assertEqual(availability.apply_exception(exception), 2)
+
+    def test_refresh_keeps_booked_slots(self):
+        availability.materialize(weeks=1)
+        booked = AvailabilitySlot.objects.order_by("start").first()
+        booking.book_slot(make_user("patient"), self.psychiatrist, booked.pk)
+        self.rule.end_time = time(9, 30)
+        self.rule.save()
+        availability.refresh_rule(self.rule, weeks=1)
+        self.assertEqual(AvailabilitySlot.objects.count(), 7)
+        self.assertTrue(AvailabilitySlot.objects.filter(pk=booked.pk).exists())
+
+    def test_job_worker_keeps_the_horizon_filled(self):
+        call_command("run_jobs", once=True, stdout=StringIO())
+        self.rule.refresh_from_db()
+        self.assertEqual(self.rule.materialized_until, timezone.localdate() + timedelta(weeks=availability.HORIZON_WEEKS))
+        self.assertTrue(AvailabilitySlot.objects.filter(rule=self.rule).exists())
+
+
+class SlotSearchTests(TestCase):
+    def setUp(self):
+        self.soon = timezone.now() + timedelta(days=1)
+        self.asha = make_psychiatrist("Asha", languages="Hindi, English", available_video=False)
+        self.bela = make_psychiatrist("Bela", languages="English")
+        self.first = make_slot(self.bela, self.soon)
+        self.second = make_slot(self.asha, self.soon + timedelta(hours=1))
+        make_slot(self.asha, self.soon + timedelta(hours=2), is_booked=True)
+        make_slot(self.asha, self.soon + timedelta(hours=3), held_by=make_user("holder"),
+                  held_until=timezone.now() + timedelta(minutes=5))
+        make_slot(self.asha, timezone.now() - timedelta(hours=1))
+        make_slot(make_psychiatrist("Unverified", is_verified=False), self.soon)
+
+    def test_free_future_slots_of_verified_psychiatrists_earliest_first(self):
+        with self.assertNumQueries(1):
+            slots, days = slot_search.search()
+            self.assertEqual([slot.psychiatrist.full_name for slot in slots], ["Bela", "Asha"])
+        self.assertEqual(slots, [self.first, self.second])
+        self.assertEqual(sum(day["count"] for day in days), 2)
+
+    def test_days_count_every_match_beyond_the_limit(self):
+        later = make_slot(self.bela, self.soon + timedelta(days=2))
+        with self.assertNumQueries(1):
+            slots, days = slot_search.search(limit=1)
+        self.assertEqual(slots, [self.first])
+        expected = Counter(timezone.localtime(slot.start).date() for slot in (self.first, self.second, later))
+        self.assertEqual({day["day"]: day["count"] for day in days}, expected)
+
+    def test_filters(self):
+        self.assertEqual(list(slot_search.free_slots(language="hindi")), [self.second])
+        self.assertEqual(list(slot_search.free_slots(language="english")), [self.first, self.second])
+        # Facets, like the directory: a partial word of another field doesn't match.
+        self.assertEqual(list(slot_search.free_slots(language="glish, hin")), [])
+        self.assertEqual(list(slot_search.free_slots(mode="video")), [self.first])
+        self.assertEqual(list(slot_search.free_slots(psychiatrist=self.asha.pk)), [self.second])
+
+    def test_expired_hold_is_free_again(self):
+        AvailabilitySlot.objects.filter(held_by__isnull=False).update(held_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(len(slot_search.search()[0]), 3)
+
+    def test_limit(self):
+        self.assertEqual(len(slot_search.search(limit=1)[0]), 1)
+        # Nonsense limits from callers still return something rather than fail.
+        self.assertEqual(len(slot_search.search(limit=-1)[0]), 1)
+
+    def test_view(self):
+        response = self.client.get("/counseling/slots/search/", {"limit": "1", "tz": "Asia/Kolkata"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([slot["id"] for slot in response.json()["slots"]], [self.first.pk])
+
+    def test_view_rejects_bad_parameters(self):
+        for params in ({"limit": "-1"}, {"limit": "0"}, {"limit": "many"}, {"days": "someday"}, {"tz": "Mars/Base"},
+                       {"from": "yesterday"}):
+            with self.subTest(params=params):
+                response = self.client.get("/counseling/slots/search/", params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("error", response.json())
+
+    def test_view_caps_large_limits(self):
+        response = self.client.get("/counseling/slots/search/", {"limit": "100000"})
+        self.assertEqual(len(response.json()["slots"]), 2)
+
+    def test_api_rejects_negative_limit(self):
+        view = AvailabilitySlotViewSet.as_view({"get": "search"}, **AvailabilitySlotViewSet.search.kwargs)
+        response = view(APIRequestFactory().get("/api/counseling/slots/search/", {"limit": "-1"}))
+        self.assertEqual(response.status_code, 400)
+        response = view(APIRequestFactory().get("/api/counseling/slots/search/", {"limit": "5"}))
+        self.assertEqual(len(response.data["slots"]), 2)
+
+
+class BookingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.psychiatrist = make_psychiatrist("Asha", available_voice=False)
+        self.slot = make_slot(self.psychiatrist, timezone.now() + timedelta(days=1))
+        self.later = make_slot(self.psychiatrist, timezone.now() + timedelta(days=2))
+        self.patient = make_user("patient")
+        self.other = make_user("other")
+
+    def test_book_slot_claims_the_slot(self):
+        created = booking.book_slot(self.patient, self.psychiatrist, self.slot.pk, mode="video")
+        self.slot.refresh_from_db()
+        self.assertTrue(self.slot.is_booked)
+        self.assertEqual((created.user, created.mode, created.status), (self.patient, "video", "pending"))
+
+    def test_second_booking_of_a_slot_fails_with_alternatives(self):
+        booking.book_slot(self.patient, self.psychiatrist, self.slot.pk)
+        with self.assertRaises(booking.SlotUnavailable) as caught:
+            booking.book_slot(self.other, self.psychiatrist, self.slot.pk)
+        self.assertEqual(caught.exception.alternatives, [self.later])
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_unbookable_slots(self):
+        past = make_slot(self.psychiatrist, timezone.now() - timedelta(hours=1))
+        someone_elses = make_slot(make_psychiatrist("Bela"), timezone.now() + timedelta(days=1))
+        held = make_slot(self.psychiatrist, timezone.now() + timedelta(days=3), held_by=self.other,
+                         held_until=timezone.now() + timedelta(minutes=5))
+        for slot_id in (past.pk, someone_elses.pk, held.pk, 0):
+            with self.subTest(slot_id=slot_id), self.assertRaises(booking.SlotUnavailable):
+                booking.book_slot(self.patient, self.psychiatrist, slot_id)
+        self.assertFalse(Booking.objects.exists())
+
+    def test_cancel_releases_the_slot_once(self):
+        created = booking.book_slot(self.patient, self.psychiatrist, self.slot.pk)
+        self.assertTrue(booking.cancel_booking(created))
+        self.assertFalse(booking.cancel_booking(Booking.objects.get(pk=created.pk)))
+        self.slot.refresh_from_db()
+        self.assertFalse(self.slot.is_booked)
+        self.assertEqual(Job.objects.filter(task="counseling.waitlist.offer_slot").count(), 1)
+        # A cancelled slot can be booked again.
+        booking.book_slot(self.other, self.psychiatrist, self.slot.pk)
+
+    def test_form_books_the_slot(self):
+        self.client.force_login(self.patient)
+        response = self.client.post(f"/counseling/book/{self.psychiatrist.pk}/", {"slot_id": self.slot.pk, "mode": "chat"})
+        self.assertRedirects(response, "/counseling/patient-dashboard/", fetch_redirect_response=False)
+        self.assertTrue(Booking.objects.filter(user=self.patient, slot=self.slot).exists())
+
+    def test_form_offers_alternatives_when_the_slot_is_taken(self):
+        elsewhere = make_slot(make_psychiatrist("Bela"), timezone.now() + timedelta(days=1))
+        booking.book_slot(self.other, self.psychiatrist, self.slot.pk)
+        self.client.force_login(self.patient)
+        response = self.client.post(f"/counseling/book/{self.psychiatrist.pk}/", {"slot_id": self.slot.pk, "mode": "chat"})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "just taken")
+        self.assertEqual(response.context["alternative_slots"], [elsewhere])
+
+    def test_form_checks_the_mode(self):
+        self.client.force_login(self.patient)
+        response = self.client.post(f"/counseling/book/{self.psychiatrist.pk}/", {"slot_id": self.slot.pk, "mode": "voice"})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Booking.objects.exists())
+
+    def test_api_answers_409_when_the_slot_is_taken(self):
+        view = BookingViewSet.as_view({"post": "create"})
+
+        def create(user):
+            request = APIRequestFactory().post(
+                "/api/counseling/bookings/", {"psychiatrist": self.psychiatrist.pk, "slot": self.slot.pk, "mode": "chat"},
+            )
+            force_authenticate(request, user)
+            return view(request)
+
+        self.assertEqual(create(self.patient).status_code, 201)
+        response = create(self.other)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual([slot["id"] for slot in response.data["alternatives"]], [self.later.pk])
+
+
+class HoldTests(TestCase):
+    def setUp(self):
+        self.psychiatrist = make_psychiatrist("Asha")
+        self.slot = make_slot(self.psychiatrist, timezone.now() + timedelta(days=1))
+        self.patient = make_user("patient")
+        self.other = make_user("other")
+
+    def test_hold_keeps_others_off_the_slot(self):
+        booking.hold_slot(self.patient, self.psychiatrist, self.slot.pk)
+        with self.assertRaises(booking.SlotUnavailable):
+            booking.hold_slot(self.other, self.psychiatrist, self.slot.pk)
+        with self.assertRaises(booking.SlotUnavailable):
+            booking.book_slot(self.other, self.psychiatrist, self.slot.pk)
+        # The holder books through their own hold.
+        booking.book_slot(self.patient, self.psychiatrist, self.slot.pk)
+
+    def test_holding_another_slot_releases_the_first(self):
+        later = make_slot(self.psychiatrist, timezone.now() + timedelta(days=2))
+        booking.hold_slot(self.patient, self.psychiatrist, self.slot.pk)
+        booking.hold_slot(self.patient, self.psychiatrist, later.pk)
+        self.slot.refresh_from_db()
+        self.assertIsNone(self.slot.held_by)
+        self.assertEqual(Job.objects.get(task="counseling.waitlist.offer_slot").kwargs, {"slot_id": self.slot.pk})
+
+    def test_release_offers_the_slot_to_the_waitlist(self):
+        booking.hold_slot(self.patient, self.psychiatrist, self.slot.pk)
+        self.assertFalse(booking.release_hold(self.other, self.slot.pk))
+        self.assertFalse(Job.objects.exists())
+        self.assertTrue(booking.release_hold(self.patient, self.slot.pk))
+        self.assertEqual(Job.objects.get().kwargs, {"slot_id": self.slot.pk})
+
+    def test_hold_never_shortens_a_longer_hold(self):
+        longer = timezone.now() + timedelta(hours=1)
+        AvailabilitySlot.objects.filter(pk=self.slot.pk).update(held_by=self.patient, held_until=longer)
+        self.assertEqual(booking.hold_slot(self.patient, self.psychiatrist, self.slot.pk), longer)
+
+    def test_expired_hold_can_be_taken(self):
+        AvailabilitySlot.objects.filter(pk=self.slot.pk).update(
+            held_by=self.other, held_until=timezone.now() - timedelta(seconds=1),
+        )
+        booking.hold_slot(self.patient, self.psychiatrist, self.slot.pk)
+
+    def test_hold_view(self):
+        url = f"/counseling/book/{self.psychiatrist.pk}/hold/"
+        self.client.force_login(self.patient)
+        response = self.client.post(url, {"slot_id": self.slot.pk})
+        self.assertEqual(response.json()["slot_id"], self.slot.pk)
+        self.assertEqual(self.client.post(url, {"slot_id": "soon"}).status_code, 400)
+
+        self.client.force_login(self.other)
+        response = self.client.post(url, {"slot_id": self.slot.pk})
+        self.assertEqual(response.status_code, 409)
+        self.assertIn("alternatives", response.json())
+
+        self.client.force_login(self.patient)
+        self.assertEqual(self.client.delete(f"{url}?slot_id={self.slot.pk}").json(), {"released": True})
+        self.assertEqual(self.client.delete(url).status_code, 400)
+
+    def test_hold_api(self):
+        view = AvailabilitySlotViewSet.as_view({"post": "hold", "delete": "hold"}, **AvailabilitySlotViewSet.hold.kwargs)
+
+        def call(method, user, pk=self.slot.pk):
+            request = getattr(APIRequestFactory(), method)(f"/api/counseling/slots/{pk}/hold/")
+            force_authenticate(request, user)
+            return view(request, pk=pk)
+
+        self.assertEqual(call("post", self.patient).data["slot_id"], self.slot.pk)
+        self.assertEqual(call("post", self.other).status_code, 409)
+        self.assertEqual(call("delete", self.patient).data, {"released": True})
+        for method in ("post", "delete"):
+            self.assertEqual(call(method, self.patient, pk="x").status_code, 404)
+
+
+class WaitlistTests(TestCase):
+    def setUp(self):
+        self.psychiatrist = make_psychiatrist("Asha")
+        self.slot = make_slot(self.psychiatrist, timezone.now() + timedelta(days=1))
+        window = (self.slot.start - timedelta(hours=1), self.slot.end + timedelta(hours=1))
+        self.first = waitlist.join(make_user("first"), self.psychiatrist, *window)
+        self.second = waitlist.join(make_user("second"), self.psychiatrist, *window)
+
+    def test_offers_go_in_queue_order(self):
+        offer = waitlist.offer_slot(self.slot.pk)
+        self.assertEqual(offer.entry, self.first)
+        self.slot.refresh_from_db()
+        self.assertEqual(self.slot.held_by, self.first.user)
+        # The hold keeps a second offer of the same slot off it.
+        self.assertIsNone(waitlist.offer_slot(self.slot.pk))
+        self.assertEqual(SlotOffer.objects.count(), 1)
+
+    def test_only_entries_whose_window_fits(self):
+        self.first.window_end = self.slot.start
+        self.first.save()
+        self.assertEqual(waitlist.offer_slot(self.slot.pk).entry, self.second)
+
+    def test_accept_books_the_slot(self):
+        offer = waitlist.offer_slot(self.slot.pk)
+        created = waitlist.accept(offer)
+        self.assertEqual((created.user, created.slot), (self.first.user, self.slot))
+        self.assertEqual(WaitlistEntry.objects.get(pk=self.first.pk).status, "booked")
+        with self.assertRaises(waitlist.OfferUnavailable):
+            waitlist.accept(offer)
+
+    def test_decline_passes_the_slot_on(self):
+        waitlist.decline(waitlist.offer_slot(self.slot.pk))
+        self.assertEqual(WaitlistEntry.objects.get(pk=self.first.pk).status, "waiting")
+        jobs.work()
+        offer = SlotOffer.objects.get(status="open")
+        self.assertEqual(offer.entry, self.second)
+
+    def test_unanswered_offer_expires(self):
+        offer = waitlist.offer_slot(self.slot.pk)
+        SlotOffer.objects.filter(pk=offer.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        waitlist.expire_offer(offer.pk)
+        self.assertEqual(SlotOffer.objects.get(pk=offer.pk).status, "expired")
+        self.assertEqual(Job.objects.filter(task="counseling.waitlist.offer_slot").count(), 1)
+
+    def test_slot_held_from_the_form_is_offered_when_the_hold_ends(self):
+        held_until = booking.hold_slot(make_user("browser"), self.psychiatrist, self.slot.pk)
+        self.assertIsNone(waitlist.offer_slot(self.slot.pk))
+        retry = Job.objects.get(task="counseling.waitlist.offer_slot")
+        self.assertEqual((retry.run_at, retry.kwargs), (held_until, {"slot_id": self.slot.pk}))
+        offer = waitlist.offer_slot(self.slot.pk, now=held_until + timedelta(seconds=1))
+        self.assertEqual(offer.entry, self.first)
+
+    def test_slot_held_by_an_offer_is_not_retried(self):
+        waitlist.offer_slot(self.slot.pk)
+        Job.objects.all().delete()
+        self.assertIsNone(waitlist.offer_slot(self.slot.pk))
+        self.assertFalse(Job.objects.exists())
+
+    def test_cancellation_reaches_the_waitlist(self):
+        taken = booking.book_slot(make_user("patient"), self.psychiatrist, self.slot.pk)
+        booking.cancel_booking(taken)
+        jobs.work()
+        self.assertEqual(SlotOffer.objects.get().entry, self.first)
+
+
+class RatingTests(TestCase):
+    def setUp(self):
+        self.psychiatrist = make_psychiatrist("Asha")
+        self.patients = [make_user(f"patient{i}") for i in range(3)]
+        past = timezone.now() - timedelta(days=1)
+        self.bookings = [
+            make_booking(patient, make_slot(self.psychiatrist, past - timedelta(hours=i)), status="completed")
+            for i, patient in enumerate(self.patients)
+        ]
+
+    def rate(self, booking_index, rating):
+        return Feedback.objects.create(booking=self.bookings[booking_index], rating=rating)
+
+    def profile(self):
+        return PsychiatristProfile.objects.get(pk=self.psychiatrist.pk)
+
+    def test_feedback_updates_the_totals(self):
+        self.assertIsNone(self.profile().rating)
+        self.rate(0, 5)
+        feedback = self.rate(1, 2)
+        profile = self.profile()
+        self.assertEqual((profile.rating_sum, profile.rating_count, profile.rating), (7, 2, 3.5))
+        self.assertEqual((profile.rating_5_count, profile.rating_2_count), (1, 1))
+
+        feedback.rating = 4
+        feedback.save()
+        profile = self.profile()
+        self.assertEqual((profile.rating_sum, profile.rating_count, profile.rating), (9, 2, 4.5))
+        self.assertEqual((profile.rating_2_count, profile.rating_4_count), (0, 1))
+
+    def test_deletes_are_counted(self):
+        self.rate(0, 5)
+        self.rate(1, 3).delete()
+        self.assertEqual(self.profile().rating, 5)
+        # Cascades: deleting the patient deletes their booking and its feedback.
+        self.patients[0].delete()
+        profile = self.profile()
+        self.assertEqual((profile.rating_count, profile.rating, profile.rating_5_count), (0, None, 0))
+
+    def test_feedback_view(self):
+        self.client.force_login(self.patients[0])
+        url = f"/counseling/feedback/{self.bookings[0].pk}/"
+        self.client.post(url, {"rating": 2, "comment": "ok"})
+        self.client.post(url, {"rating": 4, "comment": "better"})
+        self.assertEqual((self.profile().rating_count, self.profile().rating), (1, 4))
+
+    def test_reconcile_repairs_drift(self):
+        self.rate(0, 5)
+        self.rate(1, 4)
+        PsychiatristProfile.objects.filter(pk=self.psychiatrist.pk).update(rating_sum=1, rating_count=7, rating=1)
+        self.assertEqual(ratings.reconcile([self.psychiatrist.pk]), 1)
+        profile = self.profile()
+        self.assertEqual((profile.rating_sum, profile.rating_count, profile.rating), (9, 2, 4.5))
+        self.assertEqual(ratings.reconcile([self.psychiatrist.pk]), 0)
+
+    def test_rating_changes_refresh_directory_and_match_caches(self):
+        cache.clear()
+        self.assertEqual(directory.facet_counts()["rating"][0]["count"], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rate(0, 5)
+        self.assertEqual(directory.facet_counts()["rating"][0]["count"], 1)
+
+        PsychiatristProfile.objects.filter(pk=self.psychiatrist.pk).update(rating=1)
+        directory.facet_counts()
+        version = cache.get(matching.VERSION_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            ratings.reconcile([self.psychiatrist.pk])
+        self.assertNotEqual(cache.get(matching.VERSION_KEY), version)
+        self.assertEqual(directory.facet_counts()["rating"][0]["count"], 1)
+
+
+class DashboardTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.psychiatrist = make_psychiatrist("Asha")
+        self.patient = make_user("patient")
+        self.pending = self.book(timedelta(days=2))
+        self.confirmed = self.book(timedelta(days=3), status="confirmed")
+        self.cancelled = self.book(timedelta(days=4), status="cancelled")
+        self.past = [self.book(-timedelta(days=day), status="completed") for day in range(1, 13)]
+        make_slot(self.psychiatrist, self.now + timedelta(days=5))
+        make_slot(self.psychiatrist, self.now + dashboard.UPCOMING_WINDOW + timedelta(days=1))
+
+    def book(self, offset, **fields):
+        return make_booking(self.patient, make_slot(self.psychiatrist, self.now + offset), **fields)
+
+    def test_patient_dashboard(self):
+        summary = dashboard.patient_dashboard(self.patient, now=self.now)
+        self.assertEqual(summary["counts"], {"total": 15, "upcoming": 2, "pending": 1, "today": 0, "past": 12,
+                                             "completed": 12})
+        self.assertEqual(summary["upcoming_bookings"], [self.pending, self.confirmed])
+        self.assertEqual(summary["pending_bookings"], [self.pending])
+        self.assertEqual(summary["past_bookings"], self.past[:dashboard.HISTORY_PAGE_SIZE])
+        self.assertTrue(summary["history_has_next"])
+        summary = dashboard.patient_dashboard(self.patient, history=2, now=self.now)
+        self.assertEqual((summary["past_bookings"], summary["history_has_next"]), (self.past[10:], False))
+
+    def test_psychiatrist_dashboard(self):
+        noon = timezone.make_aware(datetime.combine(timezone.localdate(self.now), time(12)))
+        today = make_booking(self.patient, make_slot(self.psychiatrist, noon + timedelta(minutes=5)))
+        summary = dashboard.psychiatrist_dashboard(self.psychiatrist, now=noon)
+        self.assertEqual(summary["today_bookings"], [today])
+        self.assertEqual(summary["upcoming_bookings"], [today, self.pending, self.confirmed])
+        # Slots beyond the window are left out.
+        self.assertEqual(len(summary["upcoming_slots"]), 5)
+        self.assertEqual(summary["recent_bookings"][0], today)
+
+    def test_query_count_does_not_grow_with_history(self):
+        def queries():
+            with CaptureQueriesContext(connection) as captured:
+                dashboard.patient_dashboard(self.patient, history=2, now=self.now)
+                dashboard.psychiatrist_dashboard(self.psychiatrist, history=2, now=self.now)
+            return len(captured)
+
+        before = queries()
+        for day in range(13, 60):
+            self.book(-timedelta(days=day), status="completed")
+        self.assertEqual(queries(), before)
+
+    def test_summary_views(self):
+        self.client.force_login(self.patient)
+        data = self.client.get("/counseling/patient-dashboard/summary/").json()
+        self.assertEqual([b["id"] for b in data["upcoming_bookings"]], [self.pending.pk, self.confirmed.pk])
+        self.assertEqual(data["upcoming_bookings"][0]["psychiatrist"], "Asha")
+        self.assertEqual(self.client.get("/counseling/psychiatrist-dashboard/summary/").status_code, 404)
+        self.client.force_login(self.psychiatrist.user)
+        data = self.client.get("/counseling/psychiatrist-dashboard/summary/").json()
+        self.assertEqual(data["pending_bookings"][0]["user"], "patient")
+        self.assertEqual(len(data["upcoming_slots"]), 4)
+
+    def test_pages(self):
+        self.client.force_login(self.patient)
+        for page in ("2", "nonsense", "-3"):
+            with self.subTest(page=page):
+                self.assertEqual(self.client.get("/counseling/patient-dashboard/", {"page": page}).status_code, 200)
+        self.assertEqual(dashboard.page_number({"page": "nonsense"}), 1)
+
+
+class DirectoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.asha = make_psychiatrist("Asha Rao", specialization="Trauma, Anxiety and Depression",
+                                      languages="Hindi / English", bio="Works with survivors of violence.")
+        self.bela = make_psychiatrist("Bela Sen", specialization="Depression", languages="Bengali, English",
+                                      bio="Trauma-informed care.", available_video=False)
+        make_psychiatrist("Unverified", specialization="Trauma", is_verified=False)
+        PsychiatristProfile.objects.filter(pk=self.asha.pk).update(rating=4.8)
+        PsychiatristProfile.objects.filter(pk=self.bela.pk).update(rating=3.9)
+
+    def search(self, **params):
+        return list(directory.search(params))
+
+    def test_facets_are_parsed_on_save(self):
+        self.assertEqual(directory.parse_terms(Facet.SPECIALIZATION, "Trauma, Anxiety and Depression"),
+                         {"trauma": "Trauma", "anxiety": "Anxiety", "depression": "Depression"})
+        self.assertEqual(set(self.asha.facets.values_list("slug", flat=True)),
+                         {"trauma", "anxiety", "depression", "hindi", "english"})
+        self.bela.languages = "Bengali"
+        self.bela.save()
+        self.assertEqual(list(self.bela.facets.filter(kind=Facet.LANGUAGE).values_list("slug", flat=True)), ["bengali"])
+
+    def test_filters(self):
+        self.assertEqual(self.search(), [self.asha, self.bela])
+        self.assertEqual(self.search(specialization="depression"), [self.asha, self.bela])
+        self.assertEqual(self.search(language="beng"), [self.bela])
+        self.assertEqual(self.search(mode="video"), [self.asha])
+        self.assertEqual(self.search(rating="4"), [self.asha])
+        # Nonsense is ignored rather than failing the page.
+        self.assertEqual(self.search(rating="lots", mode="telepathy"), [self.asha, self.bela])
+
+    def test_available_this_week(self):
+        make_slot(self.bela, timezone.now() + timedelta(days=2))
+        make_slot(self.asha, timezone.now() + timedelta(days=10))
+        self.assertEqual(self.search(available="week"), [self.bela])
+
+    def test_text_search_ranks_names_first(self):
+        self.assertEqual(self.search(search="trauma"), [self.asha, self.bela])
+        self.assertEqual(self.search(search="bela"), [self.bela])
+        self.assertEqual(self.search(search="surviv"), [self.asha])
+        self.assertEqual(self.search(search='" OR *'), [])
+        self.bela.delete()
+        self.assertEqual(self.search(search="trauma"), [self.asha])
+
+    def test_facet_counts_are_cached_until_a_profile_changes(self):
+        counts = directory.facet_counts()
+        self.assertEqual(counts["total"], 2)
+        self.assertIn({"slug": "english", "name": "English", "count": 2}, counts[Facet.LANGUAGE])
+        self.assertEqual(counts["mode"]["video"], 1)
+        self.assertEqual(counts["rating"][0], {"band": "4.5", "count": 1})
+        make_psychiatrist("Chitra", languages="English")
+        self.assertEqual(directory.facet_counts()["total"], 3)
+
+    def test_view(self):
+        response = self.client.get("/counseling/directory/", {"specialization": "trauma", "search": "violence"})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Asha Rao")
+        self.assertNotContains(response, "Bela Sen")
+
+
+class MatchingTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.asha = make_psychiatrist("Asha", specialization="Trauma, Anxiety", languages="Hindi, English",
+                                      years_experience=12)
+        self.bela = make_psychiatrist("Bela", specialization="Depression", languages="Bengali", available_video=False)
+        self.chitra = make_psychiatrist("Chitra", specialization="Anxiety", languages="English")
+        make_slot(self.bela, self.now + timedelta(hours=3))
+        # Every process shares the feature matrix; start each test from a fresh one.
+        matching.invalidate()
+
+    def ranked(self, **params):
+        return [m["psychiatrist"] for m in matching.match(matching.parse_request(params), now=self.now)]
+
+    def test_concerns_and_language_rank_first(self):
+        self.assertEqual(self.ranked(concerns="trauma, anxiety")[0], self.asha)
+        self.assertEqual(self.ranked(language="bengali")[0], self.bela)
+        self.assertEqual(self.ranked(concerns="anxiety", language="english")[:2], [self.asha, self.chitra])
+
+    def test_mode_excludes(self):
+        self.assertNotIn(self.bela, self.ranked(mode="video"))
+        self.assertEqual(len(self.ranked(limit="2")), 2)
+
+    def test_time_of_day_uses_free_slots(self):
+        evening = timezone.make_aware(datetime.combine(timezone.localdate(self.now) + timedelta(days=2), time(19)))
+        make_slot(self.chitra, evening)
+        matching.invalidate()
+        result = {m["psychiatrist"]: m for m in matching.match(matching.parse_request({"time": "evening"}), now=self.now)}
+        self.assertGreater(result[self.chitra]["breakdown"]["time"], 0)
+        self.assertEqual(result[self.asha]["breakdown"]["time"], 0)
+        self.assertIn("1 free evening slot in the next two weeks", result[self.chitra]["reasons"])
+
+    def test_ratings_are_shrunk_towards_the_prior(self):
+        PsychiatristProfile.objects.filter(pk=self.chitra.pk).update(rating_sum=5, rating_count=1)
+        PsychiatristProfile.objects.filter(pk=self.asha.pk).update(rating_sum=180, rating_count=40)
+        matching.invalidate()
+        result = {m["psychiatrist"]: m for m in matching.match(matching.parse_request({}), now=self.now)}
+        self.assertGreater(result[self.asha]["breakdown"]["rating"], result[self.chitra]["breakdown"]["rating"])
+        self.assertIn("Rated 4.5 from 40 reviews", result[self.asha]["reasons"])
+
+    def test_changes_rebuild_the_features(self):
+        self.ranked()
+        dana = make_psychiatrist("Dana", specialization="Grief")
+        self.assertEqual(self.ranked(concerns="grief")[0], dana)
+
+    def test_bad_requests(self):
+        for params in ({"mode": "telepathy"}, {"time": "midnight"}, {"tz": "Mars/Base"}, {"limit": "ten"}):
+            with self.subTest(params=params), self.assertRaises(ValueError):
+                matching.parse_request(params)
+
+    def test_views(self):
+        response = self.client.get("/counseling/match/", {"concerns": "depression"})
+        self.assertEqual(response.context["matches"][0]["psychiatrist"], self.bela)
+        self.assertIn("error", self.client.get("/counseling/match/", {"mode": "telepathy"}).context)
+        view = PsychiatristProfileViewSet.as_view({"get": "match"}, **PsychiatristProfileViewSet.match.kwargs)
+        response = view(APIRequestFactory().get("/api/counseling/psychiatrists/match/", {"concerns": "trauma"}))
+        self.assertEqual(response.data["results"][0]["psychiatrist"]["id"], self.asha.pk)
+        response = view(APIRequestFactory().get("/api/counseling/psychiatrists/match/", {"time": "midnight"}))
+        self.assertEqual(response.status_code, 400)
+
+
+class CalendarTests(TestCase):
+    def setUp(self):
+        self.psychiatrist = make_psychiatrist("Asha")
+        self.patient = make_user("patient")
+        self.booking = make_booking(self.patient, make_slot(self.psychiatrist, timezone.now() + timedelta(days=1)),
+                                    notes="private")
+        make_booking(make_user("anon"), make_slot(self.psychiatrist, timezone.now() + timedelta(days=2)),
+                     allow_anonymous=True, pseudonym="Moonlight, again")
+        self.feed = ical.feed_for(self.patient)
+
+    def get(self, token=None, **headers):
+        return self.client.get(f"/counseling/calendar/{token or self.feed.token}.ics", **headers)
+
+    def test_feed(self):
+        response = self.get()
+        body = b"".join(response.streaming_content).decode()
+        self.assertEqual(response["Content-Type"], "text/calendar; charset=utf-8")
+        self.assertTrue(body.startswith("BEGIN:VCALENDAR\r\n") and body.endswith("END:VCALENDAR\r\n"))
+        self.assertIn(f"UID:booking-{self.booking.pk}@testserver", body)
+        self.assertIn("SUMMARY:Counseling session with Asha", body)
+        self.assertEqual(body.count("BEGIN:VEVENT"), 1)
+        self.assertNotIn("private", body)
+
+    def test_psychiatrist_feed_shows_pseudonyms(self):
+        body = "".join(ical.events(self.psychiatrist.user, "example.com"))
+        self.assertEqual(body.count("BEGIN:VEVENT"), 2)
+        self.assertIn("SUMMARY:Session with Moonlight\\, again", body)
+
+    def test_unchanged_feed_answers_304(self):
+        etag = self.get()["ETag"]
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        booking.cancel_booking(self.booking)
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("STATUS:CANCELLED", b"".join(response.streaming_content).decode())
+
+    def test_reset_revokes_the_old_url(self):
+        old = self.feed.token
+        self.client.force_login(self.patient)
+        self.client.post("/counseling/calendar/")
+        self.assertEqual(self.get(old).status_code, 404)
+        self.assertEqual(self.get(ical.feed_for(self.patient).token).status_code, 200)
+
+    def test_long_lines_are_folded(self):
+        folded = ical._fold("SUMMARY:" + "é" * 60)
+        lines = folded.split("\r\n ")
+        self.assertTrue(all(len(line.encode()) <= 75 for line in lines))
+        self.assertEqual("".join(lines), "SUMMARY:" + "é" * 60 + "\r\n")
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        psychiatrist = make_psychiatrist("Asha")
+        self.bookings = [
+            make_booking(make_user(f"patient{i}"), make_slot(psychiatrist, timezone.now() - timedelta(days=i + 1)))
+            for i in range(3)
+        ]
+        Feedback.objects.create(booking=self.bookings[0], rating=5, comment='Kind, "patient" listener')
+
+    def download(self, queryset, kind, fmt):
+        return b"".join(exports.response(queryset, kind, fmt).streaming_content).decode()
+
+    def test_csv(self):
+        lines = self.download(Feedback.objects.all(), "feedback", "csv").splitlines()
+        self.assertEqual(lines[0], "id,booking,psychiatrist,rating,comment,created_at")
+        self.assertIn('"Kind, ""patient"" listener"', lines[1])
+
+    def test_jsonl(self):
+        rows = [json.loads(line) for line in self.download(Booking.objects.all(), "booking", "jsonl").splitlines()]
+        self.assertEqual([row["id"] for row in rows], sorted(b.pk for b in self.bookings))
+        self.assertEqual(rows[0]["user"], "patient0")
+
+    def test_output_is_buffered(self):
+        self.assertEqual(list(exports.buffered(["ab", "cd", "e"], size=4)), ["abcd", "e"])
+
+    def test_admin_action(self):
+        admin = User.objects.create_superuser("admin", "admin@example.com", None)
+        self.client.force_login(admin)
+        response = self.client.post("/admin/counseling/booking/", {
+            "action": "export_csv", "_selected_action": [self.bookings[0].pk],
+        })
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertEqual(len(b"".join(response.streaming_content).decode().splitlines()), 2)
+
+
+class PresenceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.asha = make_psychiatrist("Asha")
+        self.bela = make_psychiatrist("Bela")
+        self.start = datetime(2026, 3, 1, 12, tzinfo=dt_timezone.utc)
+
+    def at(self, seconds):
+        return self.start + timedelta(seconds=seconds)
+
+    def beat(self, *seconds, psychiatrist=None):
+        for second in seconds:
+            presence.heartbeat((psychiatrist or self.asha).pk, now=self.at(second))
+
+    def seconds_online(self):
+        return dict(OnlineTime.objects.values_list("psychiatrist__full_name", "seconds"))
+
+    def test_online_until_the_heartbeats_stop(self):
+        self.beat(0)
+        ids = [self.asha.pk, self.bela.pk]
+        self.assertEqual(presence.online(ids, now=self.at(60)), {self.asha.pk})
+        self.assertEqual(presence.online(ids, now=self.at(91)), set())
+        presence.leave(self.asha.pk, now=self.at(30))
+        self.assertEqual(presence.online(ids, now=self.at(31)), set())
+
+    def test_busy_psychiatrists_are_not_available(self):
+        now = timezone.now()
+        for psychiatrist in (self.asha, self.bela):
+            presence.heartbeat(psychiatrist.pk, now=now)
+        make_booking(make_user("patient"), make_slot(self.bela, now - timedelta(minutes=10)), status="confirmed")
+        self.assertEqual(presence.available_now([self.asha.pk, self.bela.pk], now=now), {self.asha.pk})
+
+    def test_compact_adds_up_online_time_once(self):
+        self.beat(0, 30, 60)
+        self.beat(0, 30, psychiatrist=self.bela)
+        self.assertEqual(presence.compact(), 2)
+        self.assertEqual(self.seconds_online(), {"Asha": 60, "Bela": 30})
+        self.assertEqual(presence.compact(), 0)
+        # A gap ends the stretch; both the rest of it and the new one are counted.
+        self.beat(90, 400, 430)
+        presence.compact()
+        self.assertEqual(self.seconds_online(), {"Asha": 120, "Bela": 30})
+
+    def test_time_is_split_at_midnight(self):
+        self.start = datetime(2026, 3, 1, 23, 59, 30, tzinfo=dt_timezone.utc)
+        self.beat(0, 30, 60, 90)
+        presence.compact()
+        self.assertEqual(
+            list(OnlineTime.objects.order_by("date").values_list("date", "seconds")),
+            [(self.start.date(), 30), (self.start.date() + timedelta(days=1), 60)],
+        )
+
+    def test_one_compaction_at_a_time(self):
+        self.beat(0, 30)
+        cache.add(presence.LOCK_KEY, True)
+        self.assertIsNone(presence.compact())
+        self.assertFalse(OnlineTime.objects.exists())
+
+    def test_heartbeat_view(self):
+        self.client.force_login(self.asha.user)
+        url = "/counseling/psychiatrist-dashboard/heartbeat/"
+        self.assertEqual(self.client.post(url).json(), {"online": True, "interval": 30})
+        self.assertEqual(presence.online([self.asha.pk]), {self.asha.pk})
+        self.assertEqual(self.client.post(url, {"state": "offline"}).json(), {"online": False})
+        self.assertEqual(presence.online([self.asha.pk]), set())
+        self.client.force_login(make_user("patient"))
+        self.assertEqual(self.client.post(url).status_code, 404)
+
+
+class SessionChatTests(TransactionTestCase):
+    # Consumers reach the database from other threads, so the data has to be committed.
+
+    def setUp(self):
+        self.psychiatrist = make_psychiatrist("Asha")
+        self.patient = make_user("patient")
+        self.booking = make_booking(self.patient, make_slot(self.psychiatrist, timezone.now() + timedelta(minutes=5)))
+        self.url = f"/ws/counseling/session/{self.booking.pk}/"
+        self.stranger = make_user("stranger")
+
+    async def connect(self, user, url=None):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), url or self.url)
+        communicator.scope["user"] = user
+        connected, code = await communicator.connect()
+        return communicator, connected, code
+
+    async def test_messages_are_saved_and_reach_both_sides(self):
+        patient, connected, _ = await self.connect(self.patient)
+        self.assertTrue(connected)
+        self.assertEqual(await patient.receive_json_from(), {"type": "history", "role": "patient", "messages": []})
+        psychiatrist, _, _ = await self.connect(self.psychiatrist.user)
+        self.assertEqual((await psychiatrist.receive_json_from())["role"], "psychiatrist")
+        self.assertEqual(await patient.receive_json_from(), {"type": "presence", "role": "psychiatrist", "online": True})
+        self.assertEqual(await psychiatrist.receive_json_from(), {"type": "presence", "role": "patient", "online": True})
+
+        await patient.send_json_to({"type": "message", "body": " Hello ", "client_id": "c1"})
+        sent, received = await patient.receive_json_from(), await psychiatrist.receive_json_from()
+        self.assertEqual((sent["body"], sent["sender"], sent["client_id"]), ("Hello", "patient", "c1"))
+        self.assertNotIn("client_id", received)
+        self.assertEqual(received["id"], sent["id"])
+
+        await psychiatrist.send_json_to({"type": "typing"})
+        self.assertEqual(await patient.receive_json_from(), {"type": "typing", "role": "psychiatrist", "typing": True})
+        await patient.send_json_to({"type": "message", "body": "   ", "client_id": "c2"})
+        self.assertEqual(await patient.receive_json_from(), {"type": "error", "client_id": "c2", "error": "invalid"})
+
+        await patient.disconnect()
+        self.assertEqual(await psychiatrist.receive_json_from(), {"type": "presence", "role": "patient", "online": False})
+        await psychiatrist.disconnect()
+        session_chat.writer().task.cancel()
+        self.assertEqual(await SessionMessage.objects.acount(), 1)
+
+    async def test_reconnect_resumes_after_the_last_message(self):
+        first, second = [
+            await SessionMessage.objects.acreate(
+                booking=self.booking, sender=SessionMessage.PATIENT, body=body, created_at=timezone.now(),
+            )
+            for body in ("one", "two")
+        ]
+        patient, _, _ = await self.connect(self.patient, f"{self.url}?after={first.pk}")
+        history = await patient.receive_json_from()
+        self.assertEqual([m["id"] for m in history["messages"]], [second.pk])
+        await patient.disconnect()
+
+    async def test_only_participants_while_the_session_is_open(self):
+        for user in (AnonymousUser(), self.stranger):
+            _, connected, code = await self.connect(user)
+            self.assertEqual((connected, code), (False, 4403))
+        _, connected, _ = await self.connect(self.patient, "/ws/counseling/session/0/")
+        self.assertFalse(connected)
+        later = timezone.now() + timedelta(days=1)
+        await AvailabilitySlot.objects.filter(pk=self.booking.slot_id).aupdate(start=later, end=later + timedelta(hours=1))
+        _, connected, code = await self.connect(self.patient)
+        self.assertEqual((connected, code), (False, 4409))
+
+    async def test_only_chat_bookings(self):
+        await Booking.objects.filter(pk=self.booking.pk).aupdate(mode="video")
+        _, connected, code = await self.connect(self.patient)
+        self.assertEqual((connected, code), (False, 4406))
+
+    async def test_writer_outlives_a_failed_delivery(self):
+        writer = session_chat.TranscriptWriter(interval=0)
+        message = SessionMessage(booking_id=self.booking.pk, sender=SessionMessage.PATIENT, body="hi", created_at=timezone.now())
+        with mock.patch.object(writer, "flush", side_effect=[RuntimeError("layer down"), None]) as flush, \
+                self.assertLogs("counseling.session_chat", "ERROR"):
+            writer.add(message, "reply")
+            await asyncio.sleep(0.01)
+            writer.add(message, "reply")
+            await asyncio.sleep(0.01)
+        self.assertEqual(flush.call_count, 2)
+        self.assertFalse(writer.task.done())
+        writer.task.cancel()
+
+
+class MigrationTests(TransactionTestCase):
+    """Data migrations, run forwards from the state just before them."""
+
+    def tearDown(self):
+        MigrationExecutor(connection).migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def migrate(self, name):
+        target = [("counseling", name)]
+        executor = MigrationExecutor(connection)
+        executor.migrate(target)
+        return executor.loader.project_state(target).apps
+
+    def make_profiles(self, apps, **profiles):
+        User, Profile = apps.get_model("auth", "User"), apps.get_model("counseling", "PsychiatristProfile")
+        return [
+            Profile.objects.create(user=User.objects.create(username=name), full_name=name, license_no=f"LIC-{name}",
+                                   **fields)
+            for name, fields in profiles.items()
+        ]
+
+    def test_rating_totals_start_from_existing_feedback(self):
+        apps = self.migrate("0006_availability_rules")
+        rated, _ = self.make_profiles(apps, Rated={"rating": 1.0}, Unrated={"rating": 4.9})
+        patient = apps.get_model("auth", "User").objects.create(username="patient")
+        start = timezone.now() - timedelta(days=1)
+        for offset, stars in enumerate((5, 4, 4)):
+            slot = apps.get_model("counseling", "AvailabilitySlot").objects.create(
+                psychiatrist=rated, start=start + timedelta(hours=offset), end=start + timedelta(hours=offset, minutes=30),
+            )
+            booking = apps.get_model("counseling", "Booking").objects.create(user=patient, psychiatrist=rated, slot=slot)
+            apps.get_model("counseling", "Feedback").objects.create(booking=booking, rating=stars)
+
+        Profile = self.migrate("0007_rating_aggregates").get_model("counseling", "PsychiatristProfile")
+        rated = Profile.objects.get(full_name="Rated")
+        self.assertEqual((rated.rating_sum, rated.rating_count, rated.rating), (13, 3, Decimal("4.33")))
+        self.assertEqual((rated.rating_4_count, rated.rating_5_count, rated.rating_1_count), (2, 1, 0))
+        # Hand-entered ratings without feedback behind them are dropped.
+        self.assertIsNone(Profile.objects.get(full_name="Unrated").rating)
+
+    def test_directory_facets_and_search_index_are_backfilled(self):
+        apps = self.migrate("0007_rating_aggregates")
+        self.make_profiles(
+            apps,
+            Asha={"specialization": "Trauma and Grief", "languages": "Hindi, English"},
+            Bela={"specialization": "grief", "bio": "Postpartum support"},
+        )
+
+        apps = self.migrate("0008_directory_facets")
+        Profile = apps.get_model("counseling", "PsychiatristProfile")
+        facets = {name: set(Profile.objects.get(full_name=name).facets.values_list("kind", "slug"))
+                  for name in ("Asha", "Bela")}
+        self.assertEqual(facets, {
+            "Asha": {("specialization", "trauma"), ("specialization", "grief"), ("language", "hindi"),
+                     ("language", "english")},
+            "Bela": {("specialization", "grief")},
+        })
+        if connection.vendor == "sqlite":
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT rowid FROM {directory.FTS_TABLE} WHERE {directory.FTS_TABLE} MATCH 'postpartum'")
+                self.assertEqual([row[0] for row in cursor.fetchall()], [Profile.objects.get(full_name="Bela").pk])
@@ -8,9 +8,17 @@ urlpatterns = [
     path('', views.CounselingListView.as_view(), name='list'),
     path('dashboard/', CounselorDashboardView.as_view(), name='dashboard'),
     path('patient-dashboard/', views.PatientDashboardView.as_view(), name='patient_dashboard'),
+    path('patient-dashboard/summary/', views.DashboardSummaryView.as_view(role='patient'), name='patient_dashboard_summary'),
     path('psychiatrist-dashboard/', views.PsychiatristDashboardView.as_view(), name='psychiatrist_dashboard'),
+    path('psychiatrist-dashboard/heartbeat/', views.PresenceHeartbeatView.as_view(), name='presence_heartbeat'),
+    path('psychiatrist-dashboard/summary/', views.DashboardSummaryView.as_view(role='psychiatrist'), name='psychiatrist_dashboard_summary'),
     path('book/<int:psychiatrist_id>/', views.BookAppointmentView.as_view(), name='book_appointment'),
+    path('book/<int:psychiatrist_id>/hold/', views.HoldSlotView.as_view(), name='hold_slot'),
     path('session/<int:booking_id>/', views.SessionView.as_view(), name='session'),
     path('feedback/<int:booking_id>/', views.SubmitFeedbackView.as_view(), name='feedback'),
     path('directory/', views.BrowseDirectoryView.as_view(), name='directory'),
+    path('match/', views.MatchView.as_view(), name='match'),
+    path('calendar/', views.CalendarSubscriptionView.as_view(), name='calendar'),
+    path('calendar/<str:token>.ics', views.CalendarFeedView.as_view(), name='calendar_feed'),
+    path('slots/search/', views.SlotSearchView.as_view(), name='slot_search'),
 ]
@@ -1,52 +1,36 @@
-from django.views.generic import ListView, CreateView, DetailView, TemplateView
+import zoneinfo
+from django.views.generic import ListView, CreateView, DetailView, TemplateView, View
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.shortcuts import get_object_or_404, redirect
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django.contrib import messages
-from django.db.models import Q, Avg
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.utils import timezone
-from datetime import timedelta
-from .models import PsychiatristProfile, AvailabilitySlot, Booking, Feedback
+from django.utils.decorators import method_decorator
+from .models import PsychiatristProfile, AvailabilitySlot, Booking, Feedback, CalendarFeed
 from .forms import BookingForm, FeedbackForm, AvailabilitySlotForm
+from . import dashboard, directory, ical, matching, presence, slot_search
+from .exports import buffered
+from . import booking as booking_service
+from sisterhood_stories.ratelimit import ratelimit
 
 class CounselingListView(ListView):
     template_name = "counseling/counseling_list.html"
     context_object_name = "psychiatrists"
 
     def get_queryset(self):
-        queryset = PsychiatristProfile.objects.filter(
-            is_female=True, 
-            is_verified=True
-        ).select_related('user')
-        
-        # Filter by specialization
-        specialization = self.request.GET.get('specialization', '').strip()
-        if specialization:
-            queryset = queryset.filter(
-                Q(specialization__icontains=specialization) |
-                Q(bio__icontains=specialization)
-            )
-        
-        # Filter by rating
-        min_rating = self.request.GET.get('rating', '').strip()
-        if min_rating:
-            try:
-                min_rating_float = float(min_rating)
-                queryset = queryset.filter(rating__gte=min_rating_float)
-            except ValueError:
-                pass
-        
-        # Order by rating (highest first) or created_at
-        queryset = queryset.order_by('-rating', '-created_at')
-        
-        return queryset
+        return directory.search(self.request.GET)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['specializations'] = PsychiatristProfile.objects.filter(
-            is_verified=True
-        ).values_list('specialization', flat=True).distinct()
+        facets = directory.facet_counts()
+        context['facets'] = facets
         context['selected_specialization'] = self.request.GET.get('specialization', '')
         context['selected_rating'] = self.request.GET.get('rating', '')
+        context['selected_available'] = self.request.GET.get('available', '')
+        context['online_ids'] = presence.online(p.pk for p in context['psychiatrists'])
         return context
 
 
@@ -55,16 +39,7 @@ class PatientDashboardView(LoginRequiredMixin, TemplateView):
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['bookings'] = Booking.objects.filter(
-            user=self.request.user
-        ).select_related('psychiatrist', 'slot').order_by('-created_at')
-        context['upcoming_bookings'] = context['bookings'].filter(
-            status__in=['pending', 'confirmed'],
-            slot__start__gte=timezone.now()
-        )
-        context['past_bookings'] = context['bookings'].filter(
-            Q(status='completed') | Q(slot__start__lt=timezone.now())
-        )
+        context.update(dashboard.patient_dashboard(self.request.user, history=dashboard.page_number(self.request.GET)))
         return context
 
 
@@ -74,37 +49,43 @@ class PsychiatristDashboardView(LoginRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         profile = get_object_or_404(PsychiatristProfile, user=self.request.user)
-        
-        # Get upcoming slots
-        context['upcoming_slots'] = AvailabilitySlot.objects.filter(
-            psychiatrist=profile,
-            start__gte=timezone.now()
-        ).order_by('start')
-        
-        # Get bookings
-        context['bookings'] = Booking.objects.filter(
-            psychiatrist=profile
-        ).select_related('user', 'slot').order_by('-created_at')
-        
-        # Get pending bookings
-        context['pending_bookings'] = context['bookings'].filter(
-            status='pending',
-            slot__start__gte=timezone.now()
-        )
-        
-        # Get today's bookings
-        today_start = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        today_end = today_start + timedelta(days=1)
-        context['today_bookings'] = context['bookings'].filter(
-            slot__start__gte=today_start,
-            slot__start__lt=today_end,
-            status__in=['pending', 'confirmed']
-        )
-        
+        context.update(dashboard.psychiatrist_dashboard(profile, history=dashboard.page_number(self.request.GET)))
         context['profile'] = profile
         return context
 
 
+class DashboardSummaryView(LoginRequiredMixin, View):
+    """
+    JSON counts and upcoming bookings for a dashboard to poll, so the page
+    can refresh without re-rendering. ``role`` is "patient" or "psychiatrist".
+    """
+    role = "patient"
+
+    def get(self, request):
+        if self.role == "psychiatrist":
+            profile = get_object_or_404(PsychiatristProfile, user=request.user)
+            return JsonResponse(dashboard.serialize(dashboard.psychiatrist_dashboard(profile), counterpart="user"))
+        return JsonResponse(dashboard.serialize(dashboard.patient_dashboard(request.user), counterpart="psychiatrist"))
+
+
+class PresenceHeartbeatView(LoginRequiredMixin, View):
+    """
+    Heartbeats from an open psychiatrist dashboard; ``state=offline`` when
+    it closes. Answers with the interval to beat at.
+    """
+
+    def post(self, request):
+        profile_id = PsychiatristProfile.objects.filter(user=request.user).values_list('pk', flat=True).first()
+        if profile_id is None:
+            raise Http404
+        if request.POST.get('state') == 'offline':
+            presence.leave(profile_id)
+            return JsonResponse({'online': False})
+        presence.heartbeat(profile_id)
+        return JsonResponse({'online': True, 'interval': int(presence.HEARTBEAT_INTERVAL.total_seconds())})
+
+
+@method_decorator(ratelimit('booking'), name='dispatch')
 class BookAppointmentView(LoginRequiredMixin, CreateView):
     model = Booking
     form_class = BookingForm
@@ -118,19 +99,32 @@ class BookAppointmentView(LoginRequiredMixin, CreateView):
             is_female=True
         )
     
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        # Booking.clean() checks the chosen mode against the psychiatrist.
+        kwargs['instance'] = Booking(user=self.request.user, psychiatrist=self.get_psychiatrist())
+        return kwargs
+    
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         psychiatrist = self.get_psychiatrist()
         
-        # Get available slots (not booked and in the future)
-        available_slots = AvailabilitySlot.objects.filter(
+        # Get available slots (not booked, not held by someone else, in the future)
+        now = timezone.now()
+        available_slots = list(AvailabilitySlot.objects.filter(
+            AvailabilitySlot.not_held(now, self.request.user),
             psychiatrist=psychiatrist,
             is_booked=False,
-            start__gte=timezone.now()
-        ).order_by('start')
+            start__gte=now
+        ).order_by('start'))
         
         context['psychiatrist'] = psychiatrist
         context['available_slots'] = available_slots
+        context['held_slot'] = next(
+            (slot for slot in available_slots if slot.held_by_id == self.request.user.id and slot.held_until > now), None
+        )
+        context['hold_minutes'] = int(booking_service.HOLD_TTL.total_seconds() // 60)
+        context['alternative_slots'] = getattr(self, 'alternative_slots', [])
         return context
     
     def form_valid(self, form):
@@ -141,29 +135,53 @@ class BookAppointmentView(LoginRequiredMixin, CreateView):
             form.add_error(None, "Please select an available time slot.")
             return self.form_invalid(form)
         
-        slot = get_object_or_404(
-            AvailabilitySlot,
-            id=slot_id,
-            psychiatrist=psychiatrist,
-            is_booked=False,
-            start__gte=timezone.now()
-        )
-        
-        booking = form.save(commit=False)
-        booking.user = self.request.user
-        booking.psychiatrist = psychiatrist
-        booking.slot = slot
-        booking.status = 'pending'
-        booking.save()
-        
-        # Mark slot as booked
-        slot.is_booked = True
-        slot.save()
-        
+        try:
+            booking_service.book_slot(
+                self.request.user,
+                psychiatrist,
+                slot_id,
+                mode=form.cleaned_data['mode'],
+                allow_anonymous=form.cleaned_data['allow_anonymous'],
+                pseudonym=form.cleaned_data['pseudonym'],
+                notes=form.cleaned_data['notes'],
+            )
+        except booking_service.SlotUnavailable as exc:
+            form.add_error(None, "Sorry, that time slot was just taken. Please pick another one.")
+            # Other psychiatrists' openings; this psychiatrist's are already in the grid.
+            self.alternative_slots = [s for s in exc.alternatives if s.psychiatrist_id != psychiatrist.id]
+            return self.form_invalid(form)
+
         messages.success(self.request, f'Appointment booked successfully with {psychiatrist.full_name}!')
         return redirect('counseling:patient_dashboard')
 
 
+class HoldSlotView(LoginRequiredMixin, View):
+    """
+    Hold a slot while the patient fills in the booking form (POST
+    ``slot_id``), or let it go again (DELETE ``?slot_id=``).
+    """
+
+    def post(self, request, psychiatrist_id):
+        psychiatrist = get_object_or_404(PsychiatristProfile, id=psychiatrist_id, is_verified=True, is_female=True)
+        try:
+            held_until = booking_service.hold_slot(request.user, psychiatrist, int(request.POST.get('slot_id', '')))
+        except ValueError:
+            return JsonResponse({'error': 'Please select an available time slot.'}, status=400)
+        except booking_service.SlotUnavailable as exc:
+            return JsonResponse({
+                'error': 'Sorry, that time slot was just taken. Please pick another one.',
+                'alternatives': slot_search.serialize(exc.alternatives, [])['slots'],
+            }, status=409)
+        return JsonResponse({'slot_id': int(request.POST['slot_id']), 'held_until': held_until.isoformat()})
+
+    def delete(self, request, psychiatrist_id):
+        try:
+            released = booking_service.release_hold(request.user, int(request.GET.get('slot_id', '')))
+        except ValueError:
+            return JsonResponse({'error': 'Missing slot_id.'}, status=400)
+        return JsonResponse({'released': released})
+
+
 class SessionView(LoginRequiredMixin, DetailView):
     model = Booking
     template_name = "counseling/session.html"
@@ -179,18 +197,8 @@ class SessionView(LoginRequiredMixin, DetailView):
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        booking = self.get_object()
-        
-        # Check if session can start (within 15 minutes before or during slot)
-        slot_start = booking.slot.start
-        slot_end = booking.slot.end
-        now = timezone.now()
-        
-        context['can_start'] = (
-            now >= slot_start - timedelta(minutes=15) and
-            now <= slot_end and
-            booking.status in ['pending', 'confirmed']
-        )
+        context['can_start'] = self.object.can_start()
+        context['can_chat'] = context['can_start'] and self.object.mode == "chat"
         context['is_psychiatrist'] = hasattr(self.request.user, 'psychiatrist_profile')
         return context
 
@@ -224,7 +232,7 @@ class SubmitFeedbackView(LoginRequiredMixin, TemplateView):
             rating = form.cleaned_data['rating']
             comment = form.cleaned_data.get('comment', '')
             
-            # Create or update feedback
+            # Create or update feedback; saving it updates the psychiatrist's rating totals
             feedback, created = Feedback.objects.get_or_create(
                 booking=booking,
                 defaults={'rating': rating, 'comment': comment}
@@ -234,16 +242,6 @@ class SubmitFeedbackView(LoginRequiredMixin, TemplateView):
                 feedback.comment = comment
                 feedback.save()
             
-            # Update psychiatrist average rating
-            psychiatrist = booking.psychiatrist
-            avg_rating = Feedback.objects.filter(
-                booking__psychiatrist=psychiatrist
-            ).aggregate(Avg('rating'))['rating__avg']
-            
-            if avg_rating:
-                psychiatrist.rating = round(avg_rating, 2)
-                psychiatrist.save()
-            
             # Mark booking as completed if it was confirmed and is in the past
             if booking.status == 'confirmed' and booking.slot.start < timezone.now():
                 booking.status = 'completed'
@@ -263,38 +261,86 @@ class BrowseDirectoryView(ListView):
     paginate_by = 12
     
     def get_queryset(self):
-        queryset = PsychiatristProfile.objects.filter(
-            is_female=True,
-            is_verified=True
-        ).select_related('user')
-        
-        # Filter by specialization
-        specialization = self.request.GET.get('specialization', '').strip()
-        if specialization:
-            queryset = queryset.filter(specialization__icontains=specialization)
-        
-        # Filter by rating
-        min_rating = self.request.GET.get('rating', '').strip()
-        if min_rating:
-            try:
-                queryset = queryset.filter(rating__gte=float(min_rating))
-            except ValueError:
-                pass
-        
-        # Search
-        search = self.request.GET.get('search', '').strip()
-        if search:
-            queryset = queryset.filter(
-                Q(full_name__icontains=search) |
-                Q(specialization__icontains=search) |
-                Q(bio__icontains=search)
-            )
-        
-        return queryset.order_by('-rating', '-created_at')
+        return directory.search(self.request.GET)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['specializations'] = PsychiatristProfile.objects.filter(
-            is_verified=True
-        ).exclude(specialization='').values_list('specialization', flat=True).distinct()
+        context['facets'] = directory.facet_counts()
+        params = self.request.GET.copy()
+        params.pop('page', None)
+        context['filter_query'] = params.urlencode()
+        context['online_ids'] = presence.online(p.pk for p in context['psychiatrists'])
         return context
+
+
+class SlotSearchView(View):
+    """
+    JSON search for the earliest free slots across verified psychiatrists,
+    e.g. ``?days=thu&time=evening&mode=video&language=Hindi&tz=Asia/Kolkata``.
+    Returns the matching slots plus per-day counts for a calendar.
+    """
+
+    def get(self, request):
+        try:
+            tz = zoneinfo.ZoneInfo(request.GET.get('tz') or 'UTC')
+            filters = slot_search.parse_filters(request.GET)
+            limit = slot_search.parse_limit(request.GET)
+        except (ValueError, zoneinfo.ZoneInfoNotFoundError) as exc:
+            return JsonResponse({'error': str(exc) or 'Invalid search.'}, status=400)
+
+        with timezone.override(tz):
+            slots, days = slot_search.search(limit=limit, **filters)
+        return JsonResponse(slot_search.serialize(slots, days))
+
+
+class MatchView(TemplateView):
+    """Counselors ranked for a patient's concerns, language, mode and preferred time of day."""
+    template_name = "counseling/match.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['facets'] = directory.facet_counts()
+        context['day_parts'] = list(slot_search.DAY_PARTS)
+        context['modes'] = directory.MODES
+        if self.request.GET:
+            try:
+                context['matches'] = matching.match(matching.parse_request(self.request.GET))
+            except ValueError as exc:
+                context['error'] = str(exc)
+        return context
+
+
+class CalendarSubscriptionView(LoginRequiredMixin, TemplateView):
+    """Shows the user's private calendar feed URL; POST replaces it with a new one."""
+    template_name = "counseling/calendar.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        feed = ical.feed_for(self.request.user)
+        url = self.request.build_absolute_uri(reverse('counseling:calendar_feed', args=[feed.token]))
+        context['feed_url'] = url
+        context['webcal_url'] = 'webcal://' + url.split('://', 1)[1]
+        return context
+
+    def post(self, request):
+        ical.reset(request.user)
+        messages.success(request, 'Your calendar link was reset. Subscribe again with the new link.')
+        return redirect('counseling:calendar')
+
+
+class CalendarFeedView(View):
+    """The iCalendar feed behind a subscription URL; the token in the URL is the only credential."""
+
+    def get(self, request, token):
+        feed = CalendarFeed.objects.select_related('user').filter(token=token).first()
+        if feed is None:
+            raise Http404
+        # Answer calendar apps' polling from the ETag alone when nothing changed.
+        etag = quote_etag(ical.etag(feed.user))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = StreamingHttpResponse(buffered(ical.events(feed.user, request.get_host())), content_type='text/calendar; charset=utf-8')
+            response['Content-Disposition'] = 'inline; filename="counseling.ics"'
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, max-age=300'
+        return response
@@ -1,7 +1,7 @@
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.generic import TemplateView
-from django.shortcuts import redirect
-from .models import PsychiatristProfile, AvailabilitySlot, Booking
+from . import dashboard
+from .models import PsychiatristProfile
 
 class CounselorDashboardView(LoginRequiredMixin, TemplateView):
     template_name = "counseling/dashboard.html"
@@ -9,11 +9,7 @@ class CounselorDashboardView(LoginRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
         profile = PsychiatristProfile.objects.filter(user=self.request.user).first()
-        slots = AvailabilitySlot.objects.filter(psychiatrist=profile).order_by("start") if profile else []
-        bookings = Booking.objects.filter(psychiatrist=profile).select_related("user", "slot").order_by("-created_at") if profile else []
-        ctx.update({
-            "profile": profile,
-            "slots": slots,
-            "bookings": bookings,
-        })
+        ctx["profile"] = profile
+        if profile:
+            ctx.update(dashboard.psychiatrist_dashboard(profile, history=dashboard.page_number(self.request.GET)))
         return ctx
@@ -0,0 +1,147 @@
+"""
+Waitlist: offer freed slots to waiting patients, first come first served.
+
+A cancellation (``booking.cancel_booking``) or a released form hold
+(``booking.release_hold``) queues an ``offer_slot`` job; a slot still held
+from the booking form is tried again when that hold runs out. The job holds
+the slot for the next matching patient (with its ``held_by`` and
+``held_until``) and records a SlotOffer; the hold keeps everyone else,
+including other offers, off the slot. An offer that is declined or runs out
+passes the slot on to the next patient. Every step claims rows with
+conditional UPDATEs, so concurrent cancellations and workers never offer one
+slot twice or give one patient two offers at once.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from . import jobs
+from . import booking as booking_service
+from .models import AvailabilitySlot, Booking, SlotOffer, WaitlistEntry
+
+OFFER_TTL = timedelta(minutes=15)
+
+
+class OfferUnavailable(Exception):
+    """The offer was already accepted, declined or has expired."""
+
+
+def join(user, psychiatrist, window_start, window_end, mode="chat"):
+    return WaitlistEntry.objects.create(
+        user=user, psychiatrist=psychiatrist, window_start=window_start, window_end=window_end, mode=mode,
+    )
+
+
+def leave(entry):
+    """Take an entry off the waitlist, giving up any open offer. Returns False if it was already booked or gone."""
+    with transaction.atomic():
+        left = WaitlistEntry.objects.filter(pk=entry.pk, status__in=("waiting", "offered")).update(status="cancelled")
+        if left:
+            for offer in SlotOffer.objects.filter(entry=entry, status="open"):
+                _close(offer, "declined")
+    return bool(left)
+
+
+def candidates(slot):
+    """Waiting entries the slot fits, in queue order, skipping patients it was already offered to."""
+    return (
+        WaitlistEntry.objects.filter(
+            psychiatrist_id=slot.psychiatrist_id,
+            status="waiting",
+            window_start__lte=slot.start,
+            window_end__gte=slot.end,
+        )
+        .exclude(Exists(SlotOffer.objects.filter(slot=slot, entry__user=OuterRef("user"))))
+        .exclude(Exists(Booking.objects.filter(user=OuterRef("user"), slot__start__lt=slot.end,
+                                               slot__end__gt=slot.start, status__in=booking_service.ACTIVE_STATUSES)))
+        .order_by("created_at", "id")
+    )
+
+
+def offer_slot(slot_id, now=None):
+    """
+    Hold a free slot for the next waitlisted patient and record the offer.
+    Returns the SlotOffer, or None if the slot is gone, taken, held or
+    nobody is waiting for it.
+    """
+    now = now or timezone.now()
+    slot = AvailabilitySlot.objects.filter(pk=slot_id, is_booked=False, start__gt=now).first()
+    if slot is None:
+        return None
+    with transaction.atomic():
+        for entry in candidates(slot)[:20]:
+            # Hold the slot first: only one offer can win it.
+            held = AvailabilitySlot.objects.filter(
+                AvailabilitySlot.not_held(now), pk=slot.pk, is_booked=False,
+            ).update(held_by=entry.user_id, held_until=now + OFFER_TTL)
+            if not held:
+                _retry_after_hold(slot.pk, now)
+                return None
+            # Then the entry: a concurrent offer of another slot may have claimed it.
+            if WaitlistEntry.objects.filter(pk=entry.pk, status="waiting").update(status="offered"):
+                offer = SlotOffer.objects.create(slot=slot, entry=entry, expires_at=now + OFFER_TTL)
+                jobs.enqueue("counseling.waitlist.expire_offer", run_at=offer.expires_at, offer_id=offer.pk)
+                return offer
+            AvailabilitySlot.objects.filter(pk=slot.pk, held_by=entry.user_id).update(held_by=None, held_until=None)
+    return None
+
+
+def _retry_after_hold(slot_id, now):
+    # A hold from the booking form lapses without telling anyone, so look at
+    # the slot again when it runs out. Offer holds pass the slot on themselves.
+    held_until = (
+        AvailabilitySlot.objects.filter(pk=slot_id, is_booked=False, held_until__gt=now)
+        .exclude(offers__status="open")
+        .values_list("held_until", flat=True)
+        .first()
+    )
+    if held_until:
+        jobs.enqueue("counseling.waitlist.offer_slot", run_at=held_until, slot_id=slot_id)
+
+
+def _close(offer, status):
+    """Close an open offer, release its hold and pass the slot on. Returns False if it was no longer open."""
+    if not SlotOffer.objects.filter(pk=offer.pk, status="open").update(status=status):
+        return False
+    WaitlistEntry.objects.filter(pk=offer.entry_id, status="offered").update(status="waiting")
+    AvailabilitySlot.objects.filter(pk=offer.slot_id, held_by=offer.entry.user_id, is_booked=False).update(
+        held_by=None, held_until=None,
+    )
+    jobs.enqueue("counseling.waitlist.offer_slot", slot_id=offer.slot_id)
+    return True
+
+
+def accept(offer, **fields):
+    """
+    Book the offered slot for its patient. Raises ``OfferUnavailable`` if the
+    offer has closed, and ``booking.SlotUnavailable`` if the slot was lost.
+    """
+    with transaction.atomic():
+        if not SlotOffer.objects.filter(pk=offer.pk, status="open", expires_at__gt=timezone.now()).update(status="accepted"):
+            raise OfferUnavailable()
+        entry = offer.entry
+        new_booking = booking_service.book_slot(
+            entry.user, entry.psychiatrist, offer.slot_id, mode=entry.mode, **fields,
+        )
+        WaitlistEntry.objects.filter(pk=entry.pk).update(status="booked")
+    offer.status = "accepted"
+    return new_booking
+
+
+def decline(offer):
+    """Turn an offer down; the patient keeps their place for other slots."""
+    with transaction.atomic():
+        if not _close(offer, "declined"):
+            raise OfferUnavailable()
+    offer.status = "declined"
+
+
+def expire_offer(offer_id):
+    """Job: close an offer nobody answered and offer the slot to the next patient."""
+    offer = SlotOffer.objects.select_related("entry").filter(
+        pk=offer_id, status="open", expires_at__lte=timezone.now(),
+    ).first()
+    if offer is not None:
+        _close(offer, "expired")
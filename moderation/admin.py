@@ -0,0 +1,35 @@
+from django.contrib import admin
+from django.utils import timezone
+
+from .models import Flag
+
+
+@admin.register(Flag)
+class FlagAdmin(admin.ModelAdmin):
+    list_display = ("__str__", "severity", "author", "status", "created_at", "reviewed_by")
+    list_filter = ("status", "severity", "content_type")
+    search_fields = ("excerpt", "categories", "author__username")
+    readonly_fields = (
+        "content_type", "object_id", "author", "categories", "score", "severity", "excerpt",
+        "created_at", "updated_at", "reviewed_by", "reviewed_at",
+    )
+    actions = ("clear", "remove_content")
+
+    def _review(self, request, queryset, status):
+        return queryset.update(status=status, reviewed_by=request.user, reviewed_at=timezone.now())
+
+    @admin.action(description="Clear: nothing wrong with it")
+    def clear(self, request, queryset):
+        self.message_user(request, f"Cleared {self._review(request, queryset, Flag.CLEARED)} flags.")
+
+    @admin.action(description="Remove the flagged content")
+    def remove_content(self, request, queryset):
+        flags = list(queryset.select_related("content_type"))
+        # Marked first, so deleting the content keeps the flag as the record.
+        self._review(request, queryset, Flag.REMOVED)
+        removed = 0
+        for flag in flags:
+            if flag.content_object is not None:
+                flag.content_object.delete()
+                removed += 1
+        self.message_user(request, f"Removed {removed} items.")
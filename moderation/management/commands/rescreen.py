@@ -0,0 +1,82 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+
+from moderation import screening
+from moderation.models import Flag
+
+
+class Command(BaseCommand):
+    help = (
+        "Screen every post, discussion and comment again, e.g. after a "
+        "lexicon change: rows are read in batches, screened in worker "
+        "processes and their flags queued, updated or dropped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="1 screens in this process.")
+        parser.add_argument('--batch', type=int, default=2000, help="Rows per batch.")
+        parser.add_argument('--model', action='append', choices=sorted(screening.SCREENED), help="Only these models.")
+
+    def handle(self, *args, **options):
+        if options['batch'] < 1 or options['workers'] < 1:
+            raise CommandError("--batch and --workers must be positive")
+        # Compiled before the workers fork, so they start with it.
+        screening.screener()
+        pool = ProcessPoolExecutor(options['workers']) if options['workers'] > 1 else None
+        try:
+            for label in options['model'] or screening.SCREENED:
+                self.rescreen(label, pool, options)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    def rescreen(self, label, pool, options):
+        model = apps.get_model(label)
+        fields, author_field = screening.SCREENED[label]
+        content_type = ContentType.objects.get_for_model(model)
+        rows = model.objects.order_by("pk").values_list("pk", author_field, *fields)
+        started = time.perf_counter()
+        screened = flagged = 0
+        screening_seconds = 0.0
+        totals = [0, 0, 0]
+        # Batches being screened, at most two per worker so reading keeps ahead.
+        pending = deque()
+
+        def record(ids, hits, seconds):
+            nonlocal flagged, screening_seconds
+            flagged += len(hits)
+            screening_seconds += seconds
+            for i, count in enumerate(Flag.sync(content_type, ids, hits)):
+                totals[i] += count
+
+        last = 0
+        while True:
+            batch = list(rows.filter(pk__gt=last)[:options['batch']])
+            if not batch:
+                break
+            last = batch[-1][0]
+            screened += len(batch)
+            ids = [row[0] for row in batch]
+            if pool is None:
+                record(ids, *screening.screen_rows(batch))
+                continue
+            pending.append((ids, pool.submit(screening.screen_rows, batch)))
+            if len(pending) >= 2 * options['workers']:
+                ids, future = pending.popleft()
+                record(ids, *future.result())
+        while pending:
+            ids, future = pending.popleft()
+            record(ids, *future.result())
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{label}: screened {screened} in {elapsed:.2f}s ({screened / elapsed if elapsed else 0:.0f}/s, "
+            f"{screening_seconds / screened * 1_000_000 if screened else 0:.1f}us each); {flagged} flagged: "
+            f"{totals[0]} queued, {totals[1]} changed and requeued, {totals[2]} pending dropped"
+        )
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.7 on 2026-10-19 14:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Flag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('categories', models.CharField(help_text='What was caught, as group:category', max_length=255)),
+                ('score', models.FloatField()),
+                ('severity', models.PositiveSmallIntegerField(choices=[(1, 'Personal data'), (2, 'Harassment'), (3, 'Distress')])),
+                ('excerpt', models.TextField(blank=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('cleared', 'Cleared'), ('removed', 'Removed')], default='pending', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('reviewed_at', models.DateTimeField(blank=True, null=True)),
+                ('author', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='moderation_flags', to=settings.AUTH_USER_MODEL)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+                ('reviewed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-severity', '-created_at'],
+                'indexes': [models.Index(fields=['status', '-severity', '-created_at'], name='moderation_flag_queue')],
+                'constraints': [models.UniqueConstraint(fields=('content_type', 'object_id'), name='moderation_flag_one_per_object')],
+            },
+        ),
+    ]
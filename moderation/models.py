@@ -0,0 +1,127 @@
+from django.conf import settings
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import screening
+
+
+class Flag(models.Model):
+    """
+    A post, discussion or comment the screening caught, queued for a
+    moderator. One per piece of content: screening it again updates the flag,
+    and puts it back in the queue if what was caught changed.
+    """
+
+    PENDING = "pending"
+    CLEARED = "cleared"
+    REMOVED = "removed"
+    STATUS_CHOICES = (
+        (PENDING, "Pending"),
+        (CLEARED, "Cleared"),
+        (REMOVED, "Removed"),
+    )
+    SEVERITY_CHOICES = (
+        (1, "Personal data"),
+        (2, "Harassment"),
+        (3, "Distress"),
+    )
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveBigIntegerField()
+    content_object = GenericForeignKey("content_type", "object_id")
+    author = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name="moderation_flags",
+    )
+    categories = models.CharField(max_length=255, help_text="What was caught, as group:category")
+    score = models.FloatField()
+    severity = models.PositiveSmallIntegerField(choices=SEVERITY_CHOICES)
+    excerpt = models.TextField(blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    reviewed_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name="+",
+    )
+    reviewed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-severity", "-created_at"]
+        constraints = [
+            models.UniqueConstraint(fields=["content_type", "object_id"], name="moderation_flag_one_per_object"),
+        ]
+        indexes = [
+            # The moderation queue: pending flags, most severe and newest first.
+            models.Index(fields=["status", "-severity", "-created_at"], name="moderation_flag_queue"),
+        ]
+
+    def __str__(self):
+        return f"{self.content_type.model} #{self.object_id}: {self.categories} [{self.status}]"
+
+    @classmethod
+    def sync(cls, content_type, screened_ids, hits):
+        """
+        Bring the flags of ``screened_ids`` (objects of ``content_type`` just
+        screened) in line with ``hits``, ``(object_id, author_id, Screening)``
+        for those that screened. Returns ``(created, requeued, dropped)``.
+        """
+        flags = cls.objects.filter(content_type=content_type)
+        existing = {flag.object_id: flag for flag in flags.filter(object_id__in=[pk for pk, _, _ in hits])}
+        new, changed = [], []
+        for pk, author_id, result in hits:
+            categories = ",".join(result.categories)
+            flag = existing.get(pk)
+            if flag is None:
+                new.append(cls(
+                    content_type=content_type, object_id=pk, author_id=author_id, categories=categories,
+                    score=result.score, severity=result.severity, excerpt=result.excerpt,
+                ))
+            elif (flag.categories, flag.excerpt) != (categories, result.excerpt):
+                flag.categories, flag.score, flag.severity, flag.excerpt = (
+                    categories, result.score, result.severity, result.excerpt,
+                )
+                if flag.status != cls.REMOVED:
+                    flag.status, flag.reviewed_by, flag.reviewed_at = cls.PENDING, None, None
+                flag.updated_at = timezone.now()
+                changed.append(flag)
+        cls.objects.bulk_create(new, ignore_conflicts=True)
+        cls.objects.bulk_update(changed, [
+            "categories", "score", "severity", "excerpt", "status", "reviewed_by", "reviewed_at", "updated_at",
+        ])
+        # Content that no longer screens leaves the queue; reviewed flags stay as the record.
+        clean = set(screened_ids) - {pk for pk, _, _ in hits}
+        dropped = flags.filter(object_id__in=clean, status=cls.PENDING).delete()[0] if clean else 0
+        return len(new), len(changed), dropped
+
+
+@receiver(post_save, sender="stories.Post")
+@receiver(post_save, sender="stories.Comment")
+@receiver(post_save, sender="community.Discussion")
+@receiver(post_save, sender="community.Comment")
+def screen_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    fields, author_field = screening.SCREENED[sender._meta.label_lower]
+    result = screening.screen(screening.text_of([getattr(instance, field) for field in fields]))
+    if result.flagged:
+        hits = [(instance.pk, getattr(instance, author_field), result)]
+    elif created:
+        # New and clean, the common case: nothing to queue or drop.
+        return
+    else:
+        hits = []
+    Flag.sync(ContentType.objects.get_for_model(sender), [instance.pk], hits)
+
+
+@receiver(post_delete, sender="stories.Post")
+@receiver(post_delete, sender="stories.Comment")
+@receiver(post_delete, sender="community.Discussion")
+@receiver(post_delete, sender="community.Comment")
+def unflag_on_delete(sender, instance, **kwargs):
+    # Flags of content a moderator removed stay as the record.
+    Flag.objects.filter(
+        content_type=ContentType.objects.get_for_model(sender), object_id=instance.pk,
+    ).exclude(status=Flag.REMOVED).delete()
@@ -0,0 +1,153 @@
+"""
+Screening of user-written text for moderators: distress (someone may need
+help), harassment, and personal data such as phone numbers or addresses.
+
+Everything is one ``chatbot.lexicon.Matcher``: the phrases of
+``data/screening.json`` (or the file named by ``MODERATION_LEXICON``), the
+chatbot's own distress phrases, and raw patterns for personal data, so a text
+is scanned once, in microseconds for a comment. A category counts once its
+score reaches its group's threshold, and a screening's ``severity`` is the
+highest of its groups' (distress 3, harassment 2, personal data 1).
+
+Nothing here touches the database, so ``screen_rows`` can run in worker
+processes; ``models`` queues what screens as ``Flag`` rows on every save,
+and ``manage.py rescreen`` re-screens everything after a lexicon change.
+"""
+import functools
+import json
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+
+from chatbot import lexicon
+
+DEFAULT_PATH = Path(__file__).resolve().parent / "data" / "screening.json"
+# What is screened of each model: its text fields and its author.
+SCREENED = {
+    "stories.post": (("content",), "author_id"),
+    "stories.comment": (("text",), "user_id"),
+    "community.discussion": (("title", "content"), "author_id"),
+    "community.comment": (("content",), "author_id"),
+}
+EXCERPT_CHARS = 240
+# Personal data is shown to moderators as its kind, not its value.
+MASKED_GROUPS = ("personal_data",)
+
+
+class Screening:
+    """
+    What one text screened as: the ``categories`` ("group:category") that
+    counted, their total ``score``, the ``severity`` and an ``excerpt``.
+    """
+
+    def __init__(self, categories=(), score=0.0, severity=0, excerpt=""):
+        self.categories = tuple(categories)
+        self.score = score
+        self.severity = severity
+        self.excerpt = excerpt
+
+    @property
+    def flagged(self):
+        return bool(self.categories)
+
+
+class Screener:
+    """A compiled screening lexicon."""
+
+    def __init__(self, lexicons, thresholds, severity, patterns=None):
+        self.matcher = lexicon.Matcher(lexicons, thresholds, patterns)
+        self.thresholds = dict(thresholds)
+        self.severity = dict(severity)
+
+    @classmethod
+    def load(cls, path, distress_path):
+        with open(path, encoding="utf-8") as handle:
+            data = json.load(handle)
+        with open(distress_path, encoding="utf-8") as handle:
+            lexicons = {"distress": json.load(handle).get("distress", {})}
+        lexicons.update(
+            (group, categories) for group, categories in data.items()
+            if group not in ("thresholds", "severity", "patterns")
+        )
+        return cls(lexicons, data["thresholds"], data["severity"], data.get("patterns"))
+
+    def screen(self, text):
+        if not text:
+            return Screening()
+        scores = defaultdict(float)
+        spans = []
+        seen = set()
+        for match, targets in self.matcher.matches(text):
+            # A phrase counts once: saying "ugly" five times is not harassment.
+            if match.group().lower() not in seen:
+                seen.add(match.group().lower())
+                for group, category, weight in targets:
+                    scores[group, category] += weight
+            spans.append((match.start(), match.end(), targets[0][0], targets[0][1]))
+        counted = sorted(
+            (group, category) for (group, category), score in scores.items()
+            if score >= self.thresholds.get(group, 1.0)
+        )
+        if not counted:
+            return Screening()
+        groups = {group for group, _ in counted}
+        return Screening(
+            [f"{group}:{category}" for group, category in counted],
+            sum(scores[key] for key in counted),
+            max(self.severity.get(group, 1) for group in groups),
+            self._excerpt(text, [span for span in spans if span[2] in groups]),
+        )
+
+    def _excerpt(self, text, spans):
+        """The text around the first hit, personal data masked."""
+        normalized = lexicon.normalize(text)
+        if len(normalized) != len(text):
+            # Spans are offsets into the normalized text.
+            text = normalized
+        start = max(0, spans[0][0] - EXCERPT_CHARS // 3)
+        end = min(len(text), start + EXCERPT_CHARS)
+        pieces, position = [], start
+        for span_start, span_end, group, category in spans:
+            if group in MASKED_GROUPS and span_start >= position and span_end <= end:
+                # Patterns start at a word, after any "+" or "(" of a phone number.
+                while span_start > position and text[span_start - 1] in "+(":
+                    span_start -= 1
+                pieces += [text[position:span_start], f"[{category}]"]
+                position = span_end
+        pieces.append(text[position:end])
+        return ("…" if start else "") + "".join(pieces).strip() + ("…" if end < len(text) else "")
+
+
+@functools.lru_cache(maxsize=None)
+def screener():
+    """The screener for the configured lexicons, compiled on first use."""
+    return Screener.load(
+        getattr(settings, "MODERATION_LEXICON", DEFAULT_PATH),
+        getattr(settings, "CHATBOT_LEXICON", lexicon.DEFAULT_PATH),
+    )
+
+
+def screen(text):
+    return screener().screen(text)
+
+
+def text_of(values):
+    """The screened text of an object from the values of its text fields."""
+    return "\n".join(value for value in values if value)
+
+
+def screen_rows(rows):
+    """
+    Screen ``(pk, author_id, *text fields)`` rows.
+    Returns the flagged ones as ``(pk, author_id, Screening)`` and the seconds
+    spent screening.
+    """
+    started = time.perf_counter()
+    flagged = []
+    for pk, author_id, *values in rows:
+        screening = screen(text_of(values))
+        if screening.flagged:
+            flagged.append((pk, author_id, screening))
+    return flagged, time.perf_counter() - started
@@ -0,0 +1,72 @@
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+
+from stories.models import Post
+
+from . import screening
+from .models import Flag
+
+
+class ScreeningTests(TestCase):
+    def test_phone_numbers(self):
+        for text in (
+            "call me on +91 98765 43210", "ring 09876543210", "my number is 98765 43210", "text 9876543210",
+            "(555) 123-4567 anytime", "555-123-4567", "555.123.4567", "+44 20 7946 0958", "020 7946 0958",
+        ):
+            with self.subTest(text=text):
+                self.assertEqual(screening.screen(text).categories, ("personal_data:phone",))
+
+    def test_numbers_that_are_not_phone_numbers(self):
+        for text in (
+            "Between 2019 2020 2021 I was sad", "I scored 123456789 points", "order #1234 5678 9012",
+            "2019-2020-2021", "born 1990, moved 2004", "ISBN 978-3-16-148410-0", "from 10 to 12345",
+        ):
+            with self.subTest(text=text):
+                self.assertFalse(screening.screen(text).flagged)
+
+    def test_personal_data_is_masked(self):
+        result = screening.screen("Reach me at +91 98765 43210 or asha@example.com")
+        self.assertEqual(result.categories, ("personal_data:email", "personal_data:phone"))
+        self.assertEqual((result.severity, result.excerpt), (1, "Reach me at [phone] or [email]"))
+
+    def test_distress_outranks_harassment(self):
+        result = screening.screen("You are pathetic, nobody likes you. I want to die.")
+        self.assertEqual(result.categories, ("distress:distress", "harassment:abuse"))
+        self.assertEqual(result.severity, 3)
+
+    def test_a_phrase_counts_once(self):
+        self.assertFalse(screening.screen("ugly ugly ugly ugly ugly").flagged)
+        self.assertFalse(screening.screen("What a lovely day").flagged)
+
+
+class FlagTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user("author")
+
+    def test_flagged_on_save_and_dropped_when_clean(self):
+        post = Post.objects.create(author=self.author, content="I want to die")
+        flag = Flag.objects.get()
+        self.assertEqual((flag.content_object, flag.author, flag.severity), (post, self.author, 3))
+        post.content = "Feeling better today"
+        post.save()
+        self.assertFalse(Flag.objects.exists())
+
+    def test_clean_content_is_not_flagged(self):
+        Post.objects.create(author=self.author, content="A lovely walk with my sister")
+        self.assertFalse(Flag.objects.exists())
+
+    def test_changed_content_is_requeued(self):
+        post = Post.objects.create(author=self.author, content="call 555-123-4567")
+        Flag.objects.update(status=Flag.CLEARED)
+        post.content = "call 555-123-4567, or I will hurt you"
+        post.save()
+        self.assertEqual(Flag.objects.get().status, Flag.PENDING)
+
+    def test_rescreen(self):
+        post = Post.objects.create(author=self.author, content="I want to die")
+        Flag.objects.all().delete()
+        call_command("rescreen", workers=1, stdout=StringIO())
+        self.assertEqual(Flag.objects.get().object_id, post.pk)
@@ -0,0 +1,2 @@
+# System checks for multi-process deployments; registered on import.
+from . import checks  # noqa: F401
@@ -2,6 +2,11 @@
 ASGI config for sisterhood_stories project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Plain HTTP goes to Django; websocket connections are routed through Channels.
+
+This serves the whole site (the "web" process of the Procfile). Django runs
+each request's sync code in a thread of its own, so sync views don't wait on
+one another, while the streaming chat and websockets run on the event loop.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +18,19 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sisterhood_stories.settings')
 
-application = get_asgi_application()
+# Initialise Django before importing anything that touches models.
+django_asgi_app = get_asgi_application()
+
+from channels.auth import AuthMiddlewareStack  # noqa: E402
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from channels.security.websocket import AllowedHostsOriginValidator  # noqa: E402
+
+from community.routing import websocket_urlpatterns as community_websocket_urlpatterns  # noqa: E402
+from counseling.routing import websocket_urlpatterns as counseling_websocket_urlpatterns  # noqa: E402
+
+application = ProtocolTypeRouter({
+    'http': django_asgi_app,
+    'websocket': AllowedHostsOriginValidator(
+        AuthMiddlewareStack(URLRouter(community_websocket_urlpatterns + counseling_websocket_urlpatterns))
+    ),
+})
@@ -0,0 +1,27 @@
+import time
+
+from channels import layers
+
+
+class InMemoryChannelLayer(layers.InMemoryChannelLayer):
+    """
+    In-memory channel layer whose expiry sweep runs at most once every
+    ``clean_interval`` seconds.
+
+    The stock layer walks every channel and group membership on each
+    ``receive()`` and ``group_send()``, so fanning one message out to N
+    sockets costs O(N^2). Expiry only needs second-level precision, so
+    throttling the sweep keeps fan-out linear without changing semantics.
+    """
+
+    def __init__(self, clean_interval=1, **kwargs):
+        super().__init__(**kwargs)
+        self.clean_interval = clean_interval
+        self._next_clean = 0
+
+    def _clean_expired(self):
+        now = time.monotonic()
+        if now < self._next_clean:
+            return
+        self._next_clean = now + self.clean_interval
+        super()._clean_expired()
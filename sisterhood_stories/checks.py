@@ -0,0 +1,43 @@
+"""
+System checks for deployments of several processes (``settings.MULTI_PROCESS``):
+what one process writes to the cache or channel layer, the others must see.
+"""
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+PER_PROCESS_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+PER_PROCESS_LAYERS = (
+    "channels.layers.InMemoryChannelLayer",
+    "sisterhood_stories.channel_layers.InMemoryChannelLayer",
+)
+HINT = "Set REDIS_URL (or {}), or MULTI_PROCESS=False when the site runs as one process."
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    backend = settings.CACHES["default"]["BACKEND"]
+    if not settings.MULTI_PROCESS or backend not in PER_PROCESS_CACHES:
+        return []
+    users = "counselor presence and rate limiting" if settings.RATE_LIMIT_ENABLED else "counselor presence"
+    return [Error(
+        f"The default cache ({backend}) is private to each process, but {users} "
+        f"must be shared by the web, websocket and worker processes.",
+        hint=HINT.format("CACHE_BACKEND and CACHE_LOCATION"),
+        id="sisterhood_stories.E001",
+    )]
+
+
+@register()
+def check_shared_channel_layer(app_configs, **kwargs):
+    backend = settings.CHANNEL_LAYERS.get("default", {}).get("BACKEND")
+    if not settings.MULTI_PROCESS or backend not in PER_PROCESS_LAYERS:
+        return []
+    return [Error(
+        f"The channel layer ({backend}) is private to each process, so live updates "
+        f"sent by the web workers would never reach websockets served by another process.",
+        hint=HINT.format("CHANNEL_LAYER_BACKEND and CHANNEL_LAYER_URL"),
+        id="sisterhood_stories.E002",
+    )]
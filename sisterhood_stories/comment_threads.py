@@ -0,0 +1,117 @@
+"""
+Materialized-path threading shared by community and stories comments.
+
+Every comment stores ``path``: one fixed-width segment per level, each segment
+being the comment's 1-based position among its siblings. Sorting by path gives
+a depth-first, oldest-first traversal, and a run of consecutive siblings plus
+all of their descendants is one contiguous path range. A page of threads with
+the first few replies of each is therefore a single ordered range scan of the
+(container, path) index, however large the discussion is.
+"""
+from django.db import models, transaction
+from django.db.models import F, Q
+
+SEGMENT_WIDTH = 6  # base-36, ~2.1 billion siblings per level
+PATH_MAX_LENGTH = 252
+MAX_DEPTH = PATH_MAX_LENGTH // SEGMENT_WIDTH
+
+_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def encode_segment(position):
+    digits = []
+    while position:
+        position, remainder = divmod(position, 36)
+        digits.append(_DIGITS[remainder])
+    return ''.join(reversed(digits)).rjust(SEGMENT_WIDTH, '0')
+
+
+class ThreadedComment(models.Model):
+    """
+    Abstract base for comments that can be replied to.
+
+    Concrete models set ``thread_container_field`` to the name of the foreign
+    key pointing at what is being commented on; that model must have a
+    ``thread_count`` integer field used to number top-level comments.
+    """
+
+    thread_container_field = None
+
+    parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE, related_name='replies')
+    path = models.CharField(max_length=PATH_MAX_LENGTH, default='', editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    position = models.PositiveIntegerField(default=0, editable=False)
+    reply_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if self.path:
+            return super().save(*args, **kwargs)
+        # Claiming a position and inserting must commit together, otherwise a
+        # rollback would leave a gap or a duplicate path behind.
+        with transaction.atomic():
+            self._allocate_path()
+            return super().save(*args, **kwargs)
+
+    def _allocate_path(self):
+        model = type(self)
+        if not self.parent_id:
+            container = self._meta.get_field(self.thread_container_field).related_model
+            counter = container.objects.filter(pk=getattr(self, f'{self.thread_container_field}_id'))
+            # The UPDATE takes the row lock, so concurrent comments get distinct positions.
+            counter.update(thread_count=F('thread_count') + 1)
+            self.position = counter.values_list('thread_count', flat=True).get()
+            self.depth = 0
+            self.path = encode_segment(self.position)
+            return
+
+        parent = model.objects.filter(pk=self.parent_id).values('path', 'depth').get()
+        if parent['depth'] + 1 >= MAX_DEPTH:
+            # Too deep to nest further: reply alongside the parent instead.
+            grandparent_path = parent['path'][:-SEGMENT_WIDTH]
+            self.parent = model.objects.get(path=grandparent_path, **self._container_filter())
+            parent = {'path': grandparent_path, 'depth': parent['depth'] - 1}
+
+        counter = model.objects.filter(pk=self.parent_id)
+        counter.update(reply_count=F('reply_count') + 1)
+        self.position = counter.values_list('reply_count', flat=True).get()
+        self.depth = parent['depth'] + 1
+        self.path = parent['path'] + encode_segment(self.position)
+
+    def _container_filter(self):
+        field = f'{self.thread_container_field}_id'
+        return {field: getattr(self, field)}
+
+
+def thread_page(queryset, parent=None, start=1, count=20, replies=3):
+    """
+    Return siblings ``start .. start + count - 1`` under ``parent`` (top-level
+    comments when ``parent`` is None), each followed by its first ``replies``
+    direct replies, in display order. ``queryset`` should already be filtered
+    to one container so the (container, path) index drives the scan.
+    """
+    prefix = parent.path if parent else ''
+    depth = parent.depth + 1 if parent else 0
+    return queryset.filter(
+        path__gte=prefix + encode_segment(start),
+        path__lt=prefix + encode_segment(start + count),
+    ).filter(
+        Q(depth=depth) | Q(depth=depth + 1, position__lte=replies)
+    ).order_by('path')
+
+
+def nest(comments, depth=0):
+    """
+    Turn a path-ordered ``thread_page`` result into a list of comments at
+    ``depth``, each carrying its fetched replies in ``loaded_replies``.
+    """
+    roots = []
+    for comment in comments:
+        comment.loaded_replies = []
+        if comment.depth == depth:
+            roots.append(comment)
+        elif roots:
+            roots[-1].loaded_replies.append(comment)
+    return roots
@@ -0,0 +1,263 @@
+"""
+Token-bucket rate limits and concurrency caps kept in the cache, so every
+worker process shares them, given a shared cache (see ``CACHES`` in
+settings; with ``MULTI_PROCESS`` a system check refuses a per-process one).
+
+A limit like "20/m" is a bucket of 20 tokens refilled at 20 a minute: a
+client can send 20 requests at once, then one every 3 seconds. Each bucket
+is a single integer in the cache, the time in milliseconds at which it would
+be full again (GCRA's "theoretical arrival time"). Taking a token moves it
+forward with ``cache.incr``, which is atomic on Redis and Memcached and
+locked in local memory, so a check is one cache round trip and no lock; a
+denied request gives its token back with ``decr``.
+
+``settings.RATE_LIMITS`` gives each scope a "user" and an "ip" limit:
+signed-in users are held to the user one, anonymous clients to the ip one,
+so people sharing an address (an office, a campus, a mobile carrier) can't
+lock out those who signed in.
+``settings.RATE_LIMIT_CONCURRENCY`` caps how many requests of one client a
+scope serves at once.
+
+Views use ``ratelimit(scope)`` and ``concurrency_limit(scope)`` (through
+``method_decorator`` on class-based views); DRF views set ``throttle_scope``
+and use ``UserBucketThrottle`` and ``IPBucketThrottle``. Either way a
+limited request gets a 429 with ``Retry-After``.
+"""
+import asyncio
+import functools
+import math
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+# A bucket is forgotten this long after it was last found full; a client
+# held at its limit meanwhile gets one extra burst.
+MIN_TIMEOUT = 10 * 60
+# Requests in flight are forgotten after this, should a worker die holding one.
+CONCURRENCY_TIMEOUT = 5 * 60
+
+
+def _cache():
+    return caches["default"]
+
+
+@functools.lru_cache(maxsize=None)
+def parse(rate):
+    """``(tokens, milliseconds per token)`` of a rate like "20/m"."""
+    count, period = rate.split("/")
+    count = int(count)
+    return count, max(1, round(PERIODS[period] * 1000 / count))
+
+
+def hit(bucket, rate, now=None):
+    """
+    Take a token from ``bucket``, limited to ``rate``. Returns 0 if there was
+    one, else the seconds until there is.
+    """
+    tokens, step = parse(rate)
+    now = int((now if now is not None else time.time()) * 1000)
+    key = f"ratelimit:{bucket}"
+    cache = _cache()
+    timeout = max(MIN_TIMEOUT, math.ceil(tokens * step / 1000))
+    try:
+        full_at = cache.incr(key, step)
+    except ValueError:
+        cache.add(key, now, timeout)
+        try:
+            full_at = cache.incr(key, step)
+        except ValueError:
+            # Evicted in between: let it through rather than fail.
+            return 0
+    if full_at - step < now:
+        # The bucket was full: count from now. Racing requests may each do
+        # this, and are then counted once instead of each.
+        full_at = now + step
+        cache.set(key, full_at, timeout)
+    wait = full_at - now - tokens * step
+    if wait > 0:
+        cache.decr(key, step)
+        return wait / 1000
+    return 0
+
+
+def client_ip(request):
+    """
+    The client's address: with ``RATE_LIMIT_PROXIES`` proxies in front that
+    each append to X-Forwarded-For, the entry the outermost one added.
+    """
+    proxies = settings.RATE_LIMIT_PROXIES
+    if proxies:
+        forwarded = [part.strip() for part in request.headers.get("X-Forwarded-For", "").split(",") if part.strip()]
+        if len(forwarded) >= proxies:
+            return forwarded[-proxies]
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def _client(kind, request, user):
+    """The id of ``request``'s client for a "user" or "ip" limit, or None if it doesn't apply."""
+    signed_in = user is not None and user.is_authenticated
+    if kind == "user":
+        return f"user:{user.pk}" if signed_in else None
+    return None if signed_in else f"ip:{client_ip(request)}"
+
+
+def check(request, scope, user=None):
+    """Take a token from each of ``request``'s buckets in ``scope``; 0 if allowed, else seconds to wait."""
+    if not settings.RATE_LIMIT_ENABLED:
+        return 0
+    wait = 0
+    for kind, rate in settings.RATE_LIMITS.get(scope, {}).items():
+        client = _client(kind, request, user)
+        if client is not None:
+            wait = max(wait, hit(f"{scope}:{client}", rate))
+    return wait
+
+
+def acquire(key, limit):
+    """Count a request in flight under ``key``; False (and not counted) if ``limit`` are already."""
+    cache = _cache()
+    cache.add(f"concurrency:{key}", 0, CONCURRENCY_TIMEOUT)
+    try:
+        if cache.incr(f"concurrency:{key}") <= limit:
+            return True
+    except ValueError:
+        return True
+    release(key)
+    return False
+
+
+def release(key):
+    try:
+        _cache().decr(f"concurrency:{key}")
+    except ValueError:
+        pass
+
+
+acheck = sync_to_async(check)
+aacquire = sync_to_async(acquire)
+arelease = sync_to_async(release)
+
+
+def limited(request, wait, error="rate_limited"):
+    """The 429 for a request to retry after ``wait`` seconds: JSON unless a page was asked for."""
+    retry_after = max(1, math.ceil(wait))
+    if "text/html" in request.headers.get("Accept", ""):
+        response = HttpResponse("Too many requests, please try again shortly.", status=429, content_type="text/plain")
+    else:
+        response = JsonResponse({"ok": False, "error": error, "retry_after": retry_after}, status=429)
+    response["Retry-After"] = str(retry_after)
+    return response
+
+
+def ratelimit(scope, methods=("POST",)):
+    """Limit ``methods`` requests to a view by the ``scope`` buckets of ``settings.RATE_LIMITS``."""
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                if request.method in methods:
+                    wait = await acheck(request, scope, await request.auser())
+                    if wait:
+                        return limited(request, wait)
+                return await view(request, *args, **kwargs)
+        else:
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                if request.method in methods:
+                    wait = check(request, scope, getattr(request, "user", None))
+                    if wait:
+                        return limited(request, wait)
+                return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def concurrency_limit(scope, retry_after=1):
+    """
+    Serve at most ``settings.RATE_LIMIT_CONCURRENCY[scope]`` requests of one
+    client at once. A streamed response holds its place until it finishes.
+    """
+    def key(request, user):
+        return f"{scope}:{_client('user', request, user) or _client('ip', request, user)}"
+
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                limit = settings.RATE_LIMIT_CONCURRENCY.get(scope)
+                if not limit or not settings.RATE_LIMIT_ENABLED:
+                    return await view(request, *args, **kwargs)
+                held = key(request, await request.auser())
+                if not await aacquire(held, limit):
+                    return limited(request, retry_after, error="too_many_concurrent")
+                try:
+                    response = await view(request, *args, **kwargs)
+                except BaseException:
+                    await arelease(held)
+                    raise
+                if isinstance(response, StreamingHttpResponse) and response.is_async:
+                    response.streaming_content = _releasing(response.streaming_content, held)
+                else:
+                    await arelease(held)
+                return response
+        else:
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                limit = settings.RATE_LIMIT_CONCURRENCY.get(scope)
+                if not limit or not settings.RATE_LIMIT_ENABLED:
+                    return view(request, *args, **kwargs)
+                held = key(request, getattr(request, "user", None))
+                if not acquire(held, limit):
+                    return limited(request, retry_after, error="too_many_concurrent")
+                try:
+                    return view(request, *args, **kwargs)
+                finally:
+                    release(held)
+        return wrapper
+    return decorator
+
+
+async def _releasing(content, key):
+    try:
+        async for chunk in content:
+            yield chunk
+    finally:
+        await arelease(key)
+
+
+class BucketThrottle(BaseThrottle):
+    """
+    DRF throttle taking from the view's ``throttle_scope`` buckets (shared
+    with ``ratelimit``). Reads are not counted.
+    """
+
+    kind = None
+
+    def allow_request(self, request, view):
+        self.delay = 0
+        scope = getattr(view, "throttle_scope", None)
+        rate = settings.RATE_LIMITS.get(scope, {}).get(self.kind)
+        if rate is None or request.method in SAFE_METHODS or not settings.RATE_LIMIT_ENABLED:
+            return True
+        client = _client(self.kind, request, request.user)
+        if client is None:
+            return True
+        self.delay = hit(f"{scope}:{client}", rate)
+        return not self.delay
+
+    def wait(self):
+        return self.delay
+
+
+class UserBucketThrottle(BucketThrottle):
+    kind = "user"
+
+
+class IPBucketThrottle(BucketThrottle):
+    kind = "ip"
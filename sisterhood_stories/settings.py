@@ -25,6 +25,8 @@ ALLOWED_HOSTS = os.environ.get("ALLOWED_HOSTS", "*").split()
 
 # Application definition
 INSTALLED_APPS = [
+    # daphne must come first so `runserver` serves the ASGI app (websockets)
+    "daphne",
     "django.contrib.admin",
     "django.contrib.auth",
     "django.contrib.contenttypes",
@@ -38,10 +40,12 @@ INSTALLED_APPS = [
     "community",
     "counseling",
     "chatbot",
+    "moderation",
 
     # Third-party
     "rest_framework",
     "corsheaders",
+    "channels",
 ]
 
 # Middleware
@@ -78,9 +82,64 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "sisterhood_stories.wsgi.application"
+ASGI_APPLICATION = "sisterhood_stories.asgi.application"
+
+# Processes. The Procfile serves the whole site, plain HTTP, websockets and
+# the streaming chat, from one daphne process ("web") and runs background jobs
+# in another ("worker"). Websocket groups, counselor presence and rate-limit
+# buckets live in the channel layer and cache, which are private to each
+# process unless REDIS_URL is set: without it, live updates only reach
+# sockets of the process that sent them and the worker never sees presence
+# to total up. Set REDIS_URL (it provides both) before running more than one
+# web process, and MULTI_PROCESS=True to have the system checks refuse a
+# per-process cache or channel layer.
+MULTI_PROCESS = os.environ.get("MULTI_PROCESS", "False") == "True"
+redis_url = os.environ.get("REDIS_URL")
+
+# Channel layer used for live updates over websockets.
+# The in-memory layer only reaches sockets held by the same process, which is
+# fine for a single process and for tests. Otherwise set REDIS_URL, or point
+# CHANNEL_LAYER_BACKEND at a shared layer (e.g. channels_redis.core.RedisChannelLayer)
+# and CHANNEL_LAYER_URL at its server.
+CHANNEL_LAYERS = {
+    "default": {
+        "BACKEND": os.environ.get(
+            "CHANNEL_LAYER_BACKEND",
+            "channels_redis.core.RedisChannelLayer" if redis_url else "sisterhood_stories.channel_layers.InMemoryChannelLayer",
+        ),
+    }
+}
+channel_layer_url = os.environ.get("CHANNEL_LAYER_URL", redis_url)
+if channel_layer_url:
+    CHANNEL_LAYERS["default"]["CONFIG"] = {"hosts": [channel_layer_url]}
+
+# Cache. The local-memory default is per process, which is fine for one
+# process. Counselor presence (counseling.presence) and rate-limit buckets are
+# kept only in the cache, so with several processes set REDIS_URL, or point
+# CACHE_BACKEND at a shared cache (e.g. django.core.cache.backends.redis.RedisCache)
+# and CACHE_LOCATION at its server.
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get(
+            "CACHE_BACKEND",
+            "django.core.cache.backends.redis.RedisCache" if redis_url else "django.core.cache.backends.locmem.LocMemCache",
+        ),
+        "LOCATION": os.environ.get("CACHE_LOCATION", redis_url or ""),
+    }
+}
+# Cached chatbot answers (chatbot.answer_cache): a key prefix on a shared
+# cache, or a separate local-memory store so they never push presence records
+# out. Either way the least recently used answers are evicted first (for
+# Redis, set maxmemory-policy allkeys-lru).
+CACHES["chatbot"] = {**CACHES["default"], "KEY_PREFIX": "chatbot"}
+if CACHES["default"]["BACKEND"] == "django.core.cache.backends.locmem.LocMemCache":
+    # The default cap of 300 entries would evict presence records on a busy directory.
+    CACHES["default"]["OPTIONS"] = {"MAX_ENTRIES": 20000}
+    CACHES["chatbot"].update(LOCATION="chatbot", OPTIONS={"MAX_ENTRIES": 5000})
 
 # Database
-# If DATABASE_URL environment variable exists, parse it. Otherwise use sqlite for local dev.
+# If DATABASE_URL environment variable exists, parse it. Otherwise use sqlite for local dev
+# (at SQLITE_PATH if set, e.g. a scratch database for manage.py chat_load).
 DATABASES = {}
 db_url = os.environ.get("DATABASE_URL")
 if db_url:
@@ -98,7 +157,7 @@ else:
     DATABASES = {
         "default": {
             "ENGINE": "django.db.backends.sqlite3",
-            "NAME": BASE_DIR / "db.sqlite3",
+            "NAME": os.environ.get("SQLITE_PATH", BASE_DIR / "db.sqlite3"),
         }
     }
 
@@ -161,3 +220,39 @@ SESSION_COOKIE_SAMESITE = "Lax"
 CSRF_COOKIE_SAMESITE = "Lax"
 SESSION_COOKIE_HTTPONLY = True
 CSRF_COOKIE_HTTPONLY = False
+
+# Chatbot model provider. OPENAI_API_BASE can point at any chat-completions
+# compatible server (e.g. the local stub: manage.py stub_llm).
+CHATBOT_LLM_URL = os.environ.get("OPENAI_API_BASE", "https://api.openai.com/v1")
+CHATBOT_MODEL = os.environ.get("CHATBOT_MODEL", "gpt-3.5-turbo")
+# Streaming chats one process runs at once; more wait briefly, then get the local reply.
+CHATBOT_MAX_STREAMS = int(os.environ.get("CHATBOT_MAX_STREAMS", "64"))
+# Answer clear greetings, thanks and single-intent messages from templates, and
+# repeat cached model answers to common short messages, instead of calling the model.
+CHATBOT_LOCAL_ROUTING = os.environ.get("CHATBOT_LOCAL_ROUTING", "True") == "True"
+CHATBOT_CACHE_ANSWERS = os.environ.get("CHATBOT_CACHE_ANSWERS", "True") == "True"
+# Who folds old chat turns into a conversation's summary: "local" (extractive,
+# free) or "model" (one more model call when a chat outgrows its context).
+CHATBOT_SUMMARIZER = os.environ.get("CHATBOT_SUMMARIZER", "local")
+
+# Token-bucket limits per client (sisterhood_stories.ratelimit), kept in the
+# default cache so all workers share them; use a shared backend (Redis or
+# Memcached) when running several. "20/m" is a burst of 20, then one request
+# every 3 seconds. Signed-in users are held to the user limit of a scope,
+# anonymous clients to the ip one.
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "True") == "True"
+RATE_LIMITS = {
+    "chat": {"user": "20/m", "ip": "40/m"},
+    "like": {"user": "60/m", "ip": "120/m"},
+    "comment": {"user": "10/m", "ip": "30/m"},
+    "post": {"user": "5/m", "ip": "10/m"},
+    "booking": {"user": "5/m", "ip": "10/m"},
+}
+# Requests of one client a scope serves at once.
+RATE_LIMIT_CONCURRENCY = {"chat": 2}
+# Proxies in front of the app that append the client's address to
+# X-Forwarded-For; 0 trusts REMOTE_ADDR only. Deployed (DEBUG off), the site
+# sits behind the platform's load balancer, whose address REMOTE_ADDR would
+# be for every client, so the default is 1. Set 0 when clients connect
+# directly, as they could otherwise pick their address.
+RATE_LIMIT_PROXIES = int(os.environ.get("RATE_LIMIT_PROXIES", "0" if DEBUG else "1"))
@@ -0,0 +1,130 @@
+import json
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.checks import run_checks
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from . import ratelimit
+
+LOCMEM = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+REDIS = {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": "redis://localhost:6379"}}
+IN_MEMORY_LAYER = {"default": {"BACKEND": "sisterhood_stories.channel_layers.InMemoryChannelLayer"}}
+REDIS_LAYER = {"default": {"BACKEND": "channels_redis.core.RedisChannelLayer"}}
+
+
+class SharedStateCheckTests(SimpleTestCase):
+    def errors(self):
+        return sorted(error.id for error in run_checks() if error.id.startswith("sisterhood_stories."))
+
+    @override_settings(MULTI_PROCESS=True, CACHES=LOCMEM, CHANNEL_LAYERS=IN_MEMORY_LAYER)
+    def test_per_process_state_is_refused_with_several_processes(self):
+        self.assertEqual(self.errors(), ["sisterhood_stories.E001", "sisterhood_stories.E002"])
+
+    @override_settings(MULTI_PROCESS=True, CACHES=REDIS, CHANNEL_LAYERS=REDIS_LAYER)
+    def test_shared_state(self):
+        self.assertEqual(self.errors(), [])
+
+    @override_settings(MULTI_PROCESS=False, CACHES=LOCMEM, CHANNEL_LAYERS=IN_MEMORY_LAYER)
+    def test_one_process_may_keep_state_to_itself(self):
+        self.assertEqual(self.errors(), [])
+
+
+@override_settings(RATE_LIMIT_ENABLED=True, RATE_LIMIT_PROXIES=0)
+class RateLimitTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+
+    def test_parse(self):
+        self.assertEqual(ratelimit.parse("20/m"), (20, 3000))
+        self.assertEqual(ratelimit.parse("3/s"), (3, 333))
+
+    def test_bucket_allows_a_burst_then_refills(self):
+        now = 1000.0
+        self.assertEqual([ratelimit.hit("b", "3/m", now) for _ in range(3)], [0, 0, 0])
+        self.assertEqual(ratelimit.hit("b", "3/m", now), 20)
+        # A denied request takes nothing.
+        self.assertEqual(ratelimit.hit("b", "3/m", now + 5), 15)
+        self.assertEqual(ratelimit.hit("b", "3/m", now + 20), 0)
+        self.assertEqual(ratelimit.hit("b", "3/m", now + 20), 20)
+        # Idle long enough, the whole burst is back.
+        self.assertEqual([ratelimit.hit("b", "3/m", now + 600) for _ in range(3)], [0, 0, 0])
+        self.assertEqual(ratelimit.hit("other", "3/m", now + 600), 0)
+
+    def test_client_ip(self):
+        request = self.factory.get("/", HTTP_X_FORWARDED_FOR="1.1.1.1, 2.2.2.2", REMOTE_ADDR="3.3.3.3")
+        self.assertEqual(ratelimit.client_ip(request), "3.3.3.3")
+        with override_settings(RATE_LIMIT_PROXIES=1):
+            self.assertEqual(ratelimit.client_ip(request), "2.2.2.2")
+        with override_settings(RATE_LIMIT_PROXIES=3):
+            self.assertEqual(ratelimit.client_ip(request), "3.3.3.3")
+
+    @override_settings(RATE_LIMITS={"chat": {"user": "1/m", "ip": "2/m"}})
+    @mock.patch.object(ratelimit.time, "time", return_value=1000.0)
+    def test_users_and_addresses_have_their_own_limits(self, _):
+        request = self.factory.post("/")
+        user = User(pk=1, username="asha")
+        self.assertEqual(ratelimit.check(request, "chat", user), 0)
+        self.assertEqual(ratelimit.check(request, "chat", user), 60)
+        # Signed-in requests don't use up their address's allowance.
+        self.assertEqual([ratelimit.check(request, "chat", AnonymousUser()) for _ in range(3)], [0, 0, 30])
+        self.assertEqual(ratelimit.check(request, "chat", User(pk=2, username="bina")), 0)
+        self.assertEqual(ratelimit.check(request, "unknown", user), 0)
+        with override_settings(RATE_LIMIT_ENABLED=False):
+            self.assertEqual(ratelimit.check(request, "chat", user), 0)
+
+    @override_settings(RATE_LIMITS={"chat": {"ip": "1/m"}})
+    def test_limited_requests_get_429(self):
+        view = ratelimit.ratelimit("chat")(lambda request: HttpResponse("ok"))
+        self.assertEqual(view(self.factory.get("/")).status_code, 200)
+        self.assertEqual(view(self.factory.post("/")).status_code, 200)
+        response = view(self.factory.post("/"))
+        self.assertEqual((response.status_code, response["Retry-After"]), (429, "60"))
+        self.assertEqual(json.loads(response.content), {"ok": False, "error": "rate_limited", "retry_after": 60})
+        page = view(self.factory.post("/", HTTP_ACCEPT="text/html"))
+        self.assertEqual((page.status_code, page["Content-Type"]), (429, "text/plain"))
+
+    def test_concurrency(self):
+        self.assertTrue(ratelimit.acquire("k", 2))
+        self.assertTrue(ratelimit.acquire("k", 2))
+        self.assertFalse(ratelimit.acquire("k", 2))
+        ratelimit.release("k")
+        self.assertTrue(ratelimit.acquire("k", 2))
+
+    @override_settings(RATE_LIMIT_CONCURRENCY={"chat": 1})
+    async def test_streams_hold_their_place_until_finished(self):
+        async def events():
+            yield "data: 1\n\n"
+
+        @ratelimit.concurrency_limit("chat")
+        async def view(request):
+            return StreamingHttpResponse(events())
+
+        def request():
+            request = self.factory.post("/", REMOTE_ADDR="1.1.1.1")
+            request.auser = mock.AsyncMock(return_value=AnonymousUser())
+            return request
+
+        first = await view(request())
+        busy = await view(request())
+        self.assertEqual((busy.status_code, json.loads(busy.content)["error"]), (429, "too_many_concurrent"))
+        self.assertEqual([chunk async for chunk in first.streaming_content], [b"data: 1\n\n"])
+        self.assertEqual((await view(request())).status_code, 200)
+
+    @override_settings(RATE_LIMITS={"booking": {"user": "1/m"}})
+    def test_drf_throttle_counts_writes_only(self):
+        throttle, view = ratelimit.UserBucketThrottle(), mock.Mock(throttle_scope="booking")
+        request = mock.Mock(method="POST", user=User(pk=1, username="asha"))
+        self.assertTrue(throttle.allow_request(mock.Mock(method="GET", user=request.user), view))
+        self.assertTrue(throttle.allow_request(request, view))
+        self.assertFalse(throttle.allow_request(request, view))
+        self.assertEqual(throttle.wait(), 60)
+        anonymous = mock.Mock(method="POST", user=AnonymousUser(), META={"REMOTE_ADDR": "1.1.1.1"})
+        with override_settings(RATE_LIMITS={"booking": {"ip": "1/m"}}):
+            self.assertTrue(ratelimit.IPBucketThrottle().allow_request(request, view))
+            self.assertTrue(ratelimit.IPBucketThrottle().allow_request(request, view))
+            self.assertTrue(ratelimit.IPBucketThrottle().allow_request(anonymous, view))
+            self.assertFalse(ratelimit.IPBucketThrottle().allow_request(anonymous, view))
@@ -0,0 +1,37 @@
+// Live updates for community pages over a websocket.
+// Reconnects with capped exponential backoff and pings to keep proxies from
+// closing idle sockets.
+function connectLiveUpdates(path, onMessage) {
+    if (!('WebSocket' in window)) return;
+
+    const scheme = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
+    const url = scheme + window.location.host + path;
+    let retryDelay = 1000;
+    let pingTimer = null;
+
+    function open() {
+        const socket = new WebSocket(url);
+
+        socket.onopen = function() {
+            retryDelay = 1000;
+            pingTimer = setInterval(function() {
+                if (socket.readyState === WebSocket.OPEN) {
+                    socket.send(JSON.stringify({ type: 'ping' }));
+                }
+            }, 30000);
+        };
+
+        socket.onmessage = function(event) {
+            const data = JSON.parse(event.data);
+            if (data.type !== 'pong') onMessage(data);
+        };
+
+        socket.onclose = function() {
+            clearInterval(pingTimer);
+            setTimeout(open, retryDelay);
+            retryDelay = Math.min(retryDelay * 2, 60000);
+        };
+    }
+
+    open();
+}
@@ -0,0 +1,49 @@
+// Keeps a psychiatrist shown as online while their dashboard is open.
+// Beats at the interval the server asks for, and tells it when the page
+// closes or the toggle is switched off.
+function startPresenceHeartbeat(url, csrfToken, toggle) {
+    let interval = 30000;
+    let timer = null;
+    let online = true;
+
+    function beat(state) {
+        const body = new FormData();
+        body.append('csrfmiddlewaretoken', csrfToken);
+        if (state) body.append('state', state);
+        return fetch(url, { method: 'POST', body: body, credentials: 'same-origin' })
+            .then(function(response) { return response.ok ? response.json() : null; })
+            .catch(function() { return null; });
+    }
+
+    function schedule() {
+        clearTimeout(timer);
+        if (!online) return;
+        beat().then(function(data) {
+            if (data && data.interval) interval = data.interval * 1000;
+            timer = setTimeout(schedule, interval);
+        });
+    }
+
+    function render() {
+        if (!toggle) return;
+        toggle.textContent = online ? 'Online' : 'Offline';
+        toggle.title = online ? 'Patients see you as available now. Click to go offline.' : 'Click to go online.';
+    }
+
+    toggle && toggle.addEventListener('click', function() {
+        online = !online;
+        render();
+        if (online) schedule(); else { clearTimeout(timer); beat('offline'); }
+    });
+
+    window.addEventListener('pagehide', function() {
+        if (!online) return;
+        const body = new FormData();
+        body.append('csrfmiddlewaretoken', csrfToken);
+        body.append('state', 'offline');
+        navigator.sendBeacon(url, body);
+    });
+
+    render();
+    schedule();
+}
@@ -0,0 +1,66 @@
+// Tracks which items the user has scrolled past and reports a single
+// "read up to" watermark per group/discussion. Reports are debounced and
+// coalesced, so scrolling through a long page costs one request.
+const ReadMarkers = (function() {
+    const endpoint = '/community/read/';
+    const pending = { groups: {}, discussions: {} };
+    let timer = null;
+
+    function getCsrfToken() {
+        const match = document.cookie.match(/(?:^|;\s*)csrftoken=([^;]+)/);
+        return match ? decodeURIComponent(match[1]) : '';
+    }
+
+    function flush() {
+        clearTimeout(timer);
+        timer = null;
+        if (!Object.keys(pending.groups).length && !Object.keys(pending.discussions).length) return;
+
+        const body = JSON.stringify(pending);
+        pending.groups = {};
+        pending.discussions = {};
+        fetch(endpoint, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'X-CSRFToken': getCsrfToken() },
+            credentials: 'same-origin',
+            keepalive: true,
+            body: body
+        }).catch(function() {});
+    }
+
+    function mark(kind, id, createdAt) {
+        const current = pending[kind][id];
+        if (!current || new Date(current) < new Date(createdAt)) {
+            pending[kind][id] = createdAt;
+        }
+        clearTimeout(timer);
+        timer = setTimeout(flush, 3000);
+    }
+
+    // Watch every element matching `selector` (each carrying data-created)
+    // and advance the watermark for `kind`/`id` as they come into view.
+    function track(kind, id, selector) {
+        if (!('IntersectionObserver' in window)) return;
+        const observer = new IntersectionObserver(function(entries) {
+            entries.forEach(function(entry) {
+                if (!entry.isIntersecting) return;
+                mark(kind, id, entry.target.dataset.created);
+                observer.unobserve(entry.target);
+            });
+        }, { threshold: 0.6 });
+
+        function observeAll() {
+            document.querySelectorAll(selector).forEach(function(el) {
+                if (el.dataset.created && !el.dataset.readTracked) {
+                    el.dataset.readTracked = '1';
+                    observer.observe(el);
+                }
+            });
+        }
+        observeAll();
+        window.addEventListener('pagehide', flush);
+        return observeAll;  // call again after inserting live items
+    }
+
+    return { track: track, flush: flush };
+})();
@@ -0,0 +1,76 @@
+// Live chat for a counseling session over a websocket.
+// Remembers the last message id it has shown and reconnects with
+// ?after=<id>, so nothing is missed or shown twice across a dropped connection.
+function connectSessionChat(path, handlers) {
+    if (!('WebSocket' in window)) return null;
+
+    const scheme = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
+    let lastId = 0;
+    let retryDelay = 1000;
+    let pingTimer = null;
+    let socket = null;
+    let typingSent = 0;
+
+    function open() {
+        socket = new WebSocket(scheme + window.location.host + path + '?after=' + lastId);
+
+        socket.onopen = function() {
+            retryDelay = 1000;
+            handlers.onStatus && handlers.onStatus(true);
+            pingTimer = setInterval(function() {
+                if (socket.readyState === WebSocket.OPEN) {
+                    socket.send(JSON.stringify({ type: 'ping' }));
+                }
+            }, 30000);
+        };
+
+        socket.onmessage = function(event) {
+            const data = JSON.parse(event.data);
+            if (data.type === 'history') {
+                data.messages.forEach(show);
+            } else if (data.type === 'message') {
+                show(data);
+            } else if (data.type === 'typing') {
+                handlers.onTyping && handlers.onTyping(data.typing);
+            } else if (data.type === 'presence') {
+                handlers.onPresence && handlers.onPresence(data.online);
+            } else if (data.type === 'error') {
+                handlers.onError && handlers.onError(data);
+            }
+        };
+
+        socket.onclose = function(event) {
+            clearInterval(pingTimer);
+            handlers.onStatus && handlers.onStatus(false);
+            // 4403: not a participant; 4406: not a chat session; 4409: the session isn't open.
+            if (event.code === 4403 || event.code === 4406 || event.code === 4409) return;
+            setTimeout(open, retryDelay);
+            retryDelay = Math.min(retryDelay * 2, 30000);
+        };
+    }
+
+    function show(message) {
+        if (message.id <= lastId) return;
+        lastId = message.id;
+        handlers.onMessage(message);
+    }
+
+    function send(data) {
+        if (!socket || socket.readyState !== WebSocket.OPEN) return false;
+        socket.send(JSON.stringify(data));
+        return true;
+    }
+
+    open();
+    return {
+        send: function(body, clientId) {
+            typingSent = 0;
+            return send({ type: 'message', body: body, client_id: clientId });
+        },
+        typing: function() {
+            // At most one typing signal every few seconds.
+            const now = Date.now();
+            if (now - typingSent > 3000 && send({ type: 'typing', typing: true })) typingSent = now;
+        },
+    };
+}
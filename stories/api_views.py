@@ -5,6 +5,8 @@ from rest_framework.parsers import MultiPartParser, FormParser
 from django.shortcuts import get_object_or_404
 from .models import Post, Comment, Like
 from .serializers import PostSerializer, CommentSerializer, LikeSerializer
+from sisterhood_stories.comment_threads import thread_page
+from sisterhood_stories.ratelimit import IPBucketThrottle, UserBucketThrottle
 
 
 class IsAuthorOrReadOnly(permissions.BasePermission):
@@ -20,11 +22,15 @@ class PostViewSet(viewsets.ModelViewSet):
     serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly]
     parser_classes = [MultiPartParser, FormParser]
+    throttle_classes = [UserBucketThrottle, IPBucketThrottle]
+    throttle_scope = "post"
+    comment_page_size = 20
+    comment_reply_preview = 3
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
-    @action(detail=True, methods=["post"], permission_classes=[permissions.IsAuthenticated])
+    @action(detail=True, methods=["post"], permission_classes=[permissions.IsAuthenticated], throttle_scope="like")
     def like(self, request, pk=None):
         post = self.get_object()
         like, created = Like.objects.get_or_create(user=request.user, post=post)
@@ -33,15 +39,36 @@ class PostViewSet(viewsets.ModelViewSet):
             return Response({"liked": False, "likes_count": post.like_set.count()})
         return Response({"liked": True, "likes_count": post.like_set.count()})
 
-    @action(detail=True, methods=["get", "post"], permission_classes=[permissions.IsAuthenticatedOrReadOnly])
+    @action(
+        detail=True, methods=["get", "post"], permission_classes=[permissions.IsAuthenticatedOrReadOnly],
+        throttle_scope="comment",
+    )
     def comments(self, request, pk=None):
         post = self.get_object()
         if request.method == "GET":
-            qs = Comment.objects.filter(post=post).select_related("user").order_by("created_at")
+            # One page of threads (or of replies to ?parent=), each with its first few replies,
+            # in display order. Clients nest the flat list using depth/parent.
+            parent = None
+            if request.query_params.get("parent"):
+                parent = get_object_or_404(Comment, pk=request.query_params["parent"], post=post)
+            try:
+                start = max(int(request.query_params.get("start", 1)), 1)
+            except ValueError:
+                return Response({"detail": "start must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+            qs = thread_page(
+                Comment.objects.filter(post=post).select_related("user"),
+                parent=parent,
+                start=start,
+                count=self.comment_page_size,
+                replies=self.comment_reply_preview,
+            )
             return Response(CommentSerializer(qs, many=True).data)
         # POST
         text = request.data.get("text", "").strip()
         if not text:
             return Response({"detail": "text is required"}, status=status.HTTP_400_BAD_REQUEST)
-        comment = Comment.objects.create(user=request.user, post=post, text=text)
+        parent = None
+        if request.data.get("parent"):
+            parent = get_object_or_404(Comment, pk=request.data["parent"], post=post)
+        comment = Comment.objects.create(user=request.user, post=post, parent=parent, text=text)
         return Response(CommentSerializer(comment).data, status=status.HTTP_201_CREATED)
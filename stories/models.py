@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
+from sisterhood_stories.comment_threads import ThreadedComment
 
 def default_expiry():
     return timezone.now() + timezone.timedelta(hours=24)
@@ -15,6 +16,7 @@ class Post(models.Model):
     is_anonymous = models.BooleanField(default=False)
     pseudonym = models.CharField(max_length=80, blank=True)
     allow_comments = models.BooleanField(default=True)
+    thread_count = models.PositiveIntegerField(default=0, editable=False, help_text="Top-level comments ever posted")
 
     class Meta:
         ordering = ['-created_at']
@@ -56,7 +58,9 @@ class Like(models.Model):
     def __str__(self):
         return f"{self.user.username} likes {self.post}"
 
-class Comment(models.Model):
+class Comment(ThreadedComment):
+    thread_container_field = 'post'
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
     text = models.TextField()
@@ -64,6 +68,7 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        unique_together = ('post', 'path')
 
     def __str__(self):
         return f"Comment by {self.user.username} on {self.post}"
@@ -15,8 +15,8 @@ class CommentSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Comment
-        fields = ["id", "user", "post", "text", "created_at"]
-        read_only_fields = ["id", "created_at", "user"]
+        fields = ["id", "user", "post", "parent", "depth", "position", "reply_count", "text", "created_at"]
+        read_only_fields = ["id", "created_at", "user", "parent", "depth", "position", "reply_count"]
 
 
 class LikeSerializer(serializers.ModelSerializer):
@@ -13,6 +13,7 @@ from django.contrib.auth import get_user_model
 from django.contrib import messages
 from .models import Post, Comment, Like, Story
 from .forms import PostForm, StoryForm
+from sisterhood_stories.ratelimit import ratelimit
 
 User = get_user_model()
 
@@ -65,6 +66,7 @@ class PostCreateView(LoginRequiredMixin, CreateView):
 
 
 @method_decorator(login_required, name='dispatch')
+@method_decorator(ratelimit('like'), name='dispatch')
 class LikeToggleView(View):
     def post(self, request, post_id):
         post = get_object_or_404(Post, id=post_id)
@@ -96,6 +98,7 @@ class PostDeleteView(View):
 
 
 @method_decorator(login_required, name='dispatch')
+@method_decorator(ratelimit('comment'), name='dispatch')
 class CommentCreateView(LoginRequiredMixin, View):
     def post(self, request, post_id):
         post = get_object_or_404(Post, id=post_id)
@@ -106,9 +109,15 @@ class CommentCreateView(LoginRequiredMixin, View):
         if not text:
             return JsonResponse({'status': 'error', 'message': 'Comment cannot be empty'}, status=400)
             
+        parent = None
+        parent_id = request.POST.get('parent_id')
+        if parent_id:
+            parent = get_object_or_404(Comment, id=parent_id, post=post)
+
         comment = Comment.objects.create(
             user=request.user,
             post=post,
+            parent=parent,
             text=text
         )
         